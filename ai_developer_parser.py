@@ -24,6 +24,8 @@ import undetected_chromedriver as uc
 
 from openai import OpenAI
 
+from llm_cache import llm_cache
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -165,7 +167,9 @@ class AIWebScraper:
 
             user_prompt = f"Извлеки данные из следующего HTML-контента:\n\n{clean_html}"
             
-            response = self.openai_client.chat.completions.create(
+            content = llm_cache.complete(
+                self.openai_client,
+                schema_version="developer_extraction:1",
                 model="gpt-4o",  # Используем новейшую модель GPT-4o
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -175,7 +179,7 @@ class AIWebScraper:
                 temperature=0.1  # Низкая температура для стабильности
             )
             
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             logger.info("Данные успешно извлечены с помощью ИИ")
             return result
             
@@ -1,9 +1,16 @@
 import os
+import sys
 import json
 import logging
 
-# Configure logging for debugging PDF generation
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# `python app.py`: modules that do `from app import db` (models, comparison_api)
+# must get this module instead of importing a second copy of it
+if __name__ == '__main__':
+    sys.modules.setdefault('app', sys.modules[__name__])
+
+# Level and format come from LOG_LEVEL / LOG_FORMAT (see structured_logging.py)
+from structured_logging import configure_logging
+configure_logging()
 
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, abort, Blueprint, send_from_directory, send_file
 from sqlalchemy import text
@@ -16,6 +23,21 @@ from werkzeug.exceptions import BadRequest
 
 # Import smart search
 from smart_search import smart_search
+from property_query import PropertyQueryBuilder, paginate
+from query_counter import count_sql_statements
+from snapshot_cache import SnapshotCache
+from property_index import property_index_cache
+from complex_stats import load_complex_stats, refresh_complex_stats, room_details as complex_room_details
+import job_queue
+from pdf_renderer import pdf_renderer
+from property_repository import PropertyRepository, normalize_id as normalize_property_id
+from suggestion_index import suggestion_index_cache
+from full_text_search import Analyzer, build_synonym_map, full_text_index_cache
+from semantic_search import build_embeddings_snapshot, embedding_index_cache
+from similar_properties import similarity_index_cache
+from page_cache import ALL_PAGES, page_cache, page_tag
+from reference_data import reference_data
+from tiered_cache import TieredCache
 from urllib.parse import unquote, quote
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
@@ -24,11 +46,8 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 import secrets
 import re
 from email_service import send_notification, send_email
-from flask_caching import Cache
-import qrcode
 import io
 import base64
-from PIL import Image
 
 def parse_address_components(address_display_name):
     """
@@ -164,6 +183,11 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+# Per-request latency / SQL metrics, exported on /metrics. Registered before
+# CSRFProtect so that requests it rejects are timed and counted too
+from request_metrics import request_metrics
+request_metrics.init_app(app)
+
 # Initialize CSRF protection after app creation - ENABLED FOR SECURITY
 csrf = CSRFProtect(app)
 
@@ -223,10 +247,8 @@ def russian_date_filter(date_value):
     
     return f"{day} {month} {year}"
 
-# Настройка супер-производительного кэширования
-app.config['CACHE_TYPE'] = 'simple'
-app.config['CACHE_DEFAULT_TIMEOUT'] = 300  # 5 минут
-cache = Cache(app)
+# Двухуровневый кэш: LRU в памяти воркера + общее хранилище (файлы или Redis)
+cache = TieredCache()
 
 # Session configuration for Replit iframe environment
 app.config['SESSION_COOKIE_HTTPONLY'] = True
@@ -447,169 +469,240 @@ login_manager.login_message_category = 'info'
 
 
 # Property data loading functions with cache
-_properties_cache = None
-_cache_timestamp = None
 CACHE_TIMEOUT = 300  # 5 minutes
 
+# Статистика пересборки load_properties(): ожидается ровно 1 SQL-запрос на загрузку
+LOAD_PROPERTIES_STATS = {
+    'loads': 0,
+    'last_sql_statements': None,
+    'last_sql_ms': None,
+    # Полное время пересборки (SQL и разбор строк в Python)
+    'last_duration_ms': None,
+    'last_properties_count': 0,
+}
+
+def _record_load_properties_stats(sql_counter, properties_count):
+    """Сохраняет число SQL-запросов последней загрузки, чтобы регрессия N+1 была видна"""
+    LOAD_PROPERTIES_STATS['loads'] += 1
+    LOAD_PROPERTIES_STATS['last_sql_statements'] = sql_counter.statements
+    LOAD_PROPERTIES_STATS['last_sql_ms'] = round(sql_counter.sql_ms, 2)
+    LOAD_PROPERTIES_STATS['last_duration_ms'] = round(sql_counter.duration_ms, 2)
+    LOAD_PROPERTIES_STATS['last_properties_count'] = properties_count
+    app.logger.info(
+        f"load_properties(): {properties_count} properties, "
+        f"{sql_counter.statements} SQL statements ({sql_counter.sql_ms:.0f} ms SQL), "
+        f"{sql_counter.duration_ms:.0f} ms total"
+    )
+
 def load_properties():
-    """Load properties from database with fallback to JSON files"""
-    global _properties_cache, _cache_timestamp
-    import time
-    
-    # Check if we have valid cached data
-    if (_properties_cache is not None and _cache_timestamp is not None and 
-        time.time() - _cache_timestamp < CACHE_TIMEOUT):
-        # Cache hit - fast path
-        return _properties_cache
-    
+    """Load properties from the snapshot shared by all workers (rebuilt from the database on miss)"""
+    return properties_snapshot.get() or []
+
+def invalidate_properties_cache():
+    """Bump the data version so every worker drops its properties snapshot"""
+    return properties_snapshot.invalidate()
+
+def purge_pages_for_complexes(complex_names=None):
+    """Change event for cached district/street/developer pages: purge only pages showing these complexes"""
+    if complex_names is None:
+        return page_cache.purge([ALL_PAGES])
+    names = sorted({name for name in complex_names if name})
+    if not names:
+        return 0
+    from sqlalchemy import bindparam
+    tags = {page_tag('complex', name) for name in names}
+    try:
+        rows = db.session.execute(text("""
+            SELECT DISTINCT developer_name, address_locality_display_name
+            FROM excel_properties
+            WHERE complex_name IN :names
+        """).bindparams(bindparam('names', expanding=True)), {'names': names}).fetchall()
+        for developer_name, locality in rows:
+            tags.add(page_tag('developer', developer_name))
+            tags.add(page_tag('district', locality))
+        rows = db.session.execute(text("""
+            SELECT DISTINCT d.name
+            FROM residential_complexes rc
+            JOIN districts d ON d.id = rc.district_id
+            WHERE rc.name IN :names
+        """).bindparams(bindparam('names', expanding=True)), {'names': names}).fetchall()
+        tags.update(page_tag('district', row[0]) for row in rows)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error collecting page dependencies, purging all pages: {e}")
+        tags = {ALL_PAGES}
+    return page_cache.purge(tags)
+
+def on_properties_imported(complex_names=None):
+    """Refresh data derived from excel_properties after an import (complex_names=None means everything)"""
+    invalidate_properties_cache()
+    purge_pages_for_complexes(complex_names)
+    cache.invalidate('super_search')
+    cache.invalidate('developers')
+    try:
+        refresh_complex_stats(complex_names)
+    except Exception as e:
+        print(f"Error refreshing complex_stats: {e}")
+    search_suggestions_snapshot.invalidate()
+    warm_search_suggestions()
+    property_embeddings_snapshot.invalidate()
+    warm_property_embeddings()
+    warm_similar_properties()
+
+PROPERTY_ROW_COLUMNS = """
+    ep.inner_id, ep.complex_name, ep.developer_name, ep.object_rooms, ep.object_area, 
+    ep.price, ep.object_min_floor, ep.object_max_floor, ep.address_display_name, 
+    ep.address_position_lat, ep.address_position_lon, ep.address_locality_display_name,
+    ep.photos, ep.complex_object_class_display_name,
+    ep.renovation_type, ep.renovation_display_name, ep.complex_with_renovation,
+    ep.complex_building_end_build_year, ep.complex_building_end_build_quarter,
+    ep.complex_building_name, ep.address_subways, ep.trade_in, ep.deal_type,
+    ep.square_price, ep.mortgage_price, ep.object_is_apartment, ep.max_price, ep.min_price,
+    ep.complex_has_green_mortgage, ep.placement_type, ep.description
+"""
+
+def _format_property_row(prop_dict):
+    """Строка excel_properties (PROPERTY_ROW_COLUMNS + complex_max_floors) -> словарь снимка load_properties()"""
+    # Parse photos field (JSON array format)
+    photos_raw = prop_dict.get('photos', '')
+    main_image = '/static/images/no-photo.jpg'
+
+    if photos_raw and photos_raw.strip():
+        try:
+            # Try to parse as JSON array first (current database format)
+            if photos_raw.startswith('[') and photos_raw.endswith(']'):
+                images = json.loads(photos_raw)
+                if images and isinstance(images, list) and len(images) > 0:
+                    main_image = images[0].strip() if images[0] else '/static/images/no-photo.jpg'
+            # Fallback: PostgreSQL array format {url1,url2,url3}
+            elif photos_raw.startswith('{') and photos_raw.endswith('}'):
+                images_str = photos_raw[1:-1]  # Remove braces
+                if images_str:
+                    images = [img.strip().strip('"') for img in images_str.split(',') if img.strip()]
+                    main_image = images[0] if images else '/static/images/no-photo.jpg'
+            # Single image URL
+            else:
+                main_image = photos_raw.strip()
+        except (json.JSONDecodeError, ValueError, IndexError) as e:
+            print(f"Error parsing photos for property {prop_dict.get('inner_id')}: {e}")
+            main_image = '/static/images/no-photo.jpg'
+
+    # Get correct total floors for the complex
+    complex_total_floors = prop_dict.get('object_max_floor', 1)
+    # If floor data seems wrong (1/1), use real max floors of the complex
+    if complex_total_floors == 1 and prop_dict.get('complex_max_floors'):
+        complex_total_floors = prop_dict['complex_max_floors']
+
+    # Format property data  
+    rooms = prop_dict.get('object_rooms', 0)
+    area = prop_dict.get('object_area', 0) 
+    floor = prop_dict.get('object_min_floor', 1)
+
+    # Create title with proper format: "Студия, 23.40 м², 1/12 эт."
+    if rooms == 0:
+        title = f"Студия, {area} м², {floor}/{complex_total_floors} эт."
+    else:
+        title = f"{rooms}-комн, {area} м², {floor}/{complex_total_floors} эт."
+
+    # Enhanced completion date from building data
+    completion_date = 'Не указана'
+    if prop_dict.get('complex_building_end_build_year') and prop_dict.get('complex_building_end_build_quarter'):
+        year = prop_dict.get('complex_building_end_build_year')
+        quarter = prop_dict.get('complex_building_end_build_quarter')
+        completion_date = f"{quarter} кв. {year} г."
+    elif prop_dict.get('complex_building_end_build_year'):
+        year = prop_dict.get('complex_building_end_build_year')  
+        completion_date = f"{year} г."
+
+    # Enhanced finishing information
+    finishing = prop_dict.get('renovation_display_name') or prop_dict.get('renovation_type', 'Не указана')
+    if prop_dict.get('complex_with_renovation'):
+        finishing = finishing if finishing != 'Не указана' else 'С отделкой'
+
+    formatted_prop = {
+        'id': prop_dict.get('inner_id'),
+        'title': title,
+        'rooms': prop_dict.get('object_rooms', 0),
+        'area': prop_dict.get('object_area', 0),
+        'price': prop_dict.get('price', 0),
+        # Use database square_price if available, fallback to calculation
+        'price_per_sqm': prop_dict.get('square_price') or (int((prop_dict.get('price') or 0) / prop_dict['object_area']) if (prop_dict.get('object_area') or 0) > 0 else 0),
+        'floor': prop_dict.get('object_min_floor', 1),
+        'total_floors': complex_total_floors,
+        'address': prop_dict.get('address_display_name', ''),
+        'coordinates': {
+            # Поиск по id (property_repository) отдает и квартиры без координат и цены
+            'lat': float(prop_dict.get('address_position_lat') or 45.0448),
+            'lng': float(prop_dict.get('address_position_lon') or 38.9728)
+        },
+        'cashback': calculate_cashback(prop_dict.get('price', 0)),
+        'cashback_available': True,
+        'status': 'available',
+        'property_type': 'Квартира' if prop_dict.get('object_is_apartment', True) else 'Недвижимость',
+        'developer': prop_dict.get('developer_name', 'Не указан'),
+        'residential_complex': prop_dict.get('complex_name', 'ЖК Без названия'),
+        'district': prop_dict.get('address_locality_display_name', 'Район не указан'),
+        'main_image': main_image,
+        'url': f"/object/{prop_dict.get('inner_id')}",
+        'complex_name': prop_dict.get('complex_name', 'ЖК Без названия'),
+        'type': 'property',
+        # NEW ENHANCED FIELDS FROM DATABASE:
+        'finishing': finishing,
+        'renovation_type': prop_dict.get('renovation_type'),
+        'completion_date': completion_date,
+        'complex_class': prop_dict.get('complex_object_class_display_name', ''),
+        'building_name': prop_dict.get('complex_building_name', ''),
+        'nearest_metro': prop_dict.get('address_subways', ''),
+        'trade_in_available': bool(prop_dict.get('trade_in', False)),
+        'deal_type': prop_dict.get('deal_type', ''),
+        'mortgage_price': prop_dict.get('mortgage_price'),
+        'max_price': prop_dict.get('max_price'),
+        'min_price': prop_dict.get('min_price'),
+        'green_mortgage_available': bool(prop_dict.get('complex_has_green_mortgage', False)),
+        'placement_type': prop_dict.get('placement_type', ''),
+        'description': prop_dict.get('description', ''),
+        'complex_with_renovation': bool(prop_dict.get('complex_with_renovation', False))
+    }
+    return formatted_prop
+
+def _build_properties_snapshot():
+    """Load and format properties from the excel_properties table"""
     # Ensure we have app context
     from flask import has_app_context
     if not has_app_context():
         with app.app_context():
-            return load_properties()
+            return _build_properties_snapshot()
     
     try:
-        # Load from excel_properties table using raw SQL - EXPANDED FIELDS
-        sql_query = """
-            SELECT inner_id, complex_name, developer_name, object_rooms, object_area, 
-                   price, object_min_floor, object_max_floor, address_display_name, 
-                   address_position_lat, address_position_lon, address_locality_display_name,
-                   photos, complex_object_class_display_name,
-                   renovation_type, renovation_display_name, complex_with_renovation,
-                   complex_building_end_build_year, complex_building_end_build_quarter,
-                   complex_building_name, address_subways, trade_in, deal_type,
-                   square_price, mortgage_price, object_is_apartment, max_price, min_price,
-                   complex_has_green_mortgage, placement_type, description
-            FROM excel_properties 
-            WHERE price > 0 AND address_position_lat IS NOT NULL
-        """
+        with count_sql_statements() as sql_counter:
+            # Load from excel_properties table using raw SQL - EXPANDED FIELDS
+            # Этажность ЖК считается одним сгруппированным подзапросом вместо запроса на каждую квартиру
+            sql_query = f"""
+                SELECT {PROPERTY_ROW_COLUMNS},
+                       complex_floors.max_floors AS complex_max_floors
+                FROM excel_properties ep
+                LEFT JOIN (
+                    SELECT complex_name, MAX(object_max_floor) AS max_floors
+                    FROM excel_properties
+                    WHERE object_max_floor > 1
+                    GROUP BY complex_name
+                ) complex_floors ON complex_floors.complex_name = ep.complex_name
+                WHERE ep.price > 0 AND ep.address_position_lat IS NOT NULL
+            """
         
-        result = db.session.execute(text(sql_query))
-        excel_properties = result.fetchall()
+            result = db.session.execute(text(sql_query))
+            excel_properties = result.fetchall()
         
-        if excel_properties and len(excel_properties) > 0:
-            # Convert excel_properties to dictionary format
             db_properties = []
-            for prop in excel_properties:
-                prop_dict = dict(prop._mapping)
-                
-                # Parse photos field (JSON array format)
-                photos_raw = prop_dict.get('photos', '')
-                main_image = '/static/images/no-photo.jpg'
-                
-                if photos_raw and photos_raw.strip():
-                    try:
-                        # Try to parse as JSON array first (current database format)
-                        if photos_raw.startswith('[') and photos_raw.endswith(']'):
-                            images = json.loads(photos_raw)
-                            if images and isinstance(images, list) and len(images) > 0:
-                                main_image = images[0].strip() if images[0] else '/static/images/no-photo.jpg'
-                        # Fallback: PostgreSQL array format {url1,url2,url3}
-                        elif photos_raw.startswith('{') and photos_raw.endswith('}'):
-                            images_str = photos_raw[1:-1]  # Remove braces
-                            if images_str:
-                                images = [img.strip().strip('"') for img in images_str.split(',') if img.strip()]
-                                main_image = images[0] if images else '/static/images/no-photo.jpg'
-                        # Single image URL
-                        else:
-                            main_image = photos_raw.strip()
-                    except (json.JSONDecodeError, ValueError, IndexError) as e:
-                        print(f"Error parsing photos for property {prop_dict.get('inner_id')}: {e}")
-                        main_image = '/static/images/no-photo.jpg'
-                
-                # Get correct total floors for the complex
-                complex_total_floors = prop_dict.get('object_max_floor', 1)
-                # If floor data seems wrong (1/1), get real max floors from complex
-                if complex_total_floors == 1:
-                    # Query for real max floors in this complex
-                    try:
-                        max_floors_query = db.session.execute(text("""
-                            SELECT MAX(object_max_floor) as max_floors
-                            FROM excel_properties 
-                            WHERE complex_name = :complex_name
-                            AND object_max_floor > 1
-                        """), {'complex_name': prop_dict.get('complex_name', '')})
-                        max_floors_result = max_floors_query.fetchone()
-                        if max_floors_result and max_floors_result[0]:
-                            complex_total_floors = max_floors_result[0]
-                    except:
-                        pass
-                
-                # Format property data  
-                rooms = prop_dict.get('object_rooms', 0)
-                area = prop_dict.get('object_area', 0) 
-                floor = prop_dict.get('object_min_floor', 1)
-                
-                # Create title with proper format: "Студия, 23.40 м², 1/12 эт."
-                if rooms == 0:
-                    title = f"Студия, {area} м², {floor}/{complex_total_floors} эт."
-                else:
-                    title = f"{rooms}-комн, {area} м², {floor}/{complex_total_floors} эт."
-                
-                # Enhanced completion date from building data
-                completion_date = 'Не указана'
-                if prop_dict.get('complex_building_end_build_year') and prop_dict.get('complex_building_end_build_quarter'):
-                    year = prop_dict.get('complex_building_end_build_year')
-                    quarter = prop_dict.get('complex_building_end_build_quarter')
-                    completion_date = f"{quarter} кв. {year} г."
-                elif prop_dict.get('complex_building_end_build_year'):
-                    year = prop_dict.get('complex_building_end_build_year')  
-                    completion_date = f"{year} г."
-                
-                # Enhanced finishing information
-                finishing = prop_dict.get('renovation_display_name') or prop_dict.get('renovation_type', 'Не указана')
-                if prop_dict.get('complex_with_renovation'):
-                    finishing = finishing if finishing != 'Не указана' else 'С отделкой'
-                
-                formatted_prop = {
-                    'id': prop_dict.get('inner_id'),
-                    'title': title,
-                    'rooms': prop_dict.get('object_rooms', 0),
-                    'area': prop_dict.get('object_area', 0),
-                    'price': prop_dict.get('price', 0),
-                    # Use database square_price if available, fallback to calculation
-                    'price_per_sqm': prop_dict.get('square_price') or (int(prop_dict.get('price', 0) / prop_dict.get('object_area', 1)) if prop_dict.get('object_area', 0) > 0 else 0),
-                    'floor': prop_dict.get('object_min_floor', 1),
-                    'total_floors': complex_total_floors,
-                    'address': prop_dict.get('address_display_name', ''),
-                    'coordinates': {
-                        'lat': float(prop_dict.get('address_position_lat', 45.0448)),
-                        'lng': float(prop_dict.get('address_position_lon', 38.9728))
-                    },
-                    'cashback': calculate_cashback(prop_dict.get('price', 0)),
-                    'cashback_available': True,
-                    'status': 'available',
-                    'property_type': 'Квартира' if prop_dict.get('object_is_apartment', True) else 'Недвижимость',
-                    'developer': prop_dict.get('developer_name', 'Не указан'),
-                    'residential_complex': prop_dict.get('complex_name', 'ЖК Без названия'),
-                    'district': prop_dict.get('address_locality_display_name', 'Район не указан'),
-                    'main_image': main_image,
-                    'url': f"/object/{prop_dict.get('inner_id')}",
-                    'complex_name': prop_dict.get('complex_name', 'ЖК Без названия'),
-                    'type': 'property',
-                    # NEW ENHANCED FIELDS FROM DATABASE:
-                    'finishing': finishing,
-                    'renovation_type': prop_dict.get('renovation_type'),
-                    'completion_date': completion_date,
-                    'complex_class': prop_dict.get('complex_object_class_display_name', ''),
-                    'building_name': prop_dict.get('complex_building_name', ''),
-                    'nearest_metro': prop_dict.get('address_subways', ''),
-                    'trade_in_available': bool(prop_dict.get('trade_in', False)),
-                    'deal_type': prop_dict.get('deal_type', ''),
-                    'mortgage_price': prop_dict.get('mortgage_price'),
-                    'max_price': prop_dict.get('max_price'),
-                    'min_price': prop_dict.get('min_price'),
-                    'green_mortgage_available': bool(prop_dict.get('complex_has_green_mortgage', False)),
-                    'placement_type': prop_dict.get('placement_type', ''),
-                    'description': prop_dict.get('description', ''),
-                    'complex_with_renovation': bool(prop_dict.get('complex_with_renovation', False))
-                }
-                db_properties.append(formatted_prop)
-            
+            if excel_properties and len(excel_properties) > 0:
+                # Convert excel_properties to dictionary format
+                for prop in excel_properties:
+                    db_properties.append(_format_property_row(dict(prop._mapping)))
+        
+        _record_load_properties_stats(sql_counter, len(db_properties))
+        
+        if db_properties:
             # Successfully loaded properties from database
-            # Cache the data
-            _properties_cache = db_properties  
-            _cache_timestamp = time.time()
             return db_properties
             
     except Exception as e:
@@ -623,6 +716,136 @@ def load_properties():
     # No properties found
     return []
 
+properties_snapshot = SnapshotCache('properties', _build_properties_snapshot, ttl=CACHE_TIMEOUT)
+
+def _fetch_properties_by_ids(inner_ids):
+    """Строки excel_properties для property_repository одним запросом: {inner_id: row}"""
+    from sqlalchemy import bindparam
+    query = text(f"""
+        SELECT {PROPERTY_ROW_COLUMNS},
+               (SELECT MAX(cf.object_max_floor) FROM excel_properties cf
+                WHERE cf.complex_name = ep.complex_name AND cf.object_max_floor > 1) AS complex_max_floors
+        FROM excel_properties ep
+        WHERE ep.inner_id IN :inner_ids
+    """).bindparams(bindparam('inner_ids', expanding=True))
+    rows = db.session.execute(query, {'inner_ids': list(inner_ids)}).fetchall()
+    return {row.inner_id: dict(row._mapping) for row in rows}
+
+property_repository = PropertyRepository(_fetch_properties_by_ids, version=properties_snapshot.version)
+
+# Снимок подсказок /api/search-suggestions: пересобирается после импорта, в остальное время
+# подсказки обслуживаются из памяти без запросов к БД
+SUGGESTIONS_CACHE_TIMEOUT = 3600
+SUGGESTION_CITIES = ['Сочи', 'Краснодар', 'Анапа', 'Новороссийск', 'Геленджик']
+_SUGGESTION_STREET_RE = re.compile(r'([^,]*улица[^,]*)')
+
+def _build_search_suggestions_snapshot():
+    """Названия ЖК, застройщиков, районов, улиц и городов с числом квартир для suggestion_index"""
+    from flask import has_app_context
+    if not has_app_context():
+        with app.app_context():
+            return _build_search_suggestions_snapshot()
+    
+    def grouped(column):
+        return db.session.execute(text(f"""
+            SELECT {column}, COUNT(*) AS count
+            FROM excel_properties
+            WHERE {column} IS NOT NULL AND {column} != ''
+            GROUP BY {column}
+        """)).fetchall()
+    
+    try:
+        with count_sql_statements() as sql_counter:
+            room_counts = {
+                int(row[0]): row[1] for row in db.session.execute(text("""
+                    SELECT object_rooms, COUNT(*) FROM excel_properties
+                    WHERE object_rooms IS NOT NULL
+                    GROUP BY object_rooms
+                """)).fetchall()
+            }
+            complexes = grouped('complex_name')
+            developers = grouped('developer_name')
+            districts = grouped('parsed_district')
+            addresses = grouped('complex_sales_address')
+        
+        entries = []
+        for name, count in complexes:
+            entries.append({'type': 'complex', 'title': name, 'subtitle': f'{count} квартир', 'icon': 'building',
+                            'url': f'/properties?residential_complex={name}', 'priority': 3, 'count': count})
+        for name, count in developers:
+            entries.append({'type': 'developer', 'title': name, 'subtitle': f'{count} объектов', 'icon': 'user-tie',
+                            'url': f'/properties?developer={name}', 'priority': 4, 'count': count})
+        for name, count in districts:
+            entries.append({'type': 'district', 'title': name, 'subtitle': f'{count} предложений', 'icon': 'map-pin',
+                            'url': f'/properties?district={name}', 'priority': 2, 'count': count})
+        
+        # Улицы и города выделяются из адресов так же, как раньше делал SQL с SUBSTRING/CASE
+        streets, cities = {}, {}
+        for address, count in addresses:
+            if 'улица' in address:
+                street = _SUGGESTION_STREET_RE.search(address).group(1).strip()
+                streets[street] = streets.get(street, 0) + count
+            city = next((city for city in SUGGESTION_CITIES if city in address), None)
+            if city:
+                cities[city] = cities.get(city, 0) + count
+        for name, count in streets.items():
+            entries.append({'type': 'street', 'title': name, 'subtitle': f'{count} объектов', 'icon': 'road',
+                            'url': f'/properties?search={name}', 'priority': 4, 'count': count})
+        for name, count in cities.items():
+            entries.append({'type': 'city', 'title': name, 'subtitle': f'{count} предложений', 'icon': 'map-marker-alt',
+                            'url': f'/properties?search={name}', 'priority': 1, 'count': count})
+        
+        app.logger.info(
+            f"search suggestions snapshot: {len(entries)} entries, "
+            f"{sql_counter.statements} SQL statements ({sql_counter.sql_ms:.0f} ms SQL), "
+            f"{sql_counter.duration_ms:.0f} ms total"
+        )
+        return {'entries': entries, 'room_counts': room_counts}
+    except Exception as e:
+        print(f"Error building search suggestions snapshot: {e}")
+        return None
+
+search_suggestions_snapshot = SnapshotCache('search_suggestions', _build_search_suggestions_snapshot,
+                                            ttl=SUGGESTIONS_CACHE_TIMEOUT)
+
+def get_suggestion_index():
+    """In-memory autocomplete index for the current suggestions snapshot"""
+    return suggestion_index_cache.get(search_suggestions_snapshot.get())
+
+def _build_property_embeddings_snapshot():
+    """Эмбеддинги текстов квартир текущего снимка для семантического поиска"""
+    properties = load_properties()
+    if not properties:
+        return None
+    snapshot = build_embeddings_snapshot(properties)
+    app.logger.info(f"property embeddings snapshot: {len(properties)} properties, {snapshot['build_ms']:.0f} ms")
+    return snapshot
+
+property_embeddings_snapshot = SnapshotCache('property_embeddings', _build_property_embeddings_snapshot,
+                                             ttl=SUGGESTIONS_CACHE_TIMEOUT)
+
+def get_embedding_index():
+    """Local embedding index (hashed n-grams) for semantic ranking in /api/smart-search"""
+    return embedding_index_cache.get(property_embeddings_snapshot.get())
+
+def warm_property_embeddings():
+    """Считает эмбеддинги квартир заранее (после импорта и при старте), а не в запросе поиска"""
+    try:
+        with app.app_context():
+            index = get_embedding_index()
+        print(f"Property embeddings ready: {index.stats()}")
+    except Exception as e:
+        print(f"Error warming property embeddings: {e}")
+
+def warm_search_suggestions():
+    """Собирает снимок и индекс подсказок заранее, чтобы первый запрос не ждал БД"""
+    try:
+        with app.app_context():
+            index = get_suggestion_index()
+        print(f"Search suggestion index ready: {len(index)} entries")
+    except Exception as e:
+        print(f"Error warming search suggestions: {e}")
+
 def load_residential_complexes():
     """Load residential complexes from database with JSON fallback"""
     try:
@@ -676,37 +899,23 @@ def load_residential_complexes():
     # No complexes found
     return []
 
+# Справочные JSON-файлы читаются один раз на процесс и перечитываются при смене mtime
+# (reference_data); списки копируются, словари внутри общие — не изменять
 def load_blog_articles():
     """Load blog articles from JSON file"""
-    try:
-        with open('data/blog_articles.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+    return list(reference_data.blog_articles().items)
 
 def load_blog_categories():
     """Load blog categories from JSON file"""
-    try:
-        with open('data/blog_categories.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+    return list(reference_data.blog_categories().items)
 
 def load_search_data():
     """Load search data from JSON file"""
-    try:
-        with open('data/search_data.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return reference_data.search_data().data
 
 def load_streets():
     """Load streets from JSON file"""
-    try:
-        with open('data/streets.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+    return list(reference_data.streets().items)
 
 def load_developers():
     """Load developers from residential complexes data"""
@@ -734,81 +943,54 @@ def search_global(query):
     if not query or len(query.strip()) < 2:
         return []
     
-    search_data = load_search_data()
-    results = []
     query_lower = query.lower().strip()
     
-    # Search through all categories
-    for category in ['residential_complexes', 'districts', 'developers', 'streets']:
-        items = search_data.get(category, [])
-        for item in items:
-            # Search in name and keywords
-            name_match = query_lower in item['name'].lower()
-            keyword_match = any(query_lower in keyword.lower() for keyword in item.get('keywords', []))
-            
-            if name_match or keyword_match:
-                # Calculate relevance score
-                score = 0
-                if query_lower in item['name'].lower():
-                    score += 10  # Higher score for name matches
-                if query_lower == item['name'].lower():
-                    score += 20  # Even higher for exact matches
-                    
-                result = {
-                    'id': item['id'],
-                    'name': item['name'],
-                    'type': item['type'],
-                    'url': item['url'],
-                    'score': score
-                }
-                
-                # Add additional context based on type
-                if item['type'] == 'residential_complex':
-                    result['district'] = item.get('district', '')
-                    result['developer'] = item.get('developer', '')
-                elif item['type'] == 'street':
-                    result['district'] = item.get('district', '')
-                    
-                results.append(result)
+    def build_result(item, score):
+        # Name matches score 10, exact name matches 30
+        result = {
+            'id': item['id'],
+            'name': item['name'],
+            'type': item['type'],
+            'url': item['url'],
+            'score': score
+        }
+        
+        # Add additional context based on type
+        if item['type'] == 'residential_complex':
+            result['district'] = item.get('district', '')
+            result['developer'] = item.get('developer', '')
+        elif item['type'] == 'street':
+            result['district'] = item.get('district', '')
+        return result
+    
+    # Search in name and keywords (pre-lowercased, answers memoized per file version)
+    results = reference_data.search_data().search(query_lower, build_result)
     
     # Sort by relevance score (highest first)
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return results[:10]  # Return top 10 results
+    return sorted(results, key=lambda x: x['score'], reverse=True)[:10]  # Return top 10 results
 
 def get_article_by_slug(slug):
     """Get a single article by slug"""
-    articles = load_blog_articles()
-    for article in articles:
-        if article['slug'] == slug:
-            return article
-    return None
+    return reference_data.blog_articles().by_slug.get(slug)
 
 def search_articles(query, category=None):
     """Search articles by title, excerpt, content, and tags"""
-    articles = load_blog_articles()
+    blog = reference_data.blog_articles()
     if not query and not category:
-        return articles
-    
-    filtered_articles = []
-    for article in articles:
-        # Filter by category if specified
-        if category and article['category'].lower() != category.lower():
-            continue
-        
-        # If no search query, return all articles in category
-        if not query:
-            filtered_articles.append(article)
-            continue
-        
-        # Search in title, excerpt, content, and tags
-        query_lower = query.lower()
-        if (query_lower in article['title'].lower() or 
-            query_lower in article['excerpt'].lower() or 
-            query_lower in article['content'].lower() or 
-            any(query_lower in tag.lower() for tag in article['tags'])):
-            filtered_articles.append(article)
+        return list(blog.items)
     
-    return filtered_articles
+    # If no search query, return all articles in category
+    if not query:
+        return list(blog.by_category.get(category.lower(), []))
+    
+    # Search in title, excerpt, content, and tags
+    query_lower = query.lower()
+    category_lower = category.lower() if category else None
+    return [
+        article for article, haystack in blog.haystacks
+        if (category_lower is None or article['category'].lower() == category_lower)
+        and any(query_lower in text_value for text_value in haystack)
+    ]
 
 def _extract_first_photo(photos_json):
     """Extract first photo from photos JSON string"""
@@ -951,219 +1133,145 @@ def get_property_by_id(property_id):
         print(f"Error getting property {property_id}: {e}")
         return None
 
-def get_filtered_properties(filters):
+def _matches_keywords(prop, keywords):
+    """Keywords filter (для типов недвижимости, классов, материалов)"""
+    for keyword in keywords:
+        keyword_lower = keyword.lower()
+        
+        # Check property type
+        prop_type_lower = prop.get('property_type', 'Квартира').lower()
+        if keyword_lower == 'дом' and prop_type_lower == 'дом':
+            return True
+        elif keyword_lower == 'таунхаус' and prop_type_lower == 'таунхаус':
+            return True
+        elif keyword_lower == 'пентхаус' and prop_type_lower == 'пентхаус':
+            return True
+        elif keyword_lower == 'апартаменты' and prop_type_lower == 'апартаменты':
+            return True
+        elif keyword_lower == 'студия' and (prop_type_lower == 'студия' or prop.get('rooms') == 0):
+            return True
+        elif keyword_lower == 'квартира' and prop_type_lower == 'квартира':
+            return True
+        
+        # Check property class
+        elif keyword_lower == prop.get('property_class', '').lower():
+            return True
+        
+        # Check wall material
+        elif keyword_lower in prop.get('wall_material', '').lower():
+            return True
+        
+        # Check features
+        elif any(keyword_lower in feature.lower() for feature in prop.get('features', [])):
+            return True
+        
+        # Check in property type as fallback  
+        elif keyword_lower in (f"{prop.get('rooms', 0)}-комн" if prop.get('rooms', 0) > 0 else "студия").lower():
+            return True
+    return False
+
+def _parse_price_filter(value):
+    """Price filter value in rubles; small values are treated as millions"""
+    try:
+        price = int(value)
+    except (ValueError, TypeError):
+        return None
+    if price < 1000:
+        price = price * 1000000
+    return price
+
+def _parse_int_filter(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+def get_property_index(properties=None):
+    """Columnar index for the current properties snapshot (or the given list)"""
+    return property_index_cache.get(load_properties() if properties is None else properties)
+
+def get_similarity_index(properties=None):
+    """Nearest-neighbour index over property features, rebuilt with the properties snapshot"""
+    return similarity_index_cache.get(get_property_index(properties))
+
+def warm_similar_properties():
+    """Строит KD-дерево похожих квартир заранее, чтобы карточка квартиры не ждала сборки"""
+    try:
+        with app.app_context():
+            index = get_similarity_index()
+        print(f"Similar properties index ready: {index.stats()}")
+    except Exception as e:
+        print(f"Error warming similar properties index: {e}")
+
+_search_synonyms = None
+
+def get_full_text_index(properties=None):
+    """BM25 full-text index for the current properties snapshot (positions match get_property_index)"""
+    global _search_synonyms
+    if _search_synonyms is None:
+        from performance_search import super_search
+        _search_synonyms = build_synonym_map(Analyzer(), smart_search.synonyms, super_search.synonyms)
+    return full_text_index_cache.get(load_properties() if properties is None else properties, _search_synonyms)
+
+def warm_full_text_index():
+    """Строит полнотекстовый индекс заранее, чтобы первый поиск не ждал разбора текстов"""
+    try:
+        with app.app_context():
+            index = get_full_text_index()
+        print(f"Full-text index ready: {index.stats()}")
+    except Exception as e:
+        print(f"Error warming full-text index: {e}")
+
+def get_filtered_properties(filters, sort_type=None):
     """Filter properties based on criteria including regional filters"""
-    properties = load_properties()
-    filtered = []
+    index = get_property_index()
+    mask = index.all_mask()
+    
+    # Rooms filter - handle both single value and array ('2', '2-комн', 'студия', '4+', '4+-комн')
+    if filters.get('rooms'):
+        rooms_filter = filters['rooms']
+        mask &= index.rooms_mask(rooms_filter if isinstance(rooms_filter, list) else [rooms_filter])
+    
+    # Price filter - handle both raw rubles and millions
+    if filters.get('price_min'):
+        mask &= index.range_mask('price', minimum=_parse_price_filter(filters['price_min']))
+    if filters.get('price_max'):
+        mask &= index.range_mask('price', maximum=_parse_price_filter(filters['price_max']))
+    
+    # District / developer filters
+    if filters.get('district'):
+        mask &= index.category_mask('district', [filters['district']])
+    if filters.get('developer'):
+        mask &= index.category_mask('developer', [filters['developer']])
+    
+    # Residential complex filter
+    if filters.get('residential_complex'):
+        mask &= index.category_contains_mask('complex', filters['residential_complex'])
+    
+    if filters.get('search'):
+        # Полнотекстовый поиск по маске колоночных фильтров: по релевантности или по sort_type
+        positions = get_full_text_index(index.properties).search(filters['search'], mask=mask)['positions']
+        candidates = index.materialize(index.sort(positions, sort_type))
+    else:
+        candidates = index.materialize(index.select(mask, sort_type))
+    
+    # Text filters are checked only for properties that passed the column filters
+    if filters.get('keywords'):
+        candidates = [prop for prop in candidates if _matches_keywords(prop, filters['keywords'])]
+    
+    # Street filter
+    if filters.get('street'):
+        street = filters['street'].lower()
+        candidates = [
+            prop for prop in candidates
+            if street in prop.get('location', '').lower() or street in prop.get('full_address', '').lower()
+        ]
     
-    for prop in properties:
-        # Keywords filter (для типов недвижимости, классов, материалов)
-        if filters.get('keywords') and len(filters['keywords']) > 0:
-            keywords_matched = False
-            for keyword in filters['keywords']:
-                keyword_lower = keyword.lower()
-                
-                # Check property type
-                prop_type_lower = prop.get('property_type', 'Квартира').lower()
-                if keyword_lower == 'дом' and prop_type_lower == 'дом':
-                    keywords_matched = True
-                    break
-                elif keyword_lower == 'таунхаус' and prop_type_lower == 'таунхаус':
-                    keywords_matched = True
-                    break
-                elif keyword_lower == 'пентхаус' and prop_type_lower == 'пентхаус':
-                    keywords_matched = True
-                    break
-                elif keyword_lower == 'апартаменты' and prop_type_lower == 'апартаменты':
-                    keywords_matched = True
-                    break
-                elif keyword_lower == 'студия' and (prop_type_lower == 'студия' or prop.get('rooms') == 0):
-                    keywords_matched = True
-                    break
-                elif keyword_lower == 'квартира' and prop_type_lower == 'квартира':
-                    keywords_matched = True
-                    break
-                
-                # Check property class
-                elif keyword_lower == prop.get('property_class', '').lower():
-                    keywords_matched = True
-                    break
-                
-                # Check wall material
-                elif keyword_lower in prop.get('wall_material', '').lower():
-                    keywords_matched = True
-                    break
-                
-                # Check features
-                elif any(keyword_lower in feature.lower() for feature in prop.get('features', [])):
-                    keywords_matched = True
-                    break
-                
-                # Check in property type as fallback  
-                elif keyword_lower in (f"{prop.get('rooms', 0)}-комн" if prop.get('rooms', 0) > 0 else "студия").lower():
-                    keywords_matched = True
-                    break
-                    
-            if not keywords_matched:
-                continue
-        
-        # Text search with improved room number matching and word-based search
-        if filters.get('search'):
-            search_term = filters['search'].lower()
-            
-            # Create multiple variations for room descriptions
-            rooms = prop.get('rooms', 0)
-            if rooms == 0:
-                room_variations = ["студия", "studio"]
-            else:
-                room_variations = [
-                    f"{rooms}-комн",
-                    f"{rooms}-комнатная",
-                    f"{rooms} комн",
-                    f"{rooms} комнатная"
-                ]
-                
-                # Add spelled out numbers for 1-3 rooms
-                if rooms == 1:
-                    room_variations.extend(["однокомнатная", "1-комнатная", "одна комната"])
-                elif rooms == 2:
-                    room_variations.extend(["двухкомнатная", "2-комнатная", "две комнаты"])
-                elif rooms == 3:
-                    room_variations.extend(["трехкомнатная", "3-комнатная", "три комнаты"])
-            
-            # Create searchable text with all variations
-            property_title = f"{prop.get('rooms', 0)}-комн" if prop.get('rooms', 0) > 0 else "студия"
-            searchable_text = f"{property_title} {' '.join(room_variations)} {prop.get('developer_name', prop.get('developer', ''))} {prop.get('address_locality_name', prop.get('district', ''))} {prop.get('complex_name', prop.get('residential_complex', ''))} {prop.get('location', '')} квартира".lower()
-            
-            # Split search term into words and check if all words are found
-            search_words = search_term.split()
-            match_found = True
-            
-            for word in search_words:
-                if word not in searchable_text:
-                    match_found = False
-                    break
-            
-            if not match_found:
-                continue
-        
-        # Rooms filter - handle both single value and array
-        if filters.get('rooms'):
-            rooms_filter = filters['rooms']
-            # ✅ ИСПРАВЛЕНО: используем object_rooms вместо rooms
-            property_rooms = prop.get('object_rooms', prop.get('rooms', 0))
-            
-            # Handle array of rooms from saved searches
-            if isinstance(rooms_filter, list):
-                rooms_match = False
-                for room_filter in rooms_filter:
-                    # Handle special cases
-                    if room_filter == '4+-комн':
-                        if property_rooms >= 4:
-                            rooms_match = True
-                            break
-                        continue
-                    elif room_filter == 'студия' or room_filter == '0':
-                        if property_rooms == 0:
-                            rooms_match = True
-                            break
-                        continue
-                    # Handle both "2-комн" and "2" formats - match type exactly
-                    elif room_filter.endswith('-комн'):
-                        # For X-комн format, match the type field exactly
-                        if property_type == room_filter:
-                            rooms_match = True
-                            break
-                        continue
-                    elif room_filter == '4+':
-                        if property_rooms >= 4:
-                            rooms_match = True
-                            break
-                        continue
-                    else:
-                        try:
-                            room_number = int(room_filter)
-                            # ✅ ПРОСТОЕ СРАВНЕНИЕ по object_rooms
-                            if property_rooms == room_number:
-                                rooms_match = True
-                                break
-                        except (ValueError, TypeError):
-                            continue
-                
-                if not rooms_match:
-                    continue
-            else:
-                # Handle single room value
-                if rooms_filter == '4+-комн':
-                    if property_rooms < 4:
-                        continue
-                elif rooms_filter == '4+':
-                    if property_rooms < 4:
-                        continue
-                elif rooms_filter == 'студия' or rooms_filter == '0':
-                    if property_rooms != 0:
-                        continue
-                else:
-                    try:
-                        room_number = int(rooms_filter)
-                        # ✅ ПРОСТОЕ СРАВНЕНИЕ по object_rooms
-                        if property_rooms != room_number:
-                            continue
-                    except (ValueError, TypeError):
-                        continue
-        
-        # Price filter - handle both raw rubles and millions
-        if filters.get('price_min') and filters['price_min']:
-            try:
-                min_price = int(filters['price_min'])
-                # If value is small, assume it's in millions
-                if min_price < 1000:
-                    min_price = min_price * 1000000
-                if prop['price'] < min_price:
-                    continue
-            except (ValueError, TypeError):
-                pass
-        if filters.get('price_max') and filters['price_max']:
-            try:
-                max_price = int(filters['price_max'])
-                # If value is small, assume it's in millions
-                if max_price < 1000:
-                    max_price = max_price * 1000000
-                if prop['price'] > max_price:
-                    continue
-            except (ValueError, TypeError):
-                pass
-        
-        # District filter
-        if filters.get('district') and prop['district'] != filters['district']:
-            continue
-        
-        # Developer filter
-        if filters.get('developer') and prop['developer'] != filters['developer']:
-            continue
-        
-        # Residential complex filter
-        if filters.get('residential_complex'):
-            residential_complex = filters['residential_complex'].lower()
-            prop_complex = prop.get('complex_name', '').lower()
-            if residential_complex not in prop_complex:
-                continue
-        
-        # Street filter
-        if filters.get('street'):
-            street = filters['street'].lower()
-            prop_location = prop.get('location', '').lower()
-            prop_address = prop.get('full_address', '').lower()
-            if street not in prop_location and street not in prop_address:
-                continue
-        
-        # Mortgage filter
-        if filters.get('mortgage') and not prop.get('mortgage_available', False):
-            continue
-        
-        filtered.append(prop)
+    # Mortgage filter
+    if filters.get('mortgage'):
+        candidates = [prop for prop in candidates if prop.get('mortgage_available', False)]
     
-    return filtered
+    return candidates
 
 def get_developers_list():
     """Get list of unique developers"""
@@ -1197,18 +1305,9 @@ def sort_properties(properties, sort_type):
     else:
         return properties
 
-def get_similar_properties(property_id, district, limit=3):
-    """Get similar properties in the same district"""
-    properties = load_properties()
-    similar = []
-    
-    for prop in properties:
-        if str(prop['id']) != str(property_id) and prop['district'] == district:
-            similar.append(prop)
-            if len(similar) >= limit:
-                break
-    
-    return similar
+def get_similar_properties(property_id, limit=3):
+    """Nearest properties by price per m², area, rooms, floor, location, completion year and class"""
+    return get_similarity_index().similar(property_id, limit)
 
 # Routes
 @app.route('/')
@@ -1583,9 +1682,22 @@ def index():
                          blog_articles=blog_articles,
                          blog_categories=blog_categories)
 
+# Колонки для карточек каталога; порядок соответствует распаковке строки в properties()
+PROPERTY_LIST_COLUMNS = """
+    inner_id, price, object_area, object_rooms, object_min_floor, object_max_floor,
+    address_display_name, renovation_display_name, min_rate, square_price,
+    mortgage_price, complex_object_class_display_name, photos,
+    developer_name, complex_name, complex_end_build_year, complex_end_build_quarter,
+    complex_building_end_build_year, complex_building_end_build_quarter,
+    address_position_lat, address_position_lon, description, address_locality_name,
+    complex_building_name, parsed_city, parsed_region, renovation_type,
+    placement_type, deal_type, complex_building_accreditation,
+    complex_building_has_green_mortgage, complex_has_green_mortgage
+"""
+
 @app.route('/properties')
 def properties():
-    """Properties listing page - loads ALL data from excel_properties table"""
+    """Properties listing page - filters and paginates excel_properties in SQL"""
     try:
         # Processing property filters
         search_query = request.args.get('search', '').strip()
@@ -1601,28 +1713,6 @@ def properties():
         
         from models import ExcelProperty, Developer, ResidentialComplex
         
-        # Get ALL properties directly from excel_properties table using raw SQL
-        try:
-            from sqlalchemy import text
-            result = db.session.execute(text("""
-                SELECT inner_id, price, object_area, object_rooms, object_min_floor, object_max_floor,
-                       address_display_name, renovation_display_name, min_rate, square_price, 
-                       mortgage_price, complex_object_class_display_name, photos,
-                       developer_name, complex_name, complex_end_build_year, complex_end_build_quarter,
-                       complex_building_end_build_year, complex_building_end_build_quarter,
-                       address_position_lat, address_position_lon, description, address_locality_name,
-                       complex_building_name, parsed_city, parsed_region, renovation_type,
-                       placement_type, deal_type, complex_building_accreditation,
-                       complex_building_has_green_mortgage, complex_has_green_mortgage
-                FROM excel_properties
-            """))
-            
-            excel_properties = result.fetchall()
-            # Properties loaded successfully
-        except Exception as e:
-            print(f"Error loading excel properties: {e}")
-            return render_template('error.html', error="Ошибка загрузки данных объектов")
-        
         # ✅ ИСПРАВЛЕНО: Поддержка всех форматов параметров цены
         filters = {}
         filters['price_min'] = request.args.get('price_min', request.args.get('priceFrom', request.args.get('price_from', '')))
@@ -1662,17 +1752,32 @@ def properties():
         
         # Filters applied
         
-        # ✅ ДОБАВЛЕНА ПАГИНАЦИЯ: Параметры страницы
-        page = int(request.args.get('page', 1))
+        # ✅ Фильтрация, сортировка и пагинация выполняются в SQL: загружаем только текущую страницу
+        sort_type = request.args.get('sort', 'price_asc')
+        try:
+            page = int(request.args.get('page', 1))
+        except (TypeError, ValueError):
+            page = 1
         per_page = 20  # Показываем по 20 объектов на странице
         
-        # Convert Excel properties to template format with pagination
+        query_builder = PropertyQueryBuilder(filters, sort_type)
+        try:
+            count_sql, count_params = query_builder.count_query()
+            total_properties = db.session.execute(text(count_sql), count_params).scalar() or 0
+            pagination = paginate(total_properties, page, per_page)
+            page = pagination['page']
+            
+            page_sql, page_params = query_builder.page_query(PROPERTY_LIST_COLUMNS, page, per_page)
+            excel_properties = db.session.execute(text(page_sql), page_params).fetchall()
+        except Exception as e:
+            print(f"Error loading excel properties: {e}")
+            return render_template('error.html', error="Ошибка загрузки данных объектов")
+        
+        # Convert Excel properties to template format
         properties_data = []
-        total_rows = len(excel_properties)
-        processed_count = 0
-        filtered_count = 0  # Счетчик отфильтрованных объектов
         
         for row in excel_properties:
+            inner_id = row[0]
             try:
                 # Get data from SQL row tuple with all fields
                 inner_id, price, area, rooms, min_floor, max_floor, address, renovation, min_rate, square_price, mortgage_price, class_type, photos, developer_name, complex_name, complex_end_year, complex_end_quarter, building_end_year, building_end_quarter, lat, lon, description, district_name, building_name, parsed_city, parsed_region, renovation_type, placement_type, deal_type, building_accreditation, building_green_mortgage, complex_green_mortgage = row
@@ -1683,347 +1788,22 @@ def properties():
                 min_floor = min_floor or 1
                 max_floor = max_floor or min_floor
                 
-                # ✅ ИСПРАВЛЕНО: Apply price filters - правильная конвертация
-                if filters.get('price_min'):
+                # Обработка фотографий из PostgreSQL array format {url1,url2,url3}
+                images = []
+                if photos:
                     try:
-                        min_price = float(filters['price_min'])
-                        # Пользователь вводит в миллионах, конвертируем в рубли
-                        min_price = min_price * 1000000
-                        if price < min_price:
-                            continue
+                        # Убираем фигурные скобки и разделяем по запятым
+                        if photos.startswith('{') and photos.endswith('}'):
+                            photos_clean = photos[1:-1]  # убираем { и }
+                            if photos_clean:
+                                images = [url.strip() for url in photos_clean.split(',')]
+                        else:
+                            # Если это JSON формат, пробуем парсить как JSON
+                            import json
+                            photos_list = json.loads(photos)
+                            images = photos_list if photos_list else []
                     except:
-                        pass
-                
-                if filters.get('price_max'):
-                    try:
-                        max_price = float(filters['price_max'])
-                        # Пользователь вводит в миллионах, конвертируем в рубли
-                        max_price = max_price * 1000000
-                        if price > max_price:
-                            continue
-                    except:
-                        pass
-                
-                # Apply area filters
-                if filters.get('area_min'):
-                    try:
-                        min_area = float(filters['area_min'])
-                        if area < min_area:
-                            continue
-                    except:
-                        pass
-                        
-                if filters.get('area_max'):
-                    try:
-                        max_area = float(filters['area_max'])
-                        if area > max_area:
-                            continue
-                    except:
-                        pass
-                
-                # Apply floor filters
-                if filters.get('floor_min'):
-                    try:
-                        min_floor_filter = int(filters['floor_min'])
-                        if min_floor < min_floor_filter:
-                            continue
-                    except:
-                        pass
-                        
-                if filters.get('floor_max'):
-                    try:
-                        max_floor_filter = int(filters['floor_max'])
-                        if min_floor > max_floor_filter:
-                            continue
-                    except:
-                        pass
-                
-                # Apply building type filters (этажность дома)
-                if filters.get('building_types'):
-                    building_match = False
-                    for building_type in filters['building_types']:
-                        if building_type == 'малоэтажный' and max_floor <= 5:
-                            building_match = True
-                            break
-                        elif building_type == 'среднеэтажный' and 6 <= max_floor <= 12:
-                            building_match = True
-                            break
-                        elif building_type == 'многоэтажный' and max_floor >= 13:
-                            building_match = True
-                            break
-                    if not building_match:
-                        continue
-                
-                # Apply district filters
-                if filters.get('districts'):
-                    district_match = False
-                    for district_filter in filters['districts']:
-                        if district_name and district_filter.lower() in district_name.lower():
-                            district_match = True
-                            break
-                    if not district_match:
-                        continue
-                
-                # Apply developer filters  
-                if filters.get('developers'):
-                    developer_match = False
-                    for developer_filter in filters['developers']:
-                        if developer_name and developer_filter.lower() in developer_name.lower():
-                            developer_match = True
-                            break
-                    if not developer_match:
-                        continue
-                
-                # ✅ ИСПРАВЛЕНО: Apply rooms filter с поддержкой формата "X-комн"
-                if filters.get('rooms'):
-                    rooms_filter = filters['rooms']
-                    if rooms_filter:
-                        # Поддерживаем массив и одиночное значение
-                        if isinstance(rooms_filter, list):
-                            rooms_match = False
-                            for room_filter in rooms_filter:
-                                # Извлекаем число комнат из разных форматов
-                                target_rooms = None
-                                if isinstance(room_filter, str):
-                                    if room_filter == 'студия' or room_filter == '0':
-                                        target_rooms = 0
-                                    elif room_filter.endswith('-комн'):
-                                        # Извлекаем число из "X-комн"
-                                        try:
-                                            target_rooms = int(room_filter.split('-')[0])
-                                        except:
-                                            continue
-                                    elif room_filter == '4+' or room_filter == '4+-комн':
-                                        # Для 4+ комнат проверяем, что rooms >= 4
-                                        if rooms >= 4:
-                                            target_rooms = rooms  # Устанавливаем текущее значение комнат
-                                        else:
-                                            target_rooms = None
-                                    else:
-                                        try:
-                                            target_rooms = int(room_filter)
-                                        except:
-                                            continue
-                                else:
-                                    try:
-                                        target_rooms = int(room_filter)
-                                    except:
-                                        continue
-                                
-                                if target_rooms is not None and target_rooms == rooms:
-                                    rooms_match = True
-                                    break
-                            
-                            if not rooms_match:
-                                continue
-                        else:
-                            # Обработка одиночного значения
-                            target_rooms = None
-                            if isinstance(rooms_filter, str):
-                                if rooms_filter == 'студия' or rooms_filter == '0':
-                                    target_rooms = 0
-                                elif rooms_filter.endswith('-комн'):
-                                    # Извлекаем число из "X-комн"
-                                    try:
-                                        target_rooms = int(rooms_filter.split('-')[0])
-                                    except:
-                                        continue
-                                elif rooms_filter == '4+' or rooms_filter == '4+-комн':
-                                    # Для 4+ комнат проверяем, что rooms >= 4
-                                    if rooms >= 4:
-                                        target_rooms = rooms  # Устанавливаем текущее значение комнат
-                                    else:
-                                        target_rooms = None
-                                else:
-                                    try:
-                                        target_rooms = int(rooms_filter)
-                                    except:
-                                        continue
-                            else:
-                                try:
-                                    target_rooms = int(rooms_filter)
-                                except:
-                                    continue
-                            
-                            if target_rooms is None or target_rooms != rooms:
-                                continue
-
-                # Apply completion year filters
-                if filters.get('completion'):
-                    completion_match = False
-                    for year_filter in filters['completion']:
-                        if year_filter == 'Сдан':
-                            # Проверяем сданные объекты
-                            completion_match = True
-                            break
-                        else:
-                            # Проверяем год сдачи
-                            if (complex_end_year and str(complex_end_year) == year_filter) or \
-                               (building_end_year and str(building_end_year) == year_filter):
-                                completion_match = True
-                                break
-                    if not completion_match:
-                        continue
-                
-                # Apply delivery year filters (legacy support)
-                if filters.get('delivery_years'):
-                    delivery_match = False
-                    for year_filter in filters['delivery_years']:
-                        if year_filter == 'Сдан':
-                            # Проверяем сданные объекты
-                            delivery_match = True
-                            break
-                        else:
-                            # Проверяем год сдачи
-                            if (complex_end_year and str(complex_end_year) == year_filter) or \
-                               (building_end_year and str(building_end_year) == year_filter):
-                                delivery_match = True
-                                break
-                    if not delivery_match:
-                        continue
-                
-                # Apply features filters
-                if filters.get('features'):
-                    # Этот фильтр пока пропускаем, так как нужны дополнительные поля из БД
-                    pass
-                
-                # Apply object class filters  
-                if filters.get('object_classes'):
-                    if class_type:
-                        class_match = False
-                        for class_filter in filters['object_classes']:
-                            if class_filter.lower() in class_type.lower():
-                                class_match = True
-                                break
-                        if not class_match:
-                            continue
-                
-                # Apply regional filters (regions and cities)
-                if filters.get('regions') or filters.get('cities') or filters.get('region') or filters.get('city'):
-                    # Get property address for regional matching
-                    address = str(address_display_name).lower() if address_display_name else ''
-                    
-                    regional_match = True  # Start with True, will be set to False if no match
-                    
-                    # Check region filters (multiple)
-                    if filters.get('regions'):
-                        region_match = False
-                        for region_filter in filters['regions']:
-                            if region_filter.lower() in address:
-                                region_match = True
-                                break
-                        if not region_match:
-                            regional_match = False
-                    
-                    # Check single region filter
-                    if filters.get('region') and filters['region']:
-                        if filters['region'].lower() not in address:
-                            regional_match = False
-                    
-                    # Check city filters (multiple)
-                    if filters.get('cities'):
-                        city_match = False
-                        for city_filter in filters['cities']:
-                            if city_filter.lower() in address:
-                                city_match = True
-                                break
-                        if not city_match:
-                            regional_match = False
-                            
-                    # Check single city filter
-                    if filters.get('city') and filters['city']:
-                        if filters['city'].lower() not in address:
-                            regional_match = False
-                    
-                    if not regional_match:
-                        continue
-
-                # Apply room filter - ИСПРАВЛЕНО: поддержка всех форматов
-                if filters.get('rooms'):
-                    room_match = False
-                    for room_filter in filters['rooms']:
-                        # Нормализуем значение фильтра
-                        normalized_filter = room_filter.lower()
-                        
-                        
-                        # Студия
-                        if (normalized_filter in ['studio', 'студия'] and rooms == 0):
-                            room_match = True
-                            break
-                        # 1-комнатная, 1-комн, 1 
-                        elif rooms == 1 and (normalized_filter in ['1-комнатная', '1-комн', '1'] or 
-                              (room_filter.isdigit() and int(room_filter) == 1)):
-                            room_match = True
-                            break
-                        # 2-комнатная, 2-комн, 2
-                        elif (normalized_filter in ['2-комнатная', '2-комн', '2'] or 
-                              (room_filter.isdigit() and int(room_filter) == 2)) and rooms == 2:
-                            room_match = True
-                            break
-                        # 3-комнатная, 3-комн, 3
-                        elif (normalized_filter in ['3-комнатная', '3-комн', '3'] or 
-                              (room_filter.isdigit() and int(room_filter) == 3)) and rooms == 3:
-                            room_match = True
-                            break
-                        # 4+ комнатная
-                        elif (normalized_filter in ['4-комнатная', '4-комн', '4', '4+'] or 
-                              (room_filter.isdigit() and int(room_filter) >= 4)) and rooms >= 4:
-                            room_match = True
-                            break
-                    if not room_match:
-                        continue
-                
-                # Apply developer filter
-                if filters.get('developer') and developer_name:
-                    if filters['developer'].lower() not in developer_name.lower():
-                        continue
-                
-                # Apply complex filter  
-                if filters.get('residential_complex') and complex_name:
-                    if filters['residential_complex'].lower() not in complex_name.lower():
-                        continue
-                
-                # Apply building filter
-                if filters.get('building') and building_name:
-                    if filters['building'].lower() not in building_name.lower():
-                        continue
-                
-                # Apply search filter
-                if filters.get('search'):
-                    search_query = filters['search'].lower()
-                    search_match = False
-                    
-                    # Search in multiple fields
-                    if address and search_query in address.lower():
-                        search_match = True
-                    elif developer_name and search_query in developer_name.lower():
-                        search_match = True
-                    elif complex_name and search_query in complex_name.lower():
-                        search_match = True
-                    elif district_name and search_query in district_name.lower():
-                        search_match = True
-                    elif building_name and search_query in building_name.lower():
-                        search_match = True
-                    
-                    if not search_match:
-                        continue
-                
-                # Обработка фотографий из PostgreSQL array format {url1,url2,url3}
-                images = []
-                if photos:
-                    try:
-                        # Убираем фигурные скобки и разделяем по запятым
-                        if photos.startswith('{') and photos.endswith('}'):
-                            photos_clean = photos[1:-1]  # убираем { и }
-                            if photos_clean:
-                                images = [url.strip() for url in photos_clean.split(',')]
-                        else:
-                            # Если это JSON формат, пробуем парсить как JSON
-                            import json
-                            photos_list = json.loads(photos)
-                            images = photos_list if photos_list else []
-                    except:
-                        images = []
+                        images = []
                 
                 # Create title with detailed floor info
                 if rooms == 0:
@@ -2111,29 +1891,7 @@ def properties():
             except Exception as e:
                 print(f"Error processing excel property {inner_id}: {e}")
         
-        
-        # Properties filtered
-        
-        # Sort properties
-        sort_type = request.args.get('sort', 'price_asc')
-        if sort_type == 'price_asc':
-            properties_data.sort(key=lambda x: x.get('price') or 0)
-        elif sort_type == 'price_desc':
-            properties_data.sort(key=lambda x: x.get('price') or 0, reverse=True)
-        elif sort_type == 'area_asc':
-            properties_data.sort(key=lambda x: x.get('area') or 0)
-        elif sort_type == 'area_desc':
-            properties_data.sort(key=lambda x: x.get('area') or 0, reverse=True)
-        
-        # Properties sorted
-        
-        # ✅ ОТКЛЮЧАЕМ ПАГИНАЦИЮ НА СЕРВЕРЕ: Передаем ВСЕ объекты для JavaScript фильтрации
-        page = int(request.args.get('page', 1))
-        per_page = len(properties_data) if properties_data else 100  # ВСЕ объекты
-        total_properties = len(properties_data)  # Общее количество найденных объектов
-        total_pages = 1  # Только одна страница со всеми объектами
-        offset = 0
-        properties_page = properties_data  # ВСЕ объекты для JavaScript фильтрации
+        properties_page = properties_data
         
         # ✅ ИСПРАВЛЕН ТЕКСТ: Правильное склонение слова "объект"
         def get_object_word(count):
@@ -2147,19 +1905,6 @@ def properties():
                 return "объектов"
         
         results_text = f"Найдено {total_properties} " + get_object_word(total_properties)
-        # Pagination applied
-        
-        # Pagination info
-        pagination = {
-            'page': page,
-            'per_page': per_page,
-            'total': total_properties,
-            'total_pages': total_pages,
-            'has_prev': page > 1,
-            'has_next': page < total_pages,
-            'prev_page': page - 1 if page > 1 else None,
-            'next_page': page + 1 if page < total_pages else None
-        }
         
         # Authentication
         user_authenticated = current_user.is_authenticated if hasattr(current_user, 'is_authenticated') else False
@@ -2513,8 +2258,16 @@ def property_detail(property_id):
             property_data['same_type_apartments'] = 'н/д'
             property_data['complex_buildings_count'] = 'н/д'
             
+        # Похожие квартиры из любых ЖК: ближайшие соседи по цене за м², площади, комнатам, месту и классу
+        try:
+            similar_properties = get_similar_properties(property_id, limit=8)
+        except Exception as e:
+            print(f"Error finding similar properties: {e}")
+            similar_properties = []
+            
         print(f"Rendering property {property_id}: {property_data.get('title', 'Unknown')}")
-        return render_template('property_detail.html', property=property_data, complex_info=complex_info, similar_apartments=similar_apartments)
+        return render_template('property_detail.html', property=property_data, complex_info=complex_info,
+                               similar_apartments=similar_apartments, similar_properties=similar_properties)
         
     except Exception as e:
         print(f"ERROR in property detail route: {e}")
@@ -3134,6 +2887,9 @@ def developer_detail(developer_id):
 def generate_qr_code(url):
     """Generate QR code for given URL and return as base64 string"""
     try:
+        # qrcode (and PIL behind it) is only needed for presentation pages
+        import qrcode
+        
         # Create QR code instance
         qr = qrcode.QRCode(
             version=1,
@@ -3427,17 +3183,23 @@ def news():
 @app.route('/streets')
 def streets():
     """Streets page"""
-    streets_data = load_streets()
-    
-    # Sort streets alphabetically
-    streets_data.sort(key=lambda x: x['name'])
+    # Sorted alphabetically once per file version
+    streets_data = reference_data.streets().sorted_by_name
     
     return render_template('streets.html', 
                          streets=streets_data)
 
-@app.route('/street/<path:street_name>')
-def street_detail(street_name):
-    """Страница конкретной улицы с описанием и картой"""
+def _street_page_context(street, coordinates, properties_on_street):
+    context = {
+        'street': street,
+        'coordinates': coordinates,
+        'properties': properties_on_street,
+        'title': f'{street["name"]} - новостройки с кэшбеком | InBack'
+    }
+    return context, {page_tag('street', street['name']), page_tag('street', street.get('slug'))}
+
+def _resolve_street(street_name):
+    """(street, coordinates or None) for a street URL; aborts with 404 for unknown streets"""
     try:
         # Сначала ищем улицу в базе данных по slug
         street_db = db.session.execute(text("""
@@ -3468,76 +3230,25 @@ def street_detail(street_name):
                 }
                 
             app.logger.debug(f"Found street in database: {street['name']} with coordinates: {coordinates}")
-            
-            # Загружаем данные о свойствах для этой улицы (если есть)
-            properties_on_street = []
-            try:
-                with open('data/properties_new.json', 'r', encoding='utf-8') as f:
-                    properties_data = json.load(f)
-                
-                # Фильтруем свойства по улице
-                for prop in properties_data:
-                    if (street['name'].lower() in prop.get('location', '').lower() or
-                        street['name'].lower() in prop.get('full_address', '').lower()):
-                        properties_on_street.append(prop)
-            except:
-                pass
-            
-            return render_template('street_detail.html',
-                                 street=street,
-                                 coordinates=coordinates,
-                                 properties=properties_on_street,
-                                 title=f'{street["name"]} - новостройки с кэшбеком | InBack',
-                                 yandex_api_key=os.environ.get('YANDEX_MAPS_API_KEY', ''))
-        else:
-            # Ищем в JSON файле как резервный вариант
-            streets_data = load_streets()
-            
-            # Ищем улицу по имени (учитываем URL-кодирование)
-            street_name_decoded = street_name.replace('-', ' ').replace('_', ' ')
-            street = None
-            
-            # Логируем для отладки
-            app.logger.debug(f"Looking for street: {street_name} -> {street_name_decoded}")
-        
-        # Функция транслитерации для поиска старых URL
-        def translit_to_latin(text):
-            translit_map = {
-                'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
-                'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
-                'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
-                'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
-                'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
-            }
-            result = ''
-            for char in text.lower():
-                result += translit_map.get(char, char)
-            return result
-        
-        for s in streets_data:
-            # Создаем URL-slug точно так же, как в фильтре (с кириллицей)
-            street_slug_generated = s['name'].lower().replace(' ', '-').replace('.', '').replace('(', '').replace(')', '').replace(',', '')
-            
-            # Создаем полную транслитерацию для обратной совместимости
-            translit_name = translit_to_latin(s['name'])
-            translit_slug = translit_name.replace(' ', '-').replace('.', '').replace('(', '').replace(')', '').replace(',', '')
-            
-            # Простая замена символов (как было раньше)
-            simple_translit = s['name'].lower().replace(' ', '-').replace('.', '').replace('ё', 'e').replace('й', 'i').replace('а', 'a').replace('г', 'g').replace('р', 'r').replace('и', 'i').replace('н', 'n').replace('(', '').replace(')', '').replace(',', '')
-            
-            # Множественные варианты поиска
-            if (street_slug_generated == street_name.lower() or
-                translit_slug == street_name.lower() or
-                simple_translit == street_name.lower() or
-                s['name'].lower() == street_name_decoded.lower() or
-                s['name'].lower().replace(' ул.', '').replace(' ул', '') == street_name_decoded.lower().replace(' ул.', '').replace(' ул', '')):
-                street = s
-                app.logger.debug(f"Found street: {s['name']} with slug: {street_slug_generated}, translit: {translit_slug}")
-                break
+            return street, coordinates
+        
+        # Ищем в JSON файле как резервный вариант
+        streets = reference_data.streets()
+        
+        # Ищем улицу по имени (учитываем URL-кодирование)
+        street_name_decoded = street_name.replace('-', ' ').replace('_', ' ')
+        
+        # Логируем для отладки
+        app.logger.debug(f"Looking for street: {street_name} -> {street_name_decoded}")
+        
+        # Множественные варианты поиска: slug с кириллицей, транслит старых URL, название
+        street = streets.find(street_name, street_name_decoded)
+        if street:
+            app.logger.debug(f"Found street: {street['name']}")
         
         if not street:
             # Пробуем найти частичное совпадение
-            for s in streets_data:
+            for s in streets.items:
                 street_name_clean = street_name_decoded.lower().replace('ул', '').replace('.', '').strip()
                 street_db_clean = s['name'].lower().replace('ул.', '').replace('ул', '').replace('.', '').strip()
                 
@@ -3551,7 +3262,15 @@ def street_detail(street_name):
         if not street:
             app.logger.error(f"Street not found: {street_name} ({street_name_decoded})")
             abort(404)
-        
+        return street, None
+    
+    except Exception as e:
+        app.logger.error(f"Error loading street detail: {e}")
+        abort(404)
+
+def _build_street_page(street, coordinates):
+    """Template context of a resolved street page"""
+    if coordinates is None:
         # Получаем координаты из базы данных
         from models import Street
         
@@ -3569,31 +3288,33 @@ def street_detail(street_name):
                 'lat': 45.035470,
                 'lng': 38.975313
             }
+    
+    # Загружаем данные о свойствах для этой улицы (если есть)
+    properties_on_street = []
+    try:
+        with open('data/properties_new.json', 'r', encoding='utf-8') as f:
+            properties_data = json.load(f)
         
-        # Загружаем данные о свойствах для этой улицы (если есть)
-        properties_on_street = []
-        try:
-            with open('data/properties_new.json', 'r', encoding='utf-8') as f:
-                properties_data = json.load(f)
-            
-            # Фильтруем свойства по улице
-            for prop in properties_data:
-                if (street['name'].lower() in prop.get('location', '').lower() or
-                    street['name'].lower() in prop.get('full_address', '').lower()):
-                    properties_on_street.append(prop)
-        except:
-            pass
-        
-        return render_template('street_detail.html',
-                             street=street,
-                             coordinates=coordinates,
-                             properties=properties_on_street,
-                             title=f'{street["name"]} - новостройки с кэшбеком | InBack',
-                             yandex_api_key=os.environ.get('YANDEX_MAPS_API_KEY', ''))
+        # Фильтруем свойства по улице
+        for prop in properties_data:
+            if (street['name'].lower() in prop.get('location', '').lower() or
+                street['name'].lower() in prop.get('full_address', '').lower()):
+                properties_on_street.append(prop)
+    except:
+        pass
     
-    except Exception as e:
-        app.logger.error(f"Error loading street detail: {e}")
-        abort(404)
+    return _street_page_context(street, coordinates, properties_on_street)
+
+@app.route('/street/<path:street_name>')
+def street_detail(street_name):
+    """Страница конкретной улицы с описанием и картой"""
+    # Ключ — каноническое имя найденной улицы: варианты URL делят одну запись,
+    # а произвольные пути не плодят записи в кэше
+    street, coordinates = _resolve_street(street_name)
+    context = page_cache.get_or_build(page_tag('street', street['name']),
+                                      lambda: _build_street_page(street, coordinates))
+    return render_template('street_detail.html', **context,
+                           yandex_api_key=os.environ.get('YANDEX_MAPS_API_KEY', ''))
 
 @app.route('/sitemap.xml')
 def sitemap():
@@ -4467,116 +4188,66 @@ def residential():
     """Residential complexes page"""
     return render_template('residential.html')
 
+def _complex_cover_images(photos_raw, complex_name):
+    """(главное фото, фото для слайдера) ЖК из photos самой дорогой квартиры"""
+    placeholder = 'https://via.placeholder.com/400x300/0088CC/FFFFFF?text=' + complex_name.replace(' ', '+')
+    if not photos_raw:
+        return placeholder, []
+    try:
+        photos_list = []
+        # Парсим PostgreSQL array формат {url1,url2,url3}
+        if photos_raw.startswith('{') and photos_raw.endswith('}'):
+            photos_clean = photos_raw[1:-1]  # убираем { и }
+            if photos_clean:
+                photos_list = [url.strip() for url in photos_clean.split(',')]
+        else:
+            # Если это JSON формат, парсим как JSON
+            photos_list = json.loads(photos_raw)
+        
+        # Пропускаем первые фото (интерьеры квартир) и берем фото ЖК
+        start_index = min(len(photos_list) // 4, 5) if len(photos_list) > 8 else 1
+        image = photos_list[start_index] if len(photos_list) > start_index else photos_list[0]
+        # Для слайдера берем фото ЖК (пропускаем первые интерьеры)
+        images = photos_list[start_index:] if len(photos_list) > start_index else photos_list
+        return image, images
+    except Exception as e:
+        print(f"Error parsing photos for complex {complex_name}: {e}")
+        return placeholder, []
+
 @app.route('/residential-complexes')
-# Временно отключаем кэш для тестирования
 def residential_complexes():
     try:
-        # Загружаем реальные данные ЖК из базы данных 
-        # Оптимизированный запрос с фотографиями + реальные ID из residential_complexes
-        try:
-            complexes_query = db.session.execute(text("""
-                SELECT 
-                    ep.complex_name,
-                    COUNT(*) as apartments_count,
-                    MIN(ep.price) as price_from,
-                    MAX(ep.price) as price_to,
-                    MIN(ep.object_area) as area_from,
-                    MAX(ep.object_area) as area_to,
-                    MIN(ep.object_min_floor) as floors_min,
-                    MAX(ep.object_max_floor) as floors_max,
-                    MAX(ep.developer_name) as developer_name,
-                    MAX(ep.address_display_name) as address_display_name,
-                    MAX(ep.complex_sales_address) as complex_sales_address,
-                    -- Используем даты корпусов вместо общих дат ЖК
-                    MAX(ep.complex_building_end_build_year) as end_build_year,
-                    MAX(ep.complex_building_end_build_quarter) as end_build_quarter,
-                    (SELECT photos FROM excel_properties p2 
-                     WHERE p2.complex_name = ep.complex_name 
-                     AND p2.photos IS NOT NULL 
-                     ORDER BY p2.price DESC LIMIT 1) as photos,
-                    COALESCE(rc.id, ROW_NUMBER() OVER (ORDER BY ep.complex_name) + 1000) as real_id,
-                    CASE 
-                        WHEN COUNT(DISTINCT ep.complex_building_id) > 0 
-                        THEN COUNT(DISTINCT ep.complex_building_id)
-                        WHEN COUNT(DISTINCT NULLIF(ep.complex_building_name, '')) > 0 
-                        THEN COUNT(DISTINCT NULLIF(ep.complex_building_name, ''))
-                        ELSE GREATEST(1, CEIL(COUNT(*) / 3.0))  -- Примерно 3 квартиры на корпус для лучшего соответствия
-                    END as buildings_count,
-                    MAX(ep.complex_object_class_display_name) as object_class_display_name
-                FROM excel_properties ep
-                LEFT JOIN residential_complexes rc ON rc.name = ep.complex_name
-                GROUP BY ep.complex_name, rc.id
-                ORDER BY 
-                    -- ЖК "IV кв. 2025 г. Строится" всегда внизу
-                    CASE 
-                        WHEN MAX(ep.complex_building_end_build_year) = 2025 
-                        AND MAX(ep.complex_building_end_build_quarter) = 4 
-                        THEN 1  -- "IV кв. 2025 г. Строится" в конце
-                        ELSE 0  -- Остальные ЖК сначала
-                    END,
-                    ep.complex_name
-            """))
-            
-            complexes_data = complexes_query.fetchall()
-        except Exception as e:
-            print(f"Database error loading complexes: {e}")
-            # Fallback to basic query without photos
-            complexes_query = db.session.execute(text("""
-                SELECT 
-                    ep.complex_name,
-                    COUNT(*) as apartments_count,
-                    MIN(ep.price) as price_from,
-                    MAX(ep.price) as price_to,
-                    MIN(ep.object_area) as area_from,
-                    MAX(ep.object_area) as area_to,
-                    MIN(ep.object_min_floor) as floors_min,
-                    MAX(ep.object_max_floor) as floors_max,
-                    MAX(ep.developer_name) as developer_name,
-                    MAX(ep.address_display_name) as address_display_name,
-                    MAX(ep.complex_sales_address) as complex_sales_address,
-                    -- Используем даты корпусов вместо общих дат ЖК
-                    MAX(ep.complex_building_end_build_year) as end_build_year,
-                    MAX(ep.complex_building_end_build_quarter) as end_build_quarter,
-                    NULL as photos,
-                    COALESCE(rc.id, ROW_NUMBER() OVER (ORDER BY ep.complex_name) + 1000) as real_id,
-                    CASE 
-                        WHEN COUNT(DISTINCT ep.complex_building_id) > 0 
-                        THEN COUNT(DISTINCT ep.complex_building_id)
-                        WHEN COUNT(DISTINCT NULLIF(ep.complex_building_name, '')) > 0 
-                        THEN COUNT(DISTINCT NULLIF(ep.complex_building_name, ''))
-                        ELSE GREATEST(1, CEIL(COUNT(*) / 3.0))  -- Примерно 3 квартиры на корпус для лучшего соответствия
-                    END as buildings_count,
-                    MAX(ep.complex_object_class_display_name) as object_class_display_name
-                FROM excel_properties ep
-                LEFT JOIN residential_complexes rc ON rc.name = ep.complex_name
-                GROUP BY ep.complex_name, rc.id
-                ORDER BY 
-                    -- ЖК "IV кв. 2025 г. Строится" всегда внизу
-                    CASE 
-                        WHEN MAX(ep.complex_building_end_build_year) = 2025 
-                        AND MAX(ep.complex_building_end_build_quarter) = 4 
-                        THEN 1  -- "IV кв. 2025 г. Строится" в конце
-                        ELSE 0  -- Остальные ЖК сначала
-                    END,
-                    ep.complex_name
-            """))
-            complexes_data = complexes_query.fetchall()
+        from models import ResidentialComplex
+        
+        # Агрегаты по ЖК считаются при импорте (complex_stats), здесь только чтение
+        stats_rows = load_complex_stats()
+        real_ids = dict(db.session.query(ResidentialComplex.name, ResidentialComplex.id).all())
+        # ЖК без записи в residential_complexes получают стабильный номер по алфавиту
+        fallback_ids = {
+            name: position + 1001
+            for position, name in enumerate(sorted(row.complex_name for row in stats_rows))
+        }
+        # ЖК "IV кв. 2025 г. Строится" всегда внизу
+        stats_rows = sorted(stats_rows, key=lambda row: (
+            1 if row.end_build_year == 2025 and row.end_build_quarter == 4 else 0,
+            row.complex_name
+        ))
         
         complexes = []
         
-        for idx, row in enumerate(complexes_data):
+        # Используем текущую дату для определения статуса
+        current_year = 2025  # Мы в 2025 году
+        current_quarter = 4   # Текущий квартал (сентябрь = 4-й квартал - безопасность)
+        
+        for row in stats_rows:
             # Форматируем срок сдачи и определяем статус
             completion_date = 'Не указан'
             is_completed = False
+            build_year = None
             
-            from datetime import datetime
-            # Используем текущую дату для определения статуса
-            current_year = 2025  # Мы в 2025 году
-            current_quarter = 4   # Текущий квартал (сентябрь = 4-й квартал - безопасность)
-            
-            if row[11] and row[12]:  # end_build_year и end_build_quarter
-                build_year = int(row[11])
-                build_quarter = int(row[12])
+            if row.end_build_year and row.end_build_quarter:
+                build_year = int(row.end_build_year)
+                build_quarter = int(row.end_build_quarter)
                 
                 # Определяем сдан ли комплекс (более строгая логика)
                 if build_year < current_year:
@@ -4589,123 +4260,47 @@ def residential_complexes():
                 quarter_names = {1: 'I', 2: 'II', 3: 'III', 4: 'IV'}
                 quarter = quarter_names.get(build_quarter, build_quarter)
                 completion_date = f"{quarter} кв. {build_year} г."
-            elif row[11]:  # только год
-                build_year = int(row[11])
+            elif row.end_build_year:  # только год
+                build_year = int(row.end_build_year)
                 is_completed = build_year < current_year  # Строго меньше для безопасности
                 completion_date = f"{build_year} г."
             
             complex_dict = {
-                'id': row[14],  # real_id from database
-                'name': row[0],
-                'available_apartments': row[1],
-                'price_from': row[2] or 0,
-                'price_to': row[3] or 0,
-                'real_price_from': row[2] or 0,
-                'real_price_to': row[3] or 0,
-                'area_from': row[4] or 0,
-                'area_to': row[5] or 0,
-                'real_area_from': row[4] or 0,
-                'real_area_to': row[5] or 0,
-                'floors_min': row[6] or 1,
-                'floors_max': row[7] or 25,
+                'id': real_ids.get(row.complex_name) or fallback_ids[row.complex_name],
+                'name': row.complex_name,
+                'available_apartments': row.apartments_count,
+                'price_from': row.price_from or 0,
+                'price_to': row.price_to or 0,
+                'real_price_from': row.price_from or 0,
+                'real_price_to': row.price_to or 0,
+                'area_from': row.area_from or 0,
+                'area_to': row.area_to or 0,
+                'real_area_from': row.area_from or 0,
+                'real_area_to': row.area_to or 0,
+                'floors_min': row.floors_min or 1,
+                'floors_max': row.floors_max or 25,
                 'district': 'Краснодарский край',
-                'developer': row[8] or 'Не указан',
-                'address': row[9] or row[10] or 'Адрес не указан',
-                'full_address': row[10] or row[9] or 'Адрес не указан',
-                'location': row[9] or 'Адрес не указан',
+                'developer': row.developer_name or 'Не указан',
+                'address': row.address_display_name or row.complex_sales_address or 'Адрес не указан',
+                'full_address': row.complex_sales_address or row.address_display_name or 'Адрес не указан',
+                'location': row.address_display_name or 'Адрес не указан',
                 'completion_date': completion_date,
-                'buildings_count': row[15] if len(row) > 15 else 1,  # Реальное количество корпусов из Excel
+                'buildings_count': row.buildings_count,  # Реальное количество корпусов из Excel
                 'is_completed': is_completed,
                 'status': 'Сдан' if is_completed else 'Строится',
-                'object_class': row[16] if len(row) > 16 and row[16] else 'Комфорт',  # класс жилья из базы
-                'housing_class': row[16] if len(row) > 16 and row[16] else 'Комфорт',  # дублируем для совместимости
-                'max_floors': row[7] or 25,  # этажность = floors_max
-                'floors': row[7] or 25,  # дублируем для совместимости
-                'completion_year': build_year if 'build_year' in locals() else 2025
+                'object_class': row.object_class_display_name or 'Комфорт',  # класс жилья из базы
+                'housing_class': row.object_class_display_name or 'Комфорт',  # дублируем для совместимости
+                'max_floors': row.floors_max or 25,  # этажность = floors_max
+                'floors': row.floors_max or 25,  # дублируем для совместимости
+                'completion_year': build_year or 2025
             }
             
-            # Загружаем фотографии для ЖК из самой дорогой квартиры (как репрезентативные для ЖК)
-            try:
-                photos_query = db.session.execute(text("""
-                    SELECT photos FROM excel_properties 
-                    WHERE complex_name = :complex_name 
-                    AND photos IS NOT NULL 
-                    ORDER BY price DESC, object_area DESC
-                    LIMIT 1
-                """), {'complex_name': complex_dict['name']})
-                
-                photos_row = photos_query.fetchone()
-                if photos_row and photos_row[0]:
-                    try:
-                        photos_raw = photos_row[0]
-                        # Парсим PostgreSQL array формат {url1,url2,url3}
-                        if photos_raw.startswith('{') and photos_raw.endswith('}'):
-                            photos_clean = photos_raw[1:-1]  # убираем { и }
-                            if photos_clean:
-                                photos_list = [url.strip() for url in photos_clean.split(',')]
-                        else:
-                            # Если это JSON формат, парсим как JSON
-                            import json
-                            photos_list = json.loads(photos_raw)
-                        
-                        # Пропускаем первые фото (интерьеры квартир) и берем фото ЖК
-                        start_index = min(len(photos_list) // 4, 5) if len(photos_list) > 8 else 1
-                        complex_dict['image'] = photos_list[start_index] if len(photos_list) > start_index else photos_list[0]
-                        # Для слайдера берем фото ЖК (пропускаем первые интерьеры)
-                        complex_dict['images'] = photos_list[start_index:] if len(photos_list) > start_index else photos_list
-                    except Exception as e:
-                        print(f"Error parsing photos for complex {complex_dict['name']}: {e}")
-                        complex_dict['image'] = 'https://via.placeholder.com/400x300/0088CC/FFFFFF?text=' + complex_dict['name'].replace(' ', '+')
-                        complex_dict['images'] = []
-                else:
-                    complex_dict['image'] = 'https://via.placeholder.com/400x300/0088CC/FFFFFF?text=' + complex_dict['name']
-                    complex_dict['images'] = []
-            except Exception as e:
-                print(f"Database error loading photos for complex {complex_dict['name']}: {e}")
-                complex_dict['image'] = 'https://via.placeholder.com/400x300/0088CC/FFFFFF?text=' + complex_dict['name'].replace(' ', '+')
-                complex_dict['images'] = []
-                
+            complex_dict['image'], complex_dict['images'] = _complex_cover_images(row.cover_photos, row.complex_name)
+            
             # Статистика по комнатам с детальными данными для каждого типа
-            try:
-                rooms_query = db.session.execute(text("""
-                    SELECT 
-                        object_rooms,
-                        COUNT(*) as count,
-                        MIN(object_area) as min_area,
-                        MAX(object_area) as max_area,
-                        MIN(price) as min_price,
-                        MAX(price) as max_price
-                    FROM excel_properties 
-                    WHERE complex_name = :complex_name
-                    GROUP BY object_rooms
-                    ORDER BY object_rooms
-                """), {'complex_name': complex_dict['name']})
-                
-                room_stats = {}
-                room_details = {}
-                for room_row in rooms_query.fetchall():
-                    rooms = room_row[0] or 0
-                    count = room_row[1]
-                    min_area = room_row[2] or 0
-                    max_area = room_row[3] or 0
-                    min_price = room_row[4] or 0
-                    max_price = room_row[5] or 0
-                    
-                    room_type = f"{rooms}-комн" if rooms and rooms > 0 else "Студия"
-                    room_stats[room_type] = count
-                    room_details[room_type] = {
-                        'count': count,
-                        'area_from': min_area,
-                        'area_to': max_area,
-                        'price_from': min_price,
-                        'price_to': max_price
-                    }
-                
-                complex_dict['real_room_distribution'] = room_stats
-                complex_dict['room_details'] = room_details
-            except Exception as e:
-                print(f"Database error loading room stats for complex {complex_dict['name']}: {e}")
-                complex_dict['real_room_distribution'] = {}
+            room_details = complex_room_details(row)
+            complex_dict['real_room_distribution'] = {room_type: details['count'] for room_type, details in room_details.items()}
+            complex_dict['room_details'] = room_details
             
             complexes.append(complex_dict)
         
@@ -4764,73 +4359,9 @@ def map_view():
     # Map route processing
     
     try:
-        # Загружаем реальные объекты из Excel данных
-        properties_query = db.session.execute(text("""
-            SELECT * FROM excel_properties 
-            WHERE address_position_lat IS NOT NULL AND address_position_lon IS NOT NULL
-            ORDER BY price ASC
-        """))
-        
-        properties = []
-        for row in properties_query:
-            prop_dict = dict(row._mapping)
-            # Преобразуем данные в нужный формат для карты
-            property_data = {
-                'id': prop_dict.get('inner_id', prop_dict.get('id')),
-                'price': prop_dict.get('price', 0),
-                'area': prop_dict.get('object_area', 0),
-                'rooms': prop_dict.get('object_rooms', 0),
-                'title': f"{'Студия' if int(prop_dict.get('object_rooms', 0)) == 0 else str(int(prop_dict.get('object_rooms', 0))) + '-комн'}, {prop_dict.get('object_area', 0)} м²",
-                'address': prop_dict.get('address_display_name', ''),
-                'residential_complex': prop_dict.get('complex_name', ''),
-                'complex_name': prop_dict.get('complex_name', ''),  # Добавляем дублирование для фильтрации
-                'developer': prop_dict.get('developer_name', ''),
-                'district': prop_dict.get('address_locality_display_name', 'Краснодарский край'),
-                'coordinates': {
-                    'lat': float(prop_dict.get('address_position_lat', 45.0448)),
-                    'lng': float(prop_dict.get('address_position_lon', 38.9760))
-                },
-                'url': f"/object/{prop_dict.get('inner_id', prop_dict.get('id'))}",
-                'type': 'property',
-                'cashback': int(prop_dict.get('price', 0) * 0.035),
-                'cashback_available': True,
-                'status': 'available',
-                'property_type': 'Квартира',
-                # Добавляем поля этажности для карты
-                'object_min_floor': prop_dict.get('object_min_floor', 0),
-                'object_max_floor': prop_dict.get('object_max_floor', 0),
-                # Добавляем поля для новых фильтров
-                'renovation_type': prop_dict.get('renovation_type', ''),
-                'renovation_display_name': prop_dict.get('renovation_display_name', ''),
-                'complex_object_class_display_name': prop_dict.get('complex_object_class_display_name', ''),
-                'complex_has_mortgage_subsidy': prop_dict.get('complex_has_mortgage_subsidy', False),
-                'complex_has_government_program': prop_dict.get('complex_has_government_program', False),
-                'complex_has_green_mortgage': prop_dict.get('complex_has_green_mortgage', False),
-                # Добавляем реальный год сдачи
-                'complex_building_end_build_year': prop_dict.get('complex_building_end_build_year', None),
-                'complex_building_end_build_quarter': prop_dict.get('complex_building_end_build_quarter', None)
-            }
-            
-            # Парсим фотографии для превью (PostgreSQL array формат)
-            photos_raw = prop_dict.get('photos', '')
-            try:
-                if photos_raw and photos_raw.startswith('{') and photos_raw.endswith('}'):
-                    photos_clean = photos_raw[1:-1]  # убираем { и }
-                    if photos_clean:
-                        photos_list = [url.strip() for url in photos_clean.split(',') if url.strip()]
-                        property_data['main_image'] = photos_list[0] if photos_list else 'https://via.placeholder.com/400x300'
-                        # Photos parsed
-                    else:
-                        property_data['main_image'] = 'https://via.placeholder.com/400x300'
-                elif photos_raw:
-                    property_data['main_image'] = photos_raw
-                else:
-                    property_data['main_image'] = 'https://via.placeholder.com/400x300'
-            except Exception as e:
-                print(f"ERROR MAP: Failed to parse photos for {prop_dict.get('inner_id', 'unknown')}: {e}")
-                property_data['main_image'] = 'https://via.placeholder.com/400x300'
-            
-            properties.append(property_data)
+        # Квартиры карта подгружает сама через /api/map/properties по видимой области,
+        # здесь нужны только списки для фильтров
+        index = get_property_index()
         
         # Загружаем ЖК из базы данных
         complexes_query = db.session.execute(text("""
@@ -4863,9 +4394,9 @@ def map_view():
             residential_complexes.append(complex_data)
         
         # Фильтры для интерфейса
-        all_districts = sorted(list(set(prop.get('district', 'Не указан') for prop in properties)))
-        all_developers = sorted(list(set(prop.get('developer', 'Не указан') for prop in properties)))
-        all_complexes = sorted(list(set(prop.get('residential_complex', 'Не указан') for prop in properties)))
+        all_districts = sorted(str(label) for label in index.labels['district'] if label)
+        all_developers = sorted(str(label) for label in index.labels['developer'] if label)
+        all_complexes = sorted(str(label) for label in index.labels['complex'] if label)
         
         filters = {
             'rooms': request.args.getlist('rooms'),
@@ -4879,7 +4410,7 @@ def map_view():
         # Map data loaded
         
         return render_template('map.html', 
-                             properties=properties, 
+                             properties_total=len(index),
                              residential_complexes=residential_complexes,
                              all_districts=all_districts,
                              all_developers=all_developers,
@@ -5018,9 +4549,9 @@ def complexes_map():
         all_developers = sorted(list(set(complex.get('developer', 'Не указан') for complex in residential_complexes)))
         all_statuses = ['Все', 'Сдан', 'Строится']
         
-        print(f"DEBUG: Found {len(residential_complexes)} complexes for map")
+        app.logger.debug("Found %s complexes for map", len(residential_complexes))
         if residential_complexes:
-            print(f"DEBUG: First complex: {residential_complexes[0]}")
+            app.logger.debug("First complex: %s", residential_complexes[0])
         
         return render_template('complexes_map.html', 
                              residential_complexes=residential_complexes,
@@ -5034,77 +4565,170 @@ def complexes_map():
         traceback.print_exc()
         return f"Error 500: {str(e)}", 500
 
+# Карта: с какого зума отдаются отдельные квартиры вместо кластеров
+MAP_POINTS_MIN_ZOOM = 15
+# ...или если в окне квартир не больше этого числа
+MAP_POINTS_MAX_COUNT = 300
+# Верхняя граница точек в одном ответе
+MAP_POINTS_LIMIT = 2000
+# Ячеек сетки кластеров на ширину тайла (256 px) — примерно 64 px на кластер
+MAP_CLUSTER_CELLS_PER_TILE = 4
+MAP_POINT_FIELDS = ['id', 'lat', 'lng', 'price', 'rooms', 'area', 'floor', 'total_floors', 'complex_name', 'main_image']
+MAP_CLUSTER_FIELDS = ['lat', 'lng', 'count', 'min_price']
+
+def _parse_bbox(value):
+    """bbox=west,south,east,north (как в Leaflet getBounds().toBBoxString())"""
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if south > north or west > east:
+        return None
+    return west, south, east, north
+
+def _catalog_filters_from_args(args):
+    """Фильтры каталога из query string в формате get_filtered_properties()"""
+    return {
+        'rooms': args.getlist('rooms'),
+        'price_min': args.get('price_min', ''),
+        'price_max': args.get('price_max', ''),
+        'district': args.get('district', ''),
+        'developer': args.get('developer', ''),
+        'residential_complex': args.get('residential_complex', ''),
+        'area_min': args.get('area_min', type=float),
+        'area_max': args.get('area_max', type=float),
+        'floor_min': args.get('floor_min', type=float),
+        'floor_max': args.get('floor_max', type=float),
+    }
+
+def _catalog_filter_mask(index, filters):
+    """Маска PropertyIndex для колоночных фильтров каталога"""
+    mask = index.all_mask()
+    if filters.get('rooms'):
+        mask &= index.rooms_mask(filters['rooms'])
+    if filters.get('price_min'):
+        mask &= index.range_mask('price', minimum=_parse_price_filter(filters['price_min']))
+    if filters.get('price_max'):
+        mask &= index.range_mask('price', maximum=_parse_price_filter(filters['price_max']))
+    if filters.get('district'):
+        mask &= index.category_mask('district', [filters['district']])
+    if filters.get('developer'):
+        mask &= index.category_mask('developer', [filters['developer']])
+    if filters.get('residential_complex'):
+        mask &= index.category_contains_mask('complex', filters['residential_complex'])
+    if filters.get('area_min') is not None or filters.get('area_max') is not None:
+        mask &= index.range_mask('area', filters.get('area_min'), filters.get('area_max'))
+    if filters.get('floor_min') is not None or filters.get('floor_max') is not None:
+        mask &= index.range_mask('floor', filters.get('floor_min'), filters.get('floor_max'))
+    return mask
+
+def _conditional_json(payload):
+    """JSON-ответ с ETag: повторный запрос с If-None-Match получает 304 без тела"""
+    response = jsonify(payload)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/map/properties')
+def api_map_properties():
+    """
+    Квартиры для видимой области карты.
+    
+    GET /api/map/properties?bbox=west,south,east,north&zoom=12[&rooms=2&price_min=...]
+    На мелком масштабе возвращает кластеры сетки (количество и минимальная цена),
+    на крупном — отдельные точки. Строки компактные: массивы значений в порядке fields.
+    """
+    bbox = _parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return jsonify({'success': False, 'error': 'bbox=west,south,east,north обязателен'}), 400
+    zoom = request.args.get('zoom', 12, type=int)
+    zoom = max(0, min(zoom, 22))
+    west, south, east, north = bbox
+    
+    index = get_property_index()
+    mask = index.bbox_mask(south, west, north, east) & _catalog_filter_mask(index, _catalog_filters_from_args(request.args))
+    total = index.count(mask)
+    
+    if zoom >= MAP_POINTS_MIN_ZOOM or total <= MAP_POINTS_MAX_COUNT:
+        points = []
+        for prop in index.materialize(index.select(mask, sort_type='price_asc', limit=MAP_POINTS_LIMIT)):
+            coordinates = prop.get('coordinates') or {}
+            points.append([
+                prop.get('id'), coordinates.get('lat'), coordinates.get('lng'), prop.get('price'),
+                prop.get('rooms'), prop.get('area'), prop.get('floor'), prop.get('total_floors'),
+                prop.get('complex_name'), prop.get('main_image'),
+            ])
+        return _conditional_json({
+            'success': True,
+            'mode': 'points',
+            'zoom': zoom,
+            'total': total,
+            'truncated': total > len(points),
+            'fields': MAP_POINT_FIELDS,
+            'items': points,
+        })
+    
+    cell_size = 360.0 / (2 ** zoom) / MAP_CLUSTER_CELLS_PER_TILE
+    clusters = index.grid_clusters(mask, cell_size)
+    return _conditional_json({
+        'success': True,
+        'mode': 'clusters',
+        'zoom': zoom,
+        'total': total,
+        'cell_size': cell_size,
+        'fields': MAP_CLUSTER_FIELDS,
+        'items': [[round(c['lat'], 6), round(c['lng'], 6), c['count'], c['min_price']] for c in clusters],
+    })
+
 # API Routes
 @app.route('/api/properties')
 def api_properties():
-    """API endpoint for properties from Excel data with real coordinates"""
+    """
+    API endpoint for properties with real coordinates, cheapest first.
+    Reads the shared properties snapshot; ?limit=&offset= page the list and
+    ?bbox=&zoom= return the clustered map payload of /api/map/properties.
+    """
+    if request.args.get('bbox'):
+        return api_map_properties()
     try:
-        # Загружаем реальные объекты из Excel данных с координатами
-        properties_query = db.session.execute(text("""
-            SELECT * FROM excel_properties 
-            WHERE address_position_lat IS NOT NULL AND address_position_lon IS NOT NULL
-            ORDER BY price ASC
-        """))
+        index = get_property_index()
+        limit = request.args.get('limit', type=int)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        page, total = index.query(sort_type='price_asc', offset=offset, limit=limit)
         
         properties = []
-        for row in properties_query:
-            prop_dict = dict(row._mapping)
-            property_data = {
-                'id': prop_dict.get('inner_id', prop_dict.get('id')),
-                'price': prop_dict.get('price', 0),
-                'area': prop_dict.get('object_area', 0),
-                'rooms': prop_dict.get('object_rooms', 0),
-                'title': f"{'Студия' if int(prop_dict.get('object_rooms', 0)) == 0 else str(int(prop_dict.get('object_rooms', 0))) + '-комн'}, {prop_dict.get('object_area', 0)} м²",
-                'subtitle': f"{prop_dict.get('complex_name', '')} • {prop_dict.get('address_locality_display_name', '')}",
-                'address': prop_dict.get('address_display_name', ''),
-                'residential_complex': prop_dict.get('complex_name', ''),
-                'developer': prop_dict.get('developer_name', ''),
-                'developer_name': prop_dict.get('developer_name', ''),
-                'district': prop_dict.get('address_locality_display_name', 'Краснодарский край'),
-                'complex_object_class_display_name': prop_dict.get('complex_object_class_display_name', ''),
-                'completion_date': prop_dict.get('completion_date', ''),
-                'renovation_display_name': prop_dict.get('renovation_display_name', ''),
-                'object_min_floor': prop_dict.get('object_min_floor', 0),
-                'object_max_floor': prop_dict.get('object_max_floor', 0),
-                'coordinates': {
-                    'lat': float(prop_dict.get('address_position_lat', 45.0448)),
-                    'lng': float(prop_dict.get('address_position_lon', 38.9760))
-                },
-                'url': f"/object/{prop_dict.get('inner_id', prop_dict.get('id'))}",
-                'type': 'property',
-                'cashback': int(prop_dict.get('price', 0) * 0.035),
+        for prop in page:
+            price = prop.get('price') or 0
+            properties.append({
+                'id': prop.get('id'),
+                'price': price,
+                'area': prop.get('area', 0),
+                'rooms': prop.get('rooms', 0),
+                'title': f"{'Студия' if not prop.get('rooms') else str(int(prop['rooms'])) + '-комн'}, {prop.get('area', 0)} м²",
+                'subtitle': f"{prop.get('complex_name', '')} • {prop.get('district', '')}",
+                'address': prop.get('address', ''),
+                'residential_complex': prop.get('complex_name', ''),
+                'developer': prop.get('developer', ''),
+                'developer_name': prop.get('developer', ''),
+                'district': prop.get('district', 'Краснодарский край'),
+                'complex_object_class_display_name': prop.get('complex_class', ''),
+                'completion_date': prop.get('completion_date', ''),
+                'renovation_display_name': prop.get('finishing', ''),
+                'object_min_floor': prop.get('floor', 0),
+                'object_max_floor': prop.get('total_floors', 0),
+                'coordinates': prop.get('coordinates'),
+                'url': prop.get('url'),
+                'type': 'property',
+                'cashback': int(price * 0.035),
                 'cashback_available': True,
                 'status': 'available',
-                'property_type': 'Квартира'
-            }
-            
-            # Парсим фотографии (PostgreSQL array формат)
-            photos_raw = prop_dict.get('photos', '')
-            try:
-                if photos_raw and photos_raw.startswith('{') and photos_raw.endswith('}'):
-                    photos_clean = photos_raw[1:-1]  # убираем { и }
-                    if photos_clean:
-                        photos_list = [url.strip() for url in photos_clean.split(',')]
-                        property_data['main_image'] = photos_list[0] if photos_list else 'https://via.placeholder.com/400x300'
-                    else:
-                        property_data['main_image'] = 'https://via.placeholder.com/400x300'
-                elif photos_raw:
-                    # Если это JSON формат, парсим как JSON
-                    import json
-                    photos_list = json.loads(photos_raw)
-                    property_data['main_image'] = photos_list[0] if photos_list else 'https://via.placeholder.com/400x300'
-                else:
-                    property_data['main_image'] = 'https://via.placeholder.com/400x300'
-            except Exception as e:
-                print(f"Error parsing photos for API property {prop_dict.get('inner_id', 'unknown')}: {e}")
-                property_data['main_image'] = 'https://via.placeholder.com/400x300'
-            
-            properties.append(property_data)
+                'property_type': 'Квартира',
+                'main_image': prop.get('main_image'),
+            })
         
-        print(f"DEBUG: API returned {len(properties)} properties with real coordinates")
-        return jsonify({
+        return _conditional_json({
             'properties': properties,
-            'total': len(properties),
+            'total': total,
             'success': True
         })
         
@@ -5124,9 +4748,15 @@ def api_search_suggestions_old_disabled():
 def api_residential_complexes_map():
     """API endpoint for residential complexes with enhanced data for map"""
     complexes = load_residential_complexes()
+    # Корпуса, квартиры и координаты — из предрасчитанных агрегатов, без запроса на каждый ЖК
+    stats_by_name = {row.complex_name: row for row in load_complex_stats()}
     
     # Enhance complexes data for map
     for i, complex in enumerate(complexes):
+        stats = stats_by_name.get(complex.get('name'))
+        if stats and 'coordinates' not in complex and stats.lat is not None and stats.lon is not None:
+            complex['coordinates'] = {'lat': stats.lat, 'lng': stats.lon}
+        
         # Add coordinates if missing
         if 'coordinates' not in complex:
             base_lat = 45.0448
@@ -5140,19 +4770,9 @@ def api_residential_complexes_map():
         
         # ✅ ИСПРАВЛЕНО: Правильный подсчет корпусов из базы данных
         if 'buildings_count' not in complex:
-            # Получаем реальное количество корпусов из Excel данных
-            try:
-                result = db.session.execute(text("""
-                    SELECT COUNT(DISTINCT complex_building_id) as buildings_count
-                    FROM excel_properties 
-                    WHERE complex_name = :complex_name
-                """), {'complex_name': complex.get('name', '')})
-                row = result.fetchone()
-                complex['buildings_count'] = row[0] if row and row[0] else 1
-            except:
-                complex['buildings_count'] = 1  # По умолчанию 1 корпус
+            complex['buildings_count'] = stats.buildings_count if stats else 1  # По умолчанию 1 корпус
         if 'apartments_count' not in complex:
-            complex['apartments_count'] = 100 + (i % 300)
+            complex['apartments_count'] = stats.apartments_count if stats else 100 + (i % 300)
             
     return jsonify(complexes)
 
@@ -5254,248 +4874,59 @@ def download_property_pdf(property_id):
         print(f"Error generating PDF for property {property_id}: {e}")
         return jsonify({'error': 'Failed to generate PDF'}), 500
 
-@app.route('/developers')
-@cache.cached(timeout=3600)  # Кэш на 1 час
-def developers():
-    """Developers listing page with real database data"""
-    try:
-        print("Loading developers from database...")
-        
-        from models import Developer, ResidentialComplex, Property
-        from sqlalchemy import func
-        
-        # Получаем застройщиков из базы данных с статистикой
-        developers_list = (
-            db.session.query(Developer, 
-                            func.count(ResidentialComplex.id).label('complexes_count'),
-                            func.count(Property.id).label('properties_count'))
-            .outerjoin(ResidentialComplex, Developer.id == ResidentialComplex.developer_id)
-            .outerjoin(Property, Developer.id == Property.developer_id)
-            .group_by(Developer.id)
-            .order_by(func.count(Property.id).desc())
-            .all()
-        )
-        
-        # Формируем список застройщиков с данными
-        developers_data = []
-        for developer, complexes_count, properties_count in developers_list:
-            developer_dict = {
-                'id': developer.id,
-                'name': developer.name,
-                'slug': developer.slug,
-                'description': developer.description or f"Застройщик {developer.name}",
-                'logo_url': developer.logo_url or f"https://via.placeholder.com/200x100/3B82F6/FFFFFF?text={developer.name.replace(' ', '+')}",
-                'website': developer.website,
-                'phone': developer.phone,
-                'email': developer.email,
-                'address': developer.address,
-                'complexes_count': complexes_count,
-                'properties_count': properties_count,
-                'established_year': developer.established_year,
-                # Нужные поля для шаблона
-                'max_cashback': 10,  # По умолчанию 10%
-                'max_cashback_percent': 10,
-                # Статистика для отображения
-                'stats': {
-                    'total_projects': complexes_count,
-                    'total_apartments': properties_count,
-                    'avg_price': None  # Добавим позже
-                }
-            }
-            
-            # Получаем статистику из Excel данных по имени застройщика
-            excel_stats = db.session.execute(text("""
-                SELECT 
-                    COUNT(*) as total_properties,
-                    AVG(ep.price) as avg_price,
-                    MIN(ep.price) as min_price,
-                    MAX(ep.price) as max_price,
-                    COUNT(DISTINCT ep.complex_name) as total_complexes
-                FROM excel_properties ep
-                WHERE UPPER(TRIM(ep.developer_name)) = UPPER(TRIM(:developer_name))
-            """), {'developer_name': developer.name}).fetchone()
-            
-            if excel_stats and excel_stats[0]:  # Check if we have data
-                total_props, avg_price, min_price, max_price, total_complexes = excel_stats
-                developer_dict['properties_count'] = total_props or properties_count
-                developer_dict['complexes_count'] = total_complexes or complexes_count
-                developer_dict['stats'] = {
-                    'total_projects': total_complexes or complexes_count,
-                    'total_apartments': total_props or properties_count,
-                    'avg_price': int(avg_price) if avg_price else None,
-                    'min_price': int(min_price) if min_price else None,
-                    'max_price': int(max_price) if max_price else None
-                }
-            else:
-                # Fallback to basic database stats
-                developer_dict['stats'] = {
-                    'total_projects': complexes_count,
-                    'total_apartments': properties_count,
-                    'avg_price': None
-                }
-            
-            developers_data.append(developer_dict)
-        
-        print(f"Found {len(developers_data)} developers in database")
-        
-        return render_template('developers.html', developers=developers_data)
-        
-    except Exception as e:
-        print(f"Error loading developers: {e}")
-        return render_template('developers.html', developers=[])
-
-@app.route('/developer/<developer_slug>')  
-def developer_page(developer_slug):
-    """Individual developer page by slug"""
-    try:
-        # No redirect logic needed - browser will handle encoding
-        
-        # Create variations of the developer name to search for
-        # Convert slug back to possible name formats  
-        developer_name_from_slug = developer_slug.replace('-', ' ')
-        
-        # Try to find developer in database using multiple search strategies
-        developer = db.session.execute(
-            text("""
-            SELECT * FROM developers WHERE 
-            LOWER(TRANSLATE(REPLACE(name, ' ', '-'), '«»"().,;:', '')) = LOWER(:slug)
-            OR LOWER(name) LIKE LOWER(:name_pattern)
-            OR LOWER(REPLACE(name, ' ', '-')) = LOWER(:slug)
-            OR slug = :slug
-            LIMIT 1
-            """),
-            {
-                "slug": developer_slug, 
-                "name_pattern": f"%{developer_name_from_slug}%"
+def _load_developers_list():
+    """Developers with complex/property counts and price stats from excel_properties"""
+    # Фоновое обновление кэша идет вне запроса
+    from flask import has_app_context
+    if not has_app_context():
+        with app.app_context():
+            return _load_developers_list()
+    
+    print("Loading developers from database...")
+    
+    from models import Developer, ResidentialComplex, Property
+    from sqlalchemy import func
+    
+    # Получаем застройщиков из базы данных с статистикой
+    developers_list = (
+        db.session.query(Developer, 
+                        func.count(ResidentialComplex.id).label('complexes_count'),
+                        func.count(Property.id).label('properties_count'))
+        .outerjoin(ResidentialComplex, Developer.id == ResidentialComplex.developer_id)
+        .outerjoin(Property, Developer.id == Property.developer_id)
+        .group_by(Developer.id)
+        .order_by(func.count(Property.id).desc())
+        .all()
+    )
+    
+    # Формируем список застройщиков с данными
+    developers_data = []
+    for developer, complexes_count, properties_count in developers_list:
+        developer_dict = {
+            'id': developer.id,
+            'name': developer.name,
+            'slug': developer.slug,
+            'description': developer.description or f"Застройщик {developer.name}",
+            'logo_url': developer.logo_url or f"https://via.placeholder.com/200x100/3B82F6/FFFFFF?text={developer.name.replace(' ', '+')}",
+            'website': developer.website,
+            'phone': developer.phone,
+            'email': developer.email,
+            'address': developer.address,
+            'complexes_count': complexes_count,
+            'properties_count': properties_count,
+            'established_year': developer.established_year,
+            # Нужные поля для шаблона
+            'max_cashback': 10,  # По умолчанию 10%
+            'max_cashback_percent': 10,
+            # Статистика для отображения
+            'stats': {
+                'total_projects': complexes_count,
+                'total_apartments': properties_count,
+                'avg_price': None  # Добавим позже
             }
-        ).fetchone()
-        
-        if not developer:
-            print(f"Developer not found in database: {developer_slug}")
-            return redirect(url_for('developers'))
-        
-        # Convert row to dict-like object for template
-        developer_dict = dict(developer._mapping)
-        
-        # Получаем ЖК этого застройщика из Excel данных с фотографиями и реальными данными
-        developer_complexes_query = db.session.execute(text("""
-            SELECT 
-                ep.complex_name as name,
-                ep.complex_name as id,
-                COALESCE(MAX(ep.address_short_display_name), 'Адрес не указан') as location,
-                COUNT(ep.inner_id) as apartments_count,
-                COUNT(DISTINCT ep.complex_building_id) as buildings_count,
-                MIN(ep.price) as min_price,
-                MAX(ep.price) as max_price,
-                AVG(ep.price) as avg_price,
-                MAX(ep.address_position_lat) as lat,
-                MAX(ep.address_position_lon) as lng,
-                MAX(ep.complex_sales_address) as sales_address,
-                -- Получаем все фотографии из JSON массива формата ["url1","url2","url3"]
-                CASE 
-                    WHEN MAX(ep.photos) IS NOT NULL AND MAX(ep.photos) != '' AND MAX(ep.photos) != '[]' 
-                        THEN ARRAY(SELECT json_array_elements_text(MAX(ep.photos)::json))
-                    ELSE ARRAY['https://images.unsplash.com/photo-1545324418-cc1a3fa10c00?w=800']
-                END as images,
-                -- Получаем первую фотографию для совместимости  
-                CASE 
-                    WHEN MAX(ep.photos) IS NOT NULL AND MAX(ep.photos) != '' AND MAX(ep.photos) != '[]' 
-                        THEN (MAX(ep.photos)::json->>0)
-                    ELSE 'https://images.unsplash.com/photo-1545324418-cc1a3fa10c00?w=800'
-                END as image,
-                CASE 
-                    WHEN MAX(ep.complex_end_build_quarter) IS NOT NULL AND MAX(ep.complex_end_build_year) IS NOT NULL 
-                        THEN COALESCE(MAX(ep.complex_end_build_quarter)::text, 'IV') || ' кв. ' || COALESCE(MAX(ep.complex_end_build_year)::text, '2024')
-                    ELSE 'Сдан'
-                END as completion_date,
-                MIN(ep.price) as real_price_from,
-                COUNT(DISTINCT ep.object_rooms) as room_types_count
-            FROM excel_properties ep
-            WHERE UPPER(TRIM(ep.developer_name)) = UPPER(TRIM(:developer_name))
-            GROUP BY ep.complex_name
-            ORDER BY apartments_count DESC
-        """), {'developer_name': developer.name})
-        
-        developer_complexes = []
-        for complex_row in developer_complexes_query:
-            complex_dict = dict(complex_row._mapping)
-            
-            # Получаем распределение квартир по комнатности для этого ЖК
-            room_distribution_query = db.session.execute(text("""
-                SELECT 
-                    CASE 
-                        WHEN object_rooms = 0 THEN 'Студия'
-                        WHEN object_rooms = 1 THEN '1-комн.'
-                        WHEN object_rooms = 2 THEN '2-комн.'
-                        WHEN object_rooms = 3 THEN '3-комн.'
-                        WHEN object_rooms = 4 THEN '4-комн.'
-                        ELSE CAST(object_rooms AS TEXT) || '-комн.'
-                    END as room_type,
-                    COUNT(*) as count,
-                    MIN(price) as price_from,
-                    MAX(price) as price_to,
-                    MIN(object_area) as area_from,
-                    MAX(object_area) as area_to
-                FROM excel_properties 
-                WHERE UPPER(TRIM(complex_name)) = UPPER(TRIM(:complex_name))
-                  AND UPPER(TRIM(developer_name)) = UPPER(TRIM(:developer_name))
-                GROUP BY object_rooms
-                ORDER BY object_rooms
-            """), {'complex_name': complex_dict['name'], 'developer_name': developer.name})
-            
-            # Формируем данные о комнатности
-            real_room_distribution = {}
-            room_details = {}
-            
-            for room_row in room_distribution_query:
-                room_data = dict(room_row._mapping)
-                room_type = room_data['room_type']
-                real_room_distribution[room_type] = room_data['count']
-                room_details[room_type] = {
-                    'price_from': room_data['price_from'],
-                    'price_to': room_data['price_to'],
-                    'area_from': room_data['area_from'],
-                    'area_to': room_data['area_to']
-                }
-            
-            complex_dict['real_room_distribution'] = real_room_distribution
-            complex_dict['room_details'] = room_details
-            developer_complexes.append(complex_dict)
-        
-        # Получаем квартиры этого застройщика из Excel данных
-        excel_properties_query = db.session.execute(text("""
-            SELECT *
-            FROM excel_properties ep
-            WHERE UPPER(TRIM(ep.developer_name)) = UPPER(TRIM(:developer_name))
-            ORDER BY ep.price ASC
-        """), {'developer_name': developer.name})
-        
-        developer_properties = []
-        for prop_row in excel_properties_query:
-            prop_dict = dict(prop_row._mapping)
-            developer_properties.append(prop_dict)
-        
-        properties_count = len(developer_properties)
-        min_price = min([p['price'] for p in developer_properties]) if developer_properties else 0
-        
-        # Parse features and infrastructure if they exist
-        import json as json_lib
-        features = []
-        infrastructure = []
-        
-        if developer_dict.get('features'):
-            try:
-                features = json_lib.loads(developer_dict['features'])
-            except:
-                features = []
-        
-        if developer_dict.get('infrastructure'):
-            try:
-                infrastructure = json_lib.loads(developer_dict['infrastructure'])
-            except:
-                infrastructure = []
+        }
         
-        # Получаем общую статистику из Excel
+        # Получаем статистику из Excel данных по имени застройщика
         excel_stats = db.session.execute(text("""
             SELECT 
                 COUNT(*) as total_properties,
@@ -5507,43 +4938,256 @@ def developer_page(developer_slug):
             WHERE UPPER(TRIM(ep.developer_name)) = UPPER(TRIM(:developer_name))
         """), {'developer_name': developer.name}).fetchone()
         
-        # Обновляем статистику с правильными данными
-        if excel_stats and excel_stats[0]:
-            total_props, avg_price, min_price_excel, max_price_excel, total_complexes = excel_stats
-            developer_dict['properties_count'] = total_props
-            developer_dict['complexes_count'] = total_complexes
-            developer_dict['min_price'] = int(min_price_excel) if min_price_excel else 12000000
-            developer_dict['max_price'] = int(max_price_excel) if max_price_excel else 0
-            developer_dict['avg_price'] = int(avg_price) if avg_price else 0
-            print(f"DEBUG: Excel stats for {developer.name}: min_price={min_price_excel}, total_props={total_props}")
+        if excel_stats and excel_stats[0]:  # Check if we have data
+            total_props, avg_price, min_price, max_price, total_complexes = excel_stats
+            developer_dict['properties_count'] = total_props or properties_count
+            developer_dict['complexes_count'] = total_complexes or complexes_count
+            developer_dict['stats'] = {
+                'total_projects': total_complexes or complexes_count,
+                'total_apartments': total_props or properties_count,
+                'avg_price': int(avg_price) if avg_price else None,
+                'min_price': int(min_price) if min_price else None,
+                'max_price': int(max_price) if max_price else None
+            }
         else:
-            print(f"DEBUG: No Excel stats found for {developer.name}")
-        
-        # Добавляем дефолтные значения для полей, которые могут отсутствовать
-        developer_dict['total_projects'] = developer_dict.get('completed_projects', 0) or developer_dict.get('complexes_count', 0)
-        developer_dict['rating'] = developer_dict.get('rating') or 4.2
-        developer_dict['founded_year'] = developer_dict.get('founded_year') or 2015
-        developer_dict['detailed_description'] = developer_dict.get('description') or 'Надёжный застройщик с многолетним опытом строительства качественного жилья в регионе.'
-        developer_dict['description'] = developer_dict.get('description') or developer_dict['detailed_description']
-        developer_dict['advantages'] = developer_dict.get('advantages') or [
-            'Собственное строительство без субподряда',
-            'Сдача объектов точно в срок', 
-            'Качественные материалы и технологии',
-            'Полный пакет документов и сервисов'
-        ]
+            # Fallback to basic database stats
+            developer_dict['stats'] = {
+                'total_projects': complexes_count,
+                'total_apartments': properties_count,
+                'avg_price': None
+            }
         
-        return render_template('developer_detail.html', 
-                             developer=developer_dict,
-                             developer_name=developer_dict['name'],
-                             complexes=developer_complexes,
-                             apartments=developer_properties,
-                             total_properties=properties_count,
-                             min_price=min_price,
-                             features=features,
-                             infrastructure=infrastructure)
+        developers_data.append(developer_dict)
+    
+    print(f"Found {len(developers_data)} developers in database")
+    
+    return developers_data
+
+@app.route('/developers')
+def developers():
+    """Developers listing page with real database data"""
+    try:
+        # Данные кэшируются (1 час + 10 минут stale-while-revalidate), шаблон рендерится на каждый запрос:
+        # в шапке есть данные сессии и CSRF-токен
+        developers_data = cache.get_or_set('developers', 'list', _load_developers_list, timeout=3600, stale_ttl=600,
+                                           should_cache=bool)
+        return render_template('developers.html', developers=developers_data)
+        
+    except Exception as e:
+        print(f"Error loading developers: {e}")
+        return render_template('developers.html', developers=[])
+
+def _build_developer_page(developer_slug):
+    """Template context of a developer page and the entities it depends on (None if not found)"""
+    # No redirect logic needed - browser will handle encoding
+    
+    # Create variations of the developer name to search for
+    # Convert slug back to possible name formats  
+    developer_name_from_slug = developer_slug.replace('-', ' ')
+    
+    # Try to find developer in database using multiple search strategies
+    developer = db.session.execute(
+        text("""
+        SELECT * FROM developers WHERE 
+        LOWER(TRANSLATE(REPLACE(name, ' ', '-'), '«»"().,;:', '')) = LOWER(:slug)
+        OR LOWER(name) LIKE LOWER(:name_pattern)
+        OR LOWER(REPLACE(name, ' ', '-')) = LOWER(:slug)
+        OR slug = :slug
+        LIMIT 1
+        """),
+        {
+            "slug": developer_slug, 
+            "name_pattern": f"%{developer_name_from_slug}%"
+        }
+    ).fetchone()
+    
+    if not developer:
+        print(f"Developer not found in database: {developer_slug}")
+        return None
+    
+    # Convert row to dict-like object for template
+    developer_dict = dict(developer._mapping)
+    
+    # Получаем ЖК этого застройщика из Excel данных с фотографиями и реальными данными
+    developer_complexes_query = db.session.execute(text("""
+        SELECT 
+            ep.complex_name as name,
+            ep.complex_name as id,
+            COALESCE(MAX(ep.address_short_display_name), 'Адрес не указан') as location,
+            COUNT(ep.inner_id) as apartments_count,
+            COUNT(DISTINCT ep.complex_building_id) as buildings_count,
+            MIN(ep.price) as min_price,
+            MAX(ep.price) as max_price,
+            AVG(ep.price) as avg_price,
+            MAX(ep.address_position_lat) as lat,
+            MAX(ep.address_position_lon) as lng,
+            MAX(ep.complex_sales_address) as sales_address,
+            -- Получаем все фотографии из JSON массива формата ["url1","url2","url3"]
+            CASE 
+                WHEN MAX(ep.photos) IS NOT NULL AND MAX(ep.photos) != '' AND MAX(ep.photos) != '[]' 
+                    THEN ARRAY(SELECT json_array_elements_text(MAX(ep.photos)::json))
+                ELSE ARRAY['https://images.unsplash.com/photo-1545324418-cc1a3fa10c00?w=800']
+            END as images,
+            -- Получаем первую фотографию для совместимости  
+            CASE 
+                WHEN MAX(ep.photos) IS NOT NULL AND MAX(ep.photos) != '' AND MAX(ep.photos) != '[]' 
+                    THEN (MAX(ep.photos)::json->>0)
+                ELSE 'https://images.unsplash.com/photo-1545324418-cc1a3fa10c00?w=800'
+            END as image,
+            CASE 
+                WHEN MAX(ep.complex_end_build_quarter) IS NOT NULL AND MAX(ep.complex_end_build_year) IS NOT NULL 
+                    THEN COALESCE(MAX(ep.complex_end_build_quarter)::text, 'IV') || ' кв. ' || COALESCE(MAX(ep.complex_end_build_year)::text, '2024')
+                ELSE 'Сдан'
+            END as completion_date,
+            MIN(ep.price) as real_price_from,
+            COUNT(DISTINCT ep.object_rooms) as room_types_count
+        FROM excel_properties ep
+        WHERE UPPER(TRIM(ep.developer_name)) = UPPER(TRIM(:developer_name))
+        GROUP BY ep.complex_name
+        ORDER BY apartments_count DESC
+    """), {'developer_name': developer.name})
+    
+    developer_complexes = []
+    for complex_row in developer_complexes_query:
+        complex_dict = dict(complex_row._mapping)
+        
+        # Получаем распределение квартир по комнатности для этого ЖК
+        room_distribution_query = db.session.execute(text("""
+            SELECT 
+                CASE 
+                    WHEN object_rooms = 0 THEN 'Студия'
+                    WHEN object_rooms = 1 THEN '1-комн.'
+                    WHEN object_rooms = 2 THEN '2-комн.'
+                    WHEN object_rooms = 3 THEN '3-комн.'
+                    WHEN object_rooms = 4 THEN '4-комн.'
+                    ELSE CAST(object_rooms AS TEXT) || '-комн.'
+                END as room_type,
+                COUNT(*) as count,
+                MIN(price) as price_from,
+                MAX(price) as price_to,
+                MIN(object_area) as area_from,
+                MAX(object_area) as area_to
+            FROM excel_properties 
+            WHERE UPPER(TRIM(complex_name)) = UPPER(TRIM(:complex_name))
+              AND UPPER(TRIM(developer_name)) = UPPER(TRIM(:developer_name))
+            GROUP BY object_rooms
+            ORDER BY object_rooms
+        """), {'complex_name': complex_dict['name'], 'developer_name': developer.name})
+        
+        # Формируем данные о комнатности
+        real_room_distribution = {}
+        room_details = {}
+        
+        for room_row in room_distribution_query:
+            room_data = dict(room_row._mapping)
+            room_type = room_data['room_type']
+            real_room_distribution[room_type] = room_data['count']
+            room_details[room_type] = {
+                'price_from': room_data['price_from'],
+                'price_to': room_data['price_to'],
+                'area_from': room_data['area_from'],
+                'area_to': room_data['area_to']
+            }
+        
+        complex_dict['real_room_distribution'] = real_room_distribution
+        complex_dict['room_details'] = room_details
+        developer_complexes.append(complex_dict)
+    
+    # Получаем квартиры этого застройщика из Excel данных
+    excel_properties_query = db.session.execute(text("""
+        SELECT *
+        FROM excel_properties ep
+        WHERE UPPER(TRIM(ep.developer_name)) = UPPER(TRIM(:developer_name))
+        ORDER BY ep.price ASC
+    """), {'developer_name': developer.name})
+    
+    developer_properties = []
+    for prop_row in excel_properties_query:
+        prop_dict = dict(prop_row._mapping)
+        developer_properties.append(prop_dict)
+    
+    properties_count = len(developer_properties)
+    min_price = min([p['price'] for p in developer_properties]) if developer_properties else 0
+    
+    # Parse features and infrastructure if they exist
+    import json as json_lib
+    features = []
+    infrastructure = []
+    
+    if developer_dict.get('features'):
+        try:
+            features = json_lib.loads(developer_dict['features'])
+        except:
+            features = []
+    
+    if developer_dict.get('infrastructure'):
+        try:
+            infrastructure = json_lib.loads(developer_dict['infrastructure'])
+        except:
+            infrastructure = []
+    
+    # Получаем общую статистику из Excel
+    excel_stats = db.session.execute(text("""
+        SELECT 
+            COUNT(*) as total_properties,
+            AVG(ep.price) as avg_price,
+            MIN(ep.price) as min_price,
+            MAX(ep.price) as max_price,
+            COUNT(DISTINCT ep.complex_name) as total_complexes
+        FROM excel_properties ep
+        WHERE UPPER(TRIM(ep.developer_name)) = UPPER(TRIM(:developer_name))
+    """), {'developer_name': developer.name}).fetchone()
+    
+    # Обновляем статистику с правильными данными
+    if excel_stats and excel_stats[0]:
+        total_props, avg_price, min_price_excel, max_price_excel, total_complexes = excel_stats
+        developer_dict['properties_count'] = total_props
+        developer_dict['complexes_count'] = total_complexes
+        developer_dict['min_price'] = int(min_price_excel) if min_price_excel else 12000000
+        developer_dict['max_price'] = int(max_price_excel) if max_price_excel else 0
+        developer_dict['avg_price'] = int(avg_price) if avg_price else 0
+        app.logger.debug("Excel stats for %s: min_price=%s, total_props=%s", developer.name, min_price_excel, total_props)
+    else:
+        app.logger.debug("No Excel stats found for %s", developer.name)
+    
+    # Добавляем дефолтные значения для полей, которые могут отсутствовать
+    developer_dict['total_projects'] = developer_dict.get('completed_projects', 0) or developer_dict.get('complexes_count', 0)
+    developer_dict['rating'] = developer_dict.get('rating') or 4.2
+    developer_dict['founded_year'] = developer_dict.get('founded_year') or 2015
+    developer_dict['detailed_description'] = developer_dict.get('description') or 'Надёжный застройщик с многолетним опытом строительства качественного жилья в регионе.'
+    developer_dict['description'] = developer_dict.get('description') or developer_dict['detailed_description']
+    developer_dict['advantages'] = developer_dict.get('advantages') or [
+        'Собственное строительство без субподряда',
+        'Сдача объектов точно в срок', 
+        'Качественные материалы и технологии',
+        'Полный пакет документов и сервисов'
+    ]
+    
+    context = {
+        'developer': developer_dict,
+        'developer_name': developer_dict['name'],
+        'complexes': developer_complexes,
+        'apartments': developer_properties,
+        'total_properties': properties_count,
+        'min_price': min_price,
+        'features': features,
+        'infrastructure': infrastructure
+    }
+    dependencies = {page_tag('developer', developer.name), page_tag('developer', developer_slug)}
+    dependencies.update(page_tag('complex', complex_dict['name']) for complex_dict in developer_complexes)
+    return context, dependencies
+
+@app.route('/developer/<developer_slug>')  
+def developer_page(developer_slug):
+    """Individual developer page by slug"""
+    try:
+        context = page_cache.get_or_build(f'developer:{developer_slug}', lambda: _build_developer_page(developer_slug))
+        if context is None:
+            return redirect(url_for('developers'))
+        return render_template('developer_detail.html', **context)
         
     except Exception as e:
-        print(f"Error loading developer page for {developer_name}: {e}")
+        print(f"Error loading developer page for {developer_slug}: {e}")
         import traceback
         traceback.print_exc()
         return redirect(url_for('developers'))
@@ -5633,6 +5277,7 @@ def admin_update_coordinates():
             district.longitude = longitude
             district.distance_to_center = distance
             db.session.commit()
+            page_cache.purge([page_tag('district', district.slug), page_tag('district', district.name)])
             
             return jsonify({
                 'success': True,
@@ -5667,118 +5312,128 @@ def district_skhi_redirect():
     from flask import redirect, url_for
     return redirect(url_for('district_detail', district='shi'), code=301)
 
+def _build_district_page(district):
+    """Template context of a district page and the entities it depends on"""
+    from models import District
+    
+    # Get properties and complexes in this district
+    properties = load_properties()
+    complexes = load_residential_complexes()
+    
+    # Filter by district (simplified district matching)
+    district_properties = [p for p in properties if district.replace('-', ' ').lower() in (p.get('address') or '').lower()]
+    district_complexes = [c for c in complexes if district.replace('-', ' ').lower() in (c.get('district') or '').lower()]
+    
+    # Add cashback calculations
+    for prop in district_properties:
+        prop['cashback'] = calculate_cashback(prop['price'])
+    
+    # District info mapping - all 54 districts
+    district_names = {
+        '40-let-pobedy': '40 лет Победы',
+        '9i-kilometr': '9-й километр', 
+        'aviagorodok': 'Авиагородок',
+        'avrora': 'Аврора',
+        'basket-hall': 'Баскет-холл',
+        'berezovy': 'Березовый',
+        'cheremushki': 'Черемушки',
+        'dubinka': 'Дубинка',
+        'enka': 'Энка',
+        'festivalny': 'Фестивальный',
+        'gidrostroitelei': 'Гидростроителей',
+        'gorkhutor': 'Горхутор',
+        'hbk': 'ХБК',
+        'kalinino': 'Калинино',
+        'karasunsky': 'Карасунский',
+        'kolosisty': 'Колосистый',
+        'komsomolsky': 'Комсомольский',
+        'kozhzavod': 'Кожзавод',
+        'krasnaya-ploshchad': 'Красная площадь',
+        'krasnodarskiy': 'Краснодарский',
+        'kubansky': 'Кубанский',
+        'mkg': 'МКГ',
+        'molodezhny': 'Молодежный',
+        'muzykalny-mkr': 'Музыкальный микрорайон',
+        'nemetskaya-derevnya': 'Немецкая деревня',
+        'novoznamenskiy': 'Новознаменский',
+        'panorama': 'Панорама',
+        'pashkovskiy': 'Пашковский',
+        'pashkovsky': 'Пашковский-2',
+        'pokrovka': 'Покровка',
+        'prikubansky': 'Прикубанский',
+        'rayon-aeroporta': 'Район аэропорта',
+        'repino': 'Репино',
+        'rip': 'РИП',
+        'severny': 'Северный',
+        'shkolny': 'Школьный',
+        'slavyansky': 'Славянский',
+        'slavyansky2': 'Славянский-2',
+        'solnechny': 'Солнечный',
+        'tabachnaya-fabrika': 'Табачная фабрика',
+        'tec': 'ТЭЦ',
+        'tsentralnyy': 'Центральный',
+        'uchhoz-kuban': 'Учхоз Кубань',
+        'vavilova': 'Вавилова',
+        'votochno-kruglikovskii': 'Восточно-Кругликовский',
+        'yablonovskiy': 'Яблоновский',
+        'zapadny': 'Западный',
+        'zapadny-obhod': 'Западный обход',
+        'zapadny-okrug': 'Западный округ',
+        'zip-zhukova': 'ЗИП Жукова'
+    }
+    
+    # Get district data from database with coordinates
+    district_db = District.query.filter_by(slug=district).first()
+    
+    # Use district name from database if available, otherwise fallback to mapping
+    if district_db and district_db.name:
+        district_name = district_db.name
+    else:
+        district_name = district_names.get(district, district.replace('-', ' ').title())
+    
+    # Prepare district data for template
+    infrastructure_data = None
+    if district_db and district_db.infrastructure_data:
+        try:
+            import json
+            if isinstance(district_db.infrastructure_data, str):
+                infrastructure_data = json.loads(district_db.infrastructure_data)
+            else:
+                infrastructure_data = district_db.infrastructure_data
+        except Exception as e:
+            print(f"Infrastructure parsing error: {e}")
+            infrastructure_data = None
+    
+    district_data = {
+        'name': district_name,
+        'slug': district,
+        'latitude': district_db.latitude if district_db and district_db.latitude else None,
+        'longitude': district_db.longitude if district_db and district_db.longitude else None,
+        'zoom_level': district_db.zoom_level if district_db and district_db.zoom_level else 13,
+        'description': district_db.description if district_db else None,
+        'distance_to_center': getattr(district_db, 'distance_to_center', None) if district_db else None,
+        'infrastructure_data': infrastructure_data
+    }
+    
+    context = {
+        'district': district,
+        'district_name': district_name,
+        'district_data': district_data,
+        'properties': district_properties,
+        'complexes': district_complexes
+    }
+    dependencies = {page_tag('district', district), page_tag('district', district_name)}
+    dependencies.update(page_tag('complex', c.get('name')) for c in district_complexes)
+    dependencies.update(page_tag('complex', p.get('complex_name')) for p in district_properties)
+    return context, dependencies
+
 @app.route('/district/<district>')
 def district_detail(district):
     """Individual district page"""
     try:
-        # Import District model
-        from models import District
-        
-        # Get properties and complexes in this district
-        properties = load_properties()
-        complexes = load_residential_complexes()
-        
-        # Filter by district (simplified district matching)
-        district_properties = [p for p in properties if district.replace('-', ' ').lower() in p.get('address', '').lower()]
-        district_complexes = [c for c in complexes if district.replace('-', ' ').lower() in c.get('district', '').lower()]
-        
-        # Add cashback calculations
-        for prop in district_properties:
-            prop['cashback'] = calculate_cashback(prop['price'])
-        
-        # District info mapping - all 54 districts
-        district_names = {
-            '40-let-pobedy': '40 лет Победы',
-            '9i-kilometr': '9-й километр', 
-            'aviagorodok': 'Авиагородок',
-            'avrora': 'Аврора',
-            'basket-hall': 'Баскет-холл',
-            'berezovy': 'Березовый',
-            'cheremushki': 'Черемушки',
-            'dubinka': 'Дубинка',
-            'enka': 'Энка',
-            'festivalny': 'Фестивальный',
-            'gidrostroitelei': 'Гидростроителей',
-            'gorkhutor': 'Горхутор',
-            'hbk': 'ХБК',
-            'kalinino': 'Калинино',
-            'karasunsky': 'Карасунский',
-            'kolosisty': 'Колосистый',
-            'komsomolsky': 'Комсомольский',
-            'kozhzavod': 'Кожзавод',
-            'krasnaya-ploshchad': 'Красная площадь',
-            'krasnodarskiy': 'Краснодарский',
-            'kubansky': 'Кубанский',
-            'mkg': 'МКГ',
-            'molodezhny': 'Молодежный',
-            'muzykalny-mkr': 'Музыкальный микрорайон',
-            'nemetskaya-derevnya': 'Немецкая деревня',
-            'novoznamenskiy': 'Новознаменский',
-            'panorama': 'Панорама',
-            'pashkovskiy': 'Пашковский',
-            'pashkovsky': 'Пашковский-2',
-            'pokrovka': 'Покровка',
-            'prikubansky': 'Прикубанский',
-            'rayon-aeroporta': 'Район аэропорта',
-            'repino': 'Репино',
-            'rip': 'РИП',
-            'severny': 'Северный',
-            'shkolny': 'Школьный',
-            'slavyansky': 'Славянский',
-            'slavyansky2': 'Славянский-2',
-            'solnechny': 'Солнечный',
-            'tabachnaya-fabrika': 'Табачная фабрика',
-            'tec': 'ТЭЦ',
-            'tsentralnyy': 'Центральный',
-            'uchhoz-kuban': 'Учхоз Кубань',
-            'vavilova': 'Вавилова',
-            'votochno-kruglikovskii': 'Восточно-Кругликовский',
-            'yablonovskiy': 'Яблоновский',
-            'zapadny': 'Западный',
-            'zapadny-obhod': 'Западный обход',
-            'zapadny-okrug': 'Западный округ',
-            'zip-zhukova': 'ЗИП Жукова'
-        }
-        
-        # Get district data from database with coordinates
-        district_db = District.query.filter_by(slug=district).first()
-        
-        # Use district name from database if available, otherwise fallback to mapping
-        if district_db and district_db.name:
-            district_name = district_db.name
-        else:
-            district_name = district_names.get(district, district.replace('-', ' ').title())
-        
-        # Prepare district data for template
-        infrastructure_data = None
-        if district_db and district_db.infrastructure_data:
-            try:
-                import json
-                if isinstance(district_db.infrastructure_data, str):
-                    infrastructure_data = json.loads(district_db.infrastructure_data)
-                else:
-                    infrastructure_data = district_db.infrastructure_data
-            except Exception as e:
-                print(f"Infrastructure parsing error: {e}")
-                infrastructure_data = None
-        
-        district_data = {
-            'name': district_name,
-            'slug': district,
-            'latitude': district_db.latitude if district_db and district_db.latitude else None,
-            'longitude': district_db.longitude if district_db and district_db.longitude else None,
-            'zoom_level': district_db.zoom_level if district_db and district_db.zoom_level else 13,
-            'description': district_db.description if district_db else None,
-            'distance_to_center': getattr(district_db, 'distance_to_center', None) if district_db else None,
-            'infrastructure_data': infrastructure_data
-        }
-        
+        context = page_cache.get_or_build(f'district:{district}', lambda: _build_district_page(district))
         return render_template('district_detail.html', 
-                             district=district,
-                             district_name=district_name,
-                             district_data=district_data,
-                             properties=district_properties,
-                             complexes=district_complexes,
+                             **context,
                              yandex_api_key=os.environ.get('YANDEX_MAPS_API_KEY', ''))
     except Exception as e:
         # Log detailed error for debugging
@@ -5995,19 +5650,16 @@ def handle_unauthorized():
 @login_manager.user_loader
 def load_user(user_id):
     from models import User, Manager
+    from principal_cache import principal_cache
     
     # Check if this is a manager ID (with prefix 'm_')
     if user_id.startswith('m_'):
         manager_id = int(user_id[2:])  # Remove 'm_' prefix
-        manager = Manager.query.get(manager_id)
-        if manager:
-            return manager
+        return principal_cache.get(Manager, manager_id)
     else:
         # Regular user ID
         try:
-            user = User.query.get(int(user_id))
-            if user:
-                return user
+            return principal_cache.get(User, int(user_id))
         except ValueError:
             pass
     
@@ -6017,14 +5669,12 @@ def manager_required(f):
     """Decorator to require manager authentication via session"""
     from functools import wraps
     from models import Manager
+    from principal_cache import principal_cache
     
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        print(f"DEBUG: manager_required - checking session authentication")
-        print(f"DEBUG: manager_required - request.path: {request.path}")
-        print(f"DEBUG: manager_required - request.method: {request.method}")
-        print(f"DEBUG: manager_required - session.get('manager_id'): {session.get('manager_id')}")
-        print(f"DEBUG: manager_required - session.get('is_manager'): {session.get('is_manager')}")
+        app.logger.debug("manager_required - %s %s, session manager_id=%s is_manager=%s",
+                         request.method, request.path, session.get('manager_id'), session.get('is_manager'))
         
         # Check if this is an AJAX or JSON request
         is_ajax = (request.headers.get('X-Requested-With') == 'XMLHttpRequest' or 
@@ -6036,16 +5686,16 @@ def manager_required(f):
         is_manager = session.get('is_manager')
         
         if not manager_id or not is_manager:
-            print(f"DEBUG: manager_required - Manager not authenticated via session")
+            app.logger.debug("manager_required - Manager not authenticated via session")
             if is_ajax:
                 return jsonify({'success': False, 'error': 'Authentication required'}), 401
             return redirect(url_for('manager_login'))
         
-        # Verify manager still exists in database
+        # Verify manager still exists and is not blocked (cached for a few seconds, see principal_cache.py)
         try:
-            manager = Manager.query.get(manager_id)
-            if not manager:
-                print(f"DEBUG: manager_required - Manager ID {manager_id} not found in database")
+            manager = principal_cache.get(Manager, manager_id)
+            if not manager or not manager.is_active:
+                app.logger.debug("manager_required - Manager ID %s not found or inactive", manager_id)
                 # Clear invalid session
                 session.pop('manager_id', None)
                 session.pop('is_manager', None)
@@ -6053,12 +5703,12 @@ def manager_required(f):
                     return jsonify({'success': False, 'error': 'Authentication required'}), 401
                 return redirect(url_for('manager_login'))
         except Exception as e:
-            print(f"DEBUG: manager_required - Database error: {e}")
+            app.logger.debug("manager_required - Database error: %s", e)
             if is_ajax:
                 return jsonify({'success': False, 'error': 'Authentication error'}), 500
             return redirect(url_for('manager_login'))
         
-        print(f"DEBUG: manager_required - Success! Manager {manager.email} authenticated via session")
+        app.logger.debug("manager_required - Success! Manager %s authenticated via session", manager.email)
         return f(*args, **kwargs)
     return decorated_function
 
@@ -6796,10 +6446,6 @@ def send_booking_notifications(booking, property_detail):
     
     # Email notification (if configured)
     try:
-        import smtplib
-        from email.mime.text import MIMEText
-        from email.mime.multipart import MIMEMultipart
-        
         subject = f"🏠 Новая заявка на бронирование - {property_detail.complex_name}"
         
         # Prepare property details
@@ -6847,18 +6493,21 @@ def send_booking_notifications(booking, property_detail):
         print(f"Telegram notification error: {e}")
 
 def send_email_notification(email, subject, body):
-    """Send email notification"""
-    import smtplib
-    from email.mime.text import MIMEText
+    """Queue plain-text email notification for the outbox dispatcher"""
+    from email_service import SMTP_CONFIGURED
+    
+    if not SMTP_CONFIGURED:
+        print(f"📧 Would send email to {email}: {subject}")
+        print(f"Body: {body[:100]}...")
+        return
     
-    # Simple email sending (would need proper SMTP configuration in production)
-    print(f"📧 Would send email to {email}: {subject}")
-    print(f"Body: {body[:100]}...")
+    from outbox import enqueue_email
+    enqueue_email(email, subject, body, body_format='plain')
 
 def send_telegram_booking_notification(booking, property_detail, managers):
     """Send Telegram notification to managers"""
     try:
-        import requests
+        from outbox import enqueue_telegram
         
         bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
         if not bot_token:
@@ -6889,14 +6538,8 @@ def send_telegram_booking_notification(booking, property_detail, managers):
         for manager in managers:
             if hasattr(manager, 'telegram_chat_id') and manager.telegram_chat_id:
                 try:
-                    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-                    payload = {
-                        'chat_id': manager.telegram_chat_id,
-                        'text': message,
-                        'parse_mode': 'HTML'
-                    }
-                    requests.post(url, data=payload, timeout=5)
-                    print(f"📱 Telegram notification sent to manager {manager.name}")
+                    enqueue_telegram(manager.telegram_chat_id, message, parse_mode='HTML')
+                    print(f"📱 Telegram notification queued for manager {manager.name}")
                 except Exception as telegram_error:
                     print(f"Failed to send Telegram to manager {manager.name}: {telegram_error}")
                     
@@ -7277,17 +6920,17 @@ def view_presentation(unique_id):
         db.session.rollback()
         print(f"Error recording presentation view: {e}")
     
-    print("DEBUG: Starting data loading phase...")
+    app.logger.debug("Starting data loading phase...")
     
     # Load properties data to enrich the collection properties
     try:
-        print("DEBUG: Loading properties data...")
+        app.logger.debug("Loading properties data...")
         properties_data = load_properties()
-        print(f"DEBUG: Loaded {len(properties_data)} properties")
+        app.logger.debug("Loaded %s properties", len(properties_data))
         
-        print("DEBUG: Loading complexes data...")
+        app.logger.debug("Loading complexes data...")
         complexes_data = load_residential_complexes()
-        print(f"DEBUG: Loaded {len(complexes_data) if complexes_data else 0} complexes")
+        app.logger.debug("Loaded %s complexes", len(complexes_data) if complexes_data else 0)
     except Exception as e:
         print(f"ERROR: Failed to load data: {e}")
         import traceback
@@ -7446,9 +7089,9 @@ def view_presentation(unique_id):
     # Sort by order_index (handle None values)
     enriched_properties.sort(key=lambda x: x['order_index'] if x['order_index'] is not None else 999)
     
-    print(f"DEBUG: About to render template with {len(enriched_properties)} enriched properties")
-    print(f"DEBUG: Presentation object: {presentation}")
-    print(f"DEBUG: First property sample: {enriched_properties[0] if enriched_properties else 'No properties'}")
+    app.logger.debug("About to render template with %s enriched properties", len(enriched_properties))
+    app.logger.debug("Presentation object: %s", presentation)
+    app.logger.debug("First property sample: %s", enriched_properties[0] if enriched_properties else 'No properties')
     
     # Format presentation data for template (same structure as manager version)
     presentation_data = {
@@ -7686,29 +7329,29 @@ def share_presentation(presentation_id):
     from flask_login import current_user
     import urllib.parse
     
-    print(f"DEBUG: share_presentation - presentation_id: {presentation_id}")
-    print(f"DEBUG: share_presentation - current_user: {current_user}")
-    print(f"DEBUG: share_presentation - session manager_id: {session.get('manager_id')}")
-    print(f"DEBUG: share_presentation - request.method: {request.method}")
-    print(f"DEBUG: share_presentation - request.content_type: {request.content_type}")
+    app.logger.debug("share_presentation - presentation_id: %s", presentation_id)
+    app.logger.debug("share_presentation - current_user: %s", current_user)
+    app.logger.debug("share_presentation - session manager_id: %s", session.get('manager_id'))
+    app.logger.debug("share_presentation - request.method: %s", request.method)
+    app.logger.debug("share_presentation - request.content_type: %s", request.content_type)
     
     try:
         data = request.get_json() or {}  # Пустой JSON валиден
-        print(f"DEBUG: share_presentation - request data: {data}")
+        app.logger.debug("share_presentation - request data: %s", data)
     except Exception as e:
-        print(f"DEBUG: share_presentation - JSON parsing error: {e}")
+        app.logger.debug("share_presentation - JSON parsing error: %s", e)
         return jsonify({'success': False, 'error': f'Invalid JSON: {str(e)}'}), 400
         
     # Строгая проверка владения презентацией через Flask-Login и session
     manager_id = session.get('manager_id')
     if not manager_id:
-        print(f"DEBUG: share_presentation - No manager_id in session")
+        app.logger.debug("share_presentation - No manager_id in session")
         return jsonify({'success': False, 'error': 'Не авторизован как менеджер'}), 401
     
     # Безопасное логирование после проверки аутентификации
-    print(f"DEBUG: share_presentation - current_user.email: {getattr(current_user, 'email', 'Not authenticated')}")
+    app.logger.debug("share_presentation - current_user.email: %s", getattr(current_user, 'email', 'Not authenticated'))
     
-    print(f"DEBUG: share_presentation - Looking for presentation {presentation_id} by manager {manager_id}")
+    app.logger.debug("share_presentation - Looking for presentation %s by manager %s", presentation_id, manager_id)
     
     presentation = Collection.query.filter_by(
         id=presentation_id,
@@ -7716,7 +7359,7 @@ def share_presentation(presentation_id):
         collection_type='presentation'
     ).first()
     
-    print(f"DEBUG: share_presentation - Found presentation: {presentation}")
+    app.logger.debug("share_presentation - Found presentation: %s", presentation)
     
     if not presentation:
         # Try to find presentation regardless of owner for debugging
@@ -7724,28 +7367,28 @@ def share_presentation(presentation_id):
             id=presentation_id,
             collection_type='presentation'
         ).first()
-        print(f"DEBUG: share_presentation - Any presentation with this ID: {any_presentation}")
+        app.logger.debug("share_presentation - Any presentation with this ID: %s", any_presentation)
         if any_presentation:
-            print(f"DEBUG: share_presentation - Presentation exists but belongs to manager {any_presentation.created_by_manager_id}")
+            app.logger.debug("share_presentation - Presentation exists but belongs to manager %s", any_presentation.created_by_manager_id)
         return jsonify({'success': False, 'error': 'Презентация не найдена или у вас нет прав доступа'}), 404
     
     client_name = data.get('client_name', presentation.client_name)
-    print(f"DEBUG: share_presentation - Client name: {client_name}")
+    app.logger.debug("share_presentation - Client name: %s", client_name)
     
     # Обновляем имя клиента если передано
     if client_name and client_name != presentation.client_name:
-        print(f"DEBUG: share_presentation - Updating client name from '{presentation.client_name}' to '{client_name}'")
+        app.logger.debug("share_presentation - Updating client name from '%s' to '%s'", presentation.client_name, client_name)
         presentation.client_name = client_name
         db.session.commit()
     
     # Формируем ссылку
     base_url = request.url_root.rstrip('/')
     presentation_url = f"{base_url}/presentation/modern/{presentation.unique_url}"
-    print(f"DEBUG: share_presentation - Presentation URL: {presentation_url}")
+    app.logger.debug("share_presentation - Presentation URL: %s", presentation_url)
     
     # Формируем сообщение для отправки
     properties_count = len(presentation.properties) if presentation.properties else 0
-    print(f"DEBUG: share_presentation - Properties count: {properties_count}")
+    app.logger.debug("share_presentation - Properties count: %s", properties_count)
     
     message_text = f"""🏠 Презентация недвижимости от InBack
 
@@ -7773,7 +7416,7 @@ def share_presentation(presentation_id):
         }
     }
     
-    print(f"DEBUG: share_presentation - Returning response: {response_data}")
+    app.logger.debug("share_presentation - Returning response: %s", response_data)
     return jsonify(response_data)
 
 @app.route('/api/favorites/toggle', methods=['POST'])
@@ -7788,8 +7431,8 @@ def toggle_favorite():
     if not property_id:
         return jsonify({'success': False, 'error': 'property_id required'}), 400
     
-    print(f"DEBUG: Favorites toggle called by user {getattr(current_user, 'id', 'not_authenticated')} for property {property_id}")
-    print(f"DEBUG: Request data: {data}")
+    app.logger.debug("Favorites toggle called by user %s for property %s", getattr(current_user, 'id', 'not_authenticated'), property_id)
+    app.logger.debug("Request data: %s", data)
     
     # Check if already in favorites
     existing = FavoriteProperty.query.filter_by(
@@ -8156,55 +7799,42 @@ def get_manager_favorite_properties():
             except (ValueError, TypeError):
                 continue  # Skip invalid IDs
         
-        # Load properties from PostgreSQL using direct SQL to avoid ORM issues
-        import psycopg2
-        import os
         import json
         
-        # Connect to database directly
         try:
-            conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
-            cur = conn.cursor()
-            
-            # Build SQL query based on filter_ids
             if filter_ids:
-                placeholders = ','.join(['%s'] * len(filter_ids))
-                sql_query = f"""
-                SELECT inner_id, complex_name, developer_name, object_rooms, object_area, 
-                       price, address_display_name, photos, complex_object_class_display_name,
-                       address_locality_display_name, object_min_floor, object_max_floor,
-                       square_price, renovation_display_name,
-                       complex_building_end_build_year, complex_building_name,
-                       renovation_type, deal_type, complex_has_green_mortgage
-                FROM excel_properties 
-                WHERE inner_id IN ({placeholders})
-                LIMIT 10
-                """
-                cur.execute(sql_query, filter_ids)
+                # По id — через property_repository (одним запросом + LRU), в порядке запроса
+                found = property_repository.get_many(filter_ids[:10])
+                rows = [found[str(inner_id)] for inner_id in filter_ids[:10] if str(inner_id) in found]
             else:
-                sql_query = """
-                SELECT inner_id, complex_name, developer_name, object_rooms, object_area, 
-                       price, address_display_name, photos, complex_object_class_display_name,
-                       address_locality_display_name, object_min_floor, object_max_floor,
-                       square_price, renovation_display_name,
-                       complex_building_end_build_year, complex_building_name,
-                       renovation_type, deal_type, complex_has_green_mortgage
-                FROM excel_properties 
-                LIMIT 100
-                """
-                cur.execute(sql_query)
+                rows = [dict(row._mapping) for row in db.session.execute(text(f"""
+                    SELECT {PROPERTY_ROW_COLUMNS}
+                    FROM excel_properties ep
+                    LIMIT 100
+                """)).fetchall()]
             
-            rows = cur.fetchall()
             properties_data = []
             
             for row in rows:
-                # Unpack row data (19 values to match SELECT order)  
-                (inner_id, complex_name, developer_name, object_rooms, object_area, 
-                 price, address_display_name, photos, complex_object_class_display_name,
-                 address_locality_display_name, object_min_floor, object_max_floor,
-                 square_price, renovation_display_name,
-                 complex_building_end_build_year, complex_building_name,
-                 renovation_type, deal_type, complex_has_green_mortgage) = row
+                inner_id = row['inner_id']
+                complex_name = row['complex_name']
+                developer_name = row['developer_name']
+                object_rooms = row['object_rooms']
+                object_area = row['object_area']
+                price = row['price']
+                address_display_name = row['address_display_name']
+                photos = row['photos']
+                complex_object_class_display_name = row['complex_object_class_display_name']
+                address_locality_display_name = row['address_locality_display_name']
+                object_min_floor = row['object_min_floor']
+                object_max_floor = row['object_max_floor']
+                square_price = row['square_price']
+                renovation_display_name = row['renovation_display_name']
+                complex_building_end_build_year = row['complex_building_end_build_year']
+                complex_building_name = row['complex_building_name']
+                renovation_type = row['renovation_type']
+                deal_type = row['deal_type']
+                complex_has_green_mortgage = row['complex_has_green_mortgage']
                 
                 # Handle photos from JSON string to first image
                 photos_data = []
@@ -8270,11 +7900,6 @@ def get_manager_favorite_properties():
             
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
-        finally:
-            if 'cur' in locals():
-                cur.close()
-            if 'conn' in locals():
-                conn.close()
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -8325,12 +7950,12 @@ def manager_dashboard():
     from models import Manager, User, CashbackApplication, Document
     
     manager_id = session.get('manager_id')
-    print(f"DEBUG: Manager dashboard - manager_id: {manager_id}")
+    app.logger.debug("Manager dashboard - manager_id: %s", manager_id)
     current_manager = Manager.query.get(manager_id)
-    print(f"DEBUG: Manager dashboard - current_manager: {current_manager}")
+    app.logger.debug("Manager dashboard - current_manager: %s", current_manager)
     
     if not current_manager:
-        print("DEBUG: Manager not found, redirecting to login")
+        app.logger.debug("Manager not found, redirecting to login")
         return redirect(url_for('manager_login'))
     
     # Get statistics
@@ -8395,7 +8020,7 @@ def manager_dashboard():
     districts = get_districts_list()
     developers = get_developers_list()
     
-    print(f"DEBUG: Rendering dashboard with manager: {current_manager.full_name}")
+    app.logger.debug("Rendering dashboard with manager: %s", current_manager.full_name)
     try:
         return render_template('auth/manager_dashboard.html',
                              current_manager=current_manager,
@@ -8413,7 +8038,7 @@ def manager_dashboard():
                              districts=districts,
                              developers=developers)
     except Exception as e:
-        print(f"DEBUG: Error rendering dashboard: {e}")
+        app.logger.debug("Error rendering dashboard: %s", e)
         import traceback
         traceback.print_exc()
         return f"Error rendering dashboard: {e}", 500
@@ -8441,11 +8066,11 @@ def manager_presentation_view(presentation_id):
     from models import Collection, CollectionProperty, Manager
     
     manager_id = session.get('manager_id')
-    print(f"DEBUG: Presentation view - manager_id: {manager_id}, presentation_id: {presentation_id}")
+    app.logger.debug("Presentation view - manager_id: %s, presentation_id: %s", manager_id, presentation_id)
     
     current_manager = Manager.query.get(manager_id)
     if not current_manager:
-        print("DEBUG: Manager not found, redirecting to login")
+        app.logger.debug("Manager not found, redirecting to login")
         return redirect(url_for('manager_login'))
     
     # Get presentation data
@@ -8456,7 +8081,7 @@ def manager_presentation_view(presentation_id):
     ).first()
     
     if not presentation:
-        print(f"DEBUG: Presentation {presentation_id} not found or access denied")
+        app.logger.debug("Presentation %s not found or access denied", presentation_id)
         flash('Презентация не найдена или у вас нет доступа к ней', 'error')
         return redirect(url_for('manager_dashboard'))
     
@@ -8465,7 +8090,7 @@ def manager_presentation_view(presentation_id):
         collection_id=presentation_id
     ).order_by(CollectionProperty.order_index).all()
     
-    print(f"DEBUG: Found {len(collection_properties)} properties in presentation")
+    app.logger.debug("Found %s properties in presentation", len(collection_properties))
     
     # Load properties data to enrich the collection properties
     properties_data = load_properties()  # This function already exists in the app
@@ -8526,9 +8151,9 @@ def manager_presentation_view(presentation_id):
             }
             enriched_properties.append(enriched_property)
         else:
-            print(f"DEBUG: Property {cp.property_id} not found in main data")
+            app.logger.debug("Property %s not found in main data", cp.property_id)
     
-    print(f"DEBUG: Enriched {len(enriched_properties)} properties")
+    app.logger.debug("Enriched %s properties", len(enriched_properties))
     
     # Format presentation data for template
     presentation_data = {
@@ -8551,7 +8176,7 @@ def manager_presentation_view(presentation_id):
                              manager=current_manager,
                              presentation=presentation_data)
     except Exception as e:
-        print(f"DEBUG: Error rendering presentation view: {e}")
+        app.logger.debug("Error rendering presentation view: %s", e)
         import traceback
         traceback.print_exc()
         flash('Ошибка при загрузке презентации', 'error')
@@ -8567,10 +8192,10 @@ def get_manager_clients_unified():
     manager_id = session.get('manager_id')
     
     try:
-        print(f"DEBUG: Getting clients for manager {manager_id}")
+        app.logger.debug("Getting clients for manager %s", manager_id)
         # Get ALL users assigned to this manager (regardless of role)
         clients = User.query.filter_by(assigned_manager_id=manager_id).all()
-        print(f"DEBUG: Found {len(clients)} assigned clients for manager {manager_id}")
+        app.logger.debug("Found %s assigned clients for manager %s", len(clients), manager_id)
         clients_data = []
         
         for client in clients:
@@ -8606,7 +8231,7 @@ def get_manager_clients_unified():
             
             clients_data.append(client_data)
         
-        print(f"DEBUG: Returning {len(clients_data)} clients data")
+        app.logger.debug("Returning %s clients data", len(clients_data))
         return jsonify({
             'success': True,
             'clients': clients_data
@@ -9082,7 +8707,7 @@ def api_manager_send_recommendation():
     category_name = data.get('category_name', '').strip()  # For creating new category
     
     # Debug logging (removing verbose logs for production)
-    print(f"DEBUG: Recommendation sent - type={recommendation_type}, item_id={item_id}, client_id={client_id}")
+    app.logger.debug("Recommendation sent - type=%s, item_id=%s, client_id=%s", recommendation_type, item_id, client_id)
     
     # Validation
     missing_fields = []
@@ -9333,19 +8958,17 @@ def api_search_properties():
         if filters.get('areaTo'):
             property_filters['area_max'] = filters['areaTo']
         
-        # Get filtered properties
-        filtered_properties = get_filtered_properties(property_filters)
+        # Get filtered properties sorted by price ascending
+        filtered_properties = get_filtered_properties(property_filters, sort_type='price_asc')
+        page = filtered_properties[:50]  # Limit to 50 results
         
-        # Add cashback to each property
-        for prop in filtered_properties:
+        # Add cashback to each property on the page
+        for prop in page:
             prop['cashback'] = calculate_cashback(prop['price'])
         
-        # Sort by price ascending
-        filtered_properties = sort_properties(filtered_properties, 'price_asc')
-        
         return jsonify({
             'success': True,
-            'properties': filtered_properties[:50],  # Limit to 50 results
+            'properties': page,
             'total_count': len(filtered_properties)
         })
         
@@ -9407,67 +9030,40 @@ def api_send_property_to_client():
 
 def filter_properties(properties, filters):
     """Filter properties based on search criteria"""
-    filtered = []
+    index = get_property_index(properties)
+    mask = index.all_mask()
     
-    for prop in properties:
-        # Price filter
-        if filters.get('priceFrom'):
-            try:
-                if prop.get('price', 0) < int(filters['priceFrom']):
-                    continue
-            except (ValueError, TypeError):
-                pass
-        
-        if filters.get('priceTo'):
-            try:
-                if prop.get('price', 0) > int(filters['priceTo']):
-                    continue
-            except (ValueError, TypeError):
-                pass
-        
-        # Rooms filter
-        if filters.get('rooms'):
-            prop_rooms = str(prop.get('rooms', ''))
-            if filters['rooms'] == 'studio' and prop_rooms != 'studio':
-                continue
-            elif filters['rooms'] != 'studio' and prop_rooms != str(filters['rooms']):
-                continue
-        
-        # District filter
-        if filters.get('districts') and len(filters['districts']) > 0:
-            prop_district = prop.get('district', '')
-            if prop_district not in filters['districts']:
-                continue
-        
-        # Area filter
-        if filters.get('areaFrom'):
-            try:
-                if prop.get('area', 0) < int(filters['areaFrom']):
-                    continue
-            except (ValueError, TypeError):
-                pass
-        
-        if filters.get('areaTo'):
-            try:
-                if prop.get('area', 0) > int(filters['areaTo']):
-                    continue
-            except (ValueError, TypeError):
-                pass
-        
-        # Developer filter
-        if filters.get('developers') and len(filters['developers']) > 0:
-            prop_developer = prop.get('developer', '')
-            if prop_developer not in filters['developers']:
-                continue
-        
-        filtered.append(prop)
-    
-    return filtered
-
-def send_property_email(client, search_name, properties, message):
-    """Send email with property recommendations"""
-    try:
-        subject = f"Новая подборка недвижимости: {search_name}"
+    # Price filter
+    if filters.get('priceFrom'):
+        mask &= index.range_mask('price', minimum=_parse_int_filter(filters['priceFrom']))
+    if filters.get('priceTo'):
+        mask &= index.range_mask('price', maximum=_parse_int_filter(filters['priceTo']))
+    
+    # Rooms filter: only an exact number of rooms can match
+    if filters.get('rooms'):
+        rooms = str(filters['rooms'])
+        mask &= index.rooms_mask([rooms]) if rooms.isdigit() else index.none_mask()
+    
+    # District filter
+    if filters.get('districts') and len(filters['districts']) > 0:
+        mask &= index.category_mask('district', filters['districts'])
+    
+    # Area filter
+    if filters.get('areaFrom'):
+        mask &= index.range_mask('area', minimum=_parse_int_filter(filters['areaFrom']))
+    if filters.get('areaTo'):
+        mask &= index.range_mask('area', maximum=_parse_int_filter(filters['areaTo']))
+    
+    # Developer filter
+    if filters.get('developers') and len(filters['developers']) > 0:
+        mask &= index.category_mask('developer', filters['developers'])
+    
+    return index.materialize(index.select(mask))
+
+def send_property_email(client, search_name, properties, message):
+    """Send email with property recommendations"""
+    try:
+        subject = f"Новая подборка недвижимости: {search_name}"
         
         properties_html = ""
         for prop in properties[:10]:  # Limit to first 10 properties
@@ -9774,12 +9370,20 @@ def dashboard():
         categories = RecommendationCategory.query.filter_by(client_id=current_user.id, is_active=True).all()
         
         # Enrich recommendations with property details
+        # Все квартиры рекомендаций — одним запросом через LRU, а не проходом по снимку на каждую
+        property_rows = property_repository.get_many(
+            rec.item_id for rec in recommendations
+            if rec.recommendation_type == 'property' and rec.item_id
+        )
+        complexes = None
         for rec in recommendations:
             if rec.recommendation_type == 'property' and rec.item_id:
                 try:
-                    properties = load_properties()
-                    complexes = load_residential_complexes()
-                    property_data = next((p for p in properties if str(p.get('id')) == str(rec.item_id)), None)
+                    property_row = property_rows.get(str(normalize_property_id(rec.item_id)))
+                    property_data = _format_property_row(property_row) if property_row else None
+                    if property_data and complexes is None and not property_data.get('complex_name'):
+                        # Список ЖК нужен только для квартир без названия ЖК
+                        complexes = load_residential_complexes()
                     if property_data:
                         # Create a simple object to store property details
                         class PropertyDetails:
@@ -9814,7 +9418,7 @@ def dashboard():
                                 self.property_type = type_mapping.get(original_type, 'apartment')
                                 self.property_type_ru = original_type
                         
-                        rec.property_details = PropertyDetails(property_data, complexes)
+                        rec.property_details = PropertyDetails(property_data, complexes or [])
                         complex_name = rec.property_details.residential_complex or 'Не указан'
                         print(f"Loaded property {rec.item_id}: {property_data.get('rooms')} комн, ЖК {complex_name}")
                     else:
@@ -10483,7 +10087,7 @@ def get_complex_favorites_list():
             real_max_price = fav.max_price or 0
             real_image = fav.complex_image or ''
             
-            print(f"DEBUG: Searching for user complex with fav.complex_id: {fav.complex_id}")
+            app.logger.debug("Searching for user complex with fav.complex_id: %s", fav.complex_id)
             
             if fav.complex_id:
                 try:
@@ -10527,13 +10131,13 @@ def get_complex_favorites_list():
                                 except:
                                     pass
                             
-                            print(f"DEBUG: ✅ Found user complex in excel_properties: {real_complex_name}")
+                            app.logger.debug("✅ Found user complex in excel_properties: %s", real_complex_name)
                             break
                     else:
-                        print(f"DEBUG: ❌ User complex with ID {fav.complex_id} not found in excel_properties")
+                        app.logger.debug("❌ User complex with ID %s not found in excel_properties", fav.complex_id)
                 
                 except Exception as e:
-                    print(f"DEBUG: Error searching user excel_properties: {e}")
+                    app.logger.debug("Error searching user excel_properties: %s", e)
             
             favorites_list.append({
                 'id': fav.complex_id,
@@ -10688,8 +10292,8 @@ def manager_toggle_favorite():
     if not manager_id:
         return jsonify({'success': False, 'error': 'Manager ID not found'}), 401
     
-    print(f"DEBUG: Manager favorites toggle called by manager {manager_id} for property {property_id}")
-    print(f"DEBUG: Request data: {data}")
+    app.logger.debug("Manager favorites toggle called by manager %s for property %s", manager_id, property_id)
+    app.logger.debug("Request data: %s", data)
     
     # Check if already in favorites
     existing = ManagerFavoriteProperty.query.filter_by(
@@ -11154,7 +10758,7 @@ def manager_get_complex_favorites_list():
                     rc = ResidentialComplex.query.get(complex_int_id)
                     if rc and rc.name and rc.name not in complex_names:
                         complex_names.append(rc.name)
-                        print(f"DEBUG: Added missing favorite complex to search: {rc.name}")
+                        app.logger.debug("Added missing favorite complex to search: %s", rc.name)
                 except (ValueError, TypeError):
                     pass
         excel_data = {}
@@ -11194,8 +10798,8 @@ def manager_get_complex_favorites_list():
                         }
                         break
             
-            print(f"DEBUG: Searched {len(normalized_names)} names, found {len(excel_data)} matches")
-            print(f"DEBUG: excel_data keys: {list(excel_data.keys())[:2]}")  # First 2 keys
+            app.logger.debug("Searched %s names, found %s matches", len(normalized_names), len(excel_data))
+            app.logger.debug("excel_data keys: %s", list(excel_data.keys())[:2])  # First 2 keys
         
         
         # Загружаем все комплексы сразу с joined данными  
@@ -11235,14 +10839,14 @@ def manager_get_complex_favorites_list():
                 # ✅ ИСПРАВЛЕНИЕ: Используем тот же SQL что и /residential-complexes для поиска по динамическим ID
             try:
                 complex_db = None
-                print(f"DEBUG: Searching for complex with fav.complex_id: {fav.complex_id}")
+                app.logger.debug("Searching for complex with fav.complex_id: %s", fav.complex_id)
                 
                 if fav.complex_id:
                     # Сначала пробуем найти в residential_complexes (для старых записей)
                     try:
                         complex_int_id = int(fav.complex_id)
                         complex_db = ResidentialComplex.query.get(complex_int_id)
-                        print(f"DEBUG: Found by id {complex_int_id}: {complex_db.name if complex_db else 'None'}")
+                        app.logger.debug("Found by id %s: %s", complex_int_id, complex_db.name if complex_db else 'None')
                     except (ValueError, TypeError):
                         pass
                 
@@ -11253,10 +10857,10 @@ def manager_get_complex_favorites_list():
                     real_district = complex_db.district.name if complex_db.district else real_district
                     real_address = complex_db.address or real_address
                     real_image = complex_db.main_image or real_image
-                    print(f"DEBUG: ✅ Using residential_complexes data: {real_complex_name}")
+                    app.logger.debug("✅ Using residential_complexes data: %s", real_complex_name)
                 else:
                     # ✅ НОВОЕ: Ищем в excel_properties используя тот же SQL что и /residential-complexes
-                    print(f"DEBUG: Searching in excel_properties for ID {fav.complex_id}")
+                    app.logger.debug("Searching in excel_properties for ID %s", fav.complex_id)
                     try:
                         # Воссоздаем тот же запрос что генерирует ID на странице /residential-complexes
                         excel_complex_query = db.session.execute(text("""
@@ -11299,13 +10903,13 @@ def manager_get_complex_favorites_list():
                                     except:
                                         pass
                                 
-                                print(f"DEBUG: ✅ Found complex in excel_properties: {real_complex_name}")
+                                app.logger.debug("✅ Found complex in excel_properties: %s", real_complex_name)
                                 break
                         else:
-                            print(f"DEBUG: ❌ Complex with ID {fav.complex_id} not found in excel_properties")
+                            app.logger.debug("❌ Complex with ID %s not found in excel_properties", fav.complex_id)
                     
                     except Exception as e:
-                        print(f"DEBUG: Error searching excel_properties: {e}")
+                        app.logger.debug("Error searching excel_properties: %s", e)
                     
                     # Теперь ищем данные в excel_properties по названию ЖК
                     if real_complex_name != 'ЖК без названия':
@@ -11465,7 +11069,7 @@ def admin_users():
                 # Устанавливаем текущую дату для пользователей без даты создания
                 user.created_at = datetime.now()
         
-        print(f"DEBUG: Loading admin_users page - Found {users.total} users")
+        app.logger.debug("Loading admin_users page - Found %s users", users.total)
         
         return render_template('admin/users.html', 
                              admin=current_admin, 
@@ -11785,7 +11389,7 @@ def admin_create_user():
             db.session.add(user)
             db.session.commit()
             
-            print(f"DEBUG: Successfully created user {user.id}: {user.full_name} by admin")
+            app.logger.debug("Successfully created user %s: %s by admin", user.id, user.full_name)
             
             # Send credentials if requested
             if 'send_credentials' in request.form:
@@ -12014,7 +11618,7 @@ def admin_edit_manager(manager_id):
             flash(f'Менеджер с ID {manager_id} не найден', 'error')
             return redirect(url_for('admin_managers'))
             
-        print(f"DEBUG: Found manager {manager_id}: {manager.email}")
+        app.logger.debug("Found manager %s: %s", manager_id, manager.email)
     except Exception as e:
         print(f"ERROR in admin_edit_manager: {e}")
         flash('Ошибка при загрузке менеджера', 'error')
@@ -12296,6 +11900,24 @@ def admin_delete_post(post_id):
     
     return redirect(url_for('admin_blog'))
 
+@app.route('/admin/cache-stats')
+@admin_required
+def admin_cache_stats():
+    """Hit ratio, bytes and evictions per cached endpoint"""
+    from models import Admin
+    
+    stats = cache.stats()
+    if request.args.get('format') == 'json':
+        return jsonify(stats)
+    
+    current_admin = Admin.query.get(session.get('admin_id'))
+    if not current_admin:
+        return redirect(url_for('admin_login'))
+    
+    return render_template('admin/cache_stats.html', admin=current_admin, stats=stats,
+                           page_cache_stats=page_cache.stats(),
+                           properties_cache_stats=properties_snapshot.stats())
+
 # Analytics Routes
 @app.route('/admin/analytics/cashback')
 @admin_required
@@ -12506,12 +12128,14 @@ def admin_create_manager():
 def admin_delete_manager(manager_id):
     """Delete manager"""
     from models import Manager
+    from principal_cache import principal_cache
     
     manager = Manager.query.get_or_404(manager_id)
     
     try:
         db.session.delete(manager)
         db.session.commit()
+        principal_cache.invalidate(Manager, manager_id)
         flash('Менеджер успешно удален', 'success')
     except Exception as e:
         db.session.rollback()
@@ -12524,12 +12148,14 @@ def admin_delete_manager(manager_id):
 def admin_toggle_manager_status(manager_id):
     """Toggle manager active status"""
     from models import Manager
+    from principal_cache import principal_cache
     
     manager = Manager.query.get_or_404(manager_id)
     manager.is_active = not manager.is_active
     
     try:
         db.session.commit()
+        principal_cache.invalidate(Manager, manager_id)
         status = 'активирован' if manager.is_active else 'заблокирован'
         flash(f'Менеджер {status}', 'success')
     except Exception as e:
@@ -12889,36 +12515,36 @@ def create_manager_saved_search():
     from models import ManagerSavedSearch
     import json
     
-    print(f"DEBUG: ===== create_manager_saved_search API CALLED =====")
-    print(f"DEBUG: Method: {request.method}")
-    print(f"DEBUG: Path: {request.path}")
+    app.logger.debug("===== create_manager_saved_search API CALLED =====")
+    app.logger.debug("Method: %s", request.method)
+    app.logger.debug("Path: %s", request.path)
     # Log safe headers only (no cookies/tokens)
     safe_headers = {k: v for k, v in request.headers.items() if k.lower() not in ['cookie', 'authorization']}
-    print(f"DEBUG: Headers: {safe_headers}")
+    app.logger.debug("Headers: %s", safe_headers)
     
     manager_id = session.get('manager_id')
-    print(f"DEBUG: Manager ID from session: {manager_id}")
+    app.logger.debug("Manager ID from session: %s", manager_id)
     
     data = request.get_json()
-    print(f"DEBUG: Raw request JSON: {data}")
-    print(f"DEBUG: JSON type: {type(data)}")
+    app.logger.debug("Raw request JSON: %s", data)
+    app.logger.debug("JSON type: %s", type(data))
     
     try:
         # Extract filters from the request
         filters = data.get('filters', {})
-        print(f"DEBUG: Creating manager search with filters: {filters}")
-        print(f"DEBUG: Full request data: {data}")
-        print(f"DEBUG: Filters type: {type(filters)}")
-        print(f"DEBUG: Filters empty check: {bool(filters)}")
+        app.logger.debug("Creating manager search with filters: %s", filters)
+        app.logger.debug("Full request data: %s", data)
+        app.logger.debug("Filters type: %s", type(filters))
+        app.logger.debug("Filters empty check: %s", bool(filters))
         
         # Test if filters is actually empty - force some test data if needed
         if not filters or not any(filters.values()):
-            print("DEBUG: Filters are empty, checking raw JSON...")
+            app.logger.debug("Filters are empty, checking raw JSON...")
             raw_json = request.get_data(as_text=True)
-            print(f"DEBUG: Raw request body: {raw_json}")
+            app.logger.debug("Raw request body: %s", raw_json)
         
         filters_json = json.dumps(filters) if filters else None
-        print(f"DEBUG: Filters JSON: {filters_json}")
+        app.logger.debug("Filters JSON: %s", filters_json)
         
         # Create new search
         search = ManagerSavedSearch(
@@ -12932,11 +12558,11 @@ def create_manager_saved_search():
         
         db.session.add(search)
         db.session.commit()
-        print(f"DEBUG: Saved search with ID: {search.id}, additional_filters: {search.additional_filters}")
+        app.logger.debug("Saved search with ID: %s, additional_filters: %s", search.id, search.additional_filters)
         
         # Verify the saved data
         db.session.refresh(search)
-        print(f"DEBUG: Refreshed search additional_filters: {search.additional_filters}")
+        app.logger.debug("Refreshed search additional_filters: %s", search.additional_filters)
         
         return jsonify({
             'success': True,
@@ -13410,7 +13036,7 @@ def save_search():
     try:
         client_email = data.get('client_email')  # For managers
         
-        print(f"DEBUG: Saving search with raw data: {data}")
+        app.logger.debug("Saving search with raw data: %s", data)
         
         # Create filter object from submitted data
         filters = {}
@@ -13460,7 +13086,7 @@ def save_search():
         if 'areaTo' in filter_data and filter_data['areaTo'] and str(filter_data['areaTo']) not in ['0', '']:
             filters['areaTo'] = str(filter_data['areaTo'])
             
-        print(f"DEBUG: Extracted filters from {filter_data}: {filters}")
+        app.logger.debug("Extracted filters from %s: %s", filter_data, filters)
 
         # Create search with new format
         search = SavedSearch(
@@ -13815,9 +13441,9 @@ def apply_saved_search(search_id):
         if search.additional_filters:
             try:
                 filters = json.loads(search.additional_filters)
-                print(f"DEBUG: Loaded filters from additional_filters: {filters}")
+                app.logger.debug("Loaded filters from additional_filters: %s", filters)
             except json.JSONDecodeError as e:
-                print(f"DEBUG: Error parsing additional_filters: {e}")
+                app.logger.debug("Error parsing additional_filters: %s", e)
                 pass
         
         # Include legacy fields as filters if not already in additional_filters
@@ -13839,12 +13465,12 @@ def apply_saved_search(search_id):
         if search.size_max and 'areaTo' not in filters:
             filters['areaTo'] = str(search.size_max)
         
-        print(f"DEBUG: Применяем поиск '{search.name}' с фильтрами: {filters}")
+        app.logger.debug("Применяем поиск '%s' с фильтрами: %s", search.name, filters)
         
         try:
             search_dict = search.to_dict()
         except Exception as e:
-            print(f"DEBUG: Error in search.to_dict(): {e}")
+            app.logger.debug("Error in search.to_dict(): %s", e)
             search_dict = {
                 'id': search.id,
                 'name': search.name,
@@ -14368,7 +13994,7 @@ def get_presentation_data(presentation_id):
     from models import Collection, CollectionProperty, Manager
     
     manager_id = session.get('manager_id')
-    print(f"DEBUG: Get presentation data - manager_id: {manager_id}, presentation_id: {presentation_id}")
+    app.logger.debug("Get presentation data - manager_id: %s, presentation_id: %s", manager_id, presentation_id)
     
     current_manager = Manager.query.get(manager_id)
     if not current_manager:
@@ -14389,22 +14015,22 @@ def get_presentation_data(presentation_id):
         collection_id=presentation_id
     ).order_by(CollectionProperty.order_index).all()
     
-    print(f"DEBUG: Found {len(collection_properties)} properties in presentation")
+    app.logger.debug("Found %s properties in presentation", len(collection_properties))
     
     # Load properties data to enrich the collection properties
     properties_data = load_properties()
+    property_index = get_property_index(properties_data)
     
     # Enrich collection properties with full property data
     enriched_properties = []
+    positions = []
     for cp in collection_properties:
         # Find the property in the main properties data
-        property_data = None
-        for prop in properties_data:
-            if str(prop.get('id')) == str(cp.property_id):
-                property_data = prop
-                break
+        position = property_index.position_of(cp.property_id)
+        property_data = properties_data[position] if position is not None else None
         
         if property_data:
+            positions.append(position)
             # Get complex name directly from property_data
             complex_name = property_data.get('residential_complex', property_data.get('complex_name', 'Не указан'))
             
@@ -14448,9 +14074,30 @@ def get_presentation_data(presentation_id):
             }
             enriched_properties.append(enriched_property)
         else:
-            print(f"DEBUG: Property {cp.property_id} not found in main data")
+            app.logger.debug("Property %s not found in main data", cp.property_id)
+    
+    app.logger.debug("Enriched %s properties", len(enriched_properties))
     
-    print(f"DEBUG: Enriched {len(enriched_properties)} properties")
+    # Квартиры, похожие на уже добавленные, — подсказки менеджеру для презентации
+    similar_properties = []
+    try:
+        similarity_index = get_similarity_index(properties_data)
+        for position, distance in similarity_index.neighbors_of_many(positions, k=6):
+            prop = properties_data[position]
+            similar_properties.append({
+                'id': prop.get('id'),
+                'title': prop.get('title'),
+                'price': prop.get('price', 0),
+                'area': prop.get('area', 0),
+                'rooms': prop.get('rooms', 0),
+                'complex_name': prop.get('complex_name'),
+                'district': prop.get('district'),
+                'main_image': prop.get('main_image'),
+                'url': prop.get('url', f"/object/{prop.get('id')}"),
+                'distance': round(distance, 3)
+            })
+    except Exception as e:
+        print(f"Error finding similar properties for presentation {presentation_id}: {e}")
     
     # Format presentation data for JSON response
     presentation_data = {
@@ -14465,6 +14112,7 @@ def get_presentation_data(presentation_id):
         'last_viewed_at': presentation.last_viewed_at.isoformat() if presentation.last_viewed_at else None,
         'properties_count': len(enriched_properties),
         'properties': enriched_properties,
+        'similar_properties': similar_properties,
         'unique_url': presentation.unique_url
     }
     
@@ -14742,6 +14390,225 @@ def update_presentation_status(presentation_id):
 
 # ===== PDF AND PRINT ENDPOINTS =====
 
+PDF_PROPERTY_SQL = """
+    SELECT ep.inner_id, ep.photos, ep.complex_name, ep.complex_id,
+           ep.complex_object_class_display_name, ep.complex_building_end_build_year,
+           ep.complex_building_end_build_quarter, ep.complex_has_big_check,
+           ep.complex_financing_sber, ep.complex_has_green_mortgage,
+           ep.object_rooms, ep.object_area, ep.object_min_floor, ep.object_max_floor, 
+           ep.price, ep.address_display_name, ep.address_position_lat, ep.address_position_lon,
+           ep.developer_name, ep.renovation_display_name
+    FROM excel_properties ep
+    WHERE ep.inner_id IN :property_ids
+"""
+
+PDF_COMPLEX_SQL = """
+    SELECT complex_id, name, slug, district_id, developer_id, cashback_rate,
+           object_class_display_name, start_build_year, start_build_quarter,
+           end_build_year, end_build_quarter, has_accreditation,
+           has_green_mortgage, has_big_check, with_renovation, financing_sber
+    FROM residential_complexes 
+    WHERE complex_id IN :complex_ids
+"""
+
+# Фото ЖК хранятся в excel_properties: берем первую квартиру ЖК с фото
+PDF_COMPLEX_PHOTOS_SQL = """
+    SELECT complex_id, photos FROM (
+        SELECT complex_id, photos,
+               ROW_NUMBER() OVER (PARTITION BY complex_id ORDER BY inner_id) AS rn
+        FROM excel_properties
+        WHERE complex_id IN :complex_ids AND photos IS NOT NULL
+    ) ranked
+    WHERE rn = 1
+"""
+
+
+def _parse_complex_photos(photos_raw):
+    """До 9 фото ЖК для сетки 3x3: список или словарь категорий"""
+    try:
+        photos_data = json.loads(photos_raw)
+    except (json.JSONDecodeError, TypeError):
+        return []
+    if isinstance(photos_data, list):
+        return photos_data[:9]
+    if isinstance(photos_data, dict):
+        # If photos are organized by categories  
+        all_photos = []
+        for category, photos_list in photos_data.items():
+            if isinstance(photos_list, list):
+                all_photos.extend(photos_list)
+        return all_photos[:9]
+    return []
+
+
+def _pdf_manager_data(presentation_id):
+    from models import Collection, Manager
+    
+    try:
+        presentation = Collection.query.get(presentation_id)
+        if presentation and presentation.created_by_manager_id:
+            manager = Manager.query.get(presentation.created_by_manager_id)
+            if manager:
+                return {
+                    'name': manager.full_name or 'Менеджер',
+                    'email': manager.email or '',
+                    'phone': manager.phone or '+7 (XXX) XXX-XX-XX',
+                    'photo_url': None  # Add if available
+                }
+    except Exception as e:
+        print(f"Error loading manager data: {e}")
+    return {}
+
+
+def _build_pdf_context(property_data, complex_data, complex_photos, manager_data):
+    # Parse photos JSON with safe error handling
+    property_images = {'photos': [], 'plans': []}
+    if property_data.get('photos'):
+        try:
+            photos_list = json.loads(property_data['photos'])
+            if photos_list and isinstance(photos_list, list):
+                # First 6 images as main photos, 6-8 as plans (fixed logic)
+                property_images['photos'] = photos_list[:6]
+                property_images['plans'] = photos_list[6:8] if len(photos_list) > 6 else []
+        except (json.JSONDecodeError, TypeError, ValueError):
+            property_images['photos'] = []
+            property_images['plans'] = []
+    
+    complex_images = {'facade': [], 'territory': [], 'infrastructure': [], 'construction': []}
+    
+    # Safe type conversion with defaults (using corrected column names)
+    area = float(property_data.get('object_area') or 0)
+    price = int(property_data.get('price') or 0)  # Fixed column name
+    rooms = int(property_data.get('object_rooms') or 0)
+    floor = int(property_data.get('object_min_floor') or 0)  # Fixed column name
+    total_floors = int(property_data.get('object_max_floor') or 0)
+    
+    # Calculate price per sqm with division by zero protection
+    price_per_sqm = 0
+    if area > 0 and price > 0:
+        try:
+            price_per_sqm = int(price / area)
+        except (ZeroDivisionError, ValueError):
+            price_per_sqm = 0
+    
+    # Construct full context with safe data types
+    context = {
+        'property': {
+            'id': property_data.get('inner_id'),
+            'rooms': rooms,
+            'area': area,
+            'floor': floor,
+            'total_floors': total_floors,
+            'price': price,
+            'price_per_sqm': price_per_sqm,
+            'finishing': property_data.get('renovation_display_name') or 'Не указан',
+            'status': 'Активен',  # Default since column doesn't exist
+            'address': property_data.get('address_display_name') or 'Адрес уточняется',
+            'latitude': property_data.get('address_position_lat'),
+            'longitude': property_data.get('address_position_lon'),
+            'object_type': 'Квартира',  # Default since column doesn't exist
+            'developer_name': property_data.get('developer_name') or '',
+            'jk_name': property_data.get('complex_name') or '',
+            'property_type': 'Квартира',  # Default since column doesn't exist
+            'completion_date': None  # Will be set from complex data if available
+        },
+        'property_images': property_images,
+        'complex': {
+            'id': property_data.get('complex_id'),
+            'name': property_data.get('complex_name') or '',
+            'class': property_data.get('complex_object_class_display_name') or '',
+            'completion_year': property_data.get('complex_building_end_build_year'),
+            'completion_quarter': property_data.get('complex_building_end_build_quarter'),
+            'has_big_check': bool(property_data.get('complex_has_big_check')),
+            'financing_sber': bool(property_data.get('complex_financing_sber')),
+            'has_green_mortgage': bool(property_data.get('complex_has_green_mortgage')),
+            'developer': property_data.get('developer_name') or '',
+            'photos': complex_photos,  # Added complex photos from database
+            'features': []
+        },
+        'complex_images': complex_images,
+        'manager': manager_data,
+        'generated_at': property_data  # Full raw data for backwards compatibility
+    }
+    
+    # Add completion date to property if available
+    if context['complex']['completion_quarter'] and context['complex']['completion_year']:
+        context['property']['completion_date'] = f"{context['complex']['completion_quarter']} кв. {context['complex']['completion_year']} г."
+    
+    # Add complex features list with safe checks
+    features = []
+    if complex_data.get('has_accreditation'):
+        features.append('Аккредитован банками')
+    if complex_data.get('has_green_mortgage') or property_data.get('complex_has_green_mortgage'):
+        features.append('Льготная ипотека')  
+    if complex_data.get('with_renovation'):
+        features.append('С отделкой')
+    if complex_data.get('financing_sber') or property_data.get('complex_financing_sber'):
+        features.append('Финансирование Сбербанк')
+    if complex_data.get('has_big_check') or property_data.get('complex_has_big_check'):
+        features.append('Большой чек')
+    
+    context['complex']['features'] = features
+    return context
+
+
+def fetch_pdf_contexts(property_ids, presentation_id=None):
+    """
+    Контексты PDF для нескольких квартир сразу: {str(property_id): context}.
+    Три запроса на всю презентацию (квартиры, ЖК, фото ЖК) плюс менеджер,
+    вместо трех-четырех запросов на каждую квартиру.
+    Квартиры, которых нет в excel_properties, в результат не попадают.
+    """
+    from sqlalchemy import bindparam
+    
+    inner_ids = []
+    for property_id in property_ids:
+        try:
+            inner_ids.append(int(property_id))
+        except (TypeError, ValueError):
+            print(f"Invalid property ID format: {property_id}")
+    if not inner_ids:
+        return {}
+    
+    rows = db.session.execute(
+        text(PDF_PROPERTY_SQL).bindparams(bindparam('property_ids', expanding=True)),
+        {'property_ids': inner_ids}
+    ).fetchall()
+    properties_data = [dict(row._mapping) for row in rows]
+    
+    complexes = {}
+    complex_photos = {}
+    complex_ids = sorted({str(data['complex_id']) for data in properties_data if data.get('complex_id')})
+    if complex_ids:
+        try:
+            for row in db.session.execute(
+                    text(PDF_COMPLEX_SQL).bindparams(bindparam('complex_ids', expanding=True)),
+                    {'complex_ids': complex_ids}):
+                complexes[str(row.complex_id)] = dict(row._mapping)
+            
+            photo_ids = [int(complex_id) for complex_id in complex_ids if complex_id.isdigit()]
+            if photo_ids:
+                for row in db.session.execute(
+                        text(PDF_COMPLEX_PHOTOS_SQL).bindparams(bindparam('complex_ids', expanding=True)),
+                        {'complex_ids': photo_ids}):
+                    complex_photos[str(row.complex_id)] = _parse_complex_photos(row.photos)
+        except Exception as e:
+            print(f"Error loading complex data: {e}")
+    
+    manager_data = _pdf_manager_data(presentation_id) if presentation_id else {}
+    
+    contexts = {}
+    for property_data in properties_data:
+        complex_id = str(property_data.get('complex_id') or '')
+        contexts[str(property_data['inner_id'])] = _build_pdf_context(
+            property_data,
+            complexes.get(complex_id, {}),
+            complex_photos.get(complex_id, []),
+            manager_data,
+        )
+    return contexts
+
+
 def fetch_pdf_context(property_id, presentation_id=None):
     """
     Fetch comprehensive context for PDF generation including:
@@ -14752,189 +14619,8 @@ def fetch_pdf_context(property_id, presentation_id=None):
     FIXED: Uses SQLAlchemy text() with bindparams for SQLite compatibility
     FIXED: Added safe resource handling and division by zero protection
     """
-    import json
-    from models import Collection, CollectionProperty, ResidentialComplex, Manager
-    from sqlalchemy import text
-    
     try:
-        # Get property data using SQLAlchemy text() with bindparams (SQLite compatible)
-        property_query = text("""
-        SELECT ep.inner_id, ep.photos, ep.complex_name, ep.complex_id,
-               ep.complex_object_class_display_name, ep.complex_building_end_build_year,
-               ep.complex_building_end_build_quarter, ep.complex_has_big_check,
-               ep.complex_financing_sber, ep.complex_has_green_mortgage,
-               ep.object_rooms, ep.object_area, ep.object_min_floor, ep.object_max_floor, 
-               ep.price, ep.address_display_name, ep.address_position_lat, ep.address_position_lon,
-               ep.developer_name, ep.renovation_display_name
-        FROM excel_properties ep
-        WHERE ep.inner_id = :property_id
-        """)
-        
-        # Use SQLAlchemy session with proper error handling
-        result = db.session.execute(property_query, {'property_id': property_id})
-        property_row = result.fetchone()
-        
-        if not property_row:
-            return None
-            
-        # Convert to dictionary using _mapping for SQLAlchemy compatibility
-        property_data = dict(property_row._mapping)
-        
-        # Parse photos JSON with safe error handling
-        property_images = {'photos': [], 'plans': []}
-        if property_data.get('photos'):
-            try:
-                photos_list = json.loads(property_data['photos'])
-                if photos_list and isinstance(photos_list, list):
-                    # First 6 images as main photos, 6-8 as plans (fixed logic)
-                    property_images['photos'] = photos_list[:6]
-                    property_images['plans'] = photos_list[6:8] if len(photos_list) > 6 else []
-            except (json.JSONDecodeError, TypeError, ValueError):
-                property_images['photos'] = []
-                property_images['plans'] = []
-        
-        # Get residential complex data if available
-        complex_data = {}
-        complex_images = {'facade': [], 'territory': [], 'infrastructure': [], 'construction': []}
-        complex_photos = []
-        
-        if property_data.get('complex_id'):
-            try:
-                # Load basic complex data from residential_complexes table
-                complex_query = text("""
-                SELECT name, slug, district_id, developer_id, cashback_rate,
-                       object_class_display_name, start_build_year, start_build_quarter,
-                       end_build_year, end_build_quarter, has_accreditation,
-                       has_green_mortgage, has_big_check, with_renovation, financing_sber
-                FROM residential_complexes 
-                WHERE complex_id = CAST(:complex_id AS text)
-                """)
-                complex_result = db.session.execute(complex_query, {'complex_id': property_data['complex_id']})
-                complex_row = complex_result.fetchone()
-                
-                if complex_row:
-                    complex_data = dict(complex_row._mapping)
-                
-                # Load complex photos from excel_properties table (where photos are actually stored)
-                photos_query = text("""
-                SELECT photos FROM excel_properties 
-                WHERE complex_id = :complex_id AND photos IS NOT NULL
-                LIMIT 1
-                """)
-                photos_result = db.session.execute(photos_query, {'complex_id': property_data['complex_id']})
-                photos_row = photos_result.fetchone()
-                
-                if photos_row and photos_row[0]:
-                    try:
-                        photos_data = json.loads(photos_row[0])
-                        if isinstance(photos_data, list):
-                            complex_photos = photos_data[:9]  # Take first 9 photos for 3x3 grid
-                        elif isinstance(photos_data, dict):
-                            # If photos are organized by categories  
-                            all_photos = []
-                            for category, photos_list in photos_data.items():
-                                if isinstance(photos_list, list):
-                                    all_photos.extend(photos_list)
-                            complex_photos = all_photos[:9]  # Take first 9 photos for 3x3 grid
-                    except (json.JSONDecodeError, TypeError):
-                        complex_photos = []
-                        
-            except Exception as e:
-                print(f"Error loading complex data: {e}")
-        
-        # Get manager information if presentation_id provided
-        manager_data = {}
-        if presentation_id:
-            try:
-                presentation = Collection.query.get(presentation_id)
-                if presentation and presentation.created_by_manager_id:
-                    manager = Manager.query.get(presentation.created_by_manager_id)
-                    if manager:
-                        manager_data = {
-                            'name': manager.full_name or 'Менеджер',
-                            'email': manager.email or '',
-                            'phone': manager.phone or '+7 (XXX) XXX-XX-XX',
-                            'photo_url': None  # Add if available
-                        }
-            except Exception as e:
-                print(f"Error loading manager data: {e}")
-        
-        # Safe type conversion with defaults (using corrected column names)
-        area = float(property_data.get('object_area') or 0)
-        price = int(property_data.get('price') or 0)  # Fixed column name
-        rooms = int(property_data.get('object_rooms') or 0)
-        floor = int(property_data.get('object_min_floor') or 0)  # Fixed column name
-        total_floors = int(property_data.get('object_max_floor') or 0)
-        
-        # Calculate price per sqm with division by zero protection
-        price_per_sqm = 0
-        if area > 0 and price > 0:
-            try:
-                price_per_sqm = int(price / area)
-            except (ZeroDivisionError, ValueError):
-                price_per_sqm = 0
-        
-        # Construct full context with safe data types
-        context = {
-            'property': {
-                'id': property_data.get('inner_id'),
-                'rooms': rooms,
-                'area': area,
-                'floor': floor,
-                'total_floors': total_floors,
-                'price': price,
-                'price_per_sqm': price_per_sqm,
-                'finishing': property_data.get('renovation_display_name') or 'Не указан',
-                'status': 'Активен',  # Default since column doesn't exist
-                'address': property_data.get('address_display_name') or 'Адрес уточняется',
-                'latitude': property_data.get('address_position_lat'),
-                'longitude': property_data.get('address_position_lon'),
-                'object_type': 'Квартира',  # Default since column doesn't exist
-                'developer_name': property_data.get('developer_name') or '',
-                'jk_name': property_data.get('complex_name') or '',
-                'property_type': 'Квартира',  # Default since column doesn't exist
-                'completion_date': None  # Will be set from complex data if available
-            },
-            'property_images': property_images,
-            'complex': {
-                'id': property_data.get('complex_id'),
-                'name': property_data.get('complex_name') or '',
-                'class': property_data.get('complex_object_class_display_name') or '',
-                'completion_year': property_data.get('complex_building_end_build_year'),
-                'completion_quarter': property_data.get('complex_building_end_build_quarter'),
-                'has_big_check': bool(property_data.get('complex_has_big_check')),
-                'financing_sber': bool(property_data.get('complex_financing_sber')),
-                'has_green_mortgage': bool(property_data.get('complex_has_green_mortgage')),
-                'developer': property_data.get('developer_name') or '',
-                'photos': complex_photos,  # Added complex photos from database
-                'features': []
-            },
-            'complex_images': complex_images,
-            'manager': manager_data,
-            'generated_at': property_data  # Full raw data for backwards compatibility
-        }
-        
-        # Add completion date to property if available
-        if context['complex']['completion_quarter'] and context['complex']['completion_year']:
-            context['property']['completion_date'] = f"{context['complex']['completion_quarter']} кв. {context['complex']['completion_year']} г."
-        
-        # Add complex features list with safe checks
-        features = []
-        if complex_data.get('has_accreditation'):
-            features.append('Аккредитован банками')
-        if complex_data.get('has_green_mortgage') or property_data.get('complex_has_green_mortgage'):
-            features.append('Льготная ипотека')  
-        if complex_data.get('with_renovation'):
-            features.append('С отделкой')
-        if complex_data.get('financing_sber') or property_data.get('complex_financing_sber'):
-            features.append('Финансирование Сбербанк')
-        if complex_data.get('has_big_check') or property_data.get('complex_has_big_check'):
-            features.append('Большой чек')
-        
-        context['complex']['features'] = features
-        
-        return context
-        
+        return fetch_pdf_contexts([property_id], presentation_id).get(str(property_id))
     except Exception as e:
         print(f"Error in fetch_pdf_context: {e}")
         import traceback
@@ -14979,10 +14665,7 @@ def print_property(presentation_id, property_id):
 def download_presentation_property_pdf(presentation_id, property_id):
     """Скачать объект в PDF формате"""
     from models import Collection, CollectionProperty
-    from weasyprint import HTML, CSS
     from io import BytesIO
-    import tempfile
-    import os
     
     try:
         # Find presentation and property
@@ -15013,10 +14696,8 @@ def download_presentation_property_pdf(presentation_id, property_id):
                                      context=context,
                                      for_pdf=True)
         
-        # Generate PDF
-        pdf_buffer = BytesIO()
-        HTML(string=html_content, base_url=request.host_url).write_pdf(pdf_buffer)
-        pdf_buffer.seek(0)
+        # Generate PDF (или берем готовый из кэша, если данные и шаблон не менялись)
+        pdf_buffer = BytesIO(pdf_renderer.render_one(property_id, html_content, request.host_url))
         
         return send_file(
             pdf_buffer,
@@ -15029,419 +14710,283 @@ def download_presentation_property_pdf(presentation_id, property_id):
         print(f"Error generating PDF: {e}")
         return f"Error generating PDF: {str(e)}", 500
 
-@app.route('/api/manager/presentation/<int:presentation_id>/download-all')
+def _presentation_zip_key(presentation_id):
+    return f"presentation:{presentation_id}"
+
+
+@job_queue.register('presentation_zip', concurrency=2)
+def run_presentation_zip_job(job):
+    """
+    Собирает PDF всех квартир презентации в ZIP-файл задачи. Контексты грузятся
+    пачкой, PDF рендерятся в пуле процессов (или берутся из кэша) и пишутся в
+    архив по мере готовности.
+    """
+    from models import Collection, CollectionProperty
+    import zipfile
+
+    presentation_id = job.payload['presentation_id']
+    host_url = job.payload.get('host_url') or 'http://localhost/'
+    presentation = Collection.query.get(presentation_id)
+    if not presentation:
+        raise Exception('Презентация не найдена')
+
+    properties = CollectionProperty.query.filter_by(collection_id=presentation_id).all()
+    total_properties = len(properties)
+    contexts = fetch_pdf_contexts([prop.property_id for prop in properties], presentation_id)
+
+    # render_template и контекст-процессоры ждут запрос
+    items = []
+    with app.test_request_context(base_url=host_url):
+        for prop in properties:
+            context = contexts.get(str(prop.property_id))
+            if not context:
+                print(f"Failed to get context for property {prop.property_id}")
+                continue
+            items.append((prop.property_id, render_template('print_property.html',
+                                                            property=context['property'],
+                                                            property_images=context['property_images'],
+                                                            complex=context['complex'],
+                                                            complex_images=context['complex_images'],
+                                                            manager=context['manager'],
+                                                            presentation=presentation,
+                                                            manager_note=getattr(prop, 'manager_note', None),
+                                                            context=context,
+                                                            for_pdf=True)))
+
+    zip_path = job.file_path('.zip')
+    added = 0
+    cache_hits_before = pdf_renderer.metrics['cache_hits']
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for property_id, pdf_bytes in pdf_renderer.render_many(items, base_url=host_url):
+            zip_file.writestr(f'property_{property_id}.pdf', pdf_bytes)
+            added += 1
+            job.progress(
+                stage='processing',
+                progress=int((added / total_properties) * 85),  # 15% на упаковку
+                current=added,
+                total=total_properties,
+                message=f'Создаю PDF для квартиры {added} из {total_properties}...'
+            )
+        job.progress(stage='completing', progress=95, message='Создаю архив...')
+
+    return {
+        'file_path': zip_path,
+        'download_name': f'presentation_{presentation.title.replace(" ", "_")}_all_properties.zip',
+        'files': added,
+        'total': total_properties,
+        'cached_pdfs': pdf_renderer.metrics['cache_hits'] - cache_hits_before,
+    }
+
+
+def _enqueue_presentation_zip(presentation):
+    return job_queue.enqueue(
+        'presentation_zip',
+        {'presentation_id': presentation.id, 'host_url': request.host_url},
+        dedupe_key=_presentation_zip_key(presentation.id),
+        max_attempts=2,
+    )
+
+
+def _send_presentation_zip(job, presentation):
+    """Отдает ZIP завершенной задачи, если она относится к этой презентации"""
+    if (not job or job.dedupe_key != _presentation_zip_key(presentation.id)
+            or job.status != job_queue.JOB_COMPLETED):
+        return None
+    result = job.result_data
+    file_path = result.get('file_path')
+    if not file_path or not os.path.exists(file_path):
+        return None
+    return send_file(
+        os.path.abspath(file_path),
+        as_attachment=True,
+        download_name=result.get('download_name') or f'presentation_{presentation.id}_all_properties.zip',
+        mimetype='application/zip'
+    )
+
+
+def _presentation_zip_job_json(job, download_url):
+    payload = {'success': True, 'job_id': job.id, 'status': job.status,
+               'progress': job.progress_data, 'status_url': url_for('api_job_status', job_id=job.id)}
+    if job.status == job_queue.JOB_COMPLETED:
+        payload['download_url'] = download_url
+    elif job.status == job_queue.JOB_FAILED:
+        payload.update(success=False, error=job.error)
+    return payload
+
+
+@app.route('/api/manager/presentation/<int:presentation_id>/download-all', methods=['GET', 'POST'])
 @manager_required
 def download_all_properties(presentation_id):
-    """Скачать все объекты презентации в ZIP архиве"""
+    """
+    Скачать все объекты презентации в ZIP архиве.
+    GET и POST ставят сборку в очередь и сразу отвечают 202 с job_id и status_url;
+    готовый архив отдается по download_url (download_presentation_zip).
+    """
     from models import Collection, CollectionProperty
-    from weasyprint import HTML, CSS
-    import zipfile
-    from io import BytesIO
-    import tempfile
-    
+
     try:
-        # Find presentation
         presentation = Collection.query.get_or_404(presentation_id)
-        
+
         # Check ownership
         manager_id = session.get('manager_id')
         if presentation.created_by_manager_id != manager_id:
             return jsonify({'success': False, 'error': 'Access denied'}), 403
-        
-        # Get all properties in presentation
-        properties = CollectionProperty.query.filter_by(
-            collection_id=presentation_id
-        ).all()
-        
-        print(f"DEBUG: Found {len(properties)} properties in presentation {presentation_id}")
-        for prop in properties:
-            print(f"DEBUG: Property ID: {prop.property_id}")
-        
-        if not properties:
+
+        if not CollectionProperty.query.filter_by(collection_id=presentation_id).count():
             return jsonify({'success': False, 'error': 'No properties in presentation'}), 400
-        
-        # Create ZIP archive
-        zip_buffer = BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for prop in properties:
-                # Get property details from database using raw SQL for compatibility
-                try:
-                    query = text("""
-                        SELECT 
-                            ep.inner_id AS id,
-                            CAST(ep.object_area AS FLOAT) AS area,
-                            CAST(ep.price AS INTEGER) AS price,
-                            CAST(ep.object_min_floor AS INTEGER) AS floor,
-                            CAST(ep.object_max_floor AS INTEGER) AS total_floors,
-                            CAST(ep.object_rooms AS INTEGER) AS rooms,
-                            'Квартира' AS property_type,
-                            ep.address_display_name AS address,
-                            ep.complex_name AS jk_name,
-                            ep.developer_name AS developer_name,
-                            NULL AS completion_date
-                        FROM excel_properties ep
-                        WHERE ep.inner_id = :prop_id
-                    """)
-                    
-                    # Convert property_id to int for inner_id lookup
-                    try:
-                        prop_id_int = int(prop.property_id)
-                    except ValueError:
-                        print(f"Invalid property ID format: {prop.property_id}")
-                        continue
-                        
-                    result = db.session.execute(query, {'prop_id': prop_id_int}).fetchone()
-                    
-                    if not result:
-                        print(f"Property {prop.property_id} not found in database")
-                        continue  # Skip if property not found
-                        
-                    # Convert row to object and compute safe values
-                    from types import SimpleNamespace
-                    row_dict = dict(result._mapping)
-                    
-                    # Ensure safe types and compute price per sqm
-                    row_dict['price'] = int(row_dict['price'] or 0)
-                    row_dict['area'] = float(row_dict['area'] or 0)
-                    row_dict['rooms'] = int(row_dict['rooms'] or 0)
-                    
-                    # Compute price per sqm safely
-                    if row_dict['area'] and row_dict['area'] > 0:
-                        row_dict['price_per_sqm'] = int(row_dict['price'] / row_dict['area'])
-                    else:
-                        row_dict['price_per_sqm'] = 0
-                        
-                    property_item = SimpleNamespace(**row_dict)
-                    property_data = [property_item]
-                except Exception as e:
-                    print(f"Database error for property {prop.property_id}: {e}")
-                    continue
-                
-                if property_data:
-                    property_item = property_data[0]
-                    
-                    # Use fetch_pdf_context to get all necessary data
-                    context = fetch_pdf_context(prop.property_id, presentation_id)
-                    if not context:
-                        print(f"Failed to get context for property {prop.property_id}")
-                        continue
-                    
-                    # Generate HTML for PDF with complete context
-                    html_content = render_template('print_property.html', 
-                                                 property=context['property'],
-                                                 property_images=context['property_images'],
-                                                 complex=context['complex'],
-                                                 complex_images=context['complex_images'],
-                                                 manager=context['manager'],
-                                                 presentation=presentation,
-                                                 manager_note=getattr(prop, 'manager_note', None),
-                                                 context=context,
-                                                 for_pdf=True)
-                    
-                    # Generate PDF
-                    pdf_buffer = BytesIO()
-                    HTML(string=html_content, base_url=request.host_url).write_pdf(pdf_buffer)
-                    
-                    # Add to ZIP
-                    filename = f'property_{prop.property_id}.pdf'
-                    zip_file.writestr(filename, pdf_buffer.getvalue())
-                    print(f"DEBUG: Added {filename} to ZIP (size: {len(pdf_buffer.getvalue())} bytes)")
-        
-        zip_buffer.seek(0)
-        print(f"DEBUG: ZIP created with total size: {len(zip_buffer.getvalue())} bytes")
-        
-        return send_file(
-            zip_buffer,
-            as_attachment=True,
-            download_name=f'presentation_{presentation_id}_all_properties.zip',
-            mimetype='application/zip'
-        )
-        
+
+        # Ожидание готового архива держало бы sync-воркер gunicorn; клиент опрашивает status_url
+        job = _enqueue_presentation_zip(presentation)
+        download_url = url_for('download_presentation_zip', presentation_id=presentation_id, job_id=job.id)
+        return jsonify(_presentation_zip_job_json(job, download_url)), 202
+
     except Exception as e:
         print(f"Error creating ZIP: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+
+@app.route('/api/manager/presentation/<int:presentation_id>/download-all/<int:job_id>')
+@manager_required
+def download_presentation_zip(presentation_id, job_id):
+    """Готовый ZIP из задачи presentation_zip"""
+    from models import Collection
+
+    presentation = Collection.query.get_or_404(presentation_id)
+    if presentation.created_by_manager_id != session.get('manager_id'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    response = _send_presentation_zip(job_queue.get_job(job_id), presentation)
+    if not response:
+        return jsonify({'success': False, 'error': 'Архив не готов или устарел'}), 404
+    return response
+
+
+def _public_presentation(unique_id):
+    from models import Collection
+    return Collection.query.filter_by(
+        unique_url=unique_id,
+        collection_type='presentation'
+    ).first()
+
+
 @app.route('/presentation/view/<string:unique_id>/download-all')
 def download_all_properties_public(unique_id):
-    """Публичное скачивание всех объектов презентации в ZIP архиве"""
-    from models import Collection, CollectionProperty
-    from weasyprint import HTML, CSS
-    import zipfile
-    from io import BytesIO
-    import tempfile
-    
+    """
+    Публичное скачивание всех объектов презентации: ставит сборку ZIP в
+    очередь, прогресс идет через /progress, а по готовности страница
+    загружает файл по download_url из последнего события.
+    """
+    from models import CollectionProperty
+
     try:
-        # Find presentation by unique_id instead of presentation_id
-        presentation = Collection.query.filter_by(
-            unique_url=unique_id,
-            collection_type='presentation'
-        ).first()
-        
+        presentation = _public_presentation(unique_id)
         if not presentation:
             return "Презентация не найдена", 404
-        
-        # Get all properties in presentation
-        properties = CollectionProperty.query.filter_by(
-            collection_id=presentation.id
-        ).all()
-        
-        print(f"DEBUG: Found {len(properties)} properties in presentation {presentation.id}")
-        for prop in properties:
-            print(f"DEBUG: Property ID: {prop.property_id}")
-        
-        if not properties:
+
+        if not CollectionProperty.query.filter_by(collection_id=presentation.id).count():
             return "Нет объектов в презентации", 400
-        
-        # Initialize progress tracking
-        progress_key = f"presentation_{unique_id}"
-        total_properties = len(properties)
-        
-        # Create ZIP archive with real progress tracking
-        zip_buffer = BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for current_index, prop in enumerate(properties, 1):
-                # Update progress
-                progress = int((current_index / total_properties) * 85)  # Leave 15% for ZIP creation
-                progress_storage[progress_key] = {
-                    'stage': 'processing',
-                    'progress': progress,
-                    'current': current_index,
-                    'total': total_properties,
-                    'message': f'Создаю PDF для квартиры {current_index} из {total_properties}...'
-                }
-                
-                # Get property details from database using raw SQL for compatibility
-                try:
-                    query = text("""
-                        SELECT 
-                            ep.inner_id AS id,
-                            CAST(ep.object_area AS FLOAT) AS area,
-                            CAST(ep.price AS INTEGER) AS price,
-                            CAST(ep.object_min_floor AS INTEGER) AS floor,
-                            CAST(ep.object_max_floor AS INTEGER) AS total_floors,
-                            CAST(ep.object_rooms AS INTEGER) AS rooms,
-                            'Квартира' AS property_type,
-                            ep.address_display_name AS address,
-                            ep.complex_name AS jk_name,
-                            ep.developer_name AS developer_name,
-                            NULL AS completion_date
-                        FROM excel_properties ep
-                        WHERE ep.inner_id = :prop_id
-                    """)
-                    
-                    # Convert property_id to int for inner_id lookup
-                    try:
-                        prop_id_int = int(prop.property_id)
-                    except ValueError:
-                        print(f"Invalid property ID format: {prop.property_id}")
-                        continue
-                        
-                    result = db.session.execute(query, {'prop_id': prop_id_int}).fetchone()
-                    
-                    if not result:
-                        print(f"Property {prop.property_id} not found in database")
-                        continue  # Skip if property not found
-                        
-                    # Convert row to object and compute safe values
-                    from types import SimpleNamespace
-                    row_dict = dict(result._mapping)
-                    
-                    # Ensure safe types and compute price per sqm
-                    row_dict['price'] = int(row_dict['price'] or 0)
-                    row_dict['area'] = float(row_dict['area'] or 0)
-                    row_dict['rooms'] = int(row_dict['rooms'] or 0)
-                    
-                    # Compute price per sqm safely
-                    if row_dict['area'] and row_dict['area'] > 0:
-                        row_dict['price_per_sqm'] = int(row_dict['price'] / row_dict['area'])
-                    else:
-                        row_dict['price_per_sqm'] = 0
-                        
-                    property_item = SimpleNamespace(**row_dict)
-                    property_data = [property_item]
-                except Exception as e:
-                    print(f"Database error for property {prop.property_id}: {e}")
-                    continue
-                
-                if property_data:
-                    property_item = property_data[0]
-                    
-                    # Use fetch_pdf_context to get all necessary data
-                    context = fetch_pdf_context(prop.property_id, presentation.id)
-                    if not context:
-                        print(f"Failed to get context for property {prop.property_id}")
-                        continue
-                    
-                    # Generate HTML for PDF with complete context
-                    html_content = render_template('print_property.html', 
-                                                 property=context['property'],
-                                                 property_images=context['property_images'],
-                                                 complex=context['complex'],
-                                                 complex_images=context['complex_images'],
-                                                 manager=context['manager'],
-                                                 presentation=presentation,
-                                                 manager_note=getattr(prop, 'manager_note', None),
-                                                 context=context,
-                                                 for_pdf=True)
-                    
-                    # Generate PDF
-                    pdf_buffer = BytesIO()
-                    HTML(string=html_content, base_url=request.host_url).write_pdf(pdf_buffer)
-                    
-                    # Add to ZIP
-                    filename = f'property_{prop.property_id}.pdf'
-                    zip_file.writestr(filename, pdf_buffer.getvalue())
-                    print(f"DEBUG: Added {filename} to ZIP (size: {len(pdf_buffer.getvalue())} bytes)")
-        
-        # Final progress - creating archive
-        progress_storage[progress_key] = {
-            'stage': 'completing',
-            'progress': 95,
-            'message': 'Создаю архив...'
-        }
-        
-        zip_buffer.seek(0)
-        print(f"DEBUG: ZIP created with total size: {len(zip_buffer.getvalue())} bytes")
-        
-        # Mark as complete
-        progress_storage[progress_key] = {
-            'stage': 'complete',
-            'progress': 100,
-            'message': 'Готово! Скачивание началось.'
-        }
-        
-        return send_file(
-            zip_buffer,
-            as_attachment=True,
-            download_name=f'presentation_{presentation.title.replace(" ", "_")}_all_properties.zip',
-            mimetype='application/zip'
-        )
-        
+
+        job = _enqueue_presentation_zip(presentation)
+        return jsonify({'success': True, 'job_id': job.id, 'status': job.status}), 202
+
     except Exception as e:
         print(f"Error creating ZIP: {e}")
-        
-        # Update progress with error
-        progress_key = f"presentation_{unique_id}"
-        progress_storage[progress_key] = {
-            'stage': 'error',
-            'progress': 0,
-            'message': f'Ошибка при создании архива: {str(e)}'
-        }
-        
         return f"Ошибка при создании архива: {str(e)}", 500
 
-# Global progress storage for tracking real-time PDF generation
-progress_storage = {}
+
+@app.route('/presentation/view/<string:unique_id>/download-all/<int:job_id>')
+def download_presentation_zip_public(unique_id, job_id):
+    """Готовый ZIP публичной презентации"""
+    presentation = _public_presentation(unique_id)
+    if not presentation:
+        return "Презентация не найдена", 404
+    response = _send_presentation_zip(job_queue.get_job(job_id), presentation)
+    if not response:
+        return "Архив не готов или устарел", 404
+    return response
+
 
 @app.route('/presentation/view/<string:unique_id>/progress')
 def download_progress_stream(unique_id):
-    """SSE endpoint для отслеживания реального прогресса создания PDF файлов"""
-    from flask import Response
+    """SSE endpoint для отслеживания прогресса сборки ZIP (читает строку задачи в БД)"""
+    from flask import Response, stream_with_context
     import json
     import time
-    from models import Collection, CollectionProperty
-    
+    from models import CollectionProperty
+
+    sse_headers = {
+        'Cache-Control': 'no-cache, no-store, must-revalidate',
+        'Connection': 'keep-alive',
+        'X-Accel-Buffering': 'no'
+    }
+
+    def single_event(payload):
+        def stream():
+            yield f"data: {json.dumps(payload)}\n\n"
+        return Response(stream(), content_type='text/event-stream', headers=sse_headers)
+
     try:
-        # Find presentation by unique_id
-        presentation = Collection.query.filter_by(
-            unique_url=unique_id,
-            collection_type='presentation'
-        ).first()
-        
+        presentation = _public_presentation(unique_id)
         if not presentation:
-            def error_stream():
-                yield f"data: {json.dumps({'error': 'Презентация не найдена'})}\n\n"
-            return Response(
-                error_stream(),
-                content_type='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache, no-store, must-revalidate',
-                    'Connection': 'keep-alive',
-                    'X-Accel-Buffering': 'no'
-                }
-            )
-        
-        # Get properties count
-        properties = CollectionProperty.query.filter_by(
-            collection_id=presentation.id
-        ).all()
-        
-        if not properties:
-            def error_stream():
-                yield f"data: {json.dumps({'error': 'Нет объектов в презентации'})}\n\n"
-            return Response(
-                error_stream(),
-                content_type='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache, no-store, must-revalidate',
-                    'Connection': 'keep-alive',
-                    'X-Accel-Buffering': 'no'
-                }
-            )
-            
+            return single_event({'error': 'Презентация не найдена'})
+
+        total = CollectionProperty.query.filter_by(collection_id=presentation.id).count()
+        if not total:
+            return single_event({'error': 'Нет объектов в презентации'})
+
+        progress_key = _presentation_zip_key(presentation.id)
+        # job_id из ответа download-all: иначе можно увидеть прошлую, уже готовую задачу
+        # раньше, чем закоммитится новая
+        job_id = request.args.get('job_id', type=int)
+
         def progress_generator():
             try:
-                total = len(properties)
-                progress_key = f"presentation_{unique_id}"
-                
-                # Initialize progress
-                progress_storage[progress_key] = {
-                    'stage': 'starting',
-                    'progress': 0,
-                    'current': 0,
-                    'total': total,
-                    'message': 'Начинаю создание PDF файлов...'
-                }
-                
-                # Начальное сообщение
-                yield f"data: {json.dumps(progress_storage[progress_key])}\n\n"
-                time.sleep(1)
-                
-                # Wait for real progress updates from download endpoint
-                last_progress = 0
-                timeout_counter = 0
-                
-                while True:
-                    if progress_key in progress_storage:
-                        current_progress = progress_storage[progress_key]
-                        
-                        # Only send updates when progress changes
-                        if current_progress['progress'] != last_progress or current_progress['stage'] != 'processing':
-                            yield f"data: {json.dumps(current_progress)}\n\n"
-                            last_progress = current_progress['progress']
-                        
-                        # Check if completed
-                        if current_progress['stage'] == 'complete':
-                            break
-                            
-                        # Check if error occurred
-                        if current_progress['stage'] == 'error':
-                            break
-                    
-                    time.sleep(0.5)
-                    timeout_counter += 1
-                    
-                    # Timeout after 2 minutes
-                    if timeout_counter > 240:
-                        progress_storage[progress_key] = {
-                            'stage': 'error',
-                            'message': 'Превышено время ожидания',
-                            'progress': 0
+                yield f"data: {json.dumps({'stage': 'starting', 'progress': 0, 'current': 0, 'total': total, 'message': 'Начинаю создание PDF файлов...'})}\n\n"
+
+                last_event = None
+                # Ждем не больше 10 минут: задача живет в БД и переживает перезапуск воркера
+                for _ in range(1200):
+                    db.session.expire_all()
+                    if job_id:
+                        job = job_queue.get_job(job_id)
+                        if job and job.dedupe_key != progress_key:
+                            job = None
+                    else:
+                        job = job_queue.latest_job(progress_key)
+                    event = None
+                    if job_id and not job:
+                        event = {'stage': 'error', 'progress': 0, 'message': 'Задача создания архива не найдена'}
+                    elif job and job.status == job_queue.JOB_COMPLETED:
+                        event = {
+                            'stage': 'complete',
+                            'progress': 100,
+                            'message': 'Готово! Скачивание началось.',
+                            'download_url': url_for('download_presentation_zip_public',
+                                                    unique_id=unique_id, job_id=job.id),
                         }
-                        yield f"data: {json.dumps(progress_storage[progress_key])}\n\n"
+                    elif job and job.status == job_queue.JOB_FAILED:
+                        event = {'stage': 'error', 'progress': 0,
+                                 'message': f'Ошибка при создании архива: {job.error}'}
+                    elif job and job.status == job_queue.JOB_RUNNING and job.progress_data:
+                        event = job.progress_data
+                    elif job:
+                        event = {'stage': 'starting', 'progress': 0, 'current': 0, 'total': total,
+                                 'message': 'Ожидаю очереди на создание PDF...'}
+
+                    if event and event != last_event:
+                        yield f"data: {json.dumps(event)}\n\n"
+                        last_event = event
+                    if event and event['stage'] in ('complete', 'error'):
                         break
-                
-                # Cleanup
-                if progress_key in progress_storage:
-                    del progress_storage[progress_key]
-                    
+                    db.session.remove()
+                    time.sleep(0.5)
+                else:
+                    yield f"data: {json.dumps({'stage': 'error', 'message': 'Превышено время ожидания', 'progress': 0})}\n\n"
+
             except Exception as e:
                 yield f"data: {json.dumps({'error': f'Ошибка: {str(e)}'})}\n\n"
-        
+
         return Response(
-            progress_generator(),
+            stream_with_context(progress_generator()),
             content_type='text/event-stream',
             headers={
                 'Cache-Control': 'no-cache, no-store, must-revalidate',
@@ -15454,7 +14999,7 @@ def download_progress_stream(unique_id):
                 'Content-Type': 'text/event-stream; charset=utf-8'
             }
         )
-        
+
     except Exception as e:
         def error_stream():
             yield f"data: {json.dumps({'error': f'Ошибка сервера: {str(e)}'})}\n\n"
@@ -16229,14 +15774,14 @@ def api_user_get_recommendations():
     from datetime import datetime
     
     try:
-        print(f"DEBUG: Loading recommendations for user ID: {current_user.id}")
+        app.logger.debug("Loading recommendations for user ID: %s", current_user.id)
         
         # Get traditional recommendations
         recommendations = Recommendation.query.filter_by(
             client_id=current_user.id
         ).order_by(Recommendation.sent_at.desc()).all()
         
-        print(f"DEBUG: Found {len(recommendations)} recommendations for user {current_user.id}")
+        app.logger.debug("Found %s recommendations for user %s", len(recommendations), current_user.id)
         
         recommendations_data = []
         for rec in recommendations:
@@ -17767,8 +17312,8 @@ def admin_create_blog_post():
         category.articles_count = BlogPost.query.filter_by(category=category.name, status='published').count()
         db.session.commit()
         
-        print(f'DEBUG: Created article "{title}" in category "{category.name}" with status "{status}"')
-        print(f'DEBUG: Updated category "{category.name}" article count to {category.articles_count}')
+        app.logger.debug('Created article "%s" in category "%s" with status "%s"', title, category.name, status)
+        app.logger.debug('Updated category "%s" article count to %s', category.name, category.articles_count)
         
         flash('Статья успешно создана!', 'success')
         return redirect(url_for('admin_blog_management'))
@@ -18730,6 +18275,10 @@ try:
 except Exception as e:
     print(f"Warning: Could not register notification settings blueprint: {e}")
 
+# Comparison API (user and manager) lives in its own blueprint module
+from comparison_api import comparison_bp
+app.register_blueprint(comparison_bp)
+
 # Smart Search API Endpoints
 @app.route('/api/smart-search')
 def smart_search_api():
@@ -18740,19 +18289,20 @@ def smart_search_api():
         return jsonify({'results': [], 'criteria': {}, 'suggestions': []})
     
     try:
-        # Анализируем запрос с помощью OpenAI
+        # Разбираем запрос правилами (GPT — только при SMART_SEARCH_USE_LLM=1)
         criteria = smart_search.analyze_search_query(query)
         # Search criteria processed
         
         # Получаем свойства и применяем фильтры
         properties = load_properties()
-        # Применяем базовые фильтры на основе критериев
-        filtered_properties = apply_smart_filters(properties, criteria)
+        # Особенностей ("у парка", "балкон") нет в колонках снимка — они участвуют
+        # в семантическом ранжировании, а не отсекают все квартиры
+        filtered_properties = apply_smart_filters(properties, dict(criteria, features=[]))
         
-        # Применяем семантический поиск если нужно
+        # Ранжируем по близости эмбеддингов, если запрос описательный
         if criteria.get('semantic_search') or criteria.get('features'):
             filtered_properties = smart_search.semantic_property_search(
-                filtered_properties, query, criteria
+                filtered_properties, query, criteria, get_embedding_index()
             )
         
         # Подготавливаем результаты
@@ -18785,8 +18335,7 @@ def smart_search_api():
         return jsonify({'results': [], 'error': str(e)})
 
 @app.route('/api/search-suggestions')
-# ❌ КЭШ ОТКЛЮЧЁН для отладки типов квартир
-# @cache.memoize(timeout=300)
+# Без кэша ответов: подсказки отдает индекс в памяти (suggestion_index), запросов к БД нет
 def search_suggestions_api():
     """Супер-быстрый API для автодополнения поиска с типами квартир"""
     query = request.args.get('q', '').strip()
@@ -18838,7 +18387,7 @@ def search_suggestions_fallback(query):
         return jsonify({'suggestions': [], 'error': str(e)})
 
 @app.route('/api/super-search')
-@cache.memoize(timeout=180)  # Кэш на 3 минуты
+@cache.cached(timeout=180, namespace='super_search', stale_ttl=60)
 def super_search_api():
     """Новый супер-быстрый поиск недвижимости"""
     query = request.args.get('q', '').strip()
@@ -18848,11 +18397,31 @@ def super_search_api():
     try:
         from performance_search import super_search
         results = super_search.search_properties(query, limit=50)
-        return jsonify(results)
+        # Ответ с ошибкой — 500, чтобы cache.cached не закрепил пустую выдачу
+        return jsonify(results), 500 if results.get('error') else 200
         
     except Exception as e:
         print(f"Super search error: {e}")
-        return jsonify({'results': [], 'total': 0, 'error': str(e)})
+        return jsonify({'results': [], 'total': 0, 'error': str(e)}), 500
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Метрики процесса в текстовом формате Prometheus. Доступ — по METRICS_TOKEN
+    (заголовок Authorization: Bearer или ?token=) или из сессии админа;
+    без токена в окружении метрики видит только админ.
+    """
+    import hmac
+    from flask import Response
+
+    token = os.environ.get('METRICS_TOKEN')
+    provided = request.headers.get('Authorization', '').removeprefix('Bearer ').strip() or request.args.get('token', '')
+    token_ok = bool(token) and hmac.compare_digest(provided, token)
+    if not token_ok and not (session.get('is_admin') and session.get('admin_id')):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(request_metrics.render_prometheus(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8',
+                    headers={'Cache-Control': 'no-store'})
 
 @app.route('/api/metrics', methods=['POST'])
 def collect_metrics():
@@ -18862,22 +18431,23 @@ def collect_metrics():
         if not data:
             return jsonify({'status': 'error', 'message': 'No data provided'}), 400
         
-        # Логируем важные метрики
+        # Замеры браузера попадают в inback_client_duration_seconds на /metrics
         metric_type = data.get('type', 'unknown')
         
         if metric_type == 'page_load':
             duration = data.get('duration', 0)
-            url = data.get('url', 'unknown')
-            print(f"⚡ Page Load: {url} in {round(duration)}ms")
-        
         elif metric_type == 'search_performance':
-            query = data.get('query', '')
-            response_time = data.get('response_time', 0)
-            results_count = data.get('results_count', 0)
-            print(f"🔍 Search: '{query}' - {round(response_time)}ms, {results_count} results")
+            duration = data.get('response_time', 0)
+        else:
+            return jsonify({'status': 'ignored'})
         
-        # В реальном приложении здесь бы была запись в базу данных
-        # для аналитики производительности
+        try:
+            duration_ms = float(duration)
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'Invalid duration'}), 400
+        # Отсекаем мусор, чтобы один клиент не испортил гистограмму
+        if 0 <= duration_ms <= 600000:
+            request_metrics.observe_client(metric_type, duration_ms / 1000)
         
         return jsonify({'status': 'success'})
         
@@ -18902,17 +18472,31 @@ def smart_suggestions_api():
 
 def apply_smart_filters(properties, criteria):
     """Применяет умные фильтры на основе критериев OpenAI"""
-    filtered = properties.copy()
+    index = get_property_index(properties)
+    mask = index.all_mask()
     
-    # Фильтр по комнатам
+    # Фильтр по комнатам (числа строками, студия = "0")
     if criteria.get('rooms'):
-        rooms_list = criteria['rooms']
-        filtered = [p for p in filtered if str(p.get('rooms', '')) in rooms_list]
+        rooms_list = [room for room in criteria['rooms'] if isinstance(room, str) and room.isdigit()]
+        mask &= index.rooms_mask(rooms_list)
     
     # Фильтр по району
     if criteria.get('district'):
-        district = criteria['district']
-        filtered = [p for p in filtered if p.get('district', '') == district]
+        mask &= index.category_mask('district', [criteria['district']])
+    
+    # Без ключевых слов и особенностей цена тоже фильтруется по колонкам;
+    # иначе ее нужно применять после отбора "дорого/недорого"
+    text_filters = criteria.get('keywords') or criteria.get('features')
+    if not text_filters and criteria.get('price_range'):
+        price_range = criteria['price_range']
+        if len(price_range) >= 1 and price_range[0]:
+            mask &= index.range_mask('price', minimum=price_range[0])
+        if len(price_range) >= 2 and price_range[1]:
+            mask &= index.range_mask('price', maximum=price_range[1])
+    
+    filtered = index.materialize(index.select(mask))
+    if not text_filters:
+        return filtered
     
     # Фильтр по ключевым словам (типы недвижимости, классы, материалы)
     if criteria.get('keywords'):
@@ -19023,27 +18607,27 @@ def manager_add_client():
     import re
     
     manager_id = session.get('manager_id')
-    print(f"DEBUG: Add client endpoint called by manager {manager_id}")
-    print(f"DEBUG: Request method: {request.method}, Content-Type: {request.content_type}")
-    print(f"DEBUG: Request is_json: {request.is_json}")
+    app.logger.debug("Add client endpoint called by manager %s", manager_id)
+    app.logger.debug("Request method: %s, Content-Type: %s", request.method, request.content_type)
+    app.logger.debug("Request is_json: %s", request.is_json)
     
     try:
         # Accept both JSON and form data
         if request.is_json:
             data = request.get_json()
-            print(f"DEBUG: Received JSON data: {data}")
+            app.logger.debug("Received JSON data: %s", data)
             full_name = data.get('full_name', '').strip()
             email = data.get('email', '').strip().lower()
             phone = data.get('phone', '').strip() if data.get('phone') else None
             is_active = data.get('is_active', True)
         else:
-            print(f"DEBUG: Received form data: {dict(request.form)}")
+            app.logger.debug("Received form data: %s", dict(request.form))
             full_name = request.form.get('full_name', '').strip()
             email = request.form.get('email', '').strip().lower()
             phone = request.form.get('phone', '').strip() if request.form.get('phone') else None
             is_active = 'is_active' in request.form
         
-        print(f"DEBUG: Parsed data - name: {full_name}, email: {email}, phone: {phone}, active: {is_active}")
+        app.logger.debug("Parsed data - name: %s, email: %s, phone: %s, active: %s", full_name, email, phone, is_active)
         
         # Validation
         if not full_name or len(full_name) < 2:
@@ -19086,7 +18670,7 @@ def manager_add_client():
         db.session.add(user)
         db.session.commit()
         
-        print(f"DEBUG: Successfully created client {user.id}: {user.full_name}")
+        app.logger.debug("Successfully created client %s: %s", user.id, user.full_name)
         
         # Send welcome email and SMS with credentials
         try:
@@ -19120,7 +18704,7 @@ def manager_add_client():
                 content=email_content,
                 template_name='notification'
             )
-            print(f"DEBUG: Welcome email with credentials sent to {email}")
+            app.logger.debug("Welcome email with credentials sent to %s", email)
             
             # Send SMS if phone number provided
             if phone:
@@ -19136,15 +18720,15 @@ def manager_add_client():
                     )
                     
                     if sms_sent:
-                        print(f"DEBUG: SMS sent successfully to {phone}")
+                        app.logger.debug("SMS sent successfully to %s", phone)
                     else:
-                        print(f"DEBUG: SMS sending failed for {phone}")
+                        app.logger.debug("SMS sending failed for %s", phone)
                     
                 except Exception as sms_e:
-                    print(f"DEBUG: Failed to send SMS: {sms_e}")
+                    app.logger.debug("Failed to send SMS: %s", sms_e)
                     
         except Exception as e:
-            print(f"DEBUG: Failed to send welcome email: {e}")
+            app.logger.debug("Failed to send welcome email: %s", e)
         
         return jsonify({
             'success': True, 
@@ -19174,14 +18758,14 @@ def manager_get_client(client_id):
     
     try:
         manager_id = session.get('manager_id')
-        print(f"DEBUG: Get client {client_id}, manager_id: {manager_id}")
+        app.logger.debug("Get client %s, manager_id: %s", client_id, manager_id)
         
         # Try to find client assigned to this manager first, then any buyer
         client = User.query.filter_by(id=client_id, assigned_manager_id=manager_id).first()
         if not client:
             client = User.query.filter_by(id=client_id, role='buyer').first()
         
-        print(f"DEBUG: Found client: {client}")
+        app.logger.debug("Found client: %s", client)
         
         if not client:
             return jsonify({'success': False, 'error': 'Клиент не найден'}), 404
@@ -19194,11 +18778,11 @@ def manager_get_client(client_id):
             'phone': client.phone or '',
             'is_active': client.is_active if hasattr(client, 'is_active') else True
         }
-        print(f"DEBUG: Returning client data: {response_data}")
+        app.logger.debug("Returning client data: %s", response_data)
         return jsonify(response_data)
         
     except Exception as e:
-        print(f"DEBUG: Exception in get_client: {str(e)}")
+        app.logger.debug("Exception in get_client: %s", str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/manager/edit-client', methods=['POST'])
@@ -19657,6 +19241,52 @@ def view_scraped_file(filename):
             'message': f'Ошибка при чтении файла: {str(e)}'
         }), 500
 
+@job_queue.register('excel_import', concurrency=1)
+def run_excel_import_job(job):
+    """Импорт загруженного Excel-файла с прогрессом по порциям"""
+    def report_progress(progress):
+        # Реальный прогресс по порциям: строки, проценты, скорость
+        job.progress(message=(
+            f"Обработано {progress['processed']}"
+            + (f" из {progress['total']}" if progress.get('total') else '')
+            + f" строк ({progress['rows_per_sec']} строк/сек)"
+        ), **progress)
+
+    result = import_excel_to_database(job.payload['file_path'], progress_callback=report_progress)
+    if not result.get('success'):
+        raise Exception(result.get('message'))
+    return result
+
+
+@job_queue.register('saved_search_sweep', concurrency=1, every=6 * 3600)
+def run_saved_search_sweep_job(job):
+    """Рассылка новых объектов по сохраненным поискам"""
+    from saved_search_notifications import check_saved_search_results
+    return {'notifications_sent': check_saved_search_results()}
+
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job_status(job_id):
+    """
+    Статус фоновой задачи. Админ видит любые задачи, менеджер — только сборку ZIP
+    своих презентаций (результаты импорта Excel и прочие задачи ему не отдаются).
+    """
+    from models import Collection
+
+    if not session.get('admin_id') and not session.get('manager_id'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    status = job_queue.job_status(job_id)
+    if status and not session.get('admin_id'):
+        presentation_id = job_queue.get_job(job_id).payload_data.get('presentation_id')
+        presentation = Collection.query.get(presentation_id) if presentation_id else None
+        if (status['kind'] != 'presentation_zip' or presentation is None
+                or presentation.created_by_manager_id != session.get('manager_id')):
+            status = None
+    if not status:
+        return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+    return jsonify({'success': True, 'job': status})
+
+
 @app.route('/admin/upload-excel', methods=['POST'])
 def admin_upload_excel():
     """Handle Excel file upload from admin panel"""
@@ -19686,64 +19316,18 @@ def admin_upload_excel():
         # Save the file
         file.save(file_path)
         
-        # Запуск импорта в фоновом процессе для больших файлов
+        # Импорт выполняет воркер очереди задач; статус хранится в БД и виден всем процессам
         try:
-            import threading
-            import time
-            
-            # Создаем уникальный ID задачи
-            task_id = unique_filename.replace('.', '_')
-            
-            # Статус импорта (будем хранить в глобальной переменной)
-            global import_status
-            if 'import_status' not in globals():
-                import_status = {}
-            
-            import_status[task_id] = {
-                'status': 'processing',
-                'progress': 0,
-                'message': 'Обработка файла...',
-                'started_at': time.time()
-            }
-            
-            def background_import():
-                try:
-                    with app.app_context():
-                        result = import_excel_to_database(file_path)
-                    
-                    # Обновляем статус при успехе
-                    import_status[task_id] = {
-                        'status': 'completed',
-                        'progress': 100,
-                        'message': f'✅ {result["message"]} Импортировано: {result["imported"]} записей.',
-                        'result': result,
-                        'completed_at': time.time()
-                    }
-                    
-                    # Очищаем кеш
-                    global _properties_cache, _cache_timestamp
-                    _properties_cache = None
-                    _cache_timestamp = None
-                    
-                except Exception as import_error:
-                    # Обновляем статус при ошибке
-                    import_status[task_id] = {
-                        'status': 'error',
-                        'progress': 0,
-                        'message': f'❌ Ошибка импорта: {str(import_error)}',
-                        'error': str(import_error),
-                        'failed_at': time.time()
-                    }
-            
-            # Запускаем импорт в отдельном потоке
-            thread = threading.Thread(target=background_import, daemon=True)
-            thread.start()
+            job = job_queue.enqueue('excel_import', {
+                'file_path': file_path,
+                'filename': file.filename,
+            }, max_attempts=2)
             
             # Сразу возвращаем ответ о начале обработки
             return jsonify({
                 'success': True,
                 'message': f'📤 Файл загружен! Обработка запущена в фоне. Проверьте статус через несколько минут.',
-                'task_id': task_id,
+                'task_id': str(job.id),
                 'background': True
             })
             
@@ -19758,24 +19342,50 @@ def admin_upload_excel():
 
 @app.route('/admin/check-import-status/<task_id>')
 def admin_check_import_status(task_id):
-    """Проверка статуса фонового импорта"""
+    """Проверка статуса фонового импорта (строка задачи excel_import)"""
     try:
-        global import_status
-        if 'import_status' not in globals():
-            import_status = {}
-        
-        if task_id not in import_status:
+        job = job_queue.get_job(int(task_id)) if task_id.isdigit() else None
+        if job:
+            db.session.refresh(job)
+        if not job or job.kind != 'excel_import':
             return jsonify({
                 'success': False,
                 'error': 'Задача не найдена'
             })
         
-        status_info = import_status[task_id]
+        progress = job.progress_data
+        result = job.result_data
+        status_info = dict(progress, progress=progress.get('progress', 0), attempts=job.attempts)
+        
+        if job.status == job_queue.JOB_COMPLETED:
+            status_info.update({
+                'status': 'completed',
+                'progress': 100,
+                'message': f'✅ {result.get("message")} Импортировано: {result.get("imported")} записей.',
+                'result': result,
+            })
+        elif job.status == job_queue.JOB_FAILED:
+            status_info.update({
+                'status': 'error',
+                'message': f'❌ Ошибка импорта: {job.error}',
+                'error': job.error,
+            })
+        elif job.status == job_queue.JOB_QUEUED:
+            status_info.update({
+                'status': 'processing',
+                'message': (f'Повтор после ошибки: {job.error}' if job.error else 'Файл в очереди на обработку...'),
+            })
+        else:
+            status_info.update({
+                'status': 'processing',
+                'message': progress.get('message') or 'Обработка файла...',
+            })
         
         # Добавляем время обработки
-        import time
-        if 'started_at' in status_info:
-            elapsed = time.time() - status_info['started_at']
+        started_at = job.started_at or job.created_at
+        finished_at = job.finished_at or datetime.utcnow()
+        if started_at:
+            elapsed = (finished_at - started_at).total_seconds()
             status_info['elapsed_time'] = f"{elapsed:.1f} сек"
         
         return jsonify({
@@ -19963,205 +19573,25 @@ def update_properties_with_regions():
 
 # ================== EXCEL IMPORT FUNCTIONS ==================
 
-def import_excel_to_database(file_path):
+def import_excel_to_database(file_path, progress_callback=None):
     """
-    Максимально защищенная функция импорта Excel файла в базу данных
+    Потоковый импорт Excel файла в excel_properties (см. excel_import.ExcelImportPipeline).
+    progress_callback получает словарь с processed/total/progress/rows_per_sec после каждой порции.
     """
+    from excel_import import ExcelImportPipeline
+    
     try:
-        import pandas as pd
-        from models import Developer, ResidentialComplex, ExcelProperty
-        
-        # Безопасная инициализация сессии
-        try:
-            db.session.rollback()  # Очистка любых незавершенных транзакций
-        except Exception:
-            pass
-        
-        # Read Excel file
-        df = pd.read_excel(file_path)
-        
-        # Validate required columns
-        required_columns = ['developer_name', 'complex_name', 'inner_id', 'object_rooms', 'price']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            return {"success": False, "message": f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}", "imported": 0}
-        
-        imported_count = 0
-        developers_created = set()
-        complexes_created = set()
-        errors_count = 0
-        
-        for index, row in df.iterrows():
-            if errors_count > 50:  # Максимум 50 ошибок подряд
-                break
-                
-            try:
-                # Skip rows with missing required data
-                if pd.isna(row.get('inner_id')) or pd.isna(row.get('developer_name')) or pd.isna(row.get('complex_name')):
-                    continue
-                
-                # Безопасное извлечение данных с проверкой кодировки
-                try:
-                    developer_name = str(row['developer_name']).strip()
-                    complex_name = str(row['complex_name']).strip()
-                    
-                    # Проверка на корректность кодировки
-                    developer_name.encode('utf-8')
-                    complex_name.encode('utf-8')
-                except (UnicodeDecodeError, UnicodeEncodeError) as encode_error:
-                    print(f"❌ Ошибка кодировки на строке {index}: {encode_error}")
-                    continue
-                
-                # Поиск застройщика с полной защитой
-                developer = None
-                try:
-                    with db.session.no_autoflush:
-                        developer = Developer.query.filter_by(name=developer_name).first()
-                except Exception as dev_error:
-                    print(f"❌ Ошибка поиска застройщика на строке {index}: {dev_error}")
-                    errors_count += 1
-                    continue
-                
-                # Создание застройщика если не найден
-                if not developer:
-                    try:
-                        import re
-                        import time
-                        slug = re.sub(r'[^a-zA-Z0-9а-яА-Я\-]', '-', developer_name.lower()).strip('-')
-                        if not slug:
-                            slug = f"developer-{int(time.time())}-{len(developers_created)}"
-                        
-                        developer = Developer(
-                            name=developer_name,
-                            slug=slug,
-                            description=f"Автоматически созданный застройщик: {developer_name}",
-                            website="",
-                            phone="",
-                            email=""
-                        )
-                        db.session.add(developer)
-                        db.session.flush()
-                        developers_created.add(developer_name)
-                    except Exception as create_dev_error:
-                        print(f"❌ Ошибка создания застройщика на строке {index}: {create_dev_error}")
-                        errors_count += 1
-                        continue
-                
-                # Поиск ЖК с полной защитой
-                complex_obj = None
-                try:
-                    with db.session.no_autoflush:
-                        complex_obj = ResidentialComplex.query.filter_by(
-                            name=complex_name, 
-                            developer_id=developer.id
-                        ).first()
-                except Exception as complex_error:
-                    print(f"❌ Ошибка поиска ЖК на строке {index}: {complex_error}")
-                    errors_count += 1
-                    continue
-                
-                # Создание ЖК если не найден
-                if not complex_obj:
-                    try:
-                        import re
-                        import time
-                        complex_slug = re.sub(r'[^a-zA-Z0-9а-яА-Я\-]', '-', complex_name.lower()).strip('-')
-                        if not complex_slug:
-                            complex_slug = f"complex-{int(time.time())}-{len(complexes_created)}"
-                        
-                        # Безопасная проверка уникальности slug
-                        try:
-                            with db.session.no_autoflush:
-                                if ResidentialComplex.query.filter_by(slug=complex_slug).first():
-                                    complex_slug = f"{complex_slug}-{developer.id}-{int(time.time())}"
-                        except Exception:
-                            complex_slug = f"complex-{developer.id}-{int(time.time())}"
-                        
-                        complex_obj = ResidentialComplex(
-                            name=complex_name,
-                            slug=complex_slug,
-                            developer_id=developer.id,
-                            cashback_rate=5.0
-                        )
-                        db.session.add(complex_obj)
-                        db.session.flush()
-                        complexes_created.add(complex_name)
-                    except Exception as create_complex_error:
-                        print(f"❌ Ошибка создания ЖК на строке {index}: {create_complex_error}")
-                        errors_count += 1
-                        continue
-                
-                # Проверка существования объекта с полной защитой
-                try:
-                    with db.session.no_autoflush:
-                        existing_property = ExcelProperty.query.filter_by(
-                            inner_id=int(row['inner_id'])
-                        ).first()
-                except Exception as property_error:
-                    print(f"❌ Ошибка поиска свойства на строке {index}: {property_error}")
-                    errors_count += 1
-                    continue
-                
-                if existing_property:
-                    continue  # Skip duplicates
-                
-                # Create new property from all Excel columns
-                property_data = {}
-                for col in df.columns:
-                    value = row[col]
-                    if pd.notna(value):
-                        property_data[col] = value
-                
-                # Create ExcelProperty with all columns from Excel
-                excel_property = ExcelProperty()
-                excel_property.inner_id = int(row['inner_id'])
-                
-                # Map all Excel columns to model fields
-                for col in df.columns:
-                    value = row[col]
-                    if pd.notna(value) and hasattr(excel_property, col):
-                        setattr(excel_property, col, value)
-                
-                # 🎯 АВТОМАТИЧЕСКИЙ ПАРСИНГ АДРЕСОВ ДЛЯ ФИЛЬТРАЦИИ
-                if excel_property.address_display_name:
-                    parsed = parse_address_components(excel_property.address_display_name)
-                    excel_property.parsed_country = parsed['country']
-                    excel_property.parsed_region = parsed['region']
-                    excel_property.parsed_city = parsed['city']
-                    excel_property.parsed_district = parsed['district']
-                    excel_property.parsed_street = parsed['street']
-                    excel_property.parsed_house_number = parsed['house_number']
-                
-                db.session.add(excel_property)
-                imported_count += 1
-                
-                # Commit in batches to avoid memory issues
-                if imported_count % 50 == 0:
-                    db.session.commit()
-                    
-            except Exception as row_error:
-                import traceback
-                print(f"❌ Ошибка обработки строки {index}: {row_error}")
-                print(f"   Traceback: {traceback.format_exc()}")
-                continue
+        pipeline = ExcelImportPipeline(db, address_parser=parse_address_components,
+                                       progress_callback=progress_callback)
+        result = pipeline.run(file_path)
         
-        # Final commit
-        db.session.commit()
-        
-        message_parts = [f"Файл обработан успешно"]
-        if developers_created:
-            message_parts.append(f"Создано застройщиков: {len(developers_created)}")
-        if complexes_created:
-            message_parts.append(f"Создано ЖК: {len(complexes_created)}")
-            
-        return {
-            "success": True,
-            "imported": imported_count,
-            "message": ", ".join(message_parts),
-            "developers_created": len(developers_created),
-            "complexes_created": len(complexes_created)
-        }
+        if pipeline.imported:
+            # Новая версия данных: снимок квартир пересоберется во всех воркерах, агрегаты ЖК пересчитаются.
+            # И при прерванном импорте: записанные до остановки порции уже в базе
+            on_properties_imported(pipeline.imported_complexes)
+        if progress_callback and result.get('success'):
+            progress_callback(pipeline.progress(finished=True))
+        return result
         
     except Exception as e:
         db.session.rollback()
@@ -20219,8 +19649,12 @@ def admin_test_new_data():
 def admin_data_stats():
     """Get current data statistics"""
     try:
+        import sys
         from sqlalchemy import text
         
+        # Telegram bot runtime exists only in workers that received a webhook
+        telegram_bot = sys.modules.get('telegram_bot')
+        
         # Get current statistics
         stats = db.session.execute(text("""
             SELECT 
@@ -20236,12 +19670,29 @@ def admin_data_stats():
             WHERE table_name = 'excel_properties'
         """)).fetchone()[0]
         
+        from llm_cache import llm_cache
+        import outbox
+        from principal_cache import principal_cache
+
         return jsonify({
             'success': True,
             'properties': stats[0] if stats else 0,
             'complexes': stats[1] if stats else 0,
             'developers': stats[2] if stats else 0,
-            'columns': columns
+            'columns': columns,
+            'load_properties': LOAD_PROPERTIES_STATS,
+            'properties_cache': properties_snapshot.stats(),
+            'search_suggestions_cache': dict(search_suggestions_snapshot.stats(), index=get_suggestion_index().stats()),
+            'full_text_index': get_full_text_index().stats(),
+            'property_embeddings': dict(property_embeddings_snapshot.stats(), index=get_embedding_index().stats()),
+            'llm_cache': llm_cache.stats(),
+            'page_cache': page_cache.stats(),
+            'tiered_cache': cache.stats(),
+            'reference_data': reference_data.stats(),
+            'telegram_bot': telegram_bot.bot_runtime.stats() if telegram_bot else None,
+            'outbox': outbox.stats(),
+            'request_metrics': request_metrics.stats(),
+            'principal_cache': principal_cache.stats()
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -20329,6 +19780,7 @@ def import_domclick_to_database():
         
         # Импортируем квартиры в excel_properties
         apartments_created = 0
+        imported_complexes = set()
         for apt_data in data.get('apartments', []):
             # Проверяем, что квартира не существует
             existing_apt = ExcelProperty.query.filter_by(inner_id=apt_data['inner_id']).first()
@@ -20371,6 +19823,7 @@ def import_domclick_to_database():
             
             db.session.add(property_obj)
             apartments_created += 1
+            imported_complexes.add(apt_data['complex_name'])
             
             # Сохраняем по частям
             if apartments_created % 50 == 0:
@@ -20380,6 +19833,8 @@ def import_domclick_to_database():
         # Финальное сохранение
         db.session.commit()
         
+        on_properties_imported(imported_complexes)
+        
         print(f"✅ Импорт завершен:")
         print(f"   • Застройщиков: {developers_created}")
         print(f"   • ЖК: {complexes_created}")
@@ -20412,6 +19867,7 @@ def import_gpt_vision_data(excel_file):
         df = pd.read_excel(excel_file)
         
         apartments_created = 0
+        imported_complexes = set()
         complexes_created = 0
         developers_created = 0
         
@@ -20476,6 +19932,7 @@ def import_gpt_vision_data(excel_file):
                 
                 db.session.add(property_obj)
                 apartments_created += 1
+                imported_complexes.add(complex_name or 'Не указан')
                 
                 # Сохраняем по частям
                 if apartments_created % 20 == 0:
@@ -20489,6 +19946,8 @@ def import_gpt_vision_data(excel_file):
         # Финальное сохранение
         db.session.commit()
         
+        on_properties_imported(imported_complexes)
+        
         print(f"✅ GPT Vision импорт завершен:")
         print(f"   • Застройщиков: {developers_created}")
         print(f"   • ЖК: {complexes_created}")
@@ -21150,525 +20609,94 @@ def generate_comparison_pdf():
         return jsonify({'error': 'Ошибка при создании PDF'}), 500
 
 
-# Manager Comparison API Routes for Database Persistence
-@app.route('/api/manager/comparison/load', methods=['GET'])
-@manager_required
-def manager_load_comparison():
-    """Load manager's comparison from database"""
+@app.route('/api/admin/assign-client', methods=['POST'])
+@admin_required
+def admin_assign_client():
+    """Assign client to manager"""
     try:
-        from models import ManagerComparison, ComparisonProperty, ComparisonComplex
+        data = request.get_json()
+        client_id = data.get('client_id')
+        manager_id = data.get('manager_id')
         
-        manager_id = session.get('manager_id')
+        if not client_id:
+            return jsonify({'success': False, 'error': 'ID клиента обязателен'})
         
-        # Get or create active comparison for manager
-        comparison = ManagerComparison.query.filter_by(
-            manager_id=manager_id, 
-            is_active=True
-        ).first()
+        # Find client
+        client = User.query.get(client_id)
+        if not client:
+            return jsonify({'success': False, 'error': 'Клиент не найден'})
         
-        if not comparison:
-            comparison = ManagerComparison(
-                manager_id=manager_id,
-                name='Сравнение для клиента',
-                is_active=True
-            )
-            db.session.add(comparison)
+        # If manager_id is None or 0, remove assignment
+        if not manager_id or manager_id == 0:
+            client.assigned_manager_id = None
+            client.client_status = 'Не назначен'
             db.session.commit()
+            logging.info(f"Admin removed manager assignment from client {client_id}")
+            return jsonify({
+                'success': True, 
+                'message': f'Менеджер убран у клиента {client.full_name}',
+                'client_id': client_id,
+                'manager_id': None
+            })
         
-        # Get properties and complexes
-        properties = []
-        complexes = []
+        # Find manager
+        manager = Manager.query.get(manager_id)
+        if not manager:
+            return jsonify({'success': False, 'error': 'Менеджер не найден'})
         
-        for cp in comparison.comparison_properties:
-            properties.append({
-                'property_id': cp.property_id,
-                'property_name': cp.property_name,
-                'property_price': cp.property_price,
-                'complex_name': cp.complex_name,
-                'area': cp.area,
-                'rooms': cp.rooms,
-                'order_index': cp.order_index
-            })
-            
-        for cc in comparison.comparison_complexes:
-            complexes.append({
-                'complex_id': cc.complex_id,
-                'complex_name': cc.complex_name,
-                'developer_name': cc.developer_name,
-                'min_price': cc.min_price,
-                'max_price': cc.max_price,
-                'district': cc.district,
-                'photo': cc.photo,
-                'buildings_count': cc.buildings_count,
-                'apartments_count': cc.apartments_count,
-                'completion_date': cc.completion_date,
-                'status': cc.status,
-                'complex_class': cc.complex_class,
-                'order_index': cc.order_index
-            })
+        # Assign client to manager
+        client.assigned_manager_id = manager_id
+        client.client_status = 'Назначен'
+        db.session.commit()
         
-        # Sort by order_index
-        properties.sort(key=lambda x: x['order_index'])
-        complexes.sort(key=lambda x: x['order_index'])
+        logging.info(f"Admin assigned client {client_id} to manager {manager_id}")
         
         return jsonify({
             'success': True,
-            'comparison_id': comparison.id,
-            'properties': properties,
-            'complexes': complexes
+            'message': f'Клиент {client.full_name} назначен менеджеру {manager.first_name} {manager.last_name}',
+            'client_id': client_id,
+            'manager_id': manager_id,
+            'manager_name': f'{manager.first_name} {manager.last_name}'
         })
         
     except Exception as e:
+        logging.error(f"❌ Error assigning client: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
 
-@app.route('/api/manager/comparison/save-property', methods=['POST'])
-@manager_required
-def manager_save_comparison_property():
-    """Add property to manager's comparison"""
+@app.route('/api/admin/clients-managers', methods=['GET'])
+@admin_required  
+def admin_get_clients_managers():
+    """Get all clients and managers for admin management"""
     try:
-        from models import ManagerComparison, ComparisonProperty
+        # Get all users (potential clients) - include users without role too
+        clients = User.query.filter(User.email.notlike('%@admin%')).all()
+        clients_data = []
         
-        data = request.get_json()
-        manager_id = session.get('manager_id')
+        for client in clients:
+            manager_info = None
+            if client.assigned_manager:
+                manager_info = {
+                    'id': client.assigned_manager.id,
+                    'name': f'{client.assigned_manager.first_name} {client.assigned_manager.last_name}',
+                    'email': client.assigned_manager.email
+                }
+            
+            clients_data.append({
+                'id': client.id,
+                'full_name': client.full_name,
+                'email': client.email,
+                'phone': client.phone,
+                'user_id': client.user_id,
+                'client_status': client.client_status,
+                'registration_source': client.registration_source,
+                'created_at': client.created_at.strftime('%d.%m.%Y %H:%M') if client.created_at else None,
+                'assigned_manager': manager_info
+            })
         
-        property_id = data.get('property_id')
-        if not property_id:
-            return jsonify({'success': False, 'error': 'Property ID required'})
-        
-        # Get or create active comparison
-        comparison = ManagerComparison.query.filter_by(
-            manager_id=manager_id,
-            is_active=True
-        ).first()
-        
-        if not comparison:
-            comparison = ManagerComparison(
-                manager_id=manager_id,
-                name='Сравнение для клиента',
-                is_active=True
-            )
-            db.session.add(comparison)
-            db.session.flush()
-        
-        # Check if property already exists
-        existing = ComparisonProperty.query.filter_by(
-            manager_comparison_id=comparison.id,
-            property_id=property_id
-        ).first()
-        
-        if existing:
-            return jsonify({'success': True, 'message': 'Property already in comparison'})
-        
-        # Get next order index
-        max_order = db.session.query(db.func.max(ComparisonProperty.order_index)).filter_by(
-            manager_comparison_id=comparison.id
-        ).scalar() or 0
-        
-        # Create new comparison property
-        comparison_property = ComparisonProperty(
-            manager_comparison_id=comparison.id,
-            property_id=property_id,
-            property_name=data.get('property_name', ''),
-            property_price=data.get('property_price', 0),
-            complex_name=data.get('complex_name', ''),
-            area=data.get('area', 0),
-            rooms=data.get('rooms', ''),
-            order_index=max_order + 1
-        )
-        
-        db.session.add(comparison_property)
-        db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Property added to comparison'})
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/manager/comparison/save-complex', methods=['POST'])
-@manager_required
-def manager_save_comparison_complex():
-    """Add complex to manager's comparison"""
-    try:
-        from models import ManagerComparison, ComparisonComplex
-        
-        data = request.get_json()
-        manager_id = session.get('manager_id')
-        
-        print(f"🏢 DEBUG save-complex: manager_id={manager_id}, data={data}")
-        
-        complex_id = data.get('complex_id')
-        if not complex_id:
-            print("❌ DEBUG save-complex: Complex ID missing")
-            return jsonify({'success': False, 'error': 'Complex ID required'})
-        
-        print(f"🏢 DEBUG save-complex: complex_id={complex_id}")
-        
-        # Get REAL data from excel_properties for buildings_count, apartments_count, and PRICES
-        complex_name = data.get('complex_name', '')
-        real_buildings_count = 0
-        real_apartments_count = 0
-        real_min_price = 0
-        real_max_price = 0
-        
-        if complex_name:
-            try:
-                from sqlalchemy import text
-                real_data = db.session.execute(text("""
-                    SELECT 
-                        COUNT(*) as apartments_count,
-                        CASE 
-                            WHEN COUNT(DISTINCT ep.complex_building_id) > 0 
-                            THEN COUNT(DISTINCT ep.complex_building_id)
-                            WHEN COUNT(DISTINCT NULLIF(ep.complex_building_name, '')) > 0 
-                            THEN COUNT(DISTINCT NULLIF(ep.complex_building_name, ''))
-                            ELSE GREATEST(1, CEIL(COUNT(*) / 3.0))
-                        END as buildings_count,
-                        MIN(ep.price) as real_min_price,
-                        MAX(ep.price) as real_max_price
-                    FROM excel_properties ep
-                    WHERE ep.complex_name = :complex_name
-                """), {'complex_name': complex_name}).fetchone()
-                
-                if real_data:
-                    real_apartments_count = int(real_data[0] or 0)
-                    real_buildings_count = int(real_data[1] or 1)
-                    real_min_price = int(real_data[2] or 0)
-                    real_max_price = int(real_data[3] or 0)
-                    print(f"🏢 DEBUG save-complex: Found REAL data - apartments: {real_apartments_count}, buildings: {real_buildings_count}, price: {real_min_price}-{real_max_price}")
-                else:
-                    print(f"🏢 DEBUG save-complex: No real data found for complex: {complex_name}")
-                    # Fallback to passed data
-                    real_apartments_count = data.get('apartments_count', 0)
-                    real_buildings_count = data.get('buildings_count', 0)
-                    real_min_price = data.get('min_price', 0)
-                    real_max_price = data.get('max_price', 0)
-            except Exception as e:
-                print(f"⚠️ DEBUG save-complex: Error getting real data: {e}")
-                # Fallback to passed data
-                real_apartments_count = data.get('apartments_count', 0)
-                real_buildings_count = data.get('buildings_count', 0)
-                real_min_price = data.get('min_price', 0)
-                real_max_price = data.get('max_price', 0)
-        
-        # Get or create active comparison
-        comparison = ManagerComparison.query.filter_by(
-            manager_id=manager_id,
-            is_active=True
-        ).first()
-        
-        if not comparison:
-            print("🏢 DEBUG save-complex: Creating new comparison")
-            comparison = ManagerComparison(
-                manager_id=manager_id,
-                name='Сравнение для клиента',
-                is_active=True
-            )
-            db.session.add(comparison)
-            db.session.flush()
-        
-        print(f"🏢 DEBUG save-complex: comparison_id={comparison.id}")
-        
-        # Check if complex already exists
-        existing = ComparisonComplex.query.filter_by(
-            manager_comparison_id=comparison.id,
-            complex_id=complex_id
-        ).first()
-        
-        if existing:
-            print(f"🏢 DEBUG save-complex: Complex {complex_id} already exists")
-            return jsonify({'success': True, 'message': 'Complex already in comparison'})
-        
-        # Get next order index
-        max_order = db.session.query(db.func.max(ComparisonComplex.order_index)).filter_by(
-            manager_comparison_id=comparison.id
-        ).scalar() or 0
-        
-        print(f"🏢 DEBUG save-complex: max_order={max_order}")
-        
-        # Create new comparison complex
-        comparison_complex = ComparisonComplex(
-            manager_comparison_id=comparison.id,
-            complex_id=complex_id,
-            complex_name=data.get('complex_name', ''),
-            developer_name=data.get('developer_name', ''),
-            min_price=real_min_price,
-            max_price=real_max_price,
-            district=data.get('district', ''),
-            photo=data.get('photo', ''),
-            buildings_count=real_buildings_count,
-            apartments_count=real_apartments_count,
-            completion_date=data.get('completion_date', ''),
-            status=data.get('status', ''),
-            complex_class=data.get('complex_class', ''),
-            order_index=max_order + 1
-        )
-        
-        print(f"🏢 DEBUG save-complex: Created object with complex_id={comparison_complex.complex_id}")
-        
-        db.session.add(comparison_complex)
-        db.session.commit()
-        
-        print(f"✅ DEBUG save-complex: Successfully saved complex {complex_id} to database")
-        
-        return jsonify({'success': True, 'message': 'Complex added to comparison'})
-        
-    except Exception as e:
-        print(f"❌ DEBUG save-complex: Exception {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/manager/comparison/remove-property', methods=['DELETE'])
-@manager_required
-def manager_remove_comparison_property():
-    """Remove property from manager's comparison"""
-    try:
-        from models import ManagerComparison, ComparisonProperty
-        
-        data = request.get_json()
-        manager_id = session.get('manager_id')
-        property_id = data.get('property_id')
-        
-        if not property_id:
-            return jsonify({'success': False, 'error': 'Property ID required'})
-        
-        # Find and remove the property
-        comparison = ManagerComparison.query.filter_by(
-            manager_id=manager_id,
-            is_active=True
-        ).first()
-        
-        if not comparison:
-            return jsonify({'success': False, 'error': 'No active comparison found'})
-        
-        property_to_remove = ComparisonProperty.query.filter_by(
-            manager_comparison_id=comparison.id,
-            property_id=property_id
-        ).first()
-        
-        if property_to_remove:
-            db.session.delete(property_to_remove)
-            db.session.commit()
-            return jsonify({'success': True, 'message': 'Property removed from comparison'})
-        else:
-            return jsonify({'success': False, 'error': 'Property not found in comparison'})
-            
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/manager/comparison/remove-complex', methods=['DELETE'])
-@manager_required
-def manager_remove_comparison_complex():
-    """Remove complex from manager's comparison"""
-    try:
-        from models import ManagerComparison, ComparisonComplex
-        
-        data = request.get_json()
-        manager_id = session.get('manager_id')
-        complex_id = data.get('complex_id')
-        
-        if not complex_id:
-            return jsonify({'success': False, 'error': 'Complex ID required'})
-        
-        # Find and remove the complex
-        comparison = ManagerComparison.query.filter_by(
-            manager_id=manager_id,
-            is_active=True
-        ).first()
-        
-        if not comparison:
-            return jsonify({'success': False, 'error': 'No active comparison found'})
-        
-        complex_to_remove = ComparisonComplex.query.filter_by(
-            manager_comparison_id=comparison.id,
-            complex_id=complex_id
-        ).first()
-        
-        if complex_to_remove:
-            db.session.delete(complex_to_remove)
-            db.session.commit()
-            return jsonify({'success': True, 'message': 'Complex removed from comparison'})
-        else:
-            return jsonify({'success': False, 'error': 'Complex not found in comparison'})
-            
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/manager/comparison/clear', methods=['POST'])
-@manager_required
-def manager_clear_comparison():
-    """Clear all items from manager's comparison"""
-    try:
-        from models import ManagerComparison, ComparisonProperty, ComparisonComplex
-        
-        manager_id = session.get('manager_id')
-        
-        print(f"🗑️ DEBUG clear: Starting clear for manager_id={manager_id}")
-        
-        # Find active comparison
-        comparison = ManagerComparison.query.filter_by(
-            manager_id=manager_id,
-            is_active=True
-        ).first()
-        
-        if comparison:
-            print(f"🗑️ DEBUG clear: Found comparison_id={comparison.id}")
-            
-            # Count items before deletion
-            properties_count = ComparisonProperty.query.filter_by(manager_comparison_id=comparison.id).count()
-            complexes_count = ComparisonComplex.query.filter_by(manager_comparison_id=comparison.id).count()
-            
-            print(f"🗑️ DEBUG clear: Found {properties_count} properties, {complexes_count} complexes to delete")
-            
-            # Remove all properties and complexes
-            ComparisonProperty.query.filter_by(manager_comparison_id=comparison.id).delete()
-            ComparisonComplex.query.filter_by(manager_comparison_id=comparison.id).delete()
-            db.session.commit()
-            
-            print(f"✅ DEBUG clear: Successfully cleared comparison")
-        else:
-            print(f"ℹ️ DEBUG clear: No active comparison found for manager {manager_id}")
-        
-        return jsonify({'success': True, 'message': 'Comparison cleared'})
-        
-    except Exception as e:
-        print(f"❌ DEBUG clear: Exception {str(e)}")
-        import traceback
-        print(f"❌ DEBUG clear: Traceback {traceback.format_exc()}")
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/manager/comparison/count', methods=['GET'])
-@manager_required
-def manager_comparison_count():
-    """Get count of items in manager's comparison"""
-    try:
-        from models import ManagerComparison, ComparisonProperty, ComparisonComplex
-        
-        manager_id = session.get('manager_id')
-        
-        # Get active comparison for manager
-        comparison = ManagerComparison.query.filter_by(
-            manager_id=manager_id, 
-            is_active=True
-        ).first()
-        
-        if not comparison:
-            return jsonify({
-                'success': True,
-                'properties_count': 0,
-                'complexes_count': 0,
-                'total_count': 0
-            })
-        
-        # Count items
-        properties_count = ComparisonProperty.query.filter_by(manager_comparison_id=comparison.id).count()
-        complexes_count = ComparisonComplex.query.filter_by(manager_comparison_id=comparison.id).count()
-        total_count = properties_count + complexes_count
-        
-        return jsonify({
-            'success': True,
-            'properties_count': properties_count,
-            'complexes_count': complexes_count,
-            'total_count': total_count
-        })
-        
-    except Exception as e:
-        logging.error(f"❌ Error getting comparison count: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/admin/assign-client', methods=['POST'])
-@admin_required
-def admin_assign_client():
-    """Assign client to manager"""
-    try:
-        data = request.get_json()
-        client_id = data.get('client_id')
-        manager_id = data.get('manager_id')
-        
-        if not client_id:
-            return jsonify({'success': False, 'error': 'ID клиента обязателен'})
-        
-        # Find client
-        client = User.query.get(client_id)
-        if not client:
-            return jsonify({'success': False, 'error': 'Клиент не найден'})
-        
-        # If manager_id is None or 0, remove assignment
-        if not manager_id or manager_id == 0:
-            client.assigned_manager_id = None
-            client.client_status = 'Не назначен'
-            db.session.commit()
-            logging.info(f"Admin removed manager assignment from client {client_id}")
-            return jsonify({
-                'success': True, 
-                'message': f'Менеджер убран у клиента {client.full_name}',
-                'client_id': client_id,
-                'manager_id': None
-            })
-        
-        # Find manager
-        manager = Manager.query.get(manager_id)
-        if not manager:
-            return jsonify({'success': False, 'error': 'Менеджер не найден'})
-        
-        # Assign client to manager
-        client.assigned_manager_id = manager_id
-        client.client_status = 'Назначен'
-        db.session.commit()
-        
-        logging.info(f"Admin assigned client {client_id} to manager {manager_id}")
-        
-        return jsonify({
-            'success': True,
-            'message': f'Клиент {client.full_name} назначен менеджеру {manager.first_name} {manager.last_name}',
-            'client_id': client_id,
-            'manager_id': manager_id,
-            'manager_name': f'{manager.first_name} {manager.last_name}'
-        })
-        
-    except Exception as e:
-        logging.error(f"❌ Error assigning client: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/admin/clients-managers', methods=['GET'])
-@admin_required  
-def admin_get_clients_managers():
-    """Get all clients and managers for admin management"""
-    try:
-        # Get all users (potential clients) - include users without role too
-        clients = User.query.filter(User.email.notlike('%@admin%')).all()
-        clients_data = []
-        
-        for client in clients:
-            manager_info = None
-            if client.assigned_manager:
-                manager_info = {
-                    'id': client.assigned_manager.id,
-                    'name': f'{client.assigned_manager.first_name} {client.assigned_manager.last_name}',
-                    'email': client.assigned_manager.email
-                }
-            
-            clients_data.append({
-                'id': client.id,
-                'full_name': client.full_name,
-                'email': client.email,
-                'phone': client.phone,
-                'user_id': client.user_id,
-                'client_status': client.client_status,
-                'registration_source': client.registration_source,
-                'created_at': client.created_at.strftime('%d.%m.%Y %H:%M') if client.created_at else None,
-                'assigned_manager': manager_info
-            })
-        
-        # Get all active managers
-        managers = Manager.query.filter_by(is_active=True).all()
-        managers_data = []
+        # Get all active managers
+        managers = Manager.query.filter_by(is_active=True).all()
+        managers_data = []
         
         for manager in managers:
             # Count assigned clients
@@ -21693,598 +20721,6 @@ def admin_get_clients_managers():
         return jsonify({'success': False, 'error': str(e)})
 
 
-# User Comparison API Routes for Database Persistence
-@app.route('/api/comparison/load', methods=['GET'])
-@login_required
-def load_comparison():
-    """Load user's comparison from database"""
-    from models import UserComparison, ComparisonProperty, ComparisonComplex
-    
-    try:
-        # Get or create user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            user_comparison = UserComparison(
-                user_id=current_user.id,
-                name="Мое сравнение"
-                # ✅ ИСПРАВЛЕНО: Убрано несуществующее поле description
-            )
-            db.session.add(user_comparison)
-            db.session.commit()
-        
-        # Get properties in comparison
-        properties = []
-        comparison_properties = ComparisonProperty.query.filter_by(
-            user_comparison_id=user_comparison.id
-        ).order_by(ComparisonProperty.order_index).all()
-        
-        for cp in comparison_properties:
-            # ✅ ИСПРАВЛЕНИЕ: Обогащаем property данные из excel_properties для нормализованных полей
-            property_completion_date = 'Не указано'
-            property_object_min_floor = None
-            property_object_max_floor = None  
-            property_developer_name = cp.complex_name or 'Не указано'
-            property_finishing = 'Не указано'
-            
-            print(f"DEBUG: User comparison searching for property with cp.property_id: {cp.property_id}")
-            
-            if cp.property_id:
-                try:
-                    # ✅ НОВОЕ: Ищем в excel_properties для property данных
-                    excel_property_query = db.session.execute(text("""
-                        SELECT 
-                            ep.complex_name,
-                            ep.developer_name,
-                            ep.renovation_display_name,
-                            ep.complex_building_end_build_year,
-                            ep.complex_building_end_build_quarter,
-                            ep.object_min_floor,
-                            ep.object_max_floor
-                        FROM excel_properties ep
-                        WHERE ep.inner_id = :property_id
-                        LIMIT 1
-                    """), {"property_id": str(cp.property_id)})
-                    
-                    property_result = excel_property_query.fetchone()
-                    if property_result:
-                        # ✅ Формируем completion_date из года и квартала
-                        if property_result.complex_building_end_build_year:
-                            year = property_result.complex_building_end_build_year
-                            quarter = property_result.complex_building_end_build_quarter
-                            if quarter:
-                                property_completion_date = f"{quarter} кв. {year} г."
-                            else:
-                                property_completion_date = f"{year} г."
-                        
-                        # ✅ Устанавливаем floor данные из excel_properties
-                        property_object_min_floor = property_result.object_min_floor
-                        property_object_max_floor = property_result.object_max_floor
-                        
-                        # ✅ Обновляем другие поля
-                        if property_result.developer_name:
-                            property_developer_name = property_result.developer_name
-                        if property_result.renovation_display_name:
-                            property_finishing = property_result.renovation_display_name
-                        
-                        print(f"DEBUG: ✅ Found user property in excel_properties: {property_result.complex_name}, completion_date={property_completion_date}, floors={property_object_min_floor}-{property_object_max_floor}")
-                    else:
-                        print(f"DEBUG: ❌ User property not found in excel_properties for property_id: {cp.property_id}")
-                        
-                except Exception as e:
-                    print(f"❌ DEBUG property lookup: Exception {str(e)}")
-                    
-            # ✅ ИСПРАВЛЕНО: Обогащаем данные из excel_properties если таблица comparison_properties пустая
-            enriched_property_name = cp.property_name
-            enriched_property_price = cp.property_price
-            enriched_area = cp.area
-            enriched_rooms = cp.rooms
-            enriched_complex_name = cp.complex_name
-            enriched_address = 'Адрес не указан'  # ✅ НОВОЕ: Инициализация адреса
-            enriched_photos = ''  # ✅ НОВОЕ: Инициализация фотографий
-            
-            if cp.property_id and (not enriched_property_name or enriched_property_price == 0):
-                try:
-                    # Получаем полные данные из excel_properties
-                    property_query = db.session.execute(text("""
-                        SELECT 
-                            ep.complex_name,
-                            ep.object_area,
-                            ep.object_rooms,
-                            ep.price,
-                            ep.developer_name,
-                            ep.address_display_name,
-                            ep.photos
-                        FROM excel_properties ep
-                        WHERE ep.inner_id = :property_id
-                        LIMIT 1
-                    """), {"property_id": str(cp.property_id)})
-                    
-                    prop_data = property_query.fetchone()
-                    if prop_data:
-                        enriched_rooms = prop_data.object_rooms if prop_data.object_rooms is not None else 0
-                        enriched_area = prop_data.object_area if prop_data.object_area else 0
-                        enriched_property_price = prop_data.price if prop_data.price else 0
-                        enriched_complex_name = prop_data.complex_name if prop_data.complex_name else enriched_complex_name
-                        
-                        # ✅ НОВОЕ: Добавляем адрес и фотографии
-                        enriched_address = prop_data.address_display_name if prop_data.address_display_name else 'Адрес не указан'
-                        enriched_photos = prop_data.photos if prop_data.photos else ''
-                        
-                        # ✅ Формируем правильное название квартиры
-                        if enriched_rooms == 0:
-                            rooms_text = "Студия"
-                        else:
-                            rooms_text = f"{enriched_rooms}-комн"
-                        
-                        area_text = f", {enriched_area} м²" if enriched_area else ""
-                        enriched_property_name = f"{rooms_text}{area_text}"
-                        
-                        print(f"DEBUG: ✅ Enriched property data: {enriched_property_name}, price={enriched_property_price}, area={enriched_area}, address={enriched_address}, photos={enriched_photos}")
-                    
-                except Exception as e:
-                    print(f"❌ Error enriching property data: {str(e)}")
-            
-            properties.append({
-                'property_id': cp.property_id,
-                'property_name': enriched_property_name,
-                'property_price': enriched_property_price,
-                'complex_name': enriched_complex_name,
-                'area': enriched_area,
-                'rooms': enriched_rooms,
-                'order_index': cp.order_index,
-                'added_at': cp.added_at.isoformat() if cp.added_at else None,
-                # ✅ НОВЫЕ ПОЛЯ: Нормализованные данные для comparison page
-                'completion_date': property_completion_date,
-                'object_min_floor': property_object_min_floor,
-                'object_max_floor': property_object_max_floor,
-                'developer_name': property_developer_name,
-                'finishing': property_finishing,
-                # ✅ НОВЫЕ ПОЛЯ: Адрес и фотографии
-                'address': enriched_address,
-                'photos': enriched_photos
-            })
-        
-        # Get complexes in comparison
-        complexes = []
-        comparison_complexes = ComparisonComplex.query.filter_by(
-            user_comparison_id=user_comparison.id
-        ).order_by(ComparisonComplex.order_index).all()
-        
-        for cc in comparison_complexes:
-            # ✅ ИСПРАВЛЕНИЕ: Ищем реальные данные в excel_properties для системы сравнения пользователей
-            real_complex_name = cc.complex_name or 'ЖК'
-            real_developer_name = cc.developer_name or 'Не указано'
-            real_district = cc.district or 'Не указано'
-            real_min_price = cc.min_price or 0
-            real_max_price = cc.max_price or 0
-            real_photo = cc.photo or ''
-            real_buildings_count = cc.buildings_count or 0
-            real_apartments_count = cc.apartments_count or 0
-            real_completion_date = cc.completion_date or 'Не указано'
-            real_complex_class = cc.complex_class or 'Не указано'
-            real_renovation = 'Не указано'  # ✅ Новое поле "Отделка"
-            real_floors_min = 0  # ✅ Инициализация этажности
-            real_floors_max = 0
-            
-            print(f"DEBUG: User comparison searching for complex with cc.complex_id: {cc.complex_id}")
-            
-            if cc.complex_id:
-                try:
-                    # ✅ НОВОЕ: Ищем в excel_properties используя тот же SQL что и для избранного
-                    excel_complex_query = db.session.execute(text("""
-                        SELECT 
-                            ep.complex_name,
-                            COUNT(*) as apartments_count,
-                            MIN(ep.price) as price_from,
-                            MAX(ep.price) as price_to,
-                            MAX(ep.developer_name) as developer_name,
-                            MAX(ep.address_display_name) as address_display_name,
-                            MAX(ep.complex_object_class_display_name) as complex_class,
-                            MAX(ep.renovation_display_name) as renovation_display_name,
-                            MAX(ep.complex_building_end_build_year) as end_build_year,
-                            MAX(ep.complex_building_end_build_quarter) as end_build_quarter,
-                            MIN(ep.object_min_floor) as floors_min,
-                            MAX(ep.object_max_floor) as floors_max,
-                            COALESCE(rc.id, ROW_NUMBER() OVER (ORDER BY ep.complex_name) + 1000) as real_id,
-                            CASE 
-                                WHEN COUNT(DISTINCT ep.complex_building_id) > 0 
-                                THEN COUNT(DISTINCT ep.complex_building_id)
-                                WHEN COUNT(DISTINCT NULLIF(ep.complex_building_name, '')) > 0 
-                                THEN COUNT(DISTINCT NULLIF(ep.complex_building_name, ''))
-                                ELSE GREATEST(1, CEIL(COUNT(*) / 3.0))
-                            END as buildings_count,
-                            (SELECT photos FROM excel_properties p2 
-                             WHERE p2.complex_name = ep.complex_name 
-                             AND p2.photos IS NOT NULL 
-                             ORDER BY p2.price DESC LIMIT 1) as photos
-                        FROM excel_properties ep
-                        LEFT JOIN residential_complexes rc ON rc.name = ep.complex_name
-                        GROUP BY ep.complex_name, rc.id
-                        ORDER BY ep.complex_name
-                    """))
-                    
-                    # Находим комплекс с нужным ID
-                    target_id = int(cc.complex_id)
-                    for row in excel_complex_query:
-                        if int(row.real_id) == target_id:
-                            real_complex_name = row.complex_name
-                            real_developer_name = row.developer_name or real_developer_name
-                            real_min_price = int(row.price_from) if row.price_from else 0
-                            real_max_price = int(row.price_to) if row.price_to else 0
-                            real_apartments_count = int(row.apartments_count) if row.apartments_count else 0
-                            real_buildings_count = int(row.buildings_count) if row.buildings_count else 0
-                            real_complex_class = row.complex_class or real_complex_class
-                            real_renovation = row.renovation_display_name or 'Не указано'  # ✅ Добавили отделку
-                            real_floors_min = int(row.floors_min) if row.floors_min else 0  # ✅ Этажность мин
-                            real_floors_max = int(row.floors_max) if row.floors_max else 0  # ✅ Этажность макс
-                            
-                            # Формируем дату сдачи
-                            if row.end_build_year and row.end_build_quarter:
-                                quarters = {1: 'I кв.', 2: 'II кв.', 3: 'III кв.', 4: 'IV кв.'}
-                                quarter_name = quarters.get(row.end_build_quarter, f'{row.end_build_quarter} кв.')
-                                real_completion_date = f"{quarter_name} {row.end_build_year} г."
-                            
-                            # Парсим фото
-                            if row.photos:
-                                try:
-                                    import json
-                                    photos = json.loads(row.photos) if isinstance(row.photos, str) else row.photos
-                                    if photos and isinstance(photos, list) and len(photos) > 0:
-                                        real_photo = photos[0]  # Берем первое фото
-                                except:
-                                    pass
-                            
-                            print(f"DEBUG: ✅ Found user comparison complex in excel_properties: {real_complex_name}")
-                            break
-                    else:
-                        print(f"DEBUG: ❌ User comparison complex with ID {cc.complex_id} not found in excel_properties")
-                
-                except Exception as e:
-                    print(f"DEBUG: Error searching user comparison excel_properties: {e}")
-            
-            complexes.append({
-                'complex_id': cc.complex_id,
-                'complex_name': real_complex_name,
-                'name': real_complex_name,  # ✅ ИСПРАВЛЕНИЕ: Добавлено поле 'name' для JavaScript
-                'developer_name': real_developer_name,
-                'district': real_district,
-                'min_price': real_min_price,
-                'max_price': real_max_price,
-                'photo': real_photo,
-                'buildings_count': real_buildings_count,
-                'apartments_count': real_apartments_count,
-                'completion_date': real_completion_date,
-                'status': cc.status,
-                'complex_class': real_complex_class,
-                'renovation': real_renovation,  # ✅ Добавили поле "Отделка"
-                'floors_min': real_floors_min,  # ✅ Этажность минимальная
-                'floors_max': real_floors_max,  # ✅ Этажность максимальная
-                'order_index': cc.order_index,
-                'added_at': cc.added_at.isoformat() if cc.added_at else None
-            })
-        
-        return jsonify({
-            'success': True,
-            'comparison': user_comparison.to_dict(),
-            'properties': properties,
-            'complexes': complexes
-        })
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/comparison/save-property', methods=['POST'])
-@login_required  
-def save_comparison_property():
-    """Save property to user's comparison"""
-    from models import UserComparison, ComparisonProperty
-    
-    try:
-        data = request.get_json()
-        property_id = data.get('property_id')
-        
-        if not property_id:
-            return jsonify({'success': False, 'error': 'property_id required'}), 400
-        
-        # Get or create user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            user_comparison = UserComparison(
-                user_id=current_user.id,
-                name="Мое сравнение"
-                # ✅ ИСПРАВЛЕНО: Убрано несуществующее поле description
-            )
-            db.session.add(user_comparison)
-            db.session.commit()
-        
-        # Check if property already in comparison
-        existing = ComparisonProperty.query.filter_by(
-            user_comparison_id=user_comparison.id,
-            property_id=property_id
-        ).first()
-        
-        if existing:
-            return jsonify({'success': True, 'message': 'Property already in comparison'})
-        
-        # Get max order index
-        max_order = db.session.query(db.func.max(ComparisonProperty.order_index)).filter_by(
-            user_comparison_id=user_comparison.id
-        ).scalar() or 0
-        
-        # Add property to comparison
-        comparison_property = ComparisonProperty(
-            user_comparison_id=user_comparison.id,
-            property_id=property_id,
-            property_name=data.get('property_name', ''),
-            property_price=data.get('property_price', 0),
-            complex_name=data.get('complex_name', ''),
-            area=data.get('area', 0),
-            rooms=data.get('rooms', ''),
-            order_index=max_order + 1
-        )
-        
-        db.session.add(comparison_property)
-        db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Property added to comparison'})
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/comparison/save-complex', methods=['POST'])
-@login_required
-def save_comparison_complex():
-    """Save residential complex to user's comparison"""
-    from models import UserComparison, ComparisonComplex
-    
-    try:
-        data = request.get_json()
-        complex_id = data.get('complex_id')
-        
-        if not complex_id:
-            return jsonify({'success': False, 'error': 'complex_id required'}), 400
-        
-        # Get or create user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            user_comparison = UserComparison(
-                user_id=current_user.id,
-                name="Мое сравнение"
-                # ✅ ИСПРАВЛЕНО: Убрано несуществующее поле description
-            )
-            db.session.add(user_comparison)
-            db.session.commit()
-        
-        # Check if complex already in comparison
-        existing = ComparisonComplex.query.filter_by(
-            user_comparison_id=user_comparison.id,
-            complex_id=complex_id
-        ).first()
-        
-        if existing:
-            return jsonify({'success': True, 'message': 'Complex already in comparison'})
-        
-        # Get max order index
-        max_order = db.session.query(db.func.max(ComparisonComplex.order_index)).filter_by(
-            user_comparison_id=user_comparison.id
-        ).scalar() or 0
-        
-        # Add complex to comparison
-        comparison_complex = ComparisonComplex(
-            user_comparison_id=user_comparison.id,
-            complex_id=complex_id,
-            complex_name=data.get('name', ''),
-            developer_name=data.get('developer_name', ''),
-            district=data.get('district', ''),
-            min_price=data.get('min_price', 0),
-            max_price=data.get('max_price', 0),
-            photo=data.get('photo', ''),
-            buildings_count=data.get('buildings_count', 0),
-            apartments_count=data.get('apartments_count', 0),
-            completion_date=data.get('completion_date', ''),
-            status=data.get('status', ''),
-            complex_class=data.get('complex_class', ''),
-            order_index=max_order + 1
-        )
-        
-        db.session.add(comparison_complex)
-        db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Complex added to comparison'})
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/comparison/remove-property', methods=['DELETE'])
-@login_required
-def remove_comparison_property():
-    """Remove property from user's comparison"""
-    from models import UserComparison, ComparisonProperty
-    
-    try:
-        data = request.get_json()
-        property_id = data.get('property_id')
-        
-        if not property_id:
-            return jsonify({'success': False, 'error': 'property_id required'}), 400
-        
-        # Get user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            return jsonify({'success': False, 'error': 'No comparison found'}), 404
-        
-        # Remove property from comparison
-        property_to_remove = ComparisonProperty.query.filter_by(
-            user_comparison_id=user_comparison.id,
-            property_id=property_id
-        ).first()
-        
-        if property_to_remove:
-            db.session.delete(property_to_remove)
-            db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Property removed from comparison'})
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/comparison/remove-complex', methods=['DELETE'])
-@login_required
-def remove_comparison_complex():
-    """Remove complex from user's comparison"""
-    from models import UserComparison, ComparisonComplex
-    
-    try:
-        data = request.get_json()
-        complex_id = data.get('complex_id')
-        
-        if not complex_id:
-            return jsonify({'success': False, 'error': 'complex_id required'}), 400
-        
-        # Get user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            return jsonify({'success': False, 'error': 'No comparison found'}), 404
-        
-        # Remove complex from comparison
-        complex_to_remove = ComparisonComplex.query.filter_by(
-            user_comparison_id=user_comparison.id,
-            complex_id=complex_id
-        ).first()
-        
-        if complex_to_remove:
-            db.session.delete(complex_to_remove)
-            db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Complex removed from comparison'})
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/comparison/clear', methods=['POST'])
-@login_required
-def clear_comparison():
-    """Clear user's comparison"""
-    from models import UserComparison, ComparisonProperty, ComparisonComplex
-    
-    try:
-        # Get user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            return jsonify({'success': True, 'message': 'No comparison to clear'})
-        
-        # Delete all comparison data for this user
-        ComparisonProperty.query.filter_by(user_comparison_id=user_comparison.id).delete()
-        ComparisonComplex.query.filter_by(user_comparison_id=user_comparison.id).delete()
-        
-        db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Comparison cleared successfully'})
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)})
-
-
-# ✅ НОВЫЕ API endpoints для новой страницы сравнения с path parameters
-@app.route('/api/comparison/remove/property/<property_id>', methods=['DELETE'])
-@login_required
-def remove_comparison_property_by_id(property_id):
-    """Remove property from user's comparison by ID"""
-    from models import UserComparison, ComparisonProperty
-    
-    try:
-        # Get user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            return jsonify({'success': False, 'error': 'No comparison found'}), 404
-        
-        # Remove property from comparison
-        property_to_remove = ComparisonProperty.query.filter_by(
-            user_comparison_id=user_comparison.id,
-            property_id=property_id
-        ).first()
-        
-        if property_to_remove:
-            db.session.delete(property_to_remove)
-            db.session.commit()
-            logging.info(f"✅ Property {property_id} removed from comparison for user {current_user.id}")
-        
-        return jsonify({'success': True, 'message': 'Property removed from comparison'})
-        
-    except Exception as e:
-        db.session.rollback()
-        logging.error(f"❌ Error removing property from comparison: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/comparison/remove/complex/<complex_id>', methods=['DELETE'])
-@login_required
-def remove_comparison_complex_by_id(complex_id):
-    """Remove complex from user's comparison by ID"""
-    from models import UserComparison, ComparisonComplex
-    
-    try:
-        # Get user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            return jsonify({'success': False, 'error': 'No comparison found'}), 404
-        
-        # Remove complex from comparison
-        complex_to_remove = ComparisonComplex.query.filter_by(
-            user_comparison_id=user_comparison.id,
-            complex_id=complex_id
-        ).first()
-        
-        if complex_to_remove:
-            db.session.delete(complex_to_remove)
-            db.session.commit()
-            logging.info(f"✅ Complex {complex_id} removed from comparison for user {current_user.id}")
-        
-        return jsonify({'success': True, 'message': 'Complex removed from comparison'})
-        
-    except Exception as e:
-        db.session.rollback()
-        logging.error(f"❌ Error removing complex from comparison: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
-
-
-@app.route('/api/comparison/clear', methods=['DELETE'])
-@login_required
-def clear_comparison_delete():
-    """Clear user's comparison (DELETE method)"""
-    from models import UserComparison, ComparisonProperty, ComparisonComplex
-    
-    try:
-        # Get user comparison
-        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
-        if not user_comparison:
-            return jsonify({'success': True, 'message': 'No comparison to clear'})
-        
-        # Delete all comparison data for this user
-        ComparisonProperty.query.filter_by(user_comparison_id=user_comparison.id).delete()
-        ComparisonComplex.query.filter_by(user_comparison_id=user_comparison.id).delete()
-        
-        db.session.commit()
-        logging.info(f"✅ Comparison cleared for user {current_user.id}")
-        
-        return jsonify({'success': True, 'message': 'Comparison cleared successfully'})
-        
-    except Exception as e:
-        db.session.rollback()
-        logging.error(f"❌ Error clearing comparison: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)})
-
-
 if __name__ == '__main__':
     # Telegram webhook integration
     try:
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта: время импорта app (или main) и память процесса.
+
+Каждый прогон — отдельный свежий интерпретатор, как при загрузке
+gunicorn-воркера или запуске скрипта с `from app import app, db`. Для
+прогона меряются время импорта и RSS после него; по выводу
+`python -X importtime` печатаются самые дорогие импорты верхнего уровня.
+
+Завершается с кодом 1, если при импорте загрузился один из тяжелых
+необязательных пакетов (они должны импортироваться лениво, при первом
+использовании) или превышены заданные пороги времени и памяти.
+
+    python benchmark_import_time.py
+    python benchmark_import_time.py --module main --runs 3 --max-seconds 3 --max-rss-mb 150
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Пакеты, которые нужны отдельным страницам и задачам, но не каждому процессу
+HEAVY_MODULES = ('openai', 'pandas', 'PIL', 'qrcode', 'weasyprint', 'telegram', 'sendgrid', 'openpyxl')
+
+CHILD_CODE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+rss_kb = 0
+with open('/proc/self/status') as status:
+    for line in status:
+        if line.startswith('VmRSS:'):
+            rss_kb = int(line.split()[1])
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print('BENCHMARK_RESULT ' + json.dumps({{'seconds': seconds, 'rss_kb': rss_kb, 'heavy': heavy,
+                                        'modules': len(sys.modules)}}))
+"""
+
+
+def run_once(module):
+    env = dict(os.environ)
+    # Фоновые потоки main.py не нужны для замера импорта
+    env.setdefault('JOB_WORKER_EMBEDDED', '0')
+    env.setdefault('OUTBOX_DISPATCHER_EMBEDDED', '0')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD_CODE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    result = None
+    for line in completed.stdout.splitlines():
+        if line.startswith('BENCHMARK_RESULT '):
+            result = json.loads(line[len('BENCHMARK_RESULT '):])
+    if result is None:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    return result, completed.stderr
+
+
+def top_level_imports(importtime_output, module, limit):
+    """Самые дорогие модули, импортированные непосредственно из module (накопительное время, мс)"""
+    costs = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        # Отступ имени: два пробела на уровень вложенности; module — уровень 0
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        if depth == 1 and cumulative.strip().isdigit():
+            costs.append((int(cumulative) / 1000, name.strip()))
+    return sorted(costs, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время импорта и память холодного старта')
+    parser.add_argument('--module', default='app', help='что импортировать (app или main)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='сколько самых дорогих импортов показать')
+    parser.add_argument('--max-seconds', type=float, help='порог медианного времени импорта')
+    parser.add_argument('--max-rss-mb', type=float, help='порог медианного RSS после импорта')
+    args = parser.parse_args()
+
+    results = []
+    importtime_output = ''
+    for _ in range(args.runs):
+        result, importtime_output = run_once(args.module)
+        results.append(result)
+
+    seconds = [result['seconds'] for result in results]
+    rss_mb = [result['rss_kb'] / 1024 for result in results]
+    median_seconds = statistics.median(seconds)
+    median_rss = statistics.median(rss_mb)
+    print(f"import {args.module}: {args.runs} runs")
+    print(f"  time: median {median_seconds:.2f}s, min {min(seconds):.2f}s, max {max(seconds):.2f}s")
+    print(f"  RSS:  median {median_rss:.0f} MB, modules loaded: {results[-1]['modules']}")
+    print("  slowest top-level imports (cumulative):")
+    for milliseconds, name in top_level_imports(importtime_output, args.module, args.top):
+        print(f"    {milliseconds:8.1f} ms  {name}")
+
+    failed = False
+    heavy = sorted({name for result in results for name in result['heavy']})
+    if heavy:
+        print(f"FAIL: heavy optional modules loaded at import: {', '.join(heavy)}")
+        failed = True
+    if args.max_seconds is not None and median_seconds > args.max_seconds:
+        print(f"FAIL: import time {median_seconds:.2f}s > {args.max_seconds}s")
+        failed = True
+    if args.max_rss_mb is not None and median_rss > args.max_rss_mb:
+        print(f"FAIL: RSS {median_rss:.0f} MB > {args.max_rss_mb} MB")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Проверка single-flight LLMCache на заглушке OpenAI-клиента.
+
+Заглушка client.chat.completions.create отвечает с задержкой и считает
+вызовы. Проверяется, что:
+* одновременные одинаковые запросы из нескольких потоков дают один вызов;
+* одновременные одинаковые запросы из нескольких процессов с общим
+  каталогом кэша дают один вызов, остальные ждут его ответ;
+* следующий процесс получает ответ из кэша без вызова;
+* каждый запрос попадает ровно в один счетчик (hits / misses / shared_waits).
+
+    python benchmark_llm_cache.py
+    python benchmark_llm_cache.py --threads 32 --processes 4 --delay 0.5
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from llm_cache import LLMCache
+
+MESSAGES = [{'role': 'user', 'content': 'Двушка в центре до 8 млн'}]
+
+
+class StubClient:
+    """client.chat.completions.create(...) с задержкой delay секунд"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **params):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        message = SimpleNamespace(content=f"ответ на {messages[-1]['content']}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def run_threads(directory, threads, delay, barrier=None):
+    """(вызовов API, метрики кэша) для threads одновременных одинаковых запросов"""
+    cache = LLMCache(directory)
+    client = StubClient(delay)
+    answers, errors = [], []
+    if barrier is not None:
+        barrier.wait()
+
+    def worker():
+        try:
+            answers.append(cache.complete(client, model='gpt-4o', messages=MESSAGES, temperature=0.3))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if errors or len(set(answers)) != 1:
+        raise SystemExit(f"Ошибки или разные ответы: {errors or set(answers)}")
+    return client.calls, dict(cache.metrics)
+
+
+def _process_worker(directory, threads, delay, barrier, results):
+    results.put(run_threads(directory, threads, delay, barrier))
+
+
+def check_counters(name, metrics, requests, failures):
+    counted = metrics['hits'] + metrics['misses'] + metrics['shared_waits']
+    if counted != requests:
+        failures.append(f"{name}: учтено {counted} запросов из {requests} ({metrics})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=0.3, help='задержка заглушки, с')
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        calls, metrics = run_threads(os.path.join(directory, 'threads'), args.threads, args.delay)
+        print(f"Потоки: {args.threads} запросов -> {calls} вызов(ов) API за "
+              f"{time.perf_counter() - started:.2f} с, {metrics}")
+        if calls != 1:
+            failures.append(f"потоки: {calls} вызовов вместо 1")
+        check_counters('потоки', metrics, args.threads, failures)
+
+        shared = os.path.join(directory, 'processes')
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(args.processes)
+        results = context.Queue()
+        processes = [context.Process(target=_process_worker,
+                                     args=(shared, args.threads, args.delay, barrier, results))
+                     for _ in range(args.processes)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        per_process = [results.get(timeout=120) for _ in processes]
+        for process in processes:
+            process.join()
+        calls = sum(process_calls for process_calls, _ in per_process)
+        print(f"Процессы: {args.processes} × {args.threads} запросов -> {calls} вызов(ов) API за "
+              f"{time.perf_counter() - started:.2f} с")
+        if calls != 1:
+            failures.append(f"процессы: {calls} вызовов вместо 1")
+        for number, (_, process_metrics) in enumerate(per_process, 1):
+            check_counters(f"процесс {number}", process_metrics, args.threads, failures)
+
+        context.Process(target=_process_worker, args=(shared, 1, args.delay, None, results)).start()
+        calls, metrics = results.get(timeout=120)
+        print(f"Следующий процесс: {calls} вызов(ов) API, {metrics}")
+        if calls != 0 or metrics['hits'] != 1:
+            failures.append(f"следующий процесс: {calls} вызовов, hits={metrics['hits']}")
+        if any(name.endswith('.pending') for name in os.listdir(shared)):
+            failures.append("остался маркер .pending")
+
+    if failures:
+        raise SystemExit('\n'.join(failures))
+    print("OK: один вызов API на одинаковые запросы, каждый запрос учтен один раз")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк PropertyIndex против прохода по списку словарей.
+
+Генерирует синтетический снимок в формате load_properties() и сравнивает
+типовые запросы каталога: фильтр + подсчет, фильтр + сортировка + страница
+и "похожие квартиры" в районе. Базовый вариант повторяет циклы, которые
+были в get_filtered_properties()/filter_properties()/sort_properties().
+
+    python benchmark_property_index.py                 # 10k, 100k, 1M
+    python benchmark_property_index.py --sizes 10000 --repeat 20
+"""
+
+import argparse
+import random
+import time
+
+from property_index import PropertyIndex
+
+DISTRICTS = [f"Район {i}" for i in range(40)]
+DEVELOPERS = [f"Застройщик {i}" for i in range(150)]
+COMPLEXES = [f"ЖК {i}" for i in range(1200)]
+CLASSES = ['Эконом', 'Комфорт', 'Бизнес', 'Элит']
+
+FILTERS = {
+    'rooms': ['2', '3'],
+    'price_min': 4_000_000,
+    'price_max': 9_000_000,
+    'districts': DISTRICTS[:5],
+}
+PAGE_SIZE = 20
+
+
+def generate_properties(count, seed=42):
+    rng = random.Random(seed)
+    properties = []
+    for i in range(count):
+        rooms = rng.choice([0, 1, 1, 2, 2, 3, 4])
+        area = round(rng.uniform(20, 120), 1)
+        year = rng.randint(2023, 2029)
+        properties.append({
+            'id': str(100000 + i),
+            'rooms': rooms,
+            'area': area,
+            'price': rng.randint(2_500_000, 25_000_000),
+            'floor': rng.randint(1, 25),
+            'total_floors': 25,
+            'coordinates': {'lat': 45.0 + rng.random() / 5, 'lng': 38.9 + rng.random() / 5},
+            'district': rng.choice(DISTRICTS),
+            'developer': rng.choice(DEVELOPERS),
+            'complex_name': rng.choice(COMPLEXES),
+            'complex_class': rng.choice(CLASSES),
+            'completion_date': f"{rng.randint(1, 4)} кв. {year} г.",
+            'title': f"{rooms}-комн, {area} м²",
+            'description': 'x' * 200,
+        })
+    if properties:
+        # Район, где есть только последняя квартира, — худший случай для прохода по списку
+        properties[-1]['district'] = 'Новый район'
+    return properties
+
+
+def list_query(properties):
+    """Текущий путь: проход по словарям, сортировка всего результата, срез"""
+    rooms = {int(r) for r in FILTERS['rooms']}
+    filtered = [
+        p for p in properties
+        if p['rooms'] in rooms
+        and FILTERS['price_min'] <= p['price'] <= FILTERS['price_max']
+        and p['district'] in FILTERS['districts']
+    ]
+    filtered = sorted(filtered, key=lambda x: x.get('price') or 0)
+    return filtered[:PAGE_SIZE], len(filtered)
+
+
+def index_query(index):
+    mask = (index.rooms_mask(FILTERS['rooms'])
+            & index.range_mask('price', FILTERS['price_min'], FILTERS['price_max'])
+            & index.category_mask('district', FILTERS['districts']))
+    return index.query(mask, sort_type='price_asc', limit=PAGE_SIZE)
+
+
+def list_similar(properties, property_id, district, limit=3):
+    similar = []
+    for prop in properties:
+        if str(prop['id']) != str(property_id) and prop['district'] == district:
+            similar.append(prop)
+            if len(similar) >= limit:
+                break
+    return similar
+
+
+def index_similar(index, property_id, district, limit=3):
+    mask = index.exclude_ids(index.category_mask('district', [district]), [property_id])
+    return index.materialize(index.select(mask, limit=limit))
+
+
+def _timed(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def run_benchmark(sizes, repeat):
+    print(f"{'строк':>9} {'сборка, мс':>11} {'список, мс':>11} {'индекс, мс':>11} {'ускорение':>10}  запрос")
+    for size in sizes:
+        properties = generate_properties(size)
+        build_ms, index = _timed(lambda: PropertyIndex(properties), 1)
+
+        list_ms, (list_page, list_total) = _timed(lambda: list_query(properties), repeat)
+        index_ms, (index_page, index_total) = _timed(lambda: index_query(index), repeat)
+        assert list_total == index_total, (list_total, index_total)
+        assert [p['id'] for p in list_page] == [p['id'] for p in index_page]
+        print(f"{size:>9} {build_ms:>11.1f} {list_ms:>11.2f} {index_ms:>11.2f} {list_ms / index_ms:>9.1f}x  фильтр+сортировка+страница")
+
+        # Редкий район: список приходится просматривать целиком
+        target = properties[-1]
+        list_ms, list_result = _timed(lambda: list_similar(properties, target['id'], target['district']), repeat)
+        index_ms, index_result = _timed(lambda: index_similar(index, target['id'], target['district']), repeat)
+        assert [p['id'] for p in list_result] == [p['id'] for p in index_result]
+        print(f"{size:>9} {'':>11} {list_ms:>11.2f} {index_ms:>11.2f} {list_ms / index_ms:>9.1f}x  похожие в районе")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк PropertyIndex')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run_benchmark(args.sizes, args.repeat)
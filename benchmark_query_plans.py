@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Регрессионный бенчмарк планов запросов к excel_properties.
+
+Прогоняет EXPLAIN ANALYZE по реальным формам запросов из app.py и
+performance_search.py и завершается с кодом 1, если в плане снова появился
+Seq Scan по excel_properties (т.е. пропал или перестал подходить индекс).
+
+На маленькой базе планировщик честно выбирает Seq Scan, поэтому проверка
+идет с enable_seqscan = off: тогда последовательное сканирование остается
+в плане только если ни один индекс не применим.
+
+    python create_property_indexes.py
+    python benchmark_query_plans.py
+"""
+
+import json
+import sys
+
+from sqlalchemy import text
+
+from app import app, db
+from property_query import PropertyQueryBuilder
+
+
+def _sample_values():
+    """Берем реальные значения из базы, чтобы планы соответствовали продакшену"""
+    row = db.session.execute(text("""
+        SELECT complex_name, developer_name, address_locality_display_name
+        FROM excel_properties
+        WHERE complex_name IS NOT NULL AND developer_name IS NOT NULL
+        LIMIT 1
+    """)).fetchone()
+    complex_name, developer_name, locality = row if row else ('ЖК', 'Застройщик', 'Краснодар')
+    return {
+        'complex_name': complex_name,
+        'developer_name': developer_name,
+        'locality': locality or 'Краснодар',
+        'query': f"%{(complex_name or 'жк')[:4].lower()}%",
+    }
+
+
+def get_query_shapes():
+    """Формы запросов: (название, SQL, параметры)"""
+    values = _sample_values()
+
+    catalog = PropertyQueryBuilder({'rooms': ['2']})
+    catalog_count_sql, catalog_count_params = catalog.count_query()
+
+    return [
+        # app.py: /properties — подсчет по комнатам (PropertyQueryBuilder)
+        ('catalog_count_by_rooms', catalog_count_sql, catalog_count_params),
+        # performance_search.py: количество квартир по типу для подсказок
+        ('suggestions_rooms_count',
+         "SELECT COUNT(*) FROM excel_properties WHERE object_rooms = :rooms",
+         {'rooms': 1}),
+        # super-search: комнаты + сортировка по цене
+        ('rooms_price_order',
+         "SELECT inner_id FROM excel_properties WHERE object_rooms = :rooms ORDER BY price LIMIT 50",
+         {'rooms': 2}),
+        # app.py: фото ЖК из самой дорогой квартиры
+        ('complex_cover_photo',
+         """SELECT photos FROM excel_properties
+            WHERE complex_name = :complex_name AND photos IS NOT NULL
+            ORDER BY price DESC, object_area DESC LIMIT 1""",
+         {'complex_name': values['complex_name']}),
+        # app.py: load_properties() — этажность ЖК
+        ('complex_max_floor',
+         "SELECT MAX(object_max_floor) FROM excel_properties WHERE complex_name = :complex_name",
+         {'complex_name': values['complex_name']}),
+        # app.py: developer_page — ЖК застройщика
+        ('developer_complexes',
+         """SELECT complex_name, COUNT(*) FROM excel_properties
+            WHERE UPPER(TRIM(developer_name)) = UPPER(TRIM(:developer_name))
+            GROUP BY complex_name""",
+         {'developer_name': values['developer_name']}),
+        ('developer_exact',
+         "SELECT COUNT(*) FROM excel_properties WHERE developer_name = :developer_name",
+         {'developer_name': values['developer_name']}),
+        ('locality_exact',
+         "SELECT COUNT(*) FROM excel_properties WHERE address_locality_display_name = :locality",
+         {'locality': values['locality']}),
+        # Карта: объекты в окне координат
+        ('map_bbox',
+         """SELECT inner_id FROM excel_properties
+            WHERE address_position_lat BETWEEN 44.9 AND 45.2
+              AND address_position_lon BETWEEN 38.8 AND 39.2""",
+         {}),
+        # performance_search.py: подсказки по подстроке
+        ('suggest_complex_like',
+         """SELECT complex_name, COUNT(*) FROM excel_properties
+            WHERE LOWER(complex_name) LIKE :query GROUP BY complex_name""",
+         {'query': values['query']}),
+        ('suggest_developer_like',
+         """SELECT developer_name, COUNT(*) FROM excel_properties
+            WHERE LOWER(developer_name) LIKE :query GROUP BY developer_name""",
+         {'query': values['query']}),
+        ('suggest_district_like',
+         """SELECT parsed_district, COUNT(*) FROM excel_properties
+            WHERE LOWER(parsed_district) LIKE :query GROUP BY parsed_district""",
+         {'query': values['query']}),
+        ('suggest_street_like',
+         "SELECT COUNT(*) FROM excel_properties WHERE LOWER(complex_sales_address) LIKE :query",
+         {'query': values['query']}),
+    ]
+
+
+def _seq_scans(plan):
+    """Рекурсивно ищет Seq Scan по excel_properties в JSON-плане"""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') == 'excel_properties':
+        found.append(plan)
+    for child in plan.get('Plans', []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def run_benchmark():
+    """Возвращает количество запросов с регрессией плана"""
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            print("⚠️ Бенчмарк планов работает только с PostgreSQL (DATABASE_URL)")
+            return 0
+
+        failures = 0
+        print(f"{'запрос':<28} {'время, мс':>10}  план")
+        for name, sql, params in get_query_shapes():
+            db.session.execute(text("SET LOCAL enable_seqscan = off"))
+            raw = db.session.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"), params).scalar()
+            db.session.rollback()
+
+            explain = raw if isinstance(raw, list) else json.loads(raw)
+            plan = explain[0]['Plan']
+            execution_ms = explain[0].get('Execution Time', 0)
+            scans = _seq_scans(plan)
+            status = '❌ Seq Scan' if scans else f"✅ {plan.get('Node Type')}"
+            print(f"{name:<28} {execution_ms:>10.2f}  {status}")
+            if scans:
+                failures += 1
+
+        if failures:
+            print(f"\n❌ {failures} запрос(ов) читают excel_properties последовательным сканированием")
+        else:
+            print("\n✅ Все запросы используют индексы")
+        return failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if run_benchmark() else 0)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк SubscriptionIndex против проверки каждой квартиры каждым поиском.
+
+Генерирует синтетические сохраненные поиски (комнаты, цена в млн, площадь,
+районы, застройщики — как в additional_filters) и порцию новых квартир из
+импорта. Полный перебор для всех поисков занял бы слишком долго, поэтому он
+запускается на выборке поисков и пересчитывается на все; на той же выборке
+проверяется, что индекс находит ровно те же пары.
+
+    python benchmark_saved_search_matching.py            # 100k поисков × 10k квартир
+    python benchmark_saved_search_matching.py --searches 20000 --listings 5000
+"""
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from saved_search_matching import ListingBatch, SearchPredicate, SubscriptionIndex
+
+DISTRICTS = [f"Район {i}" for i in range(40)]
+DEVELOPERS = [f"Застройщик {i}" for i in range(150)]
+ROOM_VALUES = ['студия', '1', '2', '3', '4+']
+
+
+def generate_searches(count, seed=7):
+    rng = random.Random(seed)
+    predicates = []
+    for search_id in range(1, count + 1):
+        filters = {}
+        if rng.random() < 0.85:
+            filters['rooms'] = rng.sample(ROOM_VALUES, rng.choice([1, 1, 2]))
+        if rng.random() < 0.8:
+            low = rng.choice([2, 3, 4, 5, 6, 8])
+            filters['priceFrom'] = str(low)
+            filters['priceTo'] = str(low + rng.choice([2, 3, 4, 6]))
+        elif rng.random() < 0.5:
+            filters['priceTo'] = str(rng.choice([5, 7, 10]))
+        if rng.random() < 0.6:
+            filters['districts'] = rng.sample(DISTRICTS, rng.choice([1, 2, 3]))
+        if rng.random() < 0.15:
+            filters['developers'] = rng.sample(DEVELOPERS, rng.choice([1, 2]))
+        if rng.random() < 0.3:
+            filters['areaFrom'] = str(rng.choice([30, 40, 50, 60]))
+        predicate = SearchPredicate.from_search(search_id, json.dumps(filters, ensure_ascii=False))
+        if predicate is not None:
+            predicates.append(predicate)
+    return predicates
+
+
+def generate_listings(count, seed=42):
+    rng = random.Random(seed)
+    return [{
+        'change_id': 1000 + i,
+        'rooms': rng.choice([0, 1, 1, 2, 2, 3, 4, 5]),
+        'price': rng.randint(2_500_000, 25_000_000),
+        'area': round(rng.uniform(20, 120), 1),
+        'district': rng.choice(DISTRICTS),
+        'developer': rng.choice(DEVELOPERS),
+    } for i in range(count)]
+
+
+def brute_force(predicates, listings):
+    return {(predicate.search_id, position)
+            for predicate in predicates
+            for position, listing in enumerate(listings)
+            if predicate.matches(listing)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--searches', type=int, default=100_000)
+    parser.add_argument('--listings', type=int, default=10_000)
+    parser.add_argument('--sample', type=int, default=300, help='поисков для полного перебора')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    predicates = generate_searches(args.searches)
+    listings = generate_listings(args.listings)
+    print(f"Сгенерировано: {len(predicates)} поисков, {len(listings)} квартир "
+          f"({time.perf_counter() - started:.1f} с)")
+
+    started = time.perf_counter()
+    index = SubscriptionIndex(predicates)
+    build_seconds = time.perf_counter() - started
+    batch = ListingBatch(listings)
+
+    started = time.perf_counter()
+    searches, positions = index.match(batch)
+    matches = index.group(searches, positions)
+    match_seconds = time.perf_counter() - started
+    print(f"Индекс: {len(index.postings)} ключей, построение {build_seconds:.2f} с")
+    print(f"Сопоставление: {match_seconds:.2f} с, {len(searches)} пар, "
+          f"{len(matches)} поисков с новыми квартирами")
+
+    sample = random.Random(1).sample(predicates, min(args.sample, len(predicates)))
+    started = time.perf_counter()
+    expected = brute_force(sample, listings)
+    brute_seconds = (time.perf_counter() - started) * len(predicates) / len(sample)
+    sample_ids = {predicate.search_id for predicate in sample}
+    found = {(search_id, int(position)) for search_id, found_positions in matches.items()
+             if search_id in sample_ids for position in found_positions}
+    print(f"Полный перебор (оценка по {len(sample)} поискам): {brute_seconds:.1f} с "
+          f"-> ускорение x{brute_seconds / match_seconds:.0f}")
+    if found != expected:
+        raise SystemExit(f"Расхождение с перебором: лишних {len(found - expected)}, "
+                         f"пропущено {len(expected - found)}")
+    print(f"Совпадает с перебором на выборке ({len(expected)} пар)")
+
+    # Водяные знаки: уже проверенные изменения не возвращаются повторно
+    index.watermark[:] = np.int64(1000 + args.listings // 2)
+    started = time.perf_counter()
+    searches, _ = index.match(batch)
+    print(f"Повтор с водяными знаками на середине порции: {time.perf_counter() - started:.2f} с, "
+          f"{len(searches)} пар")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1013 @@
+"""
+API сравнения квартир и ЖК, сохраненного в БД: сравнение пользователя
+(/api/comparison/*) и менеджера (/api/manager/comparison/*).
+
+Первый из разделов app.py, вынесенный в отдельный blueprint; регистрируется
+в app.py рядом с notification_settings_bp. Эндпоинты вызываются только из JS
+по URL, поэтому смена имен эндпоинтов на comparison.* ничего не ломает.
+"""
+import logging
+
+from flask import Blueprint, jsonify, request, session
+from flask_login import current_user, login_required
+
+from app import db, manager_required, normalize_property_id, property_repository
+
+comparison_bp = Blueprint('comparison', __name__)
+logger = logging.getLogger('app.comparison')
+
+
+# Manager Comparison API Routes for Database Persistence
+@comparison_bp.route('/api/manager/comparison/load', methods=['GET'])
+@manager_required
+def manager_load_comparison():
+    """Load manager's comparison from database"""
+    try:
+        from models import ManagerComparison, ComparisonProperty, ComparisonComplex
+        
+        manager_id = session.get('manager_id')
+        
+        # Get or create active comparison for manager
+        comparison = ManagerComparison.query.filter_by(
+            manager_id=manager_id, 
+            is_active=True
+        ).first()
+        
+        if not comparison:
+            comparison = ManagerComparison(
+                manager_id=manager_id,
+                name='Сравнение для клиента',
+                is_active=True
+            )
+            db.session.add(comparison)
+            db.session.commit()
+        
+        # Get properties and complexes
+        properties = []
+        complexes = []
+        
+        for cp in comparison.comparison_properties:
+            properties.append({
+                'property_id': cp.property_id,
+                'property_name': cp.property_name,
+                'property_price': cp.property_price,
+                'complex_name': cp.complex_name,
+                'area': cp.area,
+                'rooms': cp.rooms,
+                'order_index': cp.order_index
+            })
+            
+        for cc in comparison.comparison_complexes:
+            complexes.append({
+                'complex_id': cc.complex_id,
+                'complex_name': cc.complex_name,
+                'developer_name': cc.developer_name,
+                'min_price': cc.min_price,
+                'max_price': cc.max_price,
+                'district': cc.district,
+                'photo': cc.photo,
+                'buildings_count': cc.buildings_count,
+                'apartments_count': cc.apartments_count,
+                'completion_date': cc.completion_date,
+                'status': cc.status,
+                'complex_class': cc.complex_class,
+                'order_index': cc.order_index
+            })
+        
+        # Sort by order_index
+        properties.sort(key=lambda x: x['order_index'])
+        complexes.sort(key=lambda x: x['order_index'])
+        
+        return jsonify({
+            'success': True,
+            'comparison_id': comparison.id,
+            'properties': properties,
+            'complexes': complexes
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/manager/comparison/save-property', methods=['POST'])
+@manager_required
+def manager_save_comparison_property():
+    """Add property to manager's comparison"""
+    try:
+        from models import ManagerComparison, ComparisonProperty
+        
+        data = request.get_json()
+        manager_id = session.get('manager_id')
+        
+        property_id = data.get('property_id')
+        if not property_id:
+            return jsonify({'success': False, 'error': 'Property ID required'})
+        
+        # Get or create active comparison
+        comparison = ManagerComparison.query.filter_by(
+            manager_id=manager_id,
+            is_active=True
+        ).first()
+        
+        if not comparison:
+            comparison = ManagerComparison(
+                manager_id=manager_id,
+                name='Сравнение для клиента',
+                is_active=True
+            )
+            db.session.add(comparison)
+            db.session.flush()
+        
+        # Check if property already exists
+        existing = ComparisonProperty.query.filter_by(
+            manager_comparison_id=comparison.id,
+            property_id=property_id
+        ).first()
+        
+        if existing:
+            return jsonify({'success': True, 'message': 'Property already in comparison'})
+        
+        # Get next order index
+        max_order = db.session.query(db.func.max(ComparisonProperty.order_index)).filter_by(
+            manager_comparison_id=comparison.id
+        ).scalar() or 0
+        
+        # Create new comparison property
+        comparison_property = ComparisonProperty(
+            manager_comparison_id=comparison.id,
+            property_id=property_id,
+            property_name=data.get('property_name', ''),
+            property_price=data.get('property_price', 0),
+            complex_name=data.get('complex_name', ''),
+            area=data.get('area', 0),
+            rooms=data.get('rooms', ''),
+            order_index=max_order + 1
+        )
+        
+        db.session.add(comparison_property)
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Property added to comparison'})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/manager/comparison/save-complex', methods=['POST'])
+@manager_required
+def manager_save_comparison_complex():
+    """Add complex to manager's comparison"""
+    try:
+        from models import ManagerComparison, ComparisonComplex
+        
+        data = request.get_json()
+        manager_id = session.get('manager_id')
+        
+        logger.debug("save-complex: manager_id=%s, data=%s", manager_id, data)
+        
+        complex_id = data.get('complex_id')
+        if not complex_id:
+            logger.debug("save-complex: Complex ID missing")
+            return jsonify({'success': False, 'error': 'Complex ID required'})
+        
+        logger.debug("save-complex: complex_id=%s", complex_id)
+        
+        # Get REAL data from excel_properties for buildings_count, apartments_count, and PRICES
+        complex_name = data.get('complex_name', '')
+        real_buildings_count = 0
+        real_apartments_count = 0
+        real_min_price = 0
+        real_max_price = 0
+        
+        if complex_name:
+            try:
+                from sqlalchemy import text
+                real_data = db.session.execute(text("""
+                    SELECT 
+                        COUNT(*) as apartments_count,
+                        CASE 
+                            WHEN COUNT(DISTINCT ep.complex_building_id) > 0 
+                            THEN COUNT(DISTINCT ep.complex_building_id)
+                            WHEN COUNT(DISTINCT NULLIF(ep.complex_building_name, '')) > 0 
+                            THEN COUNT(DISTINCT NULLIF(ep.complex_building_name, ''))
+                            ELSE GREATEST(1, CEIL(COUNT(*) / 3.0))
+                        END as buildings_count,
+                        MIN(ep.price) as real_min_price,
+                        MAX(ep.price) as real_max_price
+                    FROM excel_properties ep
+                    WHERE ep.complex_name = :complex_name
+                """), {'complex_name': complex_name}).fetchone()
+                
+                if real_data:
+                    real_apartments_count = int(real_data[0] or 0)
+                    real_buildings_count = int(real_data[1] or 1)
+                    real_min_price = int(real_data[2] or 0)
+                    real_max_price = int(real_data[3] or 0)
+                    logger.debug("save-complex: Found REAL data - apartments: %s, buildings: %s, price: %s-%s", real_apartments_count, real_buildings_count, real_min_price, real_max_price)
+                else:
+                    logger.debug("save-complex: No real data found for complex: %s", complex_name)
+                    # Fallback to passed data
+                    real_apartments_count = data.get('apartments_count', 0)
+                    real_buildings_count = data.get('buildings_count', 0)
+                    real_min_price = data.get('min_price', 0)
+                    real_max_price = data.get('max_price', 0)
+            except Exception as e:
+                logger.error("save-complex: Error getting real data: %s", e)
+                # Fallback to passed data
+                real_apartments_count = data.get('apartments_count', 0)
+                real_buildings_count = data.get('buildings_count', 0)
+                real_min_price = data.get('min_price', 0)
+                real_max_price = data.get('max_price', 0)
+        
+        # Get or create active comparison
+        comparison = ManagerComparison.query.filter_by(
+            manager_id=manager_id,
+            is_active=True
+        ).first()
+        
+        if not comparison:
+            logger.debug("save-complex: Creating new comparison")
+            comparison = ManagerComparison(
+                manager_id=manager_id,
+                name='Сравнение для клиента',
+                is_active=True
+            )
+            db.session.add(comparison)
+            db.session.flush()
+        
+        logger.debug("save-complex: comparison_id=%s", comparison.id)
+        
+        # Check if complex already exists
+        existing = ComparisonComplex.query.filter_by(
+            manager_comparison_id=comparison.id,
+            complex_id=complex_id
+        ).first()
+        
+        if existing:
+            logger.debug("save-complex: Complex %s already exists", complex_id)
+            return jsonify({'success': True, 'message': 'Complex already in comparison'})
+        
+        # Get next order index
+        max_order = db.session.query(db.func.max(ComparisonComplex.order_index)).filter_by(
+            manager_comparison_id=comparison.id
+        ).scalar() or 0
+        
+        logger.debug("save-complex: max_order=%s", max_order)
+        
+        # Create new comparison complex
+        comparison_complex = ComparisonComplex(
+            manager_comparison_id=comparison.id,
+            complex_id=complex_id,
+            complex_name=data.get('complex_name', ''),
+            developer_name=data.get('developer_name', ''),
+            min_price=real_min_price,
+            max_price=real_max_price,
+            district=data.get('district', ''),
+            photo=data.get('photo', ''),
+            buildings_count=real_buildings_count,
+            apartments_count=real_apartments_count,
+            completion_date=data.get('completion_date', ''),
+            status=data.get('status', ''),
+            complex_class=data.get('complex_class', ''),
+            order_index=max_order + 1
+        )
+        
+        logger.debug("save-complex: Created object with complex_id=%s", comparison_complex.complex_id)
+        
+        db.session.add(comparison_complex)
+        db.session.commit()
+        
+        logger.debug("save-complex: Successfully saved complex %s to database", complex_id)
+        
+        return jsonify({'success': True, 'message': 'Complex added to comparison'})
+        
+    except Exception as e:
+        logger.error("save-complex: Exception %s", e)
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/manager/comparison/remove-property', methods=['DELETE'])
+@manager_required
+def manager_remove_comparison_property():
+    """Remove property from manager's comparison"""
+    try:
+        from models import ManagerComparison, ComparisonProperty
+        
+        data = request.get_json()
+        manager_id = session.get('manager_id')
+        property_id = data.get('property_id')
+        
+        if not property_id:
+            return jsonify({'success': False, 'error': 'Property ID required'})
+        
+        # Find and remove the property
+        comparison = ManagerComparison.query.filter_by(
+            manager_id=manager_id,
+            is_active=True
+        ).first()
+        
+        if not comparison:
+            return jsonify({'success': False, 'error': 'No active comparison found'})
+        
+        property_to_remove = ComparisonProperty.query.filter_by(
+            manager_comparison_id=comparison.id,
+            property_id=property_id
+        ).first()
+        
+        if property_to_remove:
+            db.session.delete(property_to_remove)
+            db.session.commit()
+            return jsonify({'success': True, 'message': 'Property removed from comparison'})
+        else:
+            return jsonify({'success': False, 'error': 'Property not found in comparison'})
+            
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/manager/comparison/remove-complex', methods=['DELETE'])
+@manager_required
+def manager_remove_comparison_complex():
+    """Remove complex from manager's comparison"""
+    try:
+        from models import ManagerComparison, ComparisonComplex
+        
+        data = request.get_json()
+        manager_id = session.get('manager_id')
+        complex_id = data.get('complex_id')
+        
+        if not complex_id:
+            return jsonify({'success': False, 'error': 'Complex ID required'})
+        
+        # Find and remove the complex
+        comparison = ManagerComparison.query.filter_by(
+            manager_id=manager_id,
+            is_active=True
+        ).first()
+        
+        if not comparison:
+            return jsonify({'success': False, 'error': 'No active comparison found'})
+        
+        complex_to_remove = ComparisonComplex.query.filter_by(
+            manager_comparison_id=comparison.id,
+            complex_id=complex_id
+        ).first()
+        
+        if complex_to_remove:
+            db.session.delete(complex_to_remove)
+            db.session.commit()
+            return jsonify({'success': True, 'message': 'Complex removed from comparison'})
+        else:
+            return jsonify({'success': False, 'error': 'Complex not found in comparison'})
+            
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/manager/comparison/clear', methods=['POST'])
+@manager_required
+def manager_clear_comparison():
+    """Clear all items from manager's comparison"""
+    try:
+        from models import ManagerComparison, ComparisonProperty, ComparisonComplex
+        
+        manager_id = session.get('manager_id')
+        
+        logger.debug("clear: Starting clear for manager_id=%s", manager_id)
+        
+        # Find active comparison
+        comparison = ManagerComparison.query.filter_by(
+            manager_id=manager_id,
+            is_active=True
+        ).first()
+        
+        if comparison:
+            logger.debug("clear: Found comparison_id=%s", comparison.id)
+            
+            # Count items before deletion
+            properties_count = ComparisonProperty.query.filter_by(manager_comparison_id=comparison.id).count()
+            complexes_count = ComparisonComplex.query.filter_by(manager_comparison_id=comparison.id).count()
+            
+            logger.debug("clear: Found %s properties, %s complexes to delete", properties_count, complexes_count)
+            
+            # Remove all properties and complexes
+            ComparisonProperty.query.filter_by(manager_comparison_id=comparison.id).delete()
+            ComparisonComplex.query.filter_by(manager_comparison_id=comparison.id).delete()
+            db.session.commit()
+            
+            logger.debug("clear: Successfully cleared comparison")
+        else:
+            logger.debug("clear: No active comparison found for manager %s", manager_id)
+        
+        return jsonify({'success': True, 'message': 'Comparison cleared'})
+        
+    except Exception as e:
+        logger.exception("clear: Exception %s", e)
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/manager/comparison/count', methods=['GET'])
+@manager_required
+def manager_comparison_count():
+    """Get count of items in manager's comparison"""
+    try:
+        from models import ManagerComparison, ComparisonProperty, ComparisonComplex
+        
+        manager_id = session.get('manager_id')
+        
+        # Get active comparison for manager
+        comparison = ManagerComparison.query.filter_by(
+            manager_id=manager_id, 
+            is_active=True
+        ).first()
+        
+        if not comparison:
+            return jsonify({
+                'success': True,
+                'properties_count': 0,
+                'complexes_count': 0,
+                'total_count': 0
+            })
+        
+        # Count items
+        properties_count = ComparisonProperty.query.filter_by(manager_comparison_id=comparison.id).count()
+        complexes_count = ComparisonComplex.query.filter_by(manager_comparison_id=comparison.id).count()
+        total_count = properties_count + complexes_count
+        
+        return jsonify({
+            'success': True,
+            'properties_count': properties_count,
+            'complexes_count': complexes_count,
+            'total_count': total_count
+        })
+        
+    except Exception as e:
+        logging.error(f"❌ Error getting comparison count: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+
+
+# User Comparison API Routes for Database Persistence
+@comparison_bp.route('/api/comparison/load', methods=['GET'])
+@login_required
+def load_comparison():
+    """Load user's comparison from database"""
+    from models import UserComparison, ComparisonProperty, ComparisonComplex
+    
+    try:
+        # Get or create user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            user_comparison = UserComparison(
+                user_id=current_user.id,
+                name="Мое сравнение"
+                # ✅ ИСПРАВЛЕНО: Убрано несуществующее поле description
+            )
+            db.session.add(user_comparison)
+            db.session.commit()
+        
+        # Get properties in comparison
+        properties = []
+        comparison_properties = ComparisonProperty.query.filter_by(
+            user_comparison_id=user_comparison.id
+        ).order_by(ComparisonProperty.order_index).all()
+        
+        # Данные всех квартир сравнения одним запросом (с LRU) вместо двух SELECT на каждую
+        property_rows = property_repository.get_many(cp.property_id for cp in comparison_properties)
+        
+        for cp in comparison_properties:
+            # ✅ ИСПРАВЛЕНИЕ: Обогащаем property данные из excel_properties для нормализованных полей
+            property_completion_date = 'Не указано'
+            property_object_min_floor = None
+            property_object_max_floor = None  
+            property_developer_name = cp.complex_name or 'Не указано'
+            property_finishing = 'Не указано'
+            
+            logger.debug("User comparison searching for property with cp.property_id: %s", cp.property_id)
+            
+            if cp.property_id:
+                try:
+                    # ✅ НОВОЕ: Ищем в excel_properties для property данных
+                    property_result = property_rows.get(str(normalize_property_id(cp.property_id)))
+                    if property_result:
+                        # ✅ Формируем completion_date из года и квартала
+                        if property_result['complex_building_end_build_year']:
+                            year = property_result['complex_building_end_build_year']
+                            quarter = property_result['complex_building_end_build_quarter']
+                            if quarter:
+                                property_completion_date = f"{quarter} кв. {year} г."
+                            else:
+                                property_completion_date = f"{year} г."
+                        
+                        # ✅ Устанавливаем floor данные из excel_properties
+                        property_object_min_floor = property_result['object_min_floor']
+                        property_object_max_floor = property_result['object_max_floor']
+                        
+                        # ✅ Обновляем другие поля
+                        if property_result['developer_name']:
+                            property_developer_name = property_result['developer_name']
+                        if property_result['renovation_display_name']:
+                            property_finishing = property_result['renovation_display_name']
+                        
+                        logger.debug("Found user property in excel_properties: %s, completion_date=%s, floors=%s-%s", property_result['complex_name'], property_completion_date, property_object_min_floor, property_object_max_floor)
+                    else:
+                        logger.debug("User property not found in excel_properties for property_id: %s", cp.property_id)
+                        
+                except Exception as e:
+                    logger.error("property lookup: Exception %s", e)
+                    
+            # ✅ ИСПРАВЛЕНО: Обогащаем данные из excel_properties если таблица comparison_properties пустая
+            enriched_property_name = cp.property_name
+            enriched_property_price = cp.property_price
+            enriched_area = cp.area
+            enriched_rooms = cp.rooms
+            enriched_complex_name = cp.complex_name
+            enriched_address = 'Адрес не указан'  # ✅ НОВОЕ: Инициализация адреса
+            enriched_photos = ''  # ✅ НОВОЕ: Инициализация фотографий
+            
+            if cp.property_id and (not enriched_property_name or enriched_property_price == 0):
+                try:
+                    # Получаем полные данные из excel_properties
+                    prop_data = property_rows.get(str(normalize_property_id(cp.property_id)))
+                    if prop_data:
+                        enriched_rooms = prop_data['object_rooms'] if prop_data['object_rooms'] is not None else 0
+                        enriched_area = prop_data['object_area'] if prop_data['object_area'] else 0
+                        enriched_property_price = prop_data['price'] if prop_data['price'] else 0
+                        enriched_complex_name = prop_data['complex_name'] if prop_data['complex_name'] else enriched_complex_name
+                        
+                        # ✅ НОВОЕ: Добавляем адрес и фотографии
+                        enriched_address = prop_data['address_display_name'] if prop_data['address_display_name'] else 'Адрес не указан'
+                        enriched_photos = prop_data['photos'] if prop_data['photos'] else ''
+                        
+                        # ✅ Формируем правильное название квартиры
+                        if enriched_rooms == 0:
+                            rooms_text = "Студия"
+                        else:
+                            rooms_text = f"{enriched_rooms}-комн"
+                        
+                        area_text = f", {enriched_area} м²" if enriched_area else ""
+                        enriched_property_name = f"{rooms_text}{area_text}"
+                        
+                        logger.debug("Enriched property data: %s, price=%s, area=%s, address=%s, photos=%s", enriched_property_name, enriched_property_price, enriched_area, enriched_address, enriched_photos)
+                    
+                except Exception as e:
+                    logger.error("Error enriching property data: %s", e)
+            
+            properties.append({
+                'property_id': cp.property_id,
+                'property_name': enriched_property_name,
+                'property_price': enriched_property_price,
+                'complex_name': enriched_complex_name,
+                'area': enriched_area,
+                'rooms': enriched_rooms,
+                'order_index': cp.order_index,
+                'added_at': cp.added_at.isoformat() if cp.added_at else None,
+                # ✅ НОВЫЕ ПОЛЯ: Нормализованные данные для comparison page
+                'completion_date': property_completion_date,
+                'object_min_floor': property_object_min_floor,
+                'object_max_floor': property_object_max_floor,
+                'developer_name': property_developer_name,
+                'finishing': property_finishing,
+                # ✅ НОВЫЕ ПОЛЯ: Адрес и фотографии
+                'address': enriched_address,
+                'photos': enriched_photos
+            })
+        
+        # Get complexes in comparison
+        complexes = []
+        comparison_complexes = ComparisonComplex.query.filter_by(
+            user_comparison_id=user_comparison.id
+        ).order_by(ComparisonComplex.order_index).all()
+        
+        for cc in comparison_complexes:
+            # ✅ ИСПРАВЛЕНИЕ: Ищем реальные данные в excel_properties для системы сравнения пользователей
+            real_complex_name = cc.complex_name or 'ЖК'
+            real_developer_name = cc.developer_name or 'Не указано'
+            real_district = cc.district or 'Не указано'
+            real_min_price = cc.min_price or 0
+            real_max_price = cc.max_price or 0
+            real_photo = cc.photo or ''
+            real_buildings_count = cc.buildings_count or 0
+            real_apartments_count = cc.apartments_count or 0
+            real_completion_date = cc.completion_date or 'Не указано'
+            real_complex_class = cc.complex_class or 'Не указано'
+            real_renovation = 'Не указано'  # ✅ Новое поле "Отделка"
+            real_floors_min = 0  # ✅ Инициализация этажности
+            real_floors_max = 0
+            
+            logger.debug("User comparison searching for complex with cc.complex_id: %s", cc.complex_id)
+            
+            if cc.complex_id:
+                try:
+                    # ✅ НОВОЕ: Ищем в excel_properties используя тот же SQL что и для избранного
+                    excel_complex_query = db.session.execute(text("""
+                        SELECT 
+                            ep.complex_name,
+                            COUNT(*) as apartments_count,
+                            MIN(ep.price) as price_from,
+                            MAX(ep.price) as price_to,
+                            MAX(ep.developer_name) as developer_name,
+                            MAX(ep.address_display_name) as address_display_name,
+                            MAX(ep.complex_object_class_display_name) as complex_class,
+                            MAX(ep.renovation_display_name) as renovation_display_name,
+                            MAX(ep.complex_building_end_build_year) as end_build_year,
+                            MAX(ep.complex_building_end_build_quarter) as end_build_quarter,
+                            MIN(ep.object_min_floor) as floors_min,
+                            MAX(ep.object_max_floor) as floors_max,
+                            COALESCE(rc.id, ROW_NUMBER() OVER (ORDER BY ep.complex_name) + 1000) as real_id,
+                            CASE 
+                                WHEN COUNT(DISTINCT ep.complex_building_id) > 0 
+                                THEN COUNT(DISTINCT ep.complex_building_id)
+                                WHEN COUNT(DISTINCT NULLIF(ep.complex_building_name, '')) > 0 
+                                THEN COUNT(DISTINCT NULLIF(ep.complex_building_name, ''))
+                                ELSE GREATEST(1, CEIL(COUNT(*) / 3.0))
+                            END as buildings_count,
+                            (SELECT photos FROM excel_properties p2 
+                             WHERE p2.complex_name = ep.complex_name 
+                             AND p2.photos IS NOT NULL 
+                             ORDER BY p2.price DESC LIMIT 1) as photos
+                        FROM excel_properties ep
+                        LEFT JOIN residential_complexes rc ON rc.name = ep.complex_name
+                        GROUP BY ep.complex_name, rc.id
+                        ORDER BY ep.complex_name
+                    """))
+                    
+                    # Находим комплекс с нужным ID
+                    target_id = int(cc.complex_id)
+                    for row in excel_complex_query:
+                        if int(row.real_id) == target_id:
+                            real_complex_name = row.complex_name
+                            real_developer_name = row.developer_name or real_developer_name
+                            real_min_price = int(row.price_from) if row.price_from else 0
+                            real_max_price = int(row.price_to) if row.price_to else 0
+                            real_apartments_count = int(row.apartments_count) if row.apartments_count else 0
+                            real_buildings_count = int(row.buildings_count) if row.buildings_count else 0
+                            real_complex_class = row.complex_class or real_complex_class
+                            real_renovation = row.renovation_display_name or 'Не указано'  # ✅ Добавили отделку
+                            real_floors_min = int(row.floors_min) if row.floors_min else 0  # ✅ Этажность мин
+                            real_floors_max = int(row.floors_max) if row.floors_max else 0  # ✅ Этажность макс
+                            
+                            # Формируем дату сдачи
+                            if row.end_build_year and row.end_build_quarter:
+                                quarters = {1: 'I кв.', 2: 'II кв.', 3: 'III кв.', 4: 'IV кв.'}
+                                quarter_name = quarters.get(row.end_build_quarter, f'{row.end_build_quarter} кв.')
+                                real_completion_date = f"{quarter_name} {row.end_build_year} г."
+                            
+                            # Парсим фото
+                            if row.photos:
+                                try:
+                                    import json
+                                    photos = json.loads(row.photos) if isinstance(row.photos, str) else row.photos
+                                    if photos and isinstance(photos, list) and len(photos) > 0:
+                                        real_photo = photos[0]  # Берем первое фото
+                                except:
+                                    pass
+                            
+                            logger.debug("Found user comparison complex in excel_properties: %s", real_complex_name)
+                            break
+                    else:
+                        logger.debug("User comparison complex with ID %s not found in excel_properties", cc.complex_id)
+                
+                except Exception as e:
+                    logger.error("Error searching user comparison excel_properties: %s", e)
+            
+            complexes.append({
+                'complex_id': cc.complex_id,
+                'complex_name': real_complex_name,
+                'name': real_complex_name,  # ✅ ИСПРАВЛЕНИЕ: Добавлено поле 'name' для JavaScript
+                'developer_name': real_developer_name,
+                'district': real_district,
+                'min_price': real_min_price,
+                'max_price': real_max_price,
+                'photo': real_photo,
+                'buildings_count': real_buildings_count,
+                'apartments_count': real_apartments_count,
+                'completion_date': real_completion_date,
+                'status': cc.status,
+                'complex_class': real_complex_class,
+                'renovation': real_renovation,  # ✅ Добавили поле "Отделка"
+                'floors_min': real_floors_min,  # ✅ Этажность минимальная
+                'floors_max': real_floors_max,  # ✅ Этажность максимальная
+                'order_index': cc.order_index,
+                'added_at': cc.added_at.isoformat() if cc.added_at else None
+            })
+        
+        return jsonify({
+            'success': True,
+            'comparison': user_comparison.to_dict(),
+            'properties': properties,
+            'complexes': complexes
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/comparison/save-property', methods=['POST'])
+@login_required  
+def save_comparison_property():
+    """Save property to user's comparison"""
+    from models import UserComparison, ComparisonProperty
+    
+    try:
+        data = request.get_json()
+        property_id = data.get('property_id')
+        
+        if not property_id:
+            return jsonify({'success': False, 'error': 'property_id required'}), 400
+        
+        # Get or create user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            user_comparison = UserComparison(
+                user_id=current_user.id,
+                name="Мое сравнение"
+                # ✅ ИСПРАВЛЕНО: Убрано несуществующее поле description
+            )
+            db.session.add(user_comparison)
+            db.session.commit()
+        
+        # Check if property already in comparison
+        existing = ComparisonProperty.query.filter_by(
+            user_comparison_id=user_comparison.id,
+            property_id=property_id
+        ).first()
+        
+        if existing:
+            return jsonify({'success': True, 'message': 'Property already in comparison'})
+        
+        # Get max order index
+        max_order = db.session.query(db.func.max(ComparisonProperty.order_index)).filter_by(
+            user_comparison_id=user_comparison.id
+        ).scalar() or 0
+        
+        # Add property to comparison
+        comparison_property = ComparisonProperty(
+            user_comparison_id=user_comparison.id,
+            property_id=property_id,
+            property_name=data.get('property_name', ''),
+            property_price=data.get('property_price', 0),
+            complex_name=data.get('complex_name', ''),
+            area=data.get('area', 0),
+            rooms=data.get('rooms', ''),
+            order_index=max_order + 1
+        )
+        
+        db.session.add(comparison_property)
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Property added to comparison'})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/comparison/save-complex', methods=['POST'])
+@login_required
+def save_comparison_complex():
+    """Save residential complex to user's comparison"""
+    from models import UserComparison, ComparisonComplex
+    
+    try:
+        data = request.get_json()
+        complex_id = data.get('complex_id')
+        
+        if not complex_id:
+            return jsonify({'success': False, 'error': 'complex_id required'}), 400
+        
+        # Get or create user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            user_comparison = UserComparison(
+                user_id=current_user.id,
+                name="Мое сравнение"
+                # ✅ ИСПРАВЛЕНО: Убрано несуществующее поле description
+            )
+            db.session.add(user_comparison)
+            db.session.commit()
+        
+        # Check if complex already in comparison
+        existing = ComparisonComplex.query.filter_by(
+            user_comparison_id=user_comparison.id,
+            complex_id=complex_id
+        ).first()
+        
+        if existing:
+            return jsonify({'success': True, 'message': 'Complex already in comparison'})
+        
+        # Get max order index
+        max_order = db.session.query(db.func.max(ComparisonComplex.order_index)).filter_by(
+            user_comparison_id=user_comparison.id
+        ).scalar() or 0
+        
+        # Add complex to comparison
+        comparison_complex = ComparisonComplex(
+            user_comparison_id=user_comparison.id,
+            complex_id=complex_id,
+            complex_name=data.get('name', ''),
+            developer_name=data.get('developer_name', ''),
+            district=data.get('district', ''),
+            min_price=data.get('min_price', 0),
+            max_price=data.get('max_price', 0),
+            photo=data.get('photo', ''),
+            buildings_count=data.get('buildings_count', 0),
+            apartments_count=data.get('apartments_count', 0),
+            completion_date=data.get('completion_date', ''),
+            status=data.get('status', ''),
+            complex_class=data.get('complex_class', ''),
+            order_index=max_order + 1
+        )
+        
+        db.session.add(comparison_complex)
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Complex added to comparison'})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/comparison/remove-property', methods=['DELETE'])
+@login_required
+def remove_comparison_property():
+    """Remove property from user's comparison"""
+    from models import UserComparison, ComparisonProperty
+    
+    try:
+        data = request.get_json()
+        property_id = data.get('property_id')
+        
+        if not property_id:
+            return jsonify({'success': False, 'error': 'property_id required'}), 400
+        
+        # Get user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            return jsonify({'success': False, 'error': 'No comparison found'}), 404
+        
+        # Remove property from comparison
+        property_to_remove = ComparisonProperty.query.filter_by(
+            user_comparison_id=user_comparison.id,
+            property_id=property_id
+        ).first()
+        
+        if property_to_remove:
+            db.session.delete(property_to_remove)
+            db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Property removed from comparison'})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/comparison/remove-complex', methods=['DELETE'])
+@login_required
+def remove_comparison_complex():
+    """Remove complex from user's comparison"""
+    from models import UserComparison, ComparisonComplex
+    
+    try:
+        data = request.get_json()
+        complex_id = data.get('complex_id')
+        
+        if not complex_id:
+            return jsonify({'success': False, 'error': 'complex_id required'}), 400
+        
+        # Get user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            return jsonify({'success': False, 'error': 'No comparison found'}), 404
+        
+        # Remove complex from comparison
+        complex_to_remove = ComparisonComplex.query.filter_by(
+            user_comparison_id=user_comparison.id,
+            complex_id=complex_id
+        ).first()
+        
+        if complex_to_remove:
+            db.session.delete(complex_to_remove)
+            db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Complex removed from comparison'})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/comparison/clear', methods=['POST'])
+@login_required
+def clear_comparison():
+    """Clear user's comparison"""
+    from models import UserComparison, ComparisonProperty, ComparisonComplex
+    
+    try:
+        # Get user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            return jsonify({'success': True, 'message': 'No comparison to clear'})
+        
+        # Delete all comparison data for this user
+        ComparisonProperty.query.filter_by(user_comparison_id=user_comparison.id).delete()
+        ComparisonComplex.query.filter_by(user_comparison_id=user_comparison.id).delete()
+        
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Comparison cleared successfully'})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+# ✅ НОВЫЕ API endpoints для новой страницы сравнения с path parameters
+@comparison_bp.route('/api/comparison/remove/property/<property_id>', methods=['DELETE'])
+@login_required
+def remove_comparison_property_by_id(property_id):
+    """Remove property from user's comparison by ID"""
+    from models import UserComparison, ComparisonProperty
+    
+    try:
+        # Get user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            return jsonify({'success': False, 'error': 'No comparison found'}), 404
+        
+        # Remove property from comparison
+        property_to_remove = ComparisonProperty.query.filter_by(
+            user_comparison_id=user_comparison.id,
+            property_id=property_id
+        ).first()
+        
+        if property_to_remove:
+            db.session.delete(property_to_remove)
+            db.session.commit()
+            logging.info(f"✅ Property {property_id} removed from comparison for user {current_user.id}")
+        
+        return jsonify({'success': True, 'message': 'Property removed from comparison'})
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"❌ Error removing property from comparison: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/comparison/remove/complex/<complex_id>', methods=['DELETE'])
+@login_required
+def remove_comparison_complex_by_id(complex_id):
+    """Remove complex from user's comparison by ID"""
+    from models import UserComparison, ComparisonComplex
+    
+    try:
+        # Get user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            return jsonify({'success': False, 'error': 'No comparison found'}), 404
+        
+        # Remove complex from comparison
+        complex_to_remove = ComparisonComplex.query.filter_by(
+            user_comparison_id=user_comparison.id,
+            complex_id=complex_id
+        ).first()
+        
+        if complex_to_remove:
+            db.session.delete(complex_to_remove)
+            db.session.commit()
+            logging.info(f"✅ Complex {complex_id} removed from comparison for user {current_user.id}")
+        
+        return jsonify({'success': True, 'message': 'Complex removed from comparison'})
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"❌ Error removing complex from comparison: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@comparison_bp.route('/api/comparison/clear', methods=['DELETE'])
+@login_required
+def clear_comparison_delete():
+    """Clear user's comparison (DELETE method)"""
+    from models import UserComparison, ComparisonProperty, ComparisonComplex
+    
+    try:
+        # Get user comparison
+        user_comparison = UserComparison.query.filter_by(user_id=current_user.id).first()
+        if not user_comparison:
+            return jsonify({'success': True, 'message': 'No comparison to clear'})
+        
+        # Delete all comparison data for this user
+        ComparisonProperty.query.filter_by(user_comparison_id=user_comparison.id).delete()
+        ComparisonComplex.query.filter_by(user_comparison_id=user_comparison.id).delete()
+        
+        db.session.commit()
+        logging.info(f"✅ Comparison cleared for user {current_user.id}")
+        
+        return jsonify({'success': True, 'message': 'Comparison cleared successfully'})
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"❌ Error clearing comparison: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
@@ -0,0 +1,175 @@
+"""
+Предрасчитанные агрегаты по ЖК (таблица complex_stats).
+
+Страница /residential-complexes и карта ЖК раньше на каждый запрос делали
+GROUP BY по всей excel_properties, коррелированный подзапрос за фото и
+отдельные запросы по каждому ЖК. Теперь агрегаты пересчитываются после
+импорта — только для затронутых ЖК — и страницы читают готовые строки.
+
+    refresh_complex_stats()                      # полный пересчет
+    refresh_complex_stats({'ЖК Солнечный'})      # только эти ЖК
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+_NAMES_FILTER = "AND complex_name IN :names"
+
+AGGREGATES_SQL = """
+    SELECT
+        complex_name,
+        COUNT(*) AS apartments_count,
+        MIN(price) AS price_from,
+        MAX(price) AS price_to,
+        MIN(object_area) AS area_from,
+        MAX(object_area) AS area_to,
+        MIN(object_min_floor) AS floors_min,
+        MAX(object_max_floor) AS floors_max,
+        MAX(developer_name) AS developer_name,
+        MAX(address_display_name) AS address_display_name,
+        MAX(complex_sales_address) AS complex_sales_address,
+        -- Даты корпусов вместо общих дат ЖК
+        MAX(complex_building_end_build_year) AS end_build_year,
+        MAX(complex_building_end_build_quarter) AS end_build_quarter,
+        MAX(complex_object_class_display_name) AS object_class_display_name,
+        COUNT(DISTINCT complex_building_id) AS building_ids,
+        COUNT(DISTINCT NULLIF(complex_building_name, '')) AS building_names,
+        AVG(address_position_lat) AS lat,
+        AVG(address_position_lon) AS lon
+    FROM excel_properties
+    WHERE complex_name IS NOT NULL {names_filter}
+    GROUP BY complex_name
+"""
+
+# Фото ЖК берется из самой дорогой квартиры (как репрезентативное)
+COVER_PHOTOS_SQL = """
+    SELECT complex_name, photos FROM (
+        SELECT complex_name, photos,
+               ROW_NUMBER() OVER (PARTITION BY complex_name ORDER BY price DESC, object_area DESC) AS rn
+        FROM excel_properties
+        WHERE complex_name IS NOT NULL AND photos IS NOT NULL {names_filter}
+    ) ranked
+    WHERE rn = 1
+"""
+
+ROOMS_SQL = """
+    SELECT complex_name, object_rooms, COUNT(*) AS count,
+           MIN(object_area) AS min_area, MAX(object_area) AS max_area,
+           MIN(price) AS min_price, MAX(price) AS max_price
+    FROM excel_properties
+    WHERE complex_name IS NOT NULL {names_filter}
+    GROUP BY complex_name, object_rooms
+    ORDER BY complex_name, object_rooms
+"""
+
+
+def _buildings_count(building_ids, building_names, apartments_count):
+    """Корпуса по id, затем по названиям, иначе примерно 3 квартиры на корпус"""
+    if building_ids:
+        return building_ids
+    if building_names:
+        return building_names
+    return max(1, -(-apartments_count // 3))
+
+
+def _execute(db, sql, names):
+    if names is None:
+        return db.session.execute(text(sql.format(names_filter='')))
+    statement = text(sql.format(names_filter=_NAMES_FILTER)).bindparams(bindparam('names', expanding=True))
+    return db.session.execute(statement, {'names': list(names)})
+
+
+def _room_details(db, names):
+    details = {}
+    for row in _execute(db, ROOMS_SQL, names):
+        rooms = row.object_rooms or 0
+        room_type = f"{rooms}-комн" if rooms > 0 else "Студия"
+        complex_rooms = details.setdefault(row.complex_name, {})
+        previous = complex_rooms.get(room_type)
+        if previous:
+            # NULL и 0 комнат — обе "Студия"
+            previous['count'] += row.count
+            continue
+        complex_rooms[room_type] = {
+            'count': row.count,
+            'area_from': row.min_area or 0,
+            'area_to': row.max_area or 0,
+            'price_from': row.min_price or 0,
+            'price_to': row.max_price or 0,
+        }
+    return details
+
+
+def refresh_complex_stats(complex_names=None):
+    """
+    Пересчитывает complex_stats для указанных ЖК (или для всех, если None).
+    ЖК, у которых не осталось квартир, удаляются. Возвращает число обновленных строк.
+    """
+    from app import db
+    from models import ComplexStats
+
+    names = None if complex_names is None else {name for name in complex_names if name}
+    if names is not None and not names:
+        return 0
+
+    cover_photos = {row.complex_name: row.photos for row in _execute(db, COVER_PHOTOS_SQL, names)}
+    room_details = _room_details(db, names)
+    now = datetime.utcnow()
+
+    rows = []
+    for row in _execute(db, AGGREGATES_SQL, names):
+        rows.append({
+            'complex_name': row.complex_name,
+            'apartments_count': row.apartments_count,
+            'buildings_count': _buildings_count(row.building_ids, row.building_names, row.apartments_count),
+            'price_from': row.price_from,
+            'price_to': row.price_to,
+            'area_from': row.area_from,
+            'area_to': row.area_to,
+            'floors_min': row.floors_min,
+            'floors_max': row.floors_max,
+            'developer_name': row.developer_name,
+            'address_display_name': row.address_display_name,
+            'complex_sales_address': row.complex_sales_address,
+            'object_class_display_name': row.object_class_display_name,
+            'end_build_year': row.end_build_year,
+            'end_build_quarter': row.end_build_quarter,
+            'cover_photos': cover_photos.get(row.complex_name),
+            'lat': row.lat,
+            'lon': row.lon,
+            'room_details': json.dumps(room_details.get(row.complex_name, {}), ensure_ascii=False),
+            'updated_at': now,
+        })
+
+    table = ComplexStats.__table__
+    try:
+        if names is None:
+            db.session.execute(table.delete())
+        else:
+            db.session.execute(table.delete().where(table.c.complex_name.in_(names)))
+        if rows:
+            db.session.execute(table.insert(), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+
+def load_complex_stats():
+    """Все строки complex_stats; при пустой таблице (первый запуск) сначала считает их"""
+    from models import ComplexStats
+
+    stats = ComplexStats.query.all()
+    if not stats and refresh_complex_stats():
+        stats = ComplexStats.query.all()
+    return stats
+
+
+def room_details(stats):
+    """Разобранный room_details строки complex_stats"""
+    try:
+        return json.loads(stats.room_details) if stats.room_details else {}
+    except (TypeError, ValueError):
+        return {}
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Создание индексов для таблицы excel_properties.
+Скрипт идемпотентный: можно запускать после каждого деплоя или импорта.
+
+    python create_property_indexes.py                 # обычное создание
+    python create_property_indexes.py --concurrently  # без блокировки записи (PostgreSQL)
+
+B-tree индексы берутся из ExcelProperty.__table_args__, триграммные GIN-индексы
+(pg_trgm) для подсказок LOWER(col) LIKE '%q%' создаются только в PostgreSQL.
+"""
+
+import argparse
+
+from sqlalchemy import text
+
+from app import app, db
+from models import ExcelProperty
+
+# Колонки, по которым performance_search.py и app.py ищут подстроку через LOWER(col) LIKE
+TRIGRAM_COLUMNS = [
+    'complex_name',
+    'developer_name',
+    'parsed_district',
+    'complex_sales_address',
+    'address_display_name',
+]
+
+# Индексы по выражениям, которые встречаются в WHERE как есть
+EXPRESSION_INDEXES = {
+    'idx_excel_properties_developer_upper': 'UPPER(TRIM(developer_name))',
+}
+
+
+def get_index_statements(is_postgres, concurrently=False):
+    """Возвращает список (имя индекса, SQL) для всех индексов excel_properties"""
+    mode = 'CONCURRENTLY ' if (concurrently and is_postgres) else ''
+    statements = []
+
+    for index in sorted(ExcelProperty.__table__.indexes, key=lambda i: i.name):
+        columns = ', '.join(column.name for column in index.columns)
+        statements.append((index.name, f"CREATE INDEX {mode}IF NOT EXISTS {index.name} ON excel_properties ({columns})"))
+
+    for name, expression in EXPRESSION_INDEXES.items():
+        statements.append((name, f"CREATE INDEX {mode}IF NOT EXISTS {name} ON excel_properties ({expression})"))
+
+    if is_postgres:
+        for column in TRIGRAM_COLUMNS:
+            name = f"idx_excel_properties_{column}_trgm"
+            statements.append((name, (
+                f"CREATE INDEX {mode}IF NOT EXISTS {name} ON excel_properties "
+                f"USING gin (LOWER({column}) gin_trgm_ops)"
+            )))
+
+    return statements
+
+
+def create_property_indexes(concurrently=False):
+    """Создает недостающие индексы и обновляет статистику планировщика"""
+    with app.app_context():
+        engine = db.engine
+        is_postgres = engine.dialect.name == 'postgresql'
+        print(f"🔧 Создаем индексы excel_properties ({engine.dialect.name})...")
+
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            if is_postgres:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+            created = 0
+            for name, sql in get_index_statements(is_postgres, concurrently):
+                try:
+                    conn.execute(text(sql))
+                    created += 1
+                    print(f"   ✅ {name}")
+                except Exception as e:
+                    print(f"   ❌ {name}: {e}")
+
+            conn.execute(text("ANALYZE excel_properties"))
+
+        print(f"✅ Готово: {created} индексов проверено/создано")
+        return created
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Создание индексов excel_properties')
+    parser.add_argument('--concurrently', action='store_true',
+                        help='CREATE INDEX CONCURRENTLY (PostgreSQL, без блокировки записи)')
+    args = parser.parse_args()
+    create_property_indexes(concurrently=args.concurrently)
@@ -16,6 +16,8 @@ from playwright.sync_api import sync_playwright
 import requests
 from typing import Dict, List, Optional
 
+from llm_cache import llm_cache
+
 # Проверяем наличие OpenAI
 try:
     import openai
@@ -217,7 +219,10 @@ class DomclickGPTVisionParser:
 - Фокусируйся на новостройках для Краснодара
 """
 
-            response = self.client.chat.completions.create(
+            # Тот же скриншот повторно не распознается (ключ включает хэш картинки)
+            content = llm_cache.complete(
+                self.client,
+                schema_version="domclick_vision:1",
                 model="gpt-4o",  # GPT-4 Vision
                 messages=[
                     {
@@ -237,8 +242,6 @@ class DomclickGPTVisionParser:
                 max_tokens=2000,
                 temperature=0.1
             )
-            
-            content = response.choices[0].message.content
             print(f"🤖 GPT ответ получен: {len(content)} символов")
             
             # Парсим JSON из ответа
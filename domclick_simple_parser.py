@@ -14,6 +14,8 @@ import requests
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from llm_cache import llm_cache
+
 try:
     import openai
     OPENAI_AVAILABLE = True
@@ -107,7 +109,9 @@ HTML код:
 - Фокусируйся на новостройках для Краснодара
 """
 
-            response = self.client.chat.completions.create(
+            content = llm_cache.complete(
+                self.client,
+                schema_version="domclick_html:1",
                 model="gpt-4",  # Используем GPT-4 вместо Vision
                 messages=[
                     {
@@ -118,8 +122,6 @@ HTML код:
                 max_tokens=2000,
                 temperature=0.1
             )
-            
-            content = response.choices[0].message.content
             print(f"🤖 GPT ответ получен: {len(content)} символов")
             
             # Парсим JSON из ответа
@@ -1,59 +1,25 @@
 import os
 import sys
-import smtplib
 import asyncio
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from flask import render_template, url_for, request
 from datetime import datetime
 
-# SendGrid integration - from blueprint:python_sendgrid
-try:
-    from sendgrid import SendGridAPIClient
-    from sendgrid.helpers.mail import Mail, Email, To, Content
-    sendgrid_available = True
-except ImportError:
-    # Fallback classes for LSP compatibility
-    class SendGridAPIClient:
-        def __init__(self, *args): pass
-        def send(self, *args): pass
-    class Mail:
-        def __init__(self, *args, **kwargs): pass
-    class Email:
-        def __init__(self, *args): pass
-    class To:
-        def __init__(self, *args): pass
-    class Content:
-        def __init__(self, *args): pass
-    sendgrid_available = False
-    print("SendGrid not available - falling back to SMTP")
+# SendGrid (blueprint:python_sendgrid) импортируется в send_email_sendgrid только при
+# заданном SENDGRID_API_KEY: пакет не нужен каждому процессу, который импортирует app
 
 # Email configuration - using standard SMTP
-EMAIL_HOST = 'smtp.gmail.com'  # Gmail SMTP для реальной отправки
-EMAIL_PORT = 587
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')  # Gmail SMTP для реальной отправки
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
 EMAIL_USER = os.environ.get('EMAIL_USER', 'test.inback@gmail.com')  # Замените на реальный email
 EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', '')  # App Password от Gmail
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '1') != '0'
+# Без пароля письма отправляются только на явно заданный сервер (например, локальный отладочный)
+SMTP_CONFIGURED = bool(EMAIL_PASSWORD or os.environ.get('EMAIL_HOST'))
 
 # Telegram configuration - using working token
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
 
-try:
-    from telegram.ext import Application
-    from telegram import Bot
-    if TELEGRAM_BOT_TOKEN:
-        telegram_bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        print("✅ Telegram bot initialized successfully")
-    else:
-        telegram_bot = None
-        print("TELEGRAM_BOT_TOKEN not found")
-except ImportError:
-    print("Telegram bot setup failed: ImportError with telegram package")
-    telegram_bot = None
-except Exception as e:
-    telegram_bot = None
-    print(f"Telegram bot setup failed: {e}")
-
 def send_email_sendgrid(to_email, subject, template_name, **template_data):
     """
     Send email using SendGrid with HTML template
@@ -67,15 +33,18 @@ def send_email_sendgrid(to_email, subject, template_name, **template_data):
     Returns:
         bool: True if email sent successfully, False otherwise
     """
-    if not sendgrid_available:
+    sendgrid_key = os.environ.get('SENDGRID_API_KEY')
+    if not sendgrid_key:
+        return send_email_smtp(to_email, subject, template_name, **template_data)
+    
+    try:
+        from sendgrid import SendGridAPIClient
+        from sendgrid.helpers.mail import Mail, Email, To, Content
+    except ImportError:
+        print("SendGrid not available - falling back to SMTP")
         return send_email_smtp(to_email, subject, template_name, **template_data)
     
     try:
-        sendgrid_key = os.environ.get('SENDGRID_API_KEY')
-        if not sendgrid_key:
-            print("SendGrid API key not found - falling back to SMTP")
-            return send_email_smtp(to_email, subject, template_name, **template_data)
-        
         # Render HTML template
         html_content = render_template(template_name, **template_data)
         
@@ -105,7 +74,7 @@ def send_email_sendgrid(to_email, subject, template_name, **template_data):
 
 def send_email_smtp(to_email, subject, template_name, **template_data):
     """
-    Send email using standard SMTP with HTML template
+    Queue email for SMTP delivery by the outbox dispatcher (outbox.py)
     
     Args:
         to_email: Recipient email address
@@ -114,28 +83,16 @@ def send_email_smtp(to_email, subject, template_name, **template_data):
         **template_data: Data to pass to the template
     
     Returns:
-        bool: True if email sent successfully, False otherwise
+        bool: True if email was queued successfully, False otherwise
     """
     try:
         # Render HTML template
         html_content = render_template(template_name, **template_data)
         
-        # Create message
-        message = MIMEMultipart('alternative')
-        message['Subject'] = subject
-        message['From'] = f"InBack <{EMAIL_USER}>"
-        message['To'] = to_email
-        
-        # Add HTML content
-        html_part = MIMEText(html_content, 'html', 'utf-8')
-        message.attach(html_part)
-        
-        # Send email via SMTP
-        if EMAIL_PASSWORD:
-            with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-                server.starttls()
-                server.login(EMAIL_USER, EMAIL_PASSWORD)
-                server.send_message(message)
+        # Письмо уходит через очередь outbox_messages: запрос не ждет SMTP
+        if SMTP_CONFIGURED:
+            from outbox import enqueue_email
+            enqueue_email(to_email, subject, html_content)
             return True
         else:
             print(f"Email would be sent to {to_email}: {subject}")
@@ -313,31 +270,6 @@ async def send_telegram_message(chat_id, message, parse_mode='HTML'):
     # Use simple HTTP API instead of telegram_bot
     from telegram_bot import send_telegram_message
     return send_telegram_message(chat_id, message)
-    
-    try:
-        # Конвертируем chat_id в правильный формат
-        if isinstance(chat_id, str) and chat_id.startswith('@'):
-            # Username формат - попробуем как есть
-            actual_chat_id = chat_id
-        else:
-            # Числовой ID
-            actual_chat_id = int(chat_id) if str(chat_id).isdigit() else chat_id
-        
-        await telegram_bot.send_message(
-            chat_id=actual_chat_id,
-            text=message,
-            parse_mode=parse_mode
-        )
-        print(f"✓ Telegram message sent to {actual_chat_id}")
-        return True
-    except Exception as e:
-        print(f"✗ Telegram error: {e}")
-        if "unauthorized" in str(e).lower():
-            print("📱 Решение: Проверьте токен бота в @BotFather")
-        elif "chat not found" in str(e).lower() or "user not found" in str(e).lower():
-            print(f"📱 Решение: Получите chat_id через get_telegram_chat_id.py")
-            print(f"📱 Текущий ID: {chat_id} (возможно неверный)")
-        return False
 
 def send_telegram_notification(user, notification_type, **data):
     """
@@ -548,7 +480,7 @@ def send_telegram_insurance_notification(name, phone, bank, credit_amount, birth
         current_time: Время подачи заявки
     
     Returns:
-        bool: True if message sent successfully, False otherwise
+        bool: True if message was queued successfully, False otherwise
     """
     try:
         # Check if Telegram is configured
@@ -556,10 +488,6 @@ def send_telegram_insurance_notification(name, phone, bank, credit_amount, birth
             print("❌ Telegram not configured: missing TELEGRAM_BOT_TOKEN or TELEGRAM_CHAT_ID")
             return False
         
-        if not telegram_bot:
-            print("❌ Telegram bot not initialized")
-            return False
-        
         # Format the message
         message = f"""🛡 НОВАЯ ЗАЯВКА НА СТРАХОВАНИЕ
 
@@ -573,30 +501,11 @@ def send_telegram_insurance_notification(name, phone, bank, credit_amount, birth
 
 ⏰ Время подачи: {current_time}"""
         
-        # Send message using requests API (more reliable than async in this context)
-        import requests
-        
-        # Use Telegram HTTP API directly
-        telegram_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload = {
-            'chat_id': TELEGRAM_CHAT_ID,
-            'text': message,
-            'parse_mode': 'HTML'
-        }
-        
-        response = requests.post(telegram_url, data=payload, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('ok'):
-                print(f"✅ Telegram insurance notification sent successfully")
-                return True
-            else:
-                print(f"❌ Telegram API error: {result.get('description', 'Unknown error')}")
-                return False
-        else:
-            print(f"❌ Telegram HTTP error: {response.status_code}")
-            return False
+        # Отправит диспетчер очереди outbox_messages
+        from outbox import enqueue_telegram
+        enqueue_telegram(TELEGRAM_CHAT_ID, message)
+        print(f"✅ Telegram insurance notification queued")
+        return True
             
     except Exception as e:
         print(f"❌ Error sending Telegram insurance notification: {e}")
@@ -0,0 +1,462 @@
+"""
+Потоковый импорт Excel-фида в excel_properties.
+
+Файл читается порциями (openpyxl в режиме read_only для .xlsx), застройщики
+и ЖК сопоставляются по словарям, загруженным один раз, а квартиры пишутся
+пакетами через INSERT ... ON CONFLICT (inner_id) DO UPDATE. Каждая порция —
+отдельная короткая транзакция; после нее в progress_callback уходят
+обработанные строки, процент и скорость (строк/сек).
+
+Новые квартиры и квартиры, у которых изменились поля из MATCHING_COLUMNS,
+в той же транзакции записываются в property_changes — по этой ленте
+рассылка по сохраненным поискам проверяет только изменения.
+
+    pipeline = ExcelImportPipeline(db, address_parser=parse_address_components,
+                                   progress_callback=print)
+    result = pipeline.run('attached_assets/feed.xlsx')
+"""
+import math
+import os
+import re
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_CHUNK_SIZE = 1000
+# После стольких ошибочных строк импорт прерывается, как и раньше
+MAX_ERRORS = 50
+
+REQUIRED_COLUMNS = ['developer_name', 'complex_name', 'inner_id', 'object_rooms', 'price']
+
+# Колонки, от которых зависит совпадение с сохраненным поиском (см. saved_search_matching)
+MATCHING_COLUMNS = ['object_rooms', 'price', 'object_area', 'address_locality_display_name', 'developer_name']
+
+# Колонки parsed_* заполняются из address_display_name
+PARSED_ADDRESS_FIELDS = ['country', 'region', 'city', 'district', 'street', 'house_number']
+
+_TRUE_VALUES = {'1', 'true', 'yes', 'да', 'y', 't'}
+
+
+class ExcelChunkReader:
+    """Читает лист Excel порциями словарей {колонка: значение}"""
+
+    def __init__(self, file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.columns: List[str] = []
+        self.total_rows: Optional[int] = None
+
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        if os.path.splitext(self.file_path)[1].lower() == '.xlsx':
+            return self._iter_xlsx()
+        return self._iter_pandas()
+
+    def _iter_xlsx(self):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(self.file_path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            self.columns = [str(name).strip() if name is not None else '' for name in header]
+            # max_row берется из размеров листа и может отсутствовать
+            self.total_rows = sheet.max_row - 1 if sheet.max_row else None
+
+            chunk = []
+            for values in rows:
+                if not any(value is not None for value in values):
+                    continue
+                chunk.append(dict(zip(self.columns, values)))
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        finally:
+            workbook.close()
+
+    def _iter_pandas(self):
+        # .xls (xlrd) не умеет читать построчно — читаем целиком и режем на порции
+        import pandas as pd
+
+        df = pd.read_excel(self.file_path)
+        self.columns = [str(name).strip() for name in df.columns]
+        self.total_rows = len(df)
+        df.columns = self.columns
+        for start in range(0, len(df), self.chunk_size):
+            part = df.iloc[start:start + self.chunk_size]
+            yield [
+                {column: (None if _is_missing(value) else value) for column, value in row.items()}
+                for row in part.to_dict('records')
+            ]
+
+
+def _is_missing(value) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return True
+    if isinstance(value, str) and not value.strip():
+        return True
+    try:
+        import pandas as pd
+        return value is pd.NaT
+    except ImportError:
+        return False
+
+
+def _same_value(old, new) -> bool:
+    """Сравнение значения из БД (Decimal, int) с приведенным значением строки Excel"""
+    if old is None or new is None:
+        return old is None and new is None
+    try:
+        return float(old) == float(new)
+    except (TypeError, ValueError):
+        return str(old) == str(new)
+
+
+def _slugify(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9а-яА-Я\-]', '-', name.lower()).strip('-')
+
+
+def _unique_slug(slug: str, taken: set, fallback: str) -> str:
+    slug = slug or fallback
+    candidate, suffix = slug, 2
+    while candidate in taken:
+        candidate = f"{slug}-{suffix}"
+        suffix += 1
+    taken.add(candidate)
+    return candidate
+
+
+def coerce_value(value, python_type):
+    """Приводит значение ячейки к типу колонки модели; пустые ячейки -> None"""
+    if _is_missing(value):
+        return None
+    if python_type is int:
+        return int(float(value))
+    if python_type is float:
+        return float(value)
+    if python_type is bool:
+        if isinstance(value, str):
+            return value.strip().lower() in _TRUE_VALUES
+        return bool(value)
+    if python_type is str:
+        # Телефоны и коды Excel отдает числами: 79181234567.0 -> "79181234567"
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value).strip()
+    if python_type is datetime:
+        if isinstance(value, datetime):
+            return value
+        if isinstance(value, date):
+            return datetime(value.year, value.month, value.day)
+        if hasattr(value, 'to_pydatetime'):
+            return value.to_pydatetime()
+        return datetime.fromisoformat(str(value).strip())
+    return value
+
+
+class ExcelImportPipeline:
+    """Импорт одного Excel-файла; застройщики и ЖК создаются при необходимости"""
+
+    def __init__(self, db, address_parser: Optional[Callable[[str], Dict[str, Any]]] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.db = db
+        self.address_parser = address_parser
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+
+        self.processed = 0
+        self.imported = 0
+        self.skipped = 0
+        self.errors = 0
+        self.developers_created = set()
+        self.complexes_created = set()
+        self.imported_complexes = set()
+        self.changes = 0
+        self.started_at = None
+        self.total_rows = None
+
+    # --- справочники ---------------------------------------------------------
+
+    def _load_lookups(self):
+        from models import Developer, ResidentialComplex
+
+        session = self.db.session
+        self.developers = {name: developer_id for developer_id, name in
+                           session.query(Developer.id, Developer.name)}
+        self.developer_slugs = {slug for (slug,) in session.query(Developer.slug)}
+        self.complexes = {(name, developer_id): complex_id for complex_id, name, developer_id in
+                          session.query(ResidentialComplex.id, ResidentialComplex.name,
+                                        ResidentialComplex.developer_id)}
+        self.complex_slugs = {slug for (slug,) in session.query(ResidentialComplex.slug)}
+
+    def _resolve_developers_and_complexes(self, rows):
+        """Создает недостающих застройщиков и ЖК порции одним flush на каждый тип"""
+        from models import Developer, ResidentialComplex
+
+        session = self.db.session
+        new_developers = {}
+        for row in rows:
+            name = row['developer_name']
+            if name not in self.developers and name not in new_developers:
+                new_developers[name] = Developer(
+                    name=name,
+                    slug=_unique_slug(_slugify(name), self.developer_slugs,
+                                      f"developer-{int(time.time())}-{len(self.developers_created)}"),
+                    description=f"Автоматически созданный застройщик: {name}",
+                    website="",
+                    phone="",
+                    email=""
+                )
+        if new_developers:
+            session.add_all(new_developers.values())
+            session.flush()
+            for name, developer in new_developers.items():
+                self.developers[name] = developer.id
+                self.developers_created.add(name)
+
+        new_complexes = {}
+        for row in rows:
+            key = (row['complex_name'], self.developers[row['developer_name']])
+            if key not in self.complexes and key not in new_complexes:
+                name, developer_id = key
+                new_complexes[key] = ResidentialComplex(
+                    name=name,
+                    slug=_unique_slug(_slugify(name), self.complex_slugs, f"complex-{developer_id}-{int(time.time())}"),
+                    developer_id=developer_id,
+                    cashback_rate=5.0
+                )
+        if new_complexes:
+            session.add_all(new_complexes.values())
+            session.flush()
+            for key, complex_obj in new_complexes.items():
+                self.complexes[key] = complex_obj.id
+                self.complexes_created.add(key[0])
+
+    # --- строки --------------------------------------------------------------
+
+    def _prepare_columns(self, header):
+        from models import ExcelProperty
+
+        table_columns = ExcelProperty.__table__.columns
+        self.column_types = {}
+        for column in table_columns:
+            try:
+                self.column_types[column.name] = column.type.python_type
+            except NotImplementedError:
+                self.column_types[column.name] = None
+
+        self.columns = [name for name in header if name in self.column_types]
+        if 'address_display_name' in self.columns and self.address_parser:
+            for field in PARSED_ADDRESS_FIELDS:
+                name = f"parsed_{field}"
+                if name in self.column_types and name not in self.columns:
+                    self.columns.append(name)
+
+    def _convert_row(self, raw):
+        """Строка Excel -> словарь колонок excel_properties, либо None если ее нужно пропустить"""
+        if _is_missing(raw.get('inner_id')) or _is_missing(raw.get('developer_name')) or _is_missing(raw.get('complex_name')):
+            return None
+
+        row = {}
+        for name in self.columns:
+            if name in raw:
+                row[name] = coerce_value(raw[name], self.column_types[name])
+            else:
+                row[name] = None
+        row['developer_name'] = str(raw['developer_name']).strip()
+        row['complex_name'] = str(raw['complex_name']).strip()
+
+        # 🎯 АВТОМАТИЧЕСКИЙ ПАРСИНГ АДРЕСОВ ДЛЯ ФИЛЬТРАЦИИ
+        if self.address_parser and row.get('address_display_name'):
+            parsed = self.address_parser(row['address_display_name']) or {}
+            for field in PARSED_ADDRESS_FIELDS:
+                if f"parsed_{field}" in row:
+                    row[f"parsed_{field}"] = parsed.get(field)
+        return row
+
+    def _upsert_statement(self):
+        from models import ExcelProperty
+
+        table = ExcelProperty.__table__
+        dialect = self.db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise RuntimeError(f"Импорт не поддерживает СУБД {dialect}")
+
+        statement = insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=['inner_id'],
+            set_={name: statement.excluded[name] for name in self.columns if name != 'inner_id'}
+        )
+
+    def _detect_changes(self, batch) -> Tuple[List[Dict[str, Any]], set]:
+        """
+        Строки property_changes для новых квартир и квартир с измененными MATCHING_COLUMNS
+        и прежние ЖК обновляемых квартир (квартира могла переехать в другой ЖК)
+        """
+        from models import ExcelProperty
+        from sqlalchemy import select
+
+        table = ExcelProperty.__table__
+        compared = [name for name in MATCHING_COLUMNS if name in self.columns]
+        existing = {
+            row[0]: row[1:] for row in self.db.session.execute(
+                select(table.c.inner_id, table.c.complex_name, *(table.c[name] for name in compared))
+                .where(table.c.inner_id.in_([row['inner_id'] for row in batch]))
+            )
+        }
+        changes = []
+        previous_complexes = set()
+        for row in batch:
+            old = existing.get(row['inner_id'])
+            if old is None:
+                changes.append({'inner_id': row['inner_id'], 'change_type': 'new'})
+                continue
+            if old[0]:
+                previous_complexes.add(old[0])
+            if not all(_same_value(old_value, row.get(name)) for name, old_value in zip(compared, old[1:])):
+                changes.append({'inner_id': row['inner_id'], 'change_type': 'updated'})
+        return changes, previous_complexes
+
+    def _write_chunk(self, raw_rows):
+        rows = {}
+        for raw in raw_rows:
+            self.processed += 1
+            try:
+                row = self._convert_row(raw)
+            except (TypeError, ValueError, UnicodeError) as row_error:
+                print(f"❌ Ошибка обработки строки {self.processed}: {row_error}")
+                self.errors += 1
+                continue
+            if row is None:
+                self.skipped += 1
+                continue
+            # Повтор inner_id внутри порции: ON CONFLICT не может обновить строку дважды
+            rows[row['inner_id']] = row
+
+        if not rows:
+            return
+        batch = list(rows.values())
+        try:
+            self._write_batch(batch)
+        except Exception as chunk_error:
+            # Одна плохая строка не должна стоить всей порции: повторяем по одной
+            # и считаем ошибками только строки, которые не записались
+            print(f"⚠️ Порция до строки {self.processed} не записана ({chunk_error}), повтор по одной строке")
+            for row in batch:
+                if self.errors > MAX_ERRORS:
+                    break
+                try:
+                    self._write_batch([row])
+                except Exception as row_error:
+                    print(f"❌ Ошибка записи квартиры {row['inner_id']}: {row_error}")
+                    self.errors += 1
+
+    def _write_batch(self, batch):
+        session = self.db.session
+        try:
+            self._resolve_developers_and_complexes(batch)
+            changes, previous_complexes = self._detect_changes(batch)
+            session.execute(self.upsert_statement, batch)
+            if changes:
+                from models import PropertyChange
+                session.execute(PropertyChange.__table__.insert(), changes)
+            session.commit()
+        except Exception:
+            session.rollback()
+            # Созданные в этой порции застройщики и ЖК откатились вместе с ней
+            self._load_lookups()
+            raise
+        self.imported += len(batch)
+        self.changes += len(changes)
+        self.imported_complexes.update(row['complex_name'] for row in batch)
+        self.imported_complexes.update(previous_complexes)
+
+    # --- прогресс ------------------------------------------------------------
+
+    def progress(self, total_rows=None, finished=False) -> Dict[str, Any]:
+        total_rows = total_rows or self.total_rows
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        if finished:
+            percent = 100
+        elif total_rows:
+            # До финального commit и пересчета агрегатов не показываем 100%
+            percent = min(99, int(self.processed * 100 / total_rows))
+        else:
+            percent = 0
+        return {
+            'processed': self.processed,
+            'total': total_rows,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'progress': percent,
+            'rows_per_sec': round(self.processed / elapsed, 1) if elapsed > 0 else 0.0,
+            'elapsed_seconds': round(elapsed, 1),
+        }
+
+    def _report(self, total_rows=None, finished=False):
+        if self.progress_callback:
+            self.progress_callback(self.progress(total_rows, finished))
+
+    def run(self, file_path: str) -> Dict[str, Any]:
+        self.started_at = time.time()
+        reader = ExcelChunkReader(file_path, self.chunk_size)
+        chunks = iter(reader)
+        first_chunk = next(chunks, None)
+
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in reader.columns]
+        if missing_columns:
+            return {"success": False, "message": f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}", "imported": 0}
+
+        try:
+            self.db.session.rollback()  # Очистка любых незавершенных транзакций
+        except Exception:
+            pass
+        self._prepare_columns(reader.columns)
+        self._load_lookups()
+        self.upsert_statement = self._upsert_statement()
+
+        aborted = False
+        chunk = first_chunk
+        while chunk is not None:
+            self._write_chunk(chunk)
+            if self.errors > MAX_ERRORS:
+                print(f"❌ Импорт остановлен: {self.errors} ошибок")
+                aborted = True
+                break
+            self.total_rows = reader.total_rows
+            self._report()
+            chunk = next(chunks, None)
+
+        if aborted:
+            message_parts = [f"Импорт прерван после {self.errors} ошибок (строка {self.processed}), "
+                             f"записано квартир: {self.imported}"]
+        else:
+            message_parts = ["Файл обработан успешно"]
+        if self.developers_created:
+            message_parts.append(f"Создано застройщиков: {len(self.developers_created)}")
+        if self.complexes_created:
+            message_parts.append(f"Создано ЖК: {len(self.complexes_created)}")
+        if self.errors and not aborted:
+            message_parts.append(f"Ошибок: {self.errors}")
+
+        stats = self.progress()
+        return {
+            "success": not aborted,
+            "imported": self.imported,
+            "message": ", ".join(message_parts),
+            "developers_created": len(self.developers_created),
+            "complexes_created": len(self.complexes_created),
+            "property_changes": self.changes,
+            "rows_per_sec": stats['rows_per_sec'],
+            "elapsed_seconds": stats['elapsed_seconds'],
+        }
@@ -0,0 +1,404 @@
+"""
+Полнотекстовый поиск по квартирам с русской морфологией и ранжированием BM25.
+
+Раньше текстовый поиск был подстрокой: SuperSmartSearch строил OR из
+`LIKE '%kw%'` по четырем колонкам на каждое слово, а get_filtered_properties
+склеивал для каждой квартиры на каждый запрос строку searchable_text. Здесь
+инвертированный индекс строится один раз на снимок load_properties():
+
+* поля ЖК, застройщик, район, адрес (улица), описание и тип квартиры
+  с весами (BM25F: взвешенная частота терма);
+* слова приводятся к основе стеммером Snowball для русского языка, так что
+  "двухкомнатные квартиры в центре" находит "двухкомнатная ... Центральный";
+* синонимы (SmartSearch.synonyms, SuperSmartSearch.synonyms) и префиксы
+  недописанных слов расширяют запрос с меньшим весом;
+* все слова запроса должны совпасть (как раньше в _matches_search_text),
+  результат сортируется по сумме BM25 и фильтруется маской PropertyIndex.
+
+    fts = full_text_index_cache.get(properties, synonyms)
+    result = fts.search('двушка у парка', mask=index.range_mask('price', maximum=8e6), limit=20)
+    page = index.materialize(result['positions'])
+"""
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+# Вес поля в BM25F: совпадение в названии ЖК важнее совпадения в описании
+FIELD_WEIGHTS = {
+    'complex': 3.0,
+    'developer': 2.0,
+    'district': 2.0,
+    'address': 1.5,
+    'rooms': 1.0,
+    'description': 1.0,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Вес терма, добавленного из синонимов или по префиксу недописанного слова
+SYNONYM_WEIGHT = 0.6
+PREFIX_WEIGHT = 0.8
+PREFIX_MIN_LENGTH = 3
+MAX_PREFIX_EXPANSIONS = 50
+
+STOP_WORDS = {
+    'в', 'во', 'на', 'с', 'со', 'по', 'от', 'до', 'для', 'или', 'и', 'а', 'но', 'у', 'к', 'о', 'об',
+    'из', 'за', 'под', 'над', 'при', 'не', 'ул', 'г', 'д', 'жк',
+}
+
+_TOKEN_RE = re.compile(r'[0-9a-zа-я]+')
+
+
+# --- стеммер Snowball (русский) ------------------------------------------------
+
+_VOWELS = frozenset('аеиоуыэюя')
+
+
+def _endings(*groups):
+    """(окончание, нужна ли перед ним 'а'/'я'), самые длинные первыми"""
+    items = []
+    for needs_a_ya, endings in groups:
+        items.extend((ending, needs_a_ya) for ending in endings.split())
+    return sorted(items, key=lambda item: -len(item[0]))
+
+
+_PERFECTIVE_GERUND = _endings((True, 'в вши вшись'), (False, 'ив ивши ившись ыв ывши ывшись'))
+_ADJECTIVE = _endings((False, 'ее ие ые ое ими ыми ей ий ый ой ем им ым ом его ого ему ому их ых ую юю ая яя ою ею'))
+_PARTICIPLE = _endings((True, 'ем нн вш ющ щ'), (False, 'ивш ывш ующ'))
+_REFLEXIVE = _endings((False, 'ся сь'))
+_VERB = _endings(
+    (True, 'ла на ете йте ли й л ем н ло но ет ют ны ть ешь нно'),
+    (False, 'ила ыла ена ейте уйте ите или ыли ей уй ил ыл им ым ен ило ыло ено ят ует уют ит ыт ены ить ыть ишь ую ю'),
+)
+_NOUN = _endings((False, 'а ев ов ие ье е иями ями ами еи ии и ией ей ой ий й иям ям ием ем ам ом о у ах иях ях ы ь ию ью ю ия ья я'))
+_SUPERLATIVE = _endings((False, 'ейше ейш'))
+_DERIVATIONAL = _endings((False, 'ость ост'))
+
+
+def _regions(word: str):
+    """Начала областей RV и R2 по правилам Snowball"""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in _VOWELS:
+            rv = i + 1
+            break
+
+    def after_vowel_consonant(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = after_vowel_consonant(0)
+    return rv, after_vowel_consonant(r1)
+
+
+def _remove(word: str, endings, region: int) -> Optional[str]:
+    """Срезает самое длинное подходящее окончание в области; None, если не подошло"""
+    for ending, needs_a_ya in endings:
+        if not word.endswith(ending):
+            continue
+        start = len(word) - len(ending)
+        if start < region:
+            return None
+        if needs_a_ya and (start - 1 < region or word[start - 1] not in 'ая'):
+            return None
+        return word[:start]
+    return None
+
+
+def stem(word: str) -> str:
+    """Основа русского слова (Snowball); латиница и числа возвращаются как есть"""
+    word = word.replace('ё', 'е')
+    if len(word) < 3 or not any(char in _VOWELS for char in word):
+        return word
+    rv, r2 = _regions(word)
+
+    # Шаг 1
+    result = _remove(word, _PERFECTIVE_GERUND, rv)
+    if result is None:
+        word = _remove(word, _REFLEXIVE, rv) or word
+        result = _remove(word, _ADJECTIVE, rv)
+        if result is not None:
+            result = _remove(result, _PARTICIPLE, rv) or result
+        else:
+            result = _remove(word, _VERB, rv)
+            if result is None:
+                result = _remove(word, _NOUN, rv)
+    if result is not None:
+        word = result
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3
+    word = _remove(word, _DERIVATIONAL, r2) or word
+
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    else:
+        superlative = _remove(word, _SUPERLATIVE, rv)
+        if superlative is not None:
+            word = superlative
+            if word.endswith('нн'):
+                word = word[:-1]
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+
+class Analyzer:
+    """Токенизация + стемминг с кэшем основ"""
+
+    def __init__(self):
+        self._stems: Dict[str, str] = {}
+
+    def tokens(self, text) -> List[str]:
+        if not text:
+            return []
+        return _TOKEN_RE.findall(str(text).lower().replace('ё', 'е'))
+
+    def stem(self, token: str) -> str:
+        stemmed = self._stems.get(token)
+        if stemmed is None:
+            stemmed = self._stems[token] = stem(token)
+        return stemmed
+
+    def terms(self, text, keep_stop_words: bool = False) -> List[str]:
+        return [self.stem(token) for token in self.tokens(text)
+                if keep_stop_words or token not in STOP_WORDS]
+
+    def term_counts(self, text) -> Counter:
+        """{основа: количество} без стоп-слов; каждое слово стеммится один раз"""
+        counts: Counter = Counter()
+        for token, count in Counter(self.tokens(text)).items():
+            if token not in STOP_WORDS:
+                counts[self.stem(token)] += count
+        return counts
+
+
+def build_synonym_map(analyzer: Analyzer, *synonym_maps: Dict[str, Iterable[str]]) -> Dict[str, set]:
+    """
+    {основа: основы синонимов} из словарей вида {слово: [синонимы]}.
+    Многословные синонимы не используются: у них нет одной основы.
+    """
+    expansions: Dict[str, set] = defaultdict(set)
+    for synonym_map in synonym_maps:
+        for key, values in (synonym_map or {}).items():
+            group = set()
+            for phrase in [key, *values]:
+                terms = analyzer.terms(phrase)
+                if len(terms) == 1 and not terms[0].isdigit():
+                    group.add(terms[0])
+            for term in group:
+                expansions[term] |= group - {term}
+    return dict(expansions)
+
+
+def _room_text(prop: Dict[str, Any]) -> str:
+    """Названия типа квартиры, по которым ее ищут (как room_variations в _matches_search_text)"""
+    rooms = prop.get('rooms') or 0
+    try:
+        rooms = int(rooms)
+    except (TypeError, ValueError):
+        rooms = 0
+    if rooms == 0:
+        names = ['студия', 'studio']
+    else:
+        names = [f'{rooms}-комн', f'{rooms}-комнатная', f'{rooms}к']
+        names += {
+            1: ['однокомнатная', 'однушка'],
+            2: ['двухкомнатная', 'двушка'],
+            3: ['трехкомнатная', 'трешка'],
+            4: ['четырехкомнатная'],
+        }.get(rooms, [])
+    names += [prop.get('property_type') or 'квартира', 'квартира', prop.get('complex_class') or '']
+    return ' '.join(names)
+
+
+def _field_texts(prop: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        'complex': prop.get('complex_name') or prop.get('residential_complex') or '',
+        'developer': prop.get('developer') or prop.get('developer_name') or '',
+        'district': prop.get('district') or '',
+        'address': prop.get('address') or prop.get('location') or '',
+        'rooms': _room_text(prop),
+        'description': prop.get('description') or '',
+    }
+
+
+class FullTextIndex:
+    """Инвертированный индекс BM25 поверх списка словарей-квартир (позиции совпадают с PropertyIndex)"""
+
+    def __init__(self, properties: Sequence[Dict[str, Any]], synonyms: Optional[Dict[str, set]] = None,
+                 analyzer: Optional[Analyzer] = None, previous: Optional['FullTextIndex'] = None):
+        """
+        previous — индекс прошлого снимка: его словарь термов и разобранные
+        значения полей переиспользуются, так что после истечения TTL снимка
+        заново разбираются только изменившиеся тексты.
+        """
+        started = time.perf_counter()
+        self.size = len(properties)
+        self.analyzer = analyzer or (previous.analyzer if previous else Analyzer())
+        self.synonyms = synonyms or {}
+
+        # Одинаковые значения полей (ЖК, застройщик, район) повторяются тысячи раз —
+        # разбираем каждое значение один раз; постинги собираются векторно
+        term_ids: Dict[str, int] = previous._term_ids if previous else {}
+        previous_fields: Dict[tuple, tuple] = previous._field_terms if previous else {}
+        field_terms: Dict[tuple, tuple] = {}
+        term_chunks: List[np.ndarray] = []
+        weight_chunks: List[np.ndarray] = []
+        doc_term_counts = np.zeros(self.size, dtype=np.int64)
+        for position, prop in enumerate(properties):
+            for field, text in _field_texts(prop).items():
+                key = (field, text)
+                cached = field_terms.get(key)
+                if cached is None:
+                    cached = previous_fields.get(key)
+                    if cached is not None:
+                        field_terms[key] = cached
+                if cached is None:
+                    counts = self.analyzer.term_counts(text)
+                    cached = field_terms[key] = (
+                        np.array([term_ids.setdefault(term, len(term_ids)) for term in counts], dtype=np.int64),
+                        np.array(list(counts.values()), dtype=np.float32) * FIELD_WEIGHTS[field],
+                    )
+                if len(cached[0]):
+                    term_chunks.append(cached[0])
+                    weight_chunks.append(cached[1])
+                    doc_term_counts[position] += len(cached[0])
+
+        terms = np.concatenate(term_chunks) if term_chunks else np.empty(0, dtype=np.int64)
+        weights = np.concatenate(weight_chunks) if weight_chunks else np.empty(0, dtype=np.float32)
+        docs = np.repeat(np.arange(self.size, dtype=np.int64), doc_term_counts)
+        lengths = np.bincount(docs, weights=weights, minlength=self.size).astype(np.float32)
+
+        # (терм, квартира) -> взвешенная частота; ключи отсортированы по терму, затем по позиции
+        keys, inverse = np.unique(terms * max(self.size, 1) + docs, return_inverse=True)
+        tfs = np.bincount(inverse, weights=weights).astype(np.float32)
+        key_terms = keys // max(self.size, 1)
+        key_docs = (keys % max(self.size, 1)).astype(np.int32)
+        bounds = np.searchsorted(key_terms, np.arange(len(term_ids) + 1))
+
+        average_length = float(lengths.mean()) if self.size else 0.0
+        # Знаменатель BM25 без tf: k1 * (1 - b + b * dl / avgdl)
+        self._norms = (BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+                       if average_length else np.full(self.size, BM25_K1, dtype=np.float32)).astype(np.float32)
+        self._postings: Dict[str, tuple] = {}
+        self._idf: Dict[str, float] = {}
+        for term, term_id in term_ids.items():
+            start, end = bounds[term_id], bounds[term_id + 1]
+            if start == end:
+                continue
+            self._postings[term] = (key_docs[start:end], tfs[start:end])
+            self._idf[term] = math.log(1 + (self.size - (end - start) + 0.5) / (end - start + 0.5))
+        self._vocabulary = sorted(self._postings)
+        self._term_ids = term_ids
+        self._field_terms = field_terms
+        self.build_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def __len__(self):
+        return self.size
+
+    def _prefix_terms(self, term: str) -> List[str]:
+        position = bisect_left(self._vocabulary, term)
+        expansions = []
+        while (position < len(self._vocabulary) and self._vocabulary[position].startswith(term)
+               and len(expansions) < MAX_PREFIX_EXPANSIONS):
+            if self._vocabulary[position] != term:
+                expansions.append(self._vocabulary[position])
+            position += 1
+        return expansions
+
+    def analyze(self, query: str) -> List[Dict[str, float]]:
+        """Слова запроса -> группы {терм: вес}; квартира должна совпасть хотя бы с одним термом каждой группы"""
+        clauses = []
+        for token in self.analyzer.tokens(query):
+            if token in STOP_WORDS:
+                continue
+            term = self.analyzer.stem(token)
+            clause = {term: 1.0}
+            for synonym in self.synonyms.get(term, ()):
+                clause.setdefault(synonym, SYNONYM_WEIGHT)
+            if len(token) >= PREFIX_MIN_LENGTH:
+                # Недописанное слово ("красн" -> "краснодар") и основа короче исходного слова
+                for prefix_source in {term, token}:
+                    for expansion in self._prefix_terms(prefix_source):
+                        clause.setdefault(expansion, PREFIX_WEIGHT)
+            clauses.append(clause)
+        return clauses
+
+    def scores(self, query: str):
+        """(оценки BM25 по позициям, маска квартир, совпавших со всеми словами) или (None, None)"""
+        clauses = self.analyze(query)
+        if not clauses:
+            return None, None
+        total = np.zeros(self.size, dtype=np.float32)
+        matched = np.ones(self.size, dtype=bool)
+        for clause in clauses:
+            clause_scores = np.zeros(self.size, dtype=np.float32)
+            for term, weight in clause.items():
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                positions, tfs = posting
+                term_scores = (self._idf[term] * weight) * tfs * (BM25_K1 + 1) / (tfs + self._norms[positions])
+                clause_scores[positions] = np.maximum(clause_scores[positions], term_scores)
+            total += clause_scores
+            matched &= clause_scores > 0
+        return total, matched
+
+    def search(self, query: str, mask: Optional[np.ndarray] = None, offset: int = 0,
+               limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Позиции квартир по убыванию релевантности (только прошедшие mask),
+        оценки для них и общее число совпадений.
+        """
+        scores, matched = self.scores(query)
+        if scores is None:
+            return {'positions': np.empty(0, dtype=np.int64), 'scores': np.empty(0, dtype=np.float32), 'total': 0}
+        if mask is not None:
+            matched &= mask
+        positions = np.flatnonzero(matched)
+        positions = positions[np.argsort(-scores[positions], kind='stable')]
+        end = None if limit is None else offset + limit
+        page = positions[offset:end]
+        return {'positions': page, 'scores': scores[page], 'total': int(len(positions))}
+
+    def stats(self) -> Dict[str, Any]:
+        return {'documents': self.size, 'terms': len(self._postings), 'synonyms': len(self.synonyms),
+                'build_ms': self.build_ms}
+
+
+class FullTextIndexCache:
+    """
+    Индекс для текущего снимка: пересобирается, только когда load_properties()
+    вернул другой список (новая версия снимка или истек TTL).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._index: Optional[FullTextIndex] = None
+        self.builds = 0
+
+    def get(self, properties: Sequence[Dict[str, Any]], synonyms: Optional[Dict[str, set]] = None) -> FullTextIndex:
+        with self._lock:
+            if self._index is None or self._source is not properties:
+                self._index = FullTextIndex(properties, synonyms, previous=self._index)
+                self._source = properties
+                self.builds += 1
+            return self._index
+
+
+full_text_index_cache = FullTextIndexCache()
@@ -0,0 +1,366 @@
+"""
+Очередь фоновых задач в основной БД (таблица background_jobs).
+
+Раньше импорт Excel запускался в daemon-потоке со статусом в глобальном
+словаре, а ZIP презентаций собирался прямо в запросе с прогрессом в памяти
+процесса. Такое состояние терялось при перезапуске и не было видно другим
+gunicorn-воркерам. Теперь задача — строка в БД: ее может взять любой воркер,
+статус и прогресс читает любой процесс, упавшая задача повторяется.
+
+    @register('excel_import', concurrency=1)
+    def run_excel_import(job): ...
+
+    job = enqueue('excel_import', {'file_path': path})
+    job_status(job.id)
+
+Воркеры:
+    python job_worker.py                 # отдельный процесс (JOB_WORKER_EMBEDDED=0 у веба)
+    start_embedded_worker(app)           # поток внутри веб-процесса (по умолчанию, см. main.py)
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from sqlalchemy import bindparam, text
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 30  # сек; дальше удваивается с каждой попыткой
+HEARTBEAT_INTERVAL = 15
+# Задача без сигнала от воркера дольше этого времени считается брошенной
+STALE_AFTER = timedelta(minutes=5)
+JOB_RETENTION = timedelta(days=3)
+
+# Ключ блокировки Postgres, под которой воркеры по очереди выбирают задачи
+CLAIM_LOCK_KEY = 7_340_001
+
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join('instance', 'jobs'))
+
+_handlers: Dict[str, Callable] = {}
+_concurrency: Dict[str, int] = {}
+# kind -> (интервал в секундах, payload)
+_periodic: Dict[str, tuple] = {}
+
+
+class JobContext:
+    """То, что получает обработчик: аргументы задачи и запись прогресса"""
+
+    def __init__(self, job):
+        self.id = job.id
+        self.kind = job.kind
+        self.attempt = job.attempts
+        self.payload = job.payload_data
+
+    def progress(self, **progress):
+        """Сохраняет прогресс отдельным коротким коммитом, не трогая сессию обработчика"""
+        _update_job(self.id, progress=json.dumps(progress, ensure_ascii=False, default=str),
+                    heartbeat_at=datetime.utcnow())
+
+    def file_path(self, suffix: str) -> str:
+        """Путь для файла-результата задачи (ZIP и т.п.)"""
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        return os.path.join(JOBS_DIR, f"{self.kind}_{self.id}{suffix}")
+
+
+def register(kind: str, concurrency: int = DEFAULT_CONCURRENCY,
+             every: Optional[int] = None, payload: Optional[Dict[str, Any]] = None):
+    """
+    Регистрирует обработчик задач kind. concurrency — сколько таких задач
+    может выполняться одновременно во всех воркерах; every — период в
+    секундах, с которым воркер сам ставит задачу в очередь.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        _concurrency[kind] = concurrency
+        if every:
+            _periodic[kind] = (every, payload or {})
+        return func
+    return decorator
+
+
+def _db():
+    from app import db
+    return db
+
+
+def _update_job(job_id: int, **values):
+    db = _db()
+    assignments = ', '.join(f"{column} = :{column}" for column in values)
+    with db.engine.begin() as conn:
+        conn.execute(text(f"UPDATE background_jobs SET {assignments} WHERE id = :job_id"),
+                     dict(values, job_id=job_id))
+
+
+def enqueue(kind: str, payload: Optional[Dict[str, Any]] = None, dedupe_key: Optional[str] = None,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS, delay: float = 0):
+    """
+    Ставит задачу в очередь. Если у dedupe_key уже есть задача в очереди или
+    в работе, возвращается она — повторный клик не порождает вторую задачу.
+    """
+    from models import BackgroundJob
+
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    db = _db()
+    if dedupe_key:
+        active = (BackgroundJob.query
+                  .filter(BackgroundJob.dedupe_key == dedupe_key,
+                          BackgroundJob.status.in_(ACTIVE_STATUSES))
+                  .order_by(BackgroundJob.id.desc())
+                  .first())
+        if active:
+            return active
+    job = BackgroundJob(
+        kind=kind,
+        status=JOB_QUEUED,
+        dedupe_key=dedupe_key,
+        payload=json.dumps(payload or {}, ensure_ascii=False, default=str),
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(job)
+    db.session.commit()
+    _wake_embedded_worker()
+    return job
+
+
+def get_job(job_id: int):
+    from models import BackgroundJob
+    return BackgroundJob.query.get(job_id)
+
+
+def latest_job(dedupe_key: str):
+    """Последняя задача с этим ключом (в любом статусе)"""
+    from models import BackgroundJob
+    return (BackgroundJob.query
+            .filter_by(dedupe_key=dedupe_key)
+            .order_by(BackgroundJob.id.desc())
+            .first())
+
+
+def job_status(job_id: int) -> Optional[Dict[str, Any]]:
+    """Свежий статус из БД (без кэша сессии — задача меняется в другом процессе)"""
+    db = _db()
+    db.session.expire_all()
+    job = get_job(job_id)
+    return job.to_dict() if job else None
+
+
+# --- воркер ------------------------------------------------------------------
+
+def _requeue_stale(conn, now):
+    """Задачи воркеров, которые умерли посреди работы, возвращаются в очередь"""
+    conn.execute(text("""
+        UPDATE background_jobs
+        SET status = CASE WHEN attempts < max_attempts THEN :queued ELSE :failed END,
+            error = 'Воркер перестал отвечать',
+            locked_by = NULL,
+            finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE :now END
+        WHERE status = :running AND heartbeat_at < :stale_before
+    """), {'queued': JOB_QUEUED, 'failed': JOB_FAILED, 'running': JOB_RUNNING,
+           'now': now, 'stale_before': now - STALE_AFTER})
+
+
+def claim(worker_id: str, kinds: Optional[Iterable[str]] = None) -> Optional[int]:
+    """
+    Атомарно берет одну готовую задачу с учетом лимитов одновременности.
+    Возвращает id задачи или None.
+    """
+    db = _db()
+    kinds = [kind for kind in (kinds or _handlers) if kind in _handlers]
+    if not kinds:
+        return None
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            # Подсчет занятых слотов и захват должны идти под одной блокировкой,
+            # иначе два воркера одновременно превысят лимит
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': CLAIM_LOCK_KEY})
+        _requeue_stale(conn, now)
+
+        running = dict(conn.execute(text(
+            "SELECT kind, COUNT(*) FROM background_jobs WHERE status = :running GROUP BY kind"
+        ), {'running': JOB_RUNNING}).fetchall())
+        available = [kind for kind in kinds if running.get(kind, 0) < _concurrency.get(kind, DEFAULT_CONCURRENCY)]
+        if not available:
+            return None
+
+        row = conn.execute(text("""
+            SELECT id FROM background_jobs
+            WHERE status = :queued AND run_after <= :now AND kind IN :kinds
+            ORDER BY run_after, id
+            LIMIT 1
+        """).bindparams(bindparam('kinds', expanding=True)),
+            {'queued': JOB_QUEUED, 'now': now, 'kinds': available}).fetchone()
+        if row is None:
+            return None
+
+        claimed = conn.execute(text("""
+            UPDATE background_jobs
+            SET status = :running, locked_by = :worker_id, attempts = attempts + 1,
+                started_at = :now, heartbeat_at = :now, error = NULL
+            WHERE id = :job_id AND status = :queued
+        """), {'running': JOB_RUNNING, 'worker_id': worker_id, 'now': now,
+               'job_id': row.id, 'queued': JOB_QUEUED})
+        return row.id if claimed.rowcount == 1 else None
+
+
+class _Heartbeat(threading.Thread):
+    """Периодически отмечает, что задача жива, пока обработчик работает"""
+
+    def __init__(self, app, job_id):
+        super().__init__(daemon=True)
+        self.app = app
+        self.job_id = job_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                with self.app.app_context():
+                    _update_job(self.job_id, heartbeat_at=datetime.utcnow())
+            except Exception as e:
+                print(f"Job {self.job_id} heartbeat error: {e}")
+
+
+def run_job(job_id: int):
+    """Выполняет взятую задачу и записывает результат или ошибку с планом повтора"""
+    from flask import current_app
+
+    db = _db()
+    job = get_job(job_id)
+    kind = job.kind
+    handler = _handlers.get(kind)
+    heartbeat = _Heartbeat(current_app._get_current_object(), job_id)
+    heartbeat.start()
+    started = time.perf_counter()
+    try:
+        if handler is None:
+            raise ValueError(f"No handler for job kind: {kind}")
+        result = handler(JobContext(job))
+    except Exception as e:
+        db.session.rollback()
+        attempts, max_attempts = job.attempts, job.max_attempts
+        now = datetime.utcnow()
+        if attempts < max_attempts:
+            delay = RETRY_BASE_DELAY * 2 ** (attempts - 1)
+            _update_job(job_id, status=JOB_QUEUED, error=str(e), locked_by=None,
+                        run_after=now + timedelta(seconds=delay))
+            print(f"Job {job_id} ({kind}) failed, retry {attempts}/{max_attempts} in {delay}s: {e}")
+        else:
+            _update_job(job_id, status=JOB_FAILED, error=str(e), locked_by=None, finished_at=now)
+            print(f"Job {job_id} ({kind}) failed permanently: {e}")
+        return False
+    finally:
+        heartbeat.stopped.set()
+        db.session.remove()
+
+    _update_job(job_id, status=JOB_COMPLETED, locked_by=None, finished_at=datetime.utcnow(),
+                result=json.dumps(result or {}, ensure_ascii=False, default=str))
+    print(f"Job {job_id} ({kind}) completed in {time.perf_counter() - started:.1f}s")
+    return True
+
+
+def schedule_periodic():
+    """Ставит периодические задачи, если с прошлой постановки прошел их интервал"""
+    now = datetime.utcnow()
+    for kind, (interval, payload) in _periodic.items():
+        last = latest_job(f"periodic:{kind}")
+        if last is None or last.created_at <= now - timedelta(seconds=interval):
+            enqueue(kind, payload, dedupe_key=f"periodic:{kind}")
+
+
+def cleanup_finished_jobs():
+    """Удаляет старые завершенные задачи и их файлы"""
+    from models import BackgroundJob
+
+    db = _db()
+    old_jobs = (BackgroundJob.query
+                .filter(BackgroundJob.status.in_((JOB_COMPLETED, JOB_FAILED)),
+                        BackgroundJob.finished_at < datetime.utcnow() - JOB_RETENTION)
+                .all())
+    for job in old_jobs:
+        file_path = job.result_data.get('file_path')
+        if file_path and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        db.session.delete(job)
+    db.session.commit()
+    return len(old_jobs)
+
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def work(app, kinds: Optional[Iterable[str]] = None, poll_interval: float = 2.0,
+         once: bool = False, stop_event: Optional[threading.Event] = None,
+         wake_event: Optional[threading.Event] = None):
+    """
+    Цикл воркера: берет задачи, пока они есть, затем ждет poll_interval.
+    once=True — выполнить доступные задачи и выйти (для cron и тестов).
+    """
+    worker_id = _worker_id()
+    stop_event = stop_event or threading.Event()
+    housekeeping_at = 0.0
+    while not stop_event.is_set():
+        try:
+            with app.app_context():
+                if time.monotonic() - housekeeping_at > 60:
+                    housekeeping_at = time.monotonic()
+                    schedule_periodic()
+                    cleanup_finished_jobs()
+                job_id = claim(worker_id, kinds)
+                if job_id is not None:
+                    run_job(job_id)
+                    continue
+        except Exception as e:
+            print(f"Job worker {worker_id} error: {e}")
+        if once:
+            return
+        if wake_event is not None:
+            wake_event.wait(poll_interval)
+            wake_event.clear()
+        else:
+            stop_event.wait(poll_interval)
+
+
+_embedded_lock = threading.Lock()
+_embedded_threads = []
+_embedded_wake = threading.Event()
+
+
+def _wake_embedded_worker():
+    _embedded_wake.set()
+
+
+def start_embedded_worker(app, threads: int = 1, poll_interval: float = 5.0):
+    """
+    Воркер-потоки внутри веб-процесса для развертываний без отдельного
+    процесса. Состояние все равно в БД: задачи переживают перезапуск, а
+    несколько gunicorn-воркеров делят очередь через claim().
+    """
+    with _embedded_lock:
+        if _embedded_threads:
+            return
+        for number in range(threads):
+            thread = threading.Thread(
+                target=work, args=(app,),
+                kwargs={'poll_interval': poll_interval, 'wake_event': _embedded_wake},
+                name=f"job-worker-{number}", daemon=True,
+            )
+            thread.start()
+            _embedded_threads.append(thread)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Отдельный процесс-воркер очереди фоновых задач (job_queue.py).
+
+    python job_worker.py                          # все виды задач
+    python job_worker.py --kinds excel_import     # только импорт
+    python job_worker.py --once                   # выполнить готовые задачи и выйти
+    python job_worker.py --outbox                 # еще и отправлять уведомления из outbox_messages
+
+Веб-процессы при этом лучше запускать с JOB_WORKER_EMBEDDED=0, чтобы задачи
+не брали встроенные потоки воркеров (и OUTBOX_DISPATCHER_EMBEDDED=0 вместе с --outbox).
+"""
+import argparse
+import os
+import signal
+import threading
+
+os.environ.setdefault('JOB_WORKER_EMBEDDED', '0')
+
+import job_queue
+import outbox
+from app import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воркер фоновых задач')
+    parser.add_argument('--kinds', nargs='+', help='виды задач (по умолчанию все зарегистрированные)')
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    parser.add_argument('--once', action='store_true')
+    parser.add_argument('--outbox', action='store_true', help='запустить диспетчер уведомлений (outbox.py)')
+    args = parser.parse_args()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    dispatcher_thread = None
+    if args.outbox:
+        if args.once:
+            outbox.run_dispatcher(app, once=True)
+        else:
+            dispatcher_thread = threading.Thread(
+                target=outbox.run_dispatcher, args=(app,), kwargs={'stop_event': stop_event},
+                name='outbox-dispatcher',
+            )
+            dispatcher_thread.start()
+
+    print(f"Job worker started, kinds: {', '.join(args.kinds or sorted(job_queue._handlers))}")
+    job_queue.work(app, kinds=args.kinds, poll_interval=args.poll_interval,
+                   once=args.once, stop_event=stop_event)
+    if dispatcher_thread is not None:
+        dispatcher_thread.join()
+    print("Job worker stopped")
+
+
+if __name__ == '__main__':
+    main()
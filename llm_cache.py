@@ -0,0 +1,271 @@
+"""
+Общий кэш ответов OpenAI (chat.completions) на диске.
+
+Одинаковые запросы ("двушка в центре") раньше каждый раз шли в OpenAI.
+LLMCache.complete() отдает сохраненный ответ, если уже спрашивали то же
+самое: ключ — sha256 от нормализованных сообщений (регистр, пробелы, ё),
+модели, параметров генерации и версии схемы ответа (schema_version нужно
+увеличить при смене промпта или формата ответа).
+
+* хранение: файл <ключ>.json в LLM_CACHE_DIR (по умолчанию instance/cache/llm),
+  общий для всех воркеров; запись атомарная;
+* TTL: устаревшая запись не отдается и перезаписывается;
+* LRU: попадание обновляет mtime файла, prune() удаляет самые старые сверх
+  max_entries;
+* single-flight: одновременные одинаковые запросы в процессе ждут один вызов,
+  между процессами — маркер <ключ>.pending, захватываемый под короткой
+  блокировкой fcntl на полосу ключей; остальные ждут ответ до PENDING_WAIT;
+* метрики попаданий в stats().
+
+Клиент передается явно, поэтому вместо OpenAI можно подставить заглушку
+с тем же интерфейсом client.chat.completions.create(...):
+
+    content = llm_cache.complete(openai_client, schema_version='search_criteria:1',
+                                 model='gpt-4o', messages=[...], temperature=0.3)
+"""
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+LLM_CACHE_DIR = os.environ.get('LLM_CACHE_DIR', os.path.join('instance', 'cache', 'llm'))
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 10000))
+# prune() сканирует каталог, поэтому запускается раз в столько записей
+PRUNE_EVERY = 100
+# Межпроцессные блокировки — полосы lock.<n> по ключу, как в tiered_cache; файлы не удаляются,
+# иначе ждущий процесс захватит блокировку на уже удаленном inode, а новый — на свежем файле.
+# Блокировка держится только на проверку кэша и захват ключа, не на время вызова API
+LOCK_STRIPES = 256
+# Сколько ждать чужой вызов того же ключа (маркер <ключ>.pending), прежде чем звать API самим
+PENDING_WAIT = float(os.environ.get('LLM_CACHE_PENDING_WAIT', 60))
+# Маркер старше этого оставлен упавшим процессом и перехватывается
+PENDING_STALE = 120
+PENDING_POLL_INTERVAL = 0.1
+
+
+def normalize_prompt(text: str) -> str:
+    """Нижний регистр, ё -> е, пробельные символы схлопываются"""
+    return ' '.join(str(text).lower().replace('ё', 'е').split())
+
+
+def _normalize_content(content):
+    if isinstance(content, str):
+        return normalize_prompt(content)
+    if isinstance(content, list):
+        # Сообщения с картинками: текст нормализуем, данные картинки хэшируем
+        parts = []
+        for part in content:
+            if isinstance(part, dict) and part.get('type') == 'image_url':
+                url = (part.get('image_url') or {}).get('url', '')
+                parts.append({'image': hashlib.sha256(url.encode('utf-8')).hexdigest()})
+            elif isinstance(part, dict) and part.get('type') == 'text':
+                parts.append({'text': normalize_prompt(part.get('text', ''))})
+            else:
+                parts.append(part)
+        return parts
+    return content
+
+
+def cache_key(model: str, messages, schema_version: str, params: Dict[str, Any]) -> str:
+    payload = {
+        'model': model,
+        'schema_version': schema_version,
+        'messages': [{'role': message.get('role'), 'content': _normalize_content(message.get('content'))}
+                     for message in messages],
+        'params': params,
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.content: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class LLMCache:
+    def __init__(self, directory: str = LLM_CACHE_DIR, ttl: int = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _InFlight] = {}
+        self._writes = 0
+        self.metrics = {'hits': 0, 'misses': 0, 'calls': 0, 'errors': 0, 'shared_waits': 0,
+                        'expired': 0, 'evictions': 0, 'call_ms': 0.0}
+
+    def _path(self, key: str, suffix: str = 'json') -> str:
+        return os.path.join(self.directory, f"{key}.{suffix}")
+
+    def get(self, key: str) -> Optional[str]:
+        """Ответ из кэша или None (нет записи или истек TTL)"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - entry.get('created_at', 0) > self.ttl:
+            self.metrics['expired'] += 1
+            return None
+        try:
+            # mtime — время последнего обращения для LRU
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get('content')
+
+    def put(self, key: str, content: str, model: str):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': time.time(), 'model': model, 'content': content}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % PRUNE_EVERY == 0
+        if should_prune:
+            self.prune()
+
+    def prune(self) -> int:
+        """Удаляет самые давно использованные записи сверх max_entries"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+        except FileNotFoundError:
+            return 0
+        if len(entries) <= self.max_entries:
+            return 0
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        removed = 0
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+        self.metrics['evictions'] += removed
+        return removed
+
+    @contextmanager
+    def _stripe_lock(self, key: str):
+        stripe = int(key[:8], 16) % LOCK_STRIPES
+        with open(os.path.join(self.directory, f"lock.{stripe}"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _claim(self, key: str) -> bool:
+        """Создает маркер <ключ>.pending; вызывать под _stripe_lock"""
+        pending = self._path(key, 'pending')
+        try:
+            os.close(os.open(pending, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(pending) > PENDING_STALE:
+                os.utime(pending)
+                return True
+        except OSError:
+            pass
+        return False
+
+    def _call(self, client, key: str, model: str, messages, params: Dict[str, Any]) -> Tuple[str, bool]:
+        """(ответ, True — если его получил другой процесс, пока мы ждали)"""
+        os.makedirs(self.directory, exist_ok=True)
+        deadline = time.monotonic() + PENDING_WAIT
+        while True:
+            with self._stripe_lock(key):
+                # Другой процесс мог уже получить ответ
+                content = self.get(key)
+                if content is not None:
+                    return content, True
+                claimed = self._claim(key)
+            if claimed or time.monotonic() >= deadline:
+                break
+            time.sleep(PENDING_POLL_INTERVAL)
+
+        try:
+            started = time.perf_counter()
+            self.metrics['calls'] += 1
+            response = client.chat.completions.create(model=model, messages=messages, **params)
+            self.metrics['call_ms'] = round(self.metrics['call_ms'] + (time.perf_counter() - started) * 1000, 1)
+            content = response.choices[0].message.content
+        except BaseException:
+            if claimed:
+                with self._stripe_lock(key):
+                    self._release(key)
+            raise
+        # Запись и снятие маркера под блокировкой: ждущий увидит либо маркер, либо ответ
+        with self._stripe_lock(key):
+            self.put(key, content, model)
+            if claimed:
+                self._release(key)
+        return content, False
+
+    def _release(self, key: str):
+        try:
+            os.remove(self._path(key, 'pending'))
+        except OSError:
+            pass
+
+    def complete(self, client, *, model: str, messages, schema_version: str = '1', **params) -> str:
+        """
+        Текст ответа client.chat.completions.create(model=..., messages=..., **params)
+        из кэша или из одного вызова на все одновременные одинаковые запросы.
+        Ошибки клиента не кэшируются и пробрасываются вызывающему.
+
+        Каждый запрос попадает ровно в один счетчик: hits — ответ уже был в кэше,
+        shared_waits — дождался чужого вызова (в этом или другом процессе),
+        misses — вызвал API сам.
+        """
+        key = cache_key(model, messages, schema_version, params)
+        content = self.get(key)
+        if content is not None:
+            self.metrics['hits'] += 1
+            return content
+
+        with self._lock:
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[key] = _InFlight()
+        if not owner:
+            inflight.done.wait()
+            if inflight.error is not None:
+                self.metrics['errors'] += 1
+                raise inflight.error
+            self.metrics['shared_waits'] += 1
+            return inflight.content
+
+        try:
+            inflight.content, shared = self._call(client, key, model, messages, params)
+            self.metrics['shared_waits' if shared else 'misses'] += 1
+            return inflight.content
+        except BaseException as e:
+            self.metrics['misses'] += 1
+            self.metrics['errors'] += 1
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.metrics['hits'] + self.metrics['misses'] + self.metrics['shared_waits']
+        return dict(self.metrics, directory=self.directory, ttl=self.ttl, max_entries=self.max_entries,
+                    hit_ratio=round((self.metrics['hits'] + self.metrics['shared_waits']) / total, 4) if total else None)
+
+
+llm_cache = LLMCache()
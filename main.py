@@ -1,5 +1,33 @@
-from app import app
+import multiprocessing
+import os
+import threading
+
+import job_queue
+import outbox
+from app import app, warm_full_text_index, warm_property_embeddings, warm_search_suggestions, warm_similar_properties
+
+# Без отдельного `python job_worker.py` задачи очереди выполняют потоки веб-процесса.
+# Процессы пула рендера PDF (spawn) импортируют этот модуль заново — им воркер не нужен
+if os.environ.get('JOB_WORKER_EMBEDDED', '1') != '0' and multiprocessing.parent_process() is None:
+    job_queue.start_embedded_worker(app)
+
+# Письма и сообщения Telegram из outbox_messages отправляет поток веб-процесса,
+# если диспетчер не запущен отдельно (python job_worker.py --outbox)
+if os.environ.get('OUTBOX_DISPATCHER_EMBEDDED', '1') != '0' and multiprocessing.parent_process() is None:
+    outbox.start_embedded_dispatcher(app)
+
+
+def _warm_search_indexes():
+    warm_search_suggestions()
+    warm_full_text_index()
+    warm_property_embeddings()
+    warm_similar_properties()
+
+
+# Индексы поиска собираются в фоне, не задерживая старт воркера
+if multiprocessing.parent_process() is None:
+    threading.Thread(target=_warm_search_indexes, name='warm-search-indexes', daemon=True).start()
 
 if __name__ == '__main__':
     # Run Flask development server
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True)
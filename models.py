@@ -2122,7 +2122,16 @@ class Property(db.Model):
 class ExcelProperty(db.Model):
     """Полная таблица для всех 77 столбцов из Excel файла"""
     __tablename__ = 'excel_properties'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Горячие фильтры каталога, подсказок и страниц ЖК/застройщиков.
+        # Триграммные GIN-индексы для LIKE '%q%' создает create_property_indexes.py (только PostgreSQL)
+        db.Index('idx_excel_properties_rooms_price', 'object_rooms', 'price'),
+        db.Index('idx_excel_properties_complex_price', 'complex_name', 'price'),
+        db.Index('idx_excel_properties_developer', 'developer_name'),
+        db.Index('idx_excel_properties_locality', 'address_locality_display_name'),
+        db.Index('idx_excel_properties_lat_lon', 'address_position_lat', 'address_position_lon'),
+        {'extend_existing': True}
+    )
     
     # Use inner_id as primary key since id column doesn't exist in actual table
     inner_id = db.Column(db.BigInteger, primary_key=True)
@@ -2277,6 +2286,191 @@ class ExcelProperty(db.Model):
         return "Тип не указан"
 
 
+class ComplexStats(db.Model):
+    """Готовые агрегаты excel_properties по ЖК; пересчитывает complex_stats.refresh_complex_stats()"""
+    __tablename__ = 'complex_stats'
+    __table_args__ = {'extend_existing': True}
+    
+    complex_name = db.Column(db.String(300), primary_key=True)
+    
+    apartments_count = db.Column(db.Integer, default=0, nullable=False)
+    buildings_count = db.Column(db.Integer, default=1, nullable=False)
+    
+    # Диапазоны цен, площадей и этажей
+    price_from = db.Column(db.BigInteger, nullable=True)
+    price_to = db.Column(db.BigInteger, nullable=True)
+    area_from = db.Column(db.Float, nullable=True)
+    area_to = db.Column(db.Float, nullable=True)
+    floors_min = db.Column(db.Integer, nullable=True)
+    floors_max = db.Column(db.Integer, nullable=True)
+    
+    developer_name = db.Column(db.String(300), nullable=True)
+    address_display_name = db.Column(db.Text, nullable=True)
+    complex_sales_address = db.Column(db.Text, nullable=True)
+    object_class_display_name = db.Column(db.String(100), nullable=True)
+    
+    # Срок сдачи по корпусам (самый поздний)
+    end_build_year = db.Column(db.Integer, nullable=True)
+    end_build_quarter = db.Column(db.Integer, nullable=True)
+    
+    # Фото из самой дорогой квартиры ЖК (как в excel_properties.photos)
+    cover_photos = db.Column(db.Text, nullable=True)
+    
+    # Центр ЖК для карты
+    lat = db.Column(db.Float, nullable=True)
+    lon = db.Column(db.Float, nullable=True)
+    
+    # JSON: {"Студия": {"count": .., "area_from": .., "area_to": .., "price_from": .., "price_to": ..}, ...}
+    room_details = db.Column(db.Text, nullable=True)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ComplexStats {self.complex_name}: {self.apartments_count}>'
+
+
+class BackgroundJob(db.Model):
+    """Фоновая задача в очереди (job_queue.py): импорт Excel, ZIP презентаций, рассылки"""
+    __tablename__ = 'background_jobs'
+    __table_args__ = (
+        db.Index('ix_background_jobs_claim', 'status', 'kind', 'run_after'),
+        db.Index('ix_background_jobs_dedupe_key', 'dedupe_key'),
+        {'extend_existing': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+
+    # queued, running, completed, failed
+    status = db.Column(db.String(20), default='queued', nullable=False)
+
+    # Ключ для поиска задачи снаружи (например, presentation:15) и защиты от дублей
+    dedupe_key = db.Column(db.String(200), nullable=True)
+
+    # JSON: аргументы, прогресс, результат
+    payload = db.Column(db.Text, nullable=True)
+    progress = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+
+    # Когда можно брать задачу (отложенный повтор после ошибки)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # Воркер, взявший задачу, и последний сигнал от него
+    locked_by = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def _json(self, value):
+        try:
+            return json.loads(value) if value else {}
+        except (TypeError, ValueError):
+            return {}
+
+    @property
+    def payload_data(self):
+        return self._json(self.payload)
+
+    @property
+    def progress_data(self):
+        return self._json(self.progress)
+
+    @property
+    def result_data(self):
+        return self._json(self.result)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress_data,
+            'result': self.result_data,
+            'error': self.error,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.kind}: {self.status}>'
+
+
+class PropertyChange(db.Model):
+    """Лента изменений excel_properties: новые квартиры и смена цены, комнат, площади, района, застройщика"""
+    __tablename__ = 'property_changes'
+    # Номера не должны повторяться после очистки ленты (в SQLite без AUTOINCREMENT повторяются)
+    __table_args__ = {'extend_existing': True, 'sqlite_autoincrement': True}
+
+    # Возрастающий номер изменения — по нему сохраненные поиски помнят, что уже проверено
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    inner_id = db.Column(db.BigInteger, nullable=False, index=True)
+    # new, updated
+    change_type = db.Column(db.String(20), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<PropertyChange {self.id} {self.inner_id}: {self.change_type}>'
+
+
+class SavedSearchWatermark(db.Model):
+    """Последнее изменение property_changes, проверенное для сохраненного поиска"""
+    __tablename__ = 'saved_search_watermarks'
+    __table_args__ = {'extend_existing': True}
+
+    search_id = db.Column(db.Integer, db.ForeignKey('saved_searches.id', ondelete='CASCADE'), primary_key=True)
+    last_change_id = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SavedSearchWatermark {self.search_id}: {self.last_change_id}>'
+
+
+class OutboxMessage(db.Model):
+    """Исходящее письмо или сообщение Telegram, которое отправит диспетчер outbox.py"""
+    __tablename__ = 'outbox_messages'
+    __table_args__ = (
+        db.Index('ix_outbox_messages_claim', 'status', 'available_at'),
+        {'extend_existing': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # email, telegram
+    channel = db.Column(db.String(20), nullable=False)
+    # Адрес почты или chat_id
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(500), nullable=True)
+    body = db.Column(db.Text, nullable=False)
+    # Письмо: html или plain; Telegram: parse_mode (HTML, Markdown) или пусто
+    body_format = db.Column(db.String(20), nullable=True)
+
+    # pending, sending, sent, failed
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=6, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+
+    # Не отправлять раньше (повтор после ошибки, ограничение скорости)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Диспетчер, взявший сообщение, и когда
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} {self.channel} -> {self.recipient}: {self.status}>'
+
+
 class BookingRequest(db.Model):
     """Booking requests for properties from presentations"""
     __tablename__ = 'booking_requests'
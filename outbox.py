@@ -0,0 +1,571 @@
+"""
+Исходящие уведомления через таблицу outbox_messages и диспетчер отправки.
+
+Раньше письма и сообщения Telegram отправлялись прямо в обработчике запроса:
+на каждое письмо — новое SMTP-соединение, STARTTLS и логин, на каждое
+сообщение Telegram — новое HTTPS-соединение, и все это с таймаутами до 30 с,
+пока клиент ждет ответа на форму заявки. Теперь запрос только записывает
+сообщение в outbox_messages (один INSERT), а диспетчер забирает готовые
+сообщения пачками и отправляет их:
+
+* письма — через одно SMTP-соединение на диспетчер (логин один раз,
+  переподключение после SMTP_MESSAGES_PER_CONNECTION писем, простоя или обрыва);
+* Telegram — через requests.Session с пулом keep-alive соединений;
+* с ограничением скорости (ведро токенов на канал, интервал на чат Telegram),
+  повтором с экспоненциальной задержкой и паузой канала по 429 retry_after.
+
+    enqueue_email('client@example.com', 'Тема', html)
+    enqueue_telegram(chat_id, 'Текст', parse_mode='HTML')
+
+Диспетчер:
+    start_embedded_dispatcher(app)       # поток внутри веб-процесса (по умолчанию, см. main.py)
+    python job_worker.py --outbox        # в отдельном процессе воркера (OUTBOX_DISPATCHER_EMBEDDED=0 у веба)
+
+Лимиты скорости считаются на диспетчер: при нескольких процессах с
+встроенным диспетчером их сумма выше, от перебора защищает пауза по 429.
+"""
+import os
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam, text
+
+CHANNEL_EMAIL = 'email'
+CHANNEL_TELEGRAM = 'telegram'
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+DEFAULT_MAX_ATTEMPTS = 6
+RETRY_BASE_DELAY = 15  # сек; дальше удваивается с каждой попыткой
+RETRY_MAX_DELAY = 3600
+# Сообщение, взятое диспетчером, который перестал отвечать, возвращается в очередь
+LEASE = timedelta(minutes=5)
+SENT_RETENTION = timedelta(days=7)
+FAILED_RETENTION = timedelta(days=30)
+# Ждать лимит скорости на месте, если он освободится раньше; иначе отложить сообщение
+MAX_INLINE_WAIT = 2.0
+
+# Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_RATE_PER_SECOND = float(os.environ.get('TELEGRAM_RATE_PER_SECOND', 25))
+TELEGRAM_CHAT_INTERVAL = 1.0
+TELEGRAM_POOL_SIZE = 4
+TELEGRAM_TIMEOUT = 10
+
+EMAIL_RATE_PER_MINUTE = float(os.environ.get('EMAIL_RATE_PER_MINUTE', 60))
+SMTP_MESSAGES_PER_CONNECTION = 100
+# Сервер сам закрывает простаивающее соединение; закрываем раньше него
+SMTP_IDLE_TIMEOUT = 30
+SMTP_TIMEOUT = 30
+
+
+class DeliveryError(Exception):
+    """
+    Ошибка отправки. permanent — повтор не поможет (адрес отклонен, бот
+    заблокирован); channel — недоступен весь канал (нет соединения, неверный
+    токен), остальные сообщения канала в пачке откладываются; retry_after —
+    сколько секунд ждать по требованию сервера.
+    """
+
+    def __init__(self, message: str, permanent: bool = False, channel: bool = False,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.channel = channel
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Ведро токенов: rate сообщений в секунду, всплеск до burst"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """Через сколько секунд будет доступен токен"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def consume(self):
+        if self.rate > 0:
+            self._refill()
+            self._tokens -= 1
+
+
+def _db():
+    from app import db
+    return db
+
+
+# --- постановка в очередь ----------------------------------------------------
+
+def _insert(channel: str, recipient: str, body: str, subject: Optional[str] = None,
+            body_format: Optional[str] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+            delay: float = 0) -> int:
+    from flask import has_app_context
+
+    if not has_app_context():
+        # Например, из потока бота Telegram
+        from app import app
+        with app.app_context():
+            return _insert(channel, recipient, body, subject, body_format, max_attempts, delay)
+
+    from models import OutboxMessage
+
+    now = datetime.utcnow()
+    # Отдельное соединение: сообщение не зависит от незакоммиченных изменений сессии запроса
+    with _db().engine.begin() as conn:
+        result = conn.execute(OutboxMessage.__table__.insert().values(
+            channel=channel, recipient=str(recipient), subject=subject, body=body,
+            body_format=body_format, status=STATUS_PENDING, attempts=0, max_attempts=max_attempts,
+            available_at=now + timedelta(seconds=delay), created_at=now,
+        ))
+        message_id = result.inserted_primary_key[0]
+    _embedded_wake.set()
+    return message_id
+
+
+def enqueue_email(to_email: str, subject: str, body: str, body_format: str = 'html', **options) -> int:
+    """Ставит письмо в очередь; body_format — html или plain"""
+    return _insert(CHANNEL_EMAIL, to_email, body, subject=subject, body_format=body_format, **options)
+
+
+def enqueue_telegram(chat_id, message: str, parse_mode: Optional[str] = 'HTML', **options) -> int:
+    """Ставит сообщение Telegram в очередь; parse_mode=None — простой текст"""
+    return _insert(CHANNEL_TELEGRAM, chat_id, message, body_format=parse_mode, **options)
+
+
+# --- транспорты --------------------------------------------------------------
+
+class SmtpTransport:
+    """Одно SMTP-соединение на диспетчер: STARTTLS и логин один раз на много писем"""
+
+    def __init__(self, host: str, port: int, user: str, password: str, use_tls: bool = True,
+                 sender: Optional[str] = None, timeout: float = SMTP_TIMEOUT,
+                 messages_per_connection: int = SMTP_MESSAGES_PER_CONNECTION,
+                 idle_timeout: float = SMTP_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.sender = sender or f"InBack <{user}>"
+        self.timeout = timeout
+        self.messages_per_connection = messages_per_connection
+        self.idle_timeout = idle_timeout
+        self._server: Optional[smtplib.SMTP] = None
+        self._sent_on_connection = 0
+        self._last_used = 0.0
+        self.connections = 0
+
+    def _connect(self):
+        try:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            server.ehlo()
+            if self.use_tls and server.has_extn('starttls'):
+                server.starttls()
+                server.ehlo()
+            if self.password:
+                server.login(self.user, self.password)
+        except (smtplib.SMTPException, OSError) as e:
+            raise DeliveryError(f"SMTP connect to {self.host}:{self.port} failed: {e}", channel=True)
+        self._server = server
+        self._sent_on_connection = 0
+        self._last_used = time.monotonic()
+        self.connections += 1
+
+    def close(self):
+        server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+
+    def _build(self, message: Dict[str, Any]) -> MIMEMultipart:
+        mime = MIMEMultipart('alternative')
+        mime['Subject'] = message['subject'] or ''
+        mime['From'] = self.sender
+        mime['To'] = message['recipient']
+        subtype = 'plain' if message['body_format'] == 'plain' else 'html'
+        mime.attach(MIMEText(message['body'], subtype, 'utf-8'))
+        return mime
+
+    def send(self, message: Dict[str, Any]):
+        if self._server is not None and (self._sent_on_connection >= self.messages_per_connection
+                                         or time.monotonic() - self._last_used > self.idle_timeout):
+            self.close()
+        mime = self._build(message)
+        # Второй заход — если сервер уже закрыл соединение, которое мы считали живым
+        for reconnected in (False, True):
+            if self._server is None:
+                self._connect()
+                reconnected = True
+            try:
+                refused = self._server.send_message(mime)
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                self.close()
+                if reconnected:
+                    raise DeliveryError(f"SMTP disconnected: {e}", channel=True)
+                continue
+            except smtplib.SMTPRecipientsRefused as e:
+                codes = [code for code, _ in e.recipients.values()]
+                raise DeliveryError(f"Recipient refused: {e.recipients}",
+                                    permanent=all(500 <= code < 600 for code in codes))
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code == 421:
+                    self.close()
+                    raise DeliveryError(f"SMTP {e.smtp_code}: {e.smtp_error!r}", channel=True)
+                raise DeliveryError(f"SMTP {e.smtp_code}: {e.smtp_error!r}",
+                                    permanent=500 <= e.smtp_code < 600)
+            except (smtplib.SMTPException, OSError) as e:
+                self.close()
+                raise DeliveryError(f"SMTP error: {e}", channel=True)
+            self._sent_on_connection += 1
+            self._last_used = time.monotonic()
+            if refused:
+                raise DeliveryError(f"Recipient refused: {refused}", permanent=True)
+            return
+
+
+class TelegramTransport:
+    """Bot API sendMessage через requests.Session: keep-alive соединения переиспользуются"""
+
+    def __init__(self, token: str, api_url: str = TELEGRAM_API_URL, timeout: float = TELEGRAM_TIMEOUT,
+                 pool_size: int = TELEGRAM_POOL_SIZE):
+        self.url = f"{api_url.rstrip('/')}/bot{token}/sendMessage"
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def close_if_idle(self):
+        pass
+
+    def send(self, message: Dict[str, Any]):
+        payload = {'chat_id': message['recipient'], 'text': message['body']}
+        if message['body_format']:
+            payload['parse_mode'] = message['body_format']
+        try:
+            response = self.session.post(self.url, data=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise DeliveryError(f"Telegram request failed: {e}", channel=True)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        if response.status_code == 200 and data.get('ok', True):
+            return
+        description = data.get('description') or response.text[:200]
+        error = f"Telegram {response.status_code}: {description}"
+        if response.status_code == 429:
+            retry_after = (data.get('parameters') or {}).get('retry_after')
+            raise DeliveryError(error, channel=True, retry_after=float(retry_after or 1))
+        if response.status_code in (401, 404):
+            # Неверный токен или адрес API — не вина конкретного сообщения
+            raise DeliveryError(error, channel=True)
+        raise DeliveryError(error, permanent=400 <= response.status_code < 500)
+
+
+def _email_transport() -> Optional[SmtpTransport]:
+    from email_service import (EMAIL_HOST, EMAIL_PASSWORD, EMAIL_PORT, EMAIL_USE_TLS, EMAIL_USER,
+                               SMTP_CONFIGURED)
+    if not SMTP_CONFIGURED:
+        return None
+    return SmtpTransport(EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD, use_tls=EMAIL_USE_TLS)
+
+
+def _telegram_transport() -> Optional[TelegramTransport]:
+    token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    return TelegramTransport(token) if token else None
+
+
+# --- диспетчер ---------------------------------------------------------------
+
+def _retry_delay(attempts: int) -> float:
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+
+
+class Dispatcher:
+    """Забирает готовые сообщения пачками и отправляет их через транспорты каналов"""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, transports: Optional[Dict[str, Any]] = None):
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.batch_size = batch_size
+        self._transports = transports
+        self.limiters = {
+            CHANNEL_EMAIL: RateLimiter(EMAIL_RATE_PER_MINUTE / 60, burst=max(1.0, EMAIL_RATE_PER_MINUTE / 6)),
+            CHANNEL_TELEGRAM: RateLimiter(TELEGRAM_RATE_PER_SECOND),
+        }
+        # Канал -> monotonic-время, до которого он на паузе (429, нет соединения)
+        self.paused_until: Dict[str, float] = {}
+        self._chat_sent_at: Dict[str, float] = {}
+        self.metrics = {'batches': 0, 'sent': 0, 'retried': 0, 'deferred': 0, 'failed': 0,
+                        'last_error': None}
+
+    @property
+    def transports(self) -> Dict[str, Any]:
+        # Создаются в потоке диспетчера при первой пачке: конфигурация читается уже после импорта app
+        if self._transports is None:
+            self._transports = {CHANNEL_EMAIL: _email_transport(), CHANNEL_TELEGRAM: _telegram_transport()}
+        return self._transports
+
+    def close(self):
+        for transport in (self._transports or {}).values():
+            if transport is not None:
+                transport.close()
+
+    def close_idle(self):
+        for transport in (self._transports or {}).values():
+            if transport is not None:
+                transport.close_if_idle()
+
+    def claim(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        with _db().engine.begin() as conn:
+            lock = ' FOR UPDATE SKIP LOCKED' if conn.dialect.name == 'postgresql' else ''
+            ids = [row.id for row in conn.execute(text(f"""
+                SELECT id FROM outbox_messages
+                WHERE status = :pending AND available_at <= :now
+                ORDER BY available_at, id
+                LIMIT :limit{lock}
+            """), {'pending': STATUS_PENDING, 'now': now, 'limit': self.batch_size})]
+            if not ids:
+                return []
+            params = {'sending': STATUS_SENDING, 'pending': STATUS_PENDING, 'dispatcher': self.id,
+                      'now': now, 'ids': ids}
+            conn.execute(text("""
+                UPDATE outbox_messages
+                SET status = :sending, locked_by = :dispatcher, locked_at = :now
+                WHERE id IN :ids AND status = :pending
+            """).bindparams(bindparam('ids', expanding=True)), params)
+            rows = conn.execute(text("""
+                SELECT id, channel, recipient, subject, body, body_format, attempts, max_attempts
+                FROM outbox_messages
+                WHERE id IN :ids AND status = :sending AND locked_by = :dispatcher
+                ORDER BY available_at, id
+            """).bindparams(bindparam('ids', expanding=True)), params).mappings().all()
+        return [dict(row) for row in rows]
+
+    def _wait_time(self, message: Dict[str, Any]) -> float:
+        channel = message['channel']
+        wait = max(0.0, self.paused_until.get(channel, 0.0) - time.monotonic())
+        wait = max(wait, self.limiters[channel].wait_time())
+        if channel == CHANNEL_TELEGRAM:
+            sent_at = self._chat_sent_at.get(message['recipient'])
+            if sent_at is not None:
+                wait = max(wait, sent_at + TELEGRAM_CHAT_INTERVAL - time.monotonic())
+        return wait
+
+    def _deliver(self, message: Dict[str, Any]):
+        channel = message['channel']
+        transport = self.transports.get(channel)
+        if transport is None:
+            raise DeliveryError(f"Channel {channel} is not configured", channel=True)
+        self.limiters[channel].consume()
+        try:
+            transport.send(message)
+        finally:
+            if channel == CHANNEL_TELEGRAM:
+                self._chat_sent_at[message['recipient']] = time.monotonic()
+
+    def dispatch_batch(self) -> int:
+        """Одна пачка: отправка и запись результатов. Возвращает число взятых сообщений"""
+        messages = self.claim()
+        if not messages:
+            return 0
+        self.metrics['batches'] += 1
+        sent, retries, deferred, failed = [], [], [], []
+        now = datetime.utcnow()
+        try:
+            for message in messages:
+                wait = self._wait_time(message)
+                if wait > MAX_INLINE_WAIT:
+                    deferred.append({'id': message['id'], 'available_at': now + timedelta(seconds=wait)})
+                    continue
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    self._deliver(message)
+                except DeliveryError as e:
+                    self._handle_failure(message, e, retries, failed)
+                    continue
+                except Exception as e:
+                    # Неожиданная ошибка транспорта или данных сообщения — обычный повтор,
+                    # а не падение всей пачки; соединение после нее не переиспользуем
+                    transport = (self._transports or {}).get(message['channel'])
+                    if transport is not None:
+                        transport.close()
+                    self._handle_failure(message, DeliveryError(f"{type(e).__name__}: {e}"), retries, failed)
+                    continue
+                sent.append({'id': message['id'], 'attempts': message['attempts'] + 1,
+                             'sent_at': datetime.utcnow()})
+        finally:
+            # Уже отправленные должны стать sent при любом исходе, иначе после LEASE уйдут повторно;
+            # необработанные остаются sending и вернутся в очередь через housekeeping
+            self._record(sent, retries, deferred, failed)
+        for key, items in (('sent', sent), ('retried', retries), ('deferred', deferred), ('failed', failed)):
+            self.metrics[key] += len(items)
+        return len(messages)
+
+    def _handle_failure(self, message, error: DeliveryError, retries, failed):
+        attempts = message['attempts'] + 1
+        self.metrics['last_error'] = str(error)
+        print(f"Outbox {message['channel']} message {message['id']} to {message['recipient']} failed: {error}")
+        if error.permanent or attempts >= message['max_attempts']:
+            failed.append({'id': message['id'], 'attempts': attempts, 'error': str(error)})
+            return
+        delay = error.retry_after if error.retry_after is not None else _retry_delay(attempts)
+        if error.channel:
+            # Остальные сообщения канала в этой пачке не пытаемся отправить до конца паузы
+            self.paused_until[message['channel']] = time.monotonic() + delay
+        retries.append({'id': message['id'], 'attempts': attempts, 'error': str(error),
+                        'available_at': datetime.utcnow() + timedelta(seconds=delay)})
+
+    def _record(self, sent, retries, deferred, failed):
+        statements = (
+            (sent, f"""UPDATE outbox_messages SET status = '{STATUS_SENT}', attempts = :attempts,
+                       sent_at = :sent_at, last_error = NULL, locked_by = NULL WHERE id = :id"""),
+            (retries, f"""UPDATE outbox_messages SET status = '{STATUS_PENDING}', attempts = :attempts,
+                          last_error = :error, available_at = :available_at, locked_by = NULL WHERE id = :id"""),
+            (deferred, f"""UPDATE outbox_messages SET status = '{STATUS_PENDING}',
+                           available_at = :available_at, locked_by = NULL WHERE id = :id"""),
+            (failed, f"""UPDATE outbox_messages SET status = '{STATUS_FAILED}', attempts = :attempts,
+                         last_error = :error, locked_by = NULL WHERE id = :id"""),
+        )
+        with _db().engine.begin() as conn:
+            for rows, statement in statements:
+                if rows:
+                    conn.execute(text(statement), rows)
+
+    def housekeeping(self):
+        """Возвращает в очередь брошенные сообщения, удаляет старые отправленные и неудачные"""
+        now = datetime.utcnow()
+        with _db().engine.begin() as conn:
+            # Попытка засчитывается: сообщение, которое роняет диспетчер, не должно крутиться вечно
+            conn.execute(text("""
+                UPDATE outbox_messages
+                SET status = CASE WHEN attempts + 1 < max_attempts THEN :pending ELSE :failed END,
+                    attempts = attempts + 1, locked_by = NULL, last_error = 'Диспетчер перестал отвечать'
+                WHERE status = :sending AND locked_at < :stale_before
+            """), {'pending': STATUS_PENDING, 'failed': STATUS_FAILED, 'sending': STATUS_SENDING,
+                   'stale_before': now - LEASE})
+            conn.execute(text("""
+                DELETE FROM outbox_messages
+                WHERE (status = :sent AND sent_at < :sent_before)
+                   OR (status = :failed AND created_at < :failed_before)
+            """), {'sent': STATUS_SENT, 'failed': STATUS_FAILED,
+                   'sent_before': now - SENT_RETENTION, 'failed_before': now - FAILED_RETENTION})
+        stale_chats = [chat for chat, sent_at in self._chat_sent_at.items()
+                       if time.monotonic() - sent_at > TELEGRAM_CHAT_INTERVAL]
+        for chat in stale_chats:
+            del self._chat_sent_at[chat]
+
+    def stats(self) -> Dict[str, Any]:
+        transports = self._transports or {}
+        email = transports.get(CHANNEL_EMAIL)
+        return dict(self.metrics, id=self.id,
+                    smtp_connections=email.connections if email is not None else 0,
+                    paused={channel: round(until - time.monotonic(), 1)
+                            for channel, until in self.paused_until.items() if until > time.monotonic()})
+
+
+def run_dispatcher(app, poll_interval: float = 2.0, once: bool = False,
+                   stop_event: Optional[threading.Event] = None,
+                   wake_event: Optional[threading.Event] = None,
+                   dispatcher: Optional[Dispatcher] = None):
+    """
+    Цикл диспетчера: отправляет пачки, пока есть готовые сообщения, затем ждет
+    poll_interval или пробуждения от enqueue в этом же процессе.
+    once=True — отправить готовые сообщения и выйти (для cron и тестов).
+    """
+    dispatcher = dispatcher or Dispatcher()
+    stop_event = stop_event or threading.Event()
+    housekeeping_at = 0.0
+    try:
+        while not stop_event.is_set():
+            try:
+                with app.app_context():
+                    if time.monotonic() - housekeeping_at > 60:
+                        housekeeping_at = time.monotonic()
+                        dispatcher.housekeeping()
+                    if dispatcher.dispatch_batch():
+                        continue
+                    dispatcher.close_idle()
+            except Exception as e:
+                print(f"Outbox dispatcher {dispatcher.id} error: {e}")
+            if once:
+                return dispatcher
+            if wake_event is not None:
+                wake_event.wait(poll_interval)
+                wake_event.clear()
+            else:
+                stop_event.wait(poll_interval)
+    finally:
+        dispatcher.close()
+    return dispatcher
+
+
+_embedded_lock = threading.Lock()
+_embedded_wake = threading.Event()
+_embedded_dispatcher: Optional[Dispatcher] = None
+
+
+def start_embedded_dispatcher(app, poll_interval: float = 2.0):
+    """Поток диспетчера внутри веб-процесса; сообщения из этого процесса будят его сразу"""
+    global _embedded_dispatcher
+    with _embedded_lock:
+        if _embedded_dispatcher is not None:
+            return _embedded_dispatcher
+        _embedded_dispatcher = Dispatcher()
+        threading.Thread(
+            target=run_dispatcher, args=(app,),
+            kwargs={'poll_interval': poll_interval, 'wake_event': _embedded_wake,
+                    'dispatcher': _embedded_dispatcher},
+            name='outbox-dispatcher', daemon=True,
+        ).start()
+        return _embedded_dispatcher
+
+
+def stats() -> Dict[str, Any]:
+    """Очередь по каналам и статусам плюс счетчики встроенного диспетчера"""
+    with _db().engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT channel, status, COUNT(*) AS count FROM outbox_messages GROUP BY channel, status"
+        )).fetchall()
+    queue: Dict[str, Dict[str, int]] = {}
+    for channel, status, count in rows:
+        queue.setdefault(channel, {})[status] = count
+    return {'queue': queue,
+            'dispatcher': _embedded_dispatcher.stats() if _embedded_dispatcher is not None else None}
@@ -0,0 +1,169 @@
+"""
+Кэш собранных данных страниц (район, улица, застройщик) с инвалидацией по зависимостям.
+
+Страницы районов, улиц и застройщиков на каждый просмотр заново проходили по
+всем квартирам и ЖК или выполняли пачку запросов. Теперь собранный контекст
+шаблона (фрагмент) кэшируется в общем хранилище (файлы или Redis, как у
+SnapshotCache), а рендер шаблона остается на каждый запрос — в шапке есть
+данные сессии и CSRF-токен, поэтому готовый HTML между посетителями делить нельзя.
+
+Каждая запись помнит, от каких сущностей она зависит (теги вида
+`complex:неометрия`, `developer:...`, `district:...`), и версии этих тегов на
+момент сборки. Импорт вызывает purge(теги изменившихся сущностей): версии
+тегов растут, и устаревают только зависящие от них страницы — во всех воркерах.
+
+    context = page_cache.get_or_build(f'district:{slug}', lambda: build_district_page(slug))
+"""
+import hashlib
+import os
+import pickle
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from snapshot_cache import DEFAULT_CACHE_DIR, FileSnapshotStore, create_default_store
+
+# От этого тега зависит каждая страница: purge([ALL_PAGES]) сбрасывает весь кэш
+ALL_PAGES = 'all'
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 24 * 3600))
+# Счетчик всех purge(): пока он не менялся, проверять версии тегов записи не нужно
+EVENTS_TAG = 'events'
+
+
+def page_tag(kind: str, value) -> str:
+    """Тег зависимости: 'complex:жк солнечный' (регистр, ё и пробелы нормализуются)"""
+    return f"{kind}:{' '.join(str(value or '').lower().replace('ё', 'е').split())}"
+
+
+def create_page_store():
+    """Redis, если он настроен для снимков, иначе отдельный каталог instance/cache/pages"""
+    if os.environ.get('SNAPSHOT_CACHE_REDIS_URL'):
+        return create_default_store()
+    return FileSnapshotStore(os.path.join(DEFAULT_CACHE_DIR, 'pages'))
+
+
+class PageCache:
+    def __init__(self, namespace: str = 'pages', ttl: int = PAGE_CACHE_TTL, store=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._store = store
+        self._lock = threading.Lock()
+        # key -> (контекст, версии тегов, время сборки, счетчик событий при последней проверке)
+        self._local: Dict[str, Tuple[Any, Dict[str, int], float, int]] = {}
+        self.metrics = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'stale': 0, 'builds': 0,
+                        'build_errors': 0, 'purges': 0, 'purged_tags': 0}
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = create_page_store()
+        return self._store
+
+    def _name(self, kind: str, value: str) -> str:
+        return f"{self.namespace}_{kind}.{hashlib.sha1(value.encode('utf-8')).hexdigest()[:20]}"
+
+    def _tag_version(self, tag: str) -> int:
+        return self.store.get_version(self._name('tag', tag))
+
+    def _events(self) -> int:
+        return self._tag_version(EVENTS_TAG)
+
+    def _is_current(self, versions: Dict[str, int]) -> bool:
+        return all(self._tag_version(tag) == version for tag, version in versions.items())
+
+    def get(self, key: str) -> Optional[Any]:
+        """Контекст страницы или None (нет записи, истек TTL или изменилась зависимость)"""
+        events = self._events()
+        with self._lock:
+            local = self._local.get(key)
+        if local is not None:
+            context, versions, created_at, checked_events = local
+            if time.time() - created_at < self.ttl:
+                if checked_events == events or self._is_current(versions):
+                    with self._lock:
+                        self._local[key] = (context, versions, created_at, events)
+                    self.metrics['hits'] += 1
+                    return context
+            with self._lock:
+                self._local.pop(key, None)
+
+        stored = self.store.read(self._name('page', key), 0)
+        if stored is None:
+            return None
+        blob, created_at = stored
+        if time.time() - created_at >= self.ttl:
+            return None
+        entry = pickle.loads(zlib.decompress(blob))
+        if not self._is_current(entry['versions']):
+            self.metrics['stale'] += 1
+            return None
+        with self._lock:
+            self._local[key] = (entry['context'], entry['versions'], created_at, events)
+        self.metrics['shared_hits'] += 1
+        return entry['context']
+
+    def set(self, key: str, context: Any, dependencies: Iterable[str], events: Optional[int] = None):
+        """
+        Сохраняет контекст с версиями тегов dependencies. events — счетчик
+        событий до сборки: если за время сборки был purge(), запись не сохраняется,
+        чтобы не закрепить данные, прочитанные до изменения.
+        """
+        tags: Set[str] = set(dependencies) | {ALL_PAGES}
+        current_events = self._events()
+        if events is not None and events != current_events:
+            return
+        versions = {tag: self._tag_version(tag) for tag in tags}
+        blob = zlib.compress(pickle.dumps({'context': context, 'versions': versions},
+                                          protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self.store.write(self._name('page', key), 0, blob)
+        with self._lock:
+            self._local[key] = (context, versions, time.time(), current_events)
+
+    def get_or_build(self, key: str, builder: Callable[[], Optional[Tuple[Any, Iterable[str]]]]):
+        """
+        Контекст из кэша или builder() -> (контекст, теги зависимостей).
+        Если builder вернул None (страница не найдена), ничего не кэшируется.
+        """
+        context = self.get(key)
+        if context is not None:
+            return context
+        self.metrics['misses'] += 1
+        events = self._events()
+        started = time.perf_counter()
+        try:
+            built = builder()
+        except Exception:
+            self.metrics['build_errors'] += 1
+            raise
+        self.metrics['builds'] += 1
+        self.metrics['last_build_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        if built is None:
+            return None
+        context, dependencies = built
+        self.set(key, context, dependencies, events)
+        return context
+
+    def purge(self, tags: Iterable[str]) -> int:
+        """Событие изменения сущностей: устаревают страницы, зависящие от любого из тегов"""
+        tags = set(tags)
+        if not tags:
+            return 0
+        for tag in tags:
+            self.store.bump_version(self._name('tag', tag))
+        self.store.bump_version(self._name('tag', EVENTS_TAG))
+        with self._lock:
+            for key, (_, versions, _, _) in list(self._local.items()):
+                if tags.intersection(versions):
+                    del self._local[key]
+        self.metrics['purges'] += 1
+        self.metrics['purged_tags'] += len(tags)
+        return len(tags)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.metrics['hits'] + self.metrics['shared_hits'] + self.metrics['misses']
+        return dict(self.metrics, local_entries=len(self._local), ttl=self.ttl,
+                    hit_ratio=round((self.metrics['hits'] + self.metrics['shared_hits']) / total, 4) if total else None)
+
+
+page_cache = PageCache()
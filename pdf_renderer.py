@@ -0,0 +1,201 @@
+"""
+Рендер PDF квартир для презентаций: пул процессов для WeasyPrint и дисковый
+кэш готовых файлов.
+
+WeasyPrint тратит на одну страницу квартиры секунды CPU и держит GIL, поэтому
+PDF для архива презентации рендерятся параллельно в отдельных процессах.
+Готовый PDF кэшируется по ключу (property_id, хэш HTML, версия шаблона): HTML
+уже содержит все данные квартиры, заметку и контакты менеджера, так что
+повторная выгрузка той же презентации не рендерит ничего заново, а правка
+шаблона print_property.html меняет версию и обходит старый кэш.
+
+    for property_id, pdf_bytes in pdf_renderer.render_many(items, base_url):
+        zip_file.writestr(f'property_{property_id}.pdf', pdf_bytes)
+"""
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join('instance', 'cache', 'pdf'))
+PDF_CACHE_MAX_FILES = int(os.environ.get('PDF_CACHE_MAX_FILES', 5000))
+PDF_RENDER_PROCESSES = int(os.environ.get('PDF_RENDER_PROCESSES', min(4, os.cpu_count() or 1)))
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'print_property.html')
+# Увеличить при смене настроек WeasyPrint или стилей, которые не лежат в шаблоне
+RENDERER_VERSION = '1'
+
+_SAFE_NAME_RE = re.compile(r'[^0-9A-Za-z_-]')
+
+
+def render_pdf(html: str, base_url: Optional[str] = None) -> bytes:
+    """HTML -> PDF; выполняется в процессе пула"""
+    from weasyprint import HTML
+
+    buffer = BytesIO()
+    HTML(string=html, base_url=base_url).write_pdf(buffer)
+    return buffer.getvalue()
+
+
+class PdfCache:
+    """Готовые PDF в файлах <property_id>_<хэш HTML>_<версия шаблона>.pdf"""
+
+    def __init__(self, directory: str = PDF_CACHE_DIR, max_files: int = PDF_CACHE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._template_version = None
+        self._template_mtime = None
+
+    def template_version(self) -> str:
+        try:
+            mtime = os.path.getmtime(TEMPLATE_PATH)
+        except OSError:
+            return RENDERER_VERSION
+        if mtime != self._template_mtime:
+            with open(TEMPLATE_PATH, 'rb') as f:
+                digest = hashlib.sha256(f.read() + RENDERER_VERSION.encode()).hexdigest()
+            self._template_version = digest[:12]
+            self._template_mtime = mtime
+        return self._template_version
+
+    def key(self, property_id, html: str) -> str:
+        content_hash = hashlib.sha256(html.encode('utf-8')).hexdigest()[:24]
+        safe_id = _SAFE_NAME_RE.sub('_', str(property_id))
+        return f"{safe_id}_{content_hash}_{self.template_version()}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, pdf_bytes: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+
+    def prune(self) -> int:
+        """Удаляет самые старые PDF сверх max_files"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.pdf')]
+        except FileNotFoundError:
+            return 0
+        if len(entries) <= self.max_files:
+            return 0
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        removed = 0
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+class PdfRenderer:
+    """Кэш + пул процессов; без пула (processes=0) рендерит в текущем процессе"""
+
+    def __init__(self, processes: int = PDF_RENDER_PROCESSES, cache: Optional[PdfCache] = None):
+        self.processes = processes
+        self.cache = cache or PdfCache()
+        self._pool = None
+        self._lock = threading.Lock()
+        self.metrics = {'cache_hits': 0, 'cache_misses': 0, 'rendered': 0, 'render_ms': 0.0}
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None and self.processes > 0:
+                # spawn: воркер очереди живет в многопоточном процессе, fork здесь небезопасен
+                self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _store(self, key: str, pdf_bytes: bytes):
+        self.metrics['rendered'] += 1
+        self.cache.put(key, pdf_bytes)
+
+    def _add_render_time(self, started: float):
+        self.metrics['render_ms'] = round(self.metrics['render_ms'] + (time.perf_counter() - started) * 1000, 1)
+
+    def render_one(self, property_id, html: str, base_url: Optional[str] = None) -> bytes:
+        """Один PDF: из кэша или рендер в текущем процессе"""
+        key = self.cache.key(property_id, html)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.metrics['cache_hits'] += 1
+            return cached
+        self.metrics['cache_misses'] += 1
+        started = time.perf_counter()
+        pdf_bytes = render_pdf(html, base_url)
+        self._add_render_time(started)
+        self._store(key, pdf_bytes)
+        return pdf_bytes
+
+    def render_many(self, items: Iterable[Tuple[str, str]], base_url: Optional[str] = None) -> Iterator[Tuple[str, bytes]]:
+        """
+        (property_id, html) -> (property_id, pdf) по мере готовности: сначала
+        кэшированные, затем отрендеренные в пуле в порядке завершения.
+        """
+        pending: Dict[str, Tuple[str, str]] = {}
+        for property_id, html in items:
+            key = self.cache.key(property_id, html)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.metrics['cache_hits'] += 1
+                yield property_id, cached
+            else:
+                self.metrics['cache_misses'] += 1
+                pending[key] = (property_id, html)
+
+        if not pending:
+            return
+        started = time.perf_counter()
+        pool = self._get_pool() if len(pending) > 1 else None
+        if pool is None:
+            for key, (property_id, html) in pending.items():
+                pdf_bytes = render_pdf(html, base_url)
+                self._store(key, pdf_bytes)
+                yield property_id, pdf_bytes
+            self._add_render_time(started)
+            return
+
+        futures = {pool.submit(render_pdf, html, base_url): key for key, (_, html) in pending.items()}
+        try:
+            for future in as_completed(futures):
+                key = futures[future]
+                property_id = pending[key][0]
+                pdf_bytes = future.result()
+                self._store(key, pdf_bytes)
+                yield property_id, pdf_bytes
+            self._add_render_time(started)
+        except BrokenProcessPool:
+            # Процесс пула упал (например, OOM) — пересоздадим пул при следующем вызове
+            self._reset_pool()
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+            self.cache.prune()
+
+
+pdf_renderer = PdfRenderer()
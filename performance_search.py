@@ -5,8 +5,7 @@
 import re
 import time
 from typing import List, Dict, Any, Optional
-from sqlalchemy import text, and_, or_
-from app import db
+from app import get_full_text_index, get_property_index, get_suggestion_index
 
 class SuperSmartSearch:
     """Самый быстрый и умный поиск недвижимости в мире"""
@@ -107,334 +106,73 @@ class SuperSmartSearch:
         
         return criteria
     
-    def build_optimized_query(self, criteria: Dict[str, Any]) -> tuple:
-        """Строит оптимизированный SQL запрос"""
-        
-        base_query = """
-        SELECT DISTINCT
-            p.inner_id as id,
-            p.object_rooms as rooms,
-            p.object_area as area,
-            p.price,
-            p.complex_name,
-            p.developer_name,
-            p.parsed_district as district,
-            p.complex_sales_address as address,
-            p.address_position_lat as lat,
-            p.address_position_lon as lon,
-            p.photos,
-            p.url
-        FROM excel_properties p
-        WHERE 1=1
-        """
-        
-        conditions = []
-        params = {}
-        
-        # Фильтр по комнатам
-        if criteria['rooms']:
-            conditions.append("p.object_rooms = ANY(:rooms)")
-            params['rooms'] = criteria['rooms']
-        
-        # Фильтр по цене
-        if criteria['price_min']:
-            conditions.append("p.price >= :price_min")
-            params['price_min'] = criteria['price_min']
-        if criteria['price_max']:
-            conditions.append("p.price <= :price_max")
-            params['price_max'] = criteria['price_max']
-        
-        # Фильтр по площади
-        if criteria['area_min']:
-            conditions.append("p.object_area >= :area_min")
-            params['area_min'] = criteria['area_min']
-        if criteria['area_max']:
-            conditions.append("p.object_area <= :area_max")
-            params['area_max'] = criteria['area_max']
-        
-        # Текстовый поиск с использованием индексов
-        text_conditions = []
-        for i, keyword in enumerate(criteria['keywords'][:5]):  # Ограничиваем до 5 слов
-            param_name = f'keyword_{i}'
-            text_conditions.append(f"""
-                (LOWER(p.complex_name) LIKE :%{param_name}% OR
-                 LOWER(p.developer_name) LIKE :%{param_name}% OR
-                 LOWER(p.parsed_district) LIKE :%{param_name}% OR
-                 LOWER(p.complex_sales_address) LIKE :%{param_name}%)
-            """)
-            params[param_name] = f'%{keyword}%'
-        
-        if text_conditions:
-            conditions.append(f"({' OR '.join(text_conditions)})")
-        
-        # Добавляем условия к запросу
-        if conditions:
-            base_query += " AND " + " AND ".join(conditions)
-        
-        # Сортировка по релевантности
-        base_query += """
-        ORDER BY 
-            CASE WHEN LOWER(p.complex_name) LIKE :main_query THEN 1 ELSE 2 END,
-            p.price ASC
-        LIMIT 50
-        """
-        params['main_query'] = f"%{' '.join(criteria['keywords'][:3])}%"
-        
-        return base_query, params
+    # Ключевые слова типов квартир: подсказка показывается, если любое из них входит в запрос
+    ROOM_KEYWORDS = {
+        0: ['студ', 'studio', '0к', '0 к', '0-к', 'студий'],
+        1: ['1к', '1 к', '1-к', '1-ком', '1 ком', 'одн', 'однок', 'однокомн',
+            'однокомнатн', 'однокомнатная', 'однокомнатные', 'однушк', 'однушка', 'одноком'],
+        2: ['2к', '2 к', '2-к', '2-ком', '2 ком', 'двух', 'двухк', 'двухком',
+            'двухкомнатн', 'двухкомнатная', 'двухкомнатные', 'двушк', 'двушка', 'двуком', 'двухком'],
+        3: ['3к', '3 к', '3-к', '3-ком', '3 ком', 'трех', 'трёх', 'трехк', 'трёхк',
+            'трехкомнатн', 'трехкомнатная', 'трехкомнатные', 'трёхкомнатн', 'трёхкомнатная', 'трёхкомнатные',
+            'трешк', 'трешка', 'трёшка', 'триком'],
+        4: ['4к', '4 к', '4-к', '4-ком', '4 ком', 'четыр', 'четырех', 'четырёх',
+            'четырехкомнатн', 'четырехкомнатная', 'четырехкомнатные', 'четырёхкомнатн', 'четырёхкомнатная',
+            'четырёхкомнатные'],
+    }
+    
+    # Сколько подсказок каждого типа отдавать (как LIMIT в прежних SQL-запросах)
+    SUGGESTION_LIMITS = {'complex': 50, 'street': 20, 'city': 20, 'district': 15, 'developer': 15}
+    
+    @staticmethod
+    def _room_title(rooms: int) -> str:
+        return 'Студии' if rooms == 0 else f'{rooms}-комнатные квартиры'
     
     def search_suggestions(self, query: str, limit: int = 8) -> List[Dict[str, Any]]:
-        """Быстрые подсказки для автодополнения"""
+        """Быстрые подсказки для автодополнения из индекса в памяти (без запросов к БД)"""
         if len(query) < 2:
             return []
         
-        # ❌ ОТКЛЮЧАЕМ КЭШ для отладки типов квартир 
-        # cache_key = f"suggestions_{query.lower()}_{limit}"
-        # if cache_key in self.cache:
-        #     cached_data, timestamp = self.cache[cache_key]
-        #     if time.time() - timestamp < 30:
-        #         return cached_data
-        
         suggestions = []
-        query_lower = f'%{query.lower()}%'
         
         try:
-            # 🏠 ПРИОРИТЕТ 1: ТИПЫ КВАРТИР - восстанавливаем пропавшие подсказки!
-            query_clean = query.lower().strip()
-# print(f"🔍 DEBUG: Searching for '{query_clean}'")
+            index = get_suggestion_index()
+            room_counts = index.room_counts
             
-            # ✅ УЛУЧШЕННАЯ ЛОГИКА: Студии (object_rooms = 0) 
-            studio_keywords = ['студ', 'studio', '0к', '0 к', '0-к', 'студий']
-            if any(word in query_clean for word in studio_keywords) or query_clean == '0':
-                count = db.session.execute(text("SELECT COUNT(*) FROM excel_properties WHERE object_rooms = 0")).scalar()
-                if count > 0:
-                    suggestions.append({
-                        'text': 'Студии',
-                        'subtitle': f'{count} квартир доступно',
-                        'type': 'rooms',
-                        'icon': 'fas fa-home',
-                        'url': '/properties?rooms=0',
-                        'priority': 1  # ✅ ПРИОРИТЕТ 1 - самый важный
-                    })
-            
-            # ✅ МАКСИМАЛЬНО ГИБКИЙ ПОИСК: 1-комнатные (object_rooms = 1)
-            one_room_keywords = ['1к', '1 к', '1-к', '1-ком', '1 ком', 'одн', 'однок', 'однокомн', 
-                                'однокомнатн', 'однокомнатная', 'однокомнатные', 'однушк', 'однушка', 'одноком']
-            if any(word in query_clean for word in one_room_keywords) or query_clean == '1':
-                count = db.session.execute(text("SELECT COUNT(*) FROM excel_properties WHERE object_rooms = 1")).scalar()
-                if count > 0:
-                    suggestions.append({
-                        'text': '1-комнатные квартиры',
-                        'subtitle': f'{count} квартир доступно',
-                        'type': 'rooms',
-                        'icon': 'fas fa-home',
-                        'url': '/properties?rooms=1',
-                        'priority': 1  # ✅ ПРИОРИТЕТ 1 - самый важный
-                    })
-                    
-            # ✅ МАКСИМАЛЬНО ГИБКИЙ ПОИСК: 2-комнатные (object_rooms = 2)  
-            two_room_keywords = ['2к', '2 к', '2-к', '2-ком', '2 ком', 'двух', 'двухк', 'двухком',
-                                'двухкомнатн', 'двухкомнатная', 'двухкомнатные', 'двушк', 'двушка', 'двуком', 'двухком']
-            if any(word in query_clean for word in two_room_keywords) or query_clean == '2':
-                count = db.session.execute(text("SELECT COUNT(*) FROM excel_properties WHERE object_rooms = 2")).scalar()
-                if count > 0:
-                    suggestions.append({
-                        'text': '2-комнатные квартиры',
-                        'subtitle': f'{count} квартир доступно',
-                        'type': 'rooms',
-                        'icon': 'fas fa-home',
-                        'url': '/properties?rooms=2',
-                        'priority': 1  # ✅ ПРИОРИТЕТ 1 - самый важный
-                    })
-                    
-            # ✅ МАКСИМАЛЬНО ГИБКИЙ ПОИСК: 3-комнатные (object_rooms = 3)
-            three_room_keywords = ['3к', '3 к', '3-к', '3-ком', '3 ком', 'трех', 'трёх', 'трехк', 'трёхк',
-                                  'трехкомнатн', 'трехкомнатная', 'трехкомнатные', 'трёхкомнатн', 'трёхкомнатная', 'трёхкомнатные', 'трешк', 'трешка', 'трёшка', 'триком']
-            if any(word in query_clean for word in three_room_keywords) or query_clean == '3':
-                count = db.session.execute(text("SELECT COUNT(*) FROM excel_properties WHERE object_rooms = 3")).scalar()
-                if count > 0:
-                    suggestions.append({
-                        'text': '3-комнатные квартиры',
-                        'subtitle': f'{count} квартир доступно',
-                        'type': 'rooms',
-                        'icon': 'fas fa-home',
-                        'url': '/properties?rooms=3',
-                        'priority': 1  # ✅ ПРИОРИТЕТ 1 - самый важный
-                    })
-                    
-            # ✅ УЛУЧШЕННАЯ ЛОГИКА: 4-комнатные (object_rooms = 4)
-            four_room_keywords = ['4к', '4 к', '4-к', '4-ком', '4 ком', 'четыр', 'четырех', 'четырёх',
-                                 'четырехкомнатн', 'четырехкомнатная', 'четырехкомнатные', 'четырёхкомнатн', 'четырёхкомнатная', 'четырёхкомнатные']
-            if any(word in query_clean for word in four_room_keywords) or query_clean == '4':
-                count = db.session.execute(text("SELECT COUNT(*) FROM excel_properties WHERE object_rooms = 4")).scalar()
-                if count > 0:
-                    suggestions.append({
-                        'text': '4-комнатные квартиры',
-                        'subtitle': f'{count} квартир доступно', 
-                        'type': 'rooms',
-                        'icon': 'fas fa-home',
-                        'url': '/properties?rooms=4',
-                        'priority': 1  # ✅ ПРИОРИТЕТ 1 - самый важный
-                    })
+            # 🏠 ПРИОРИТЕТ 1: ТИПЫ КВАРТИР
+            query_clean = query.lower().strip()
+            for rooms, keywords in self.ROOM_KEYWORDS.items():
+                if any(word in query_clean for word in keywords) or query_clean == str(rooms):
+                    count = room_counts.get(rooms, 0)
+                    if count > 0:
+                        suggestions.append({
+                            'text': self._room_title(rooms),
+                            'subtitle': f'{count} квартир доступно',
+                            'type': 'rooms',
+                            'icon': 'fas fa-home',
+                            'url': f'/properties?rooms={rooms}',
+                            'priority': 1
+                        })
             
             # Общий поиск по "комн" если ничего конкретного не нашли
-            if ('комн' in query_clean or 'комнат' in query_clean) and not any(suggestions):
+            if ('комн' in query_clean or 'комнат' in query_clean) and not suggestions:
                 for room_num in [1, 2, 3, 4]:
-                    count = db.session.execute(text("SELECT COUNT(*) FROM excel_properties WHERE object_rooms = :rooms"), {'rooms': room_num}).scalar()
+                    count = room_counts.get(room_num, 0)
                     if count > 0:
                         suggestions.append({
                             'text': f'{room_num}-комнатные квартиры',
                             'subtitle': f'{count} квартир доступно',
                             'type': 'rooms',
                             'icon': 'fas fa-home',
-                            'url': f'/properties?rooms={room_num}'
+                            'url': f'/properties?rooms={room_num}',
+                            'priority': 1
                         })
             
-            # ЖК (приоритет 2)  
-            complexes = db.session.execute(text("""
-                SELECT DISTINCT complex_name, COUNT(*) as count
-                FROM excel_properties 
-                WHERE LOWER(complex_name) LIKE :query
-                AND complex_name IS NOT NULL 
-                GROUP BY complex_name
-                ORDER BY count DESC, complex_name
-                LIMIT 50
-            """), {'query': query_lower}).fetchall()
-            
-            for row in complexes:
-                suggestions.append({
-                    'type': 'complex',
-                    'title': row[0],
-                    'subtitle': f'{row[1]} квартир',
-                    'icon': 'building',
-                    'url': f'/properties?residential_complex={row[0]}',
-                    'priority': 3
-                })
-            
-            # Улицы (приоритет 2)
-            streets = db.session.execute(text("""
-                SELECT DISTINCT 
-                    CASE 
-                        WHEN complex_sales_address LIKE '%улица%' THEN
-                            TRIM(SUBSTRING(complex_sales_address FROM '([^,]*улица[^,]*)'))
-                        ELSE complex_sales_address
-                    END as street_name,
-                    COUNT(*) as count
-                FROM excel_properties 
-                WHERE LOWER(complex_sales_address) LIKE :query
-                AND complex_sales_address IS NOT NULL 
-                AND complex_sales_address LIKE '%улица%'
-                GROUP BY street_name
-                ORDER BY count DESC
-                LIMIT 20
-            """), {'query': query_lower}).fetchall()
-            
-            for row in streets:
-                suggestions.append({
-                    'type': 'street',
-                    'title': row[0],
-                    'subtitle': f'{row[1]} объектов',
-                    'icon': 'road',
-                    'url': f'/properties?search={row[0]}',
-                    'priority': 4
-                })
-            
-            # Города (приоритет 1 - самый важный!)
-            cities = db.session.execute(text("""
-                SELECT DISTINCT 
-                    CASE 
-                        WHEN complex_sales_address LIKE '%Сочи%' THEN 'Сочи'
-                        WHEN complex_sales_address LIKE '%Краснодар%' THEN 'Краснодар'
-                        WHEN complex_sales_address LIKE '%Анапа%' THEN 'Анапа'
-                        WHEN complex_sales_address LIKE '%Новороссийск%' THEN 'Новороссийск'
-                        WHEN complex_sales_address LIKE '%Геленджик%' THEN 'Геленджик'
-                        ELSE NULL
-                    END as city,
-                    COUNT(*) as count
-                FROM excel_properties 
-                WHERE complex_sales_address IS NOT NULL
-                AND LOWER(
-                    CASE 
-                        WHEN complex_sales_address LIKE '%Сочи%' THEN 'Сочи'
-                        WHEN complex_sales_address LIKE '%Краснодар%' THEN 'Краснодар'
-                        WHEN complex_sales_address LIKE '%Анапа%' THEN 'Анапа'
-                        WHEN complex_sales_address LIKE '%Новороссийск%' THEN 'Новороссийск'
-                        WHEN complex_sales_address LIKE '%Геленджик%' THEN 'Геленджик'
-                        ELSE ''
-                    END
-                ) LIKE :query
-                GROUP BY 
-                    CASE 
-                        WHEN complex_sales_address LIKE '%Сочи%' THEN 'Сочи'
-                        WHEN complex_sales_address LIKE '%Краснодар%' THEN 'Краснодар'
-                        WHEN complex_sales_address LIKE '%Анапа%' THEN 'Анапа'
-                        WHEN complex_sales_address LIKE '%Новороссийск%' THEN 'Новороссийск'
-                        WHEN complex_sales_address LIKE '%Геленджик%' THEN 'Геленджик'
-                        ELSE NULL
-                    END
-                HAVING 
-                    CASE 
-                        WHEN complex_sales_address LIKE '%Сочи%' THEN 'Сочи'
-                        WHEN complex_sales_address LIKE '%Краснодар%' THEN 'Краснодар'
-                        WHEN complex_sales_address LIKE '%Анапа%' THEN 'Анапа'
-                        WHEN complex_sales_address LIKE '%Новороссийск%' THEN 'Новороссийск'
-                        WHEN complex_sales_address LIKE '%Геленджик%' THEN 'Геленджик'
-                        ELSE NULL
-                    END IS NOT NULL
-                ORDER BY count DESC
-                LIMIT 20
-            """), {'query': query_lower}).fetchall()
-            
-            for row in cities:
-                suggestions.append({
-                    'type': 'city',
-                    'title': row[0],
-                    'subtitle': f'{row[1]} предложений',
-                    'icon': 'map-marker-alt',
-                    'url': f'/properties?search={row[0]}',
-                    'priority': 1
-                })
-
-            # Районы (приоритет 2)
-            districts = db.session.execute(text("""
-                SELECT DISTINCT parsed_district, COUNT(*) as count
-                FROM excel_properties 
-                WHERE LOWER(parsed_district) LIKE :query
-                AND parsed_district IS NOT NULL 
-                GROUP BY parsed_district
-                ORDER BY count DESC
-                LIMIT 15
-            """), {'query': query_lower}).fetchall()
-            
-            for row in districts:
-                suggestions.append({
-                    'type': 'district',
-                    'title': row[0],
-                    'subtitle': f'{row[1]} предложений',
-                    'icon': 'map-pin',
-                    'url': f'/properties?district={row[0]}',
-                    'priority': 2
-                })
-            
-            # Застройщики (приоритет 5)
-            developers = db.session.execute(text("""
-                SELECT DISTINCT developer_name, COUNT(*) as count
-                FROM excel_properties 
-                WHERE LOWER(developer_name) LIKE :query
-                AND developer_name IS NOT NULL 
-                GROUP BY developer_name
-                ORDER BY count DESC
-                LIMIT 15
-            """), {'query': query_lower}).fetchall()
-            
-            for row in developers:
-                suggestions.append({
-                    'type': 'developer',
-                    'title': row[0],
-                    'subtitle': f'{row[1]} объектов',
-                    'icon': 'user-tie',
-                    'url': f'/properties?developer={row[0]}',
-                    'priority': 4
-                })
+            # ЖК, улицы, города, районы и застройщики: префикс, подстрока и опечатки
+            for entry in index.search(query, limits=self.SUGGESTION_LIMITS):
+                suggestion = dict(entry)
+                suggestion.pop('count', None)
+                suggestions.append(suggestion)
             
             # Типы квартир - ТОЛЬКО если явно ищут квартиры
             query_has_room_keywords = any(word in query.lower() for word in ['студ', 'комн', 'квартир'])
@@ -450,30 +188,20 @@ class SuperSmartSearch:
                             room_suggestions.append({'rooms': i, 'name': f'{i}-комнатные'})
                 
                 for room_type in room_suggestions[:2]:
-                    result = db.session.execute(text("""
-                        SELECT COUNT(*) FROM excel_properties WHERE object_rooms = :rooms
-                    """), {'rooms': room_type['rooms']}).fetchone()
-                    count = result[0] if result else 0
-                    
                     suggestions.append({
                         'type': 'rooms',
                         'title': room_type['name'],
-                        'subtitle': f'{count} предложений',
+                        'subtitle': f'{room_counts.get(room_type["rooms"], 0)} предложений',
                         'icon': 'home',
                         'url': f'/properties?rooms={room_type["rooms"]}',
                         'priority': 5
                     })
             
-            # Сортируем по приоритету и показываем больше результатов
+            # Сортируем по приоритету (сортировка устойчивая: внутри приоритета порядок индекса)
             suggestions = sorted(suggestions, key=lambda x: x['priority'])[:min(limit, 100)]
             
-            # ✅ ИСПРАВЛЕНО: Убираем priority из результата (если есть)
             for suggestion in suggestions:
-                if 'priority' in suggestion:
-                    suggestion.pop('priority', None)
-            
-            # ❌ КЭШИРОВАНИЕ ПОЛНОСТЬЮ ОТКЛЮЧЕНО для отладки типов квартир
-            # self.cache[cache_key] = (suggestions, time.time())
+                suggestion.pop('priority', None)
             
             return suggestions
             
@@ -481,44 +209,73 @@ class SuperSmartSearch:
             print(f"Search suggestions error: {e}")
             return []
     
-    def search_properties(self, query: str, limit: int = 50) -> Dict[str, Any]:
-        """Основной поиск недвижимости"""
+    def _is_criteria_word(self, word: str) -> bool:
+        """Слово уже разобрано extract_search_criteria в фильтр (комнаты, цена, площадь)"""
+        return (word in ['студия', 'студ', 'studio']
+                or re.match(r'^(\d)[к-]?комн?$', word) is not None
+                or re.search(r'(\d+)(?:млн|мил|m)', word) is not None
+                or re.search(r'(\d+)(?:м|кв)', word) is not None)
+    
+    def search_properties(self, query: str, limit: int = 50, page: int = 1) -> Dict[str, Any]:
+        """
+        Основной поиск недвижимости: комнаты, цена и площадь из запроса — фильтры
+        PropertyIndex, остальные слова — полнотекстовый поиск с ранжированием BM25.
+        """
         if len(query) < 2:
             return {'results': [], 'total': 0, 'criteria': {}}
         
         criteria = self.extract_search_criteria(query)
-        sql_query, params = self.build_optimized_query(criteria)
         
         try:
-            results = db.session.execute(text(sql_query), params).fetchall()
+            index = get_property_index()
+            mask = index.all_mask()
+            if criteria['rooms']:
+                mask &= index.rooms_mask(criteria['rooms'])
+            if criteria['price_min'] or criteria['price_max']:
+                mask &= index.range_mask('price', criteria['price_min'], criteria['price_max'])
+            if criteria['area_min'] or criteria['area_max']:
+                mask &= index.range_mask('area', criteria['area_min'], criteria['area_max'])
+            
+            offset = (max(page, 1) - 1) * limit
+            text_query = ' '.join(word for word in criteria['keywords'] if not self._is_criteria_word(word))
+            scores = None
+            if text_query:
+                found = get_full_text_index(index.properties).search(text_query, mask=mask, offset=offset, limit=limit)
+                positions, scores, total = found['positions'], found['scores'], found['total']
+            else:
+                positions, total = index.select(mask, 'price_asc', offset, limit), index.count(mask)
             
             properties = []
-            for row in results:
+            for position, prop in enumerate(index.materialize(positions)):
+                coordinates = prop.get('coordinates') or {}
                 properties.append({
-                    'id': row[0],
-                    'rooms': row[1] or 0,
-                    'area': row[2] or 0,
-                    'price': row[3] or 0,
-                    'complex_name': row[4] or '',
-                    'developer_name': row[5] or '',
-                    'district': row[6] or '',
-                    'address': row[7] or '',
-                    'lat': row[8],
-                    'lon': row[9],
-                    'photos': row[10] or 0,
-                    'url': row[11] or f'/object/{row[0]}'
+                    'id': prop.get('id'),
+                    'rooms': prop.get('rooms') or 0,
+                    'area': prop.get('area') or 0,
+                    'price': prop.get('price') or 0,
+                    'complex_name': prop.get('complex_name') or '',
+                    'developer_name': prop.get('developer') or '',
+                    'district': prop.get('district') or '',
+                    'address': prop.get('address') or '',
+                    'lat': coordinates.get('lat'),
+                    'lon': coordinates.get('lng'),
+                    'photos': prop.get('main_image') or 0,
+                    'url': prop.get('url') or f"/object/{prop.get('id')}",
+                    'score': round(float(scores[position]), 4) if scores is not None else None
                 })
             
             return {
                 'results': properties,
-                'total': len(properties),
+                'total': total,
+                'page': max(page, 1),
+                'per_page': limit,
                 'criteria': criteria,
                 'query': query
             }
             
         except Exception as e:
             print(f"Search properties error: {e}")
-            return {'results': [], 'total': 0, 'criteria': criteria}
+            return {'results': [], 'total': 0, 'criteria': criteria, 'error': str(e)}
 
 # Создаем глобальный экземпляр
 super_search = SuperSmartSearch()
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Кэш аутентифицированного субъекта (User / Manager) между запросами.
+
+load_user (Flask-Login) и manager_required на каждый запрос читали строку
+пользователя/менеджера по id из сессии; панель менеджера опрашивает несколько
+/api/manager/* подряд, и каждый опрос повторял одни и те же SELECT. Теперь
+значения колонок хранятся PRINCIPAL_CACHE_TTL секунд (по умолчанию 30), а на
+запрос экземпляр собирается из них и прикрепляется к db.session через
+merge(load=False) без обращения к БД. Дальнейшие Manager.query.get(id) в том же
+запросе берут его из identity map, связи (favorites, clients, ...) по-прежнему
+подгружаются лениво.
+
+Кэш у каждого воркера свой. У каждого субъекта есть версия в общем хранилище
+(файлы в instance/cache/principals или Redis snapshot_cache); запись кэша
+помнит версию, при которой прочитана, и get() сверяет ее с общей — чтение
+одного маленького ключа дешевле SELECT к БД. Версия субъекта увеличивается:
+* явно через invalidate(model, id) — блокировка и удаление менеджера в админке;
+* после коммита, в котором ORM удалил субъекта или изменил is_active/пароль.
+Прочие ORM-правки (профиль, last_login при входе) сбрасывают только запись
+в своем воркере, остальные увидят их по TTL; изменения сырым SQL — тоже по TTL.
+
+    manager = principal_cache.get(Manager, session['manager_id'])
+    principal_cache.invalidate(Manager, manager_id)
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from snapshot_cache import DEFAULT_CACHE_DIR, FileSnapshotStore, create_default_store
+
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 30))
+CACHED_MODELS = ('User', 'Manager')
+# Изменение этих колонок должно сразу действовать во всех воркерах
+SECURITY_COLUMNS = ('is_active', 'password_hash', 'temp_password_hash')
+
+
+def create_principal_store():
+    """Redis, если он настроен для снимков, иначе отдельный каталог instance/cache/principals"""
+    if os.environ.get('SNAPSHOT_CACHE_REDIS_URL'):
+        return create_default_store()
+    return FileSnapshotStore(os.path.join(DEFAULT_CACHE_DIR, 'principals'))
+
+
+def _version_name(model_name: str, principal_id: int) -> str:
+    return f"principal.{model_name}.{principal_id}"
+
+
+def _column_values(instance) -> Dict[str, Any]:
+    return {attr.key: getattr(instance, attr.key) for attr in inspect(type(instance)).column_attrs}
+
+
+def _detached_instance(model, values: Dict[str, Any]):
+    # Без __init__: конструкторы User/Manager генерируют user_id запросом к БД
+    instance = inspect(model).class_manager.new_instance()
+    for key, value in values.items():
+        setattr(instance, key, value)
+    make_transient_to_detached(instance)
+    return instance
+
+
+class PrincipalCache:
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, store=None):
+        self.ttl = ttl
+        self._store = store
+        self._lock = threading.Lock()
+        # (имя модели, id) -> (monotonic-время истечения, общая версия субъекта, значения колонок)
+        self._entries: Dict[Tuple[str, int], Tuple[float, int, Dict[str, Any]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = create_principal_store()
+        return self._store
+
+    def get(self, model, principal_id) -> Optional[Any]:
+        """Экземпляр model с этим id, прикрепленный к db.session, или None, если его нет в БД"""
+        from app import db
+
+        key = (model.__name__, int(principal_id))
+        # Версия читается до загрузки строки: инвалидация во время загрузки не даст закэшировать старое
+        version = self.store.get_version(_version_name(*key))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now and entry[1] == version:
+                self.hits += 1
+                values = entry[2]
+            else:
+                self.misses += 1
+                values = None
+        if values is not None:
+            return db.session.merge(_detached_instance(model, values), load=False)
+
+        instance = db.session.get(model, key[1])
+        if instance is not None and self.ttl > 0:
+            values = _column_values(instance)
+            with self._lock:
+                self._entries[key] = (now + self.ttl, version, values)
+        return instance
+
+    def forget(self, model, principal_id):
+        """Сбрасывает запись только в этом процессе"""
+        name = model if isinstance(model, str) else model.__name__
+        with self._lock:
+            self._entries.pop((name, int(principal_id)), None)
+
+    def invalidate(self, model, principal_id):
+        """Сбрасывает субъекта во всех процессах; вызывать после коммита изменения"""
+        name = model if isinstance(model, str) else model.__name__
+        self.store.bump_version(_version_name(name, int(principal_id)))
+        self.forget(name, principal_id)
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'ttl_seconds': self.ttl,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+principal_cache = PrincipalCache()
+
+
+def _security_change(instance) -> bool:
+    state = inspect(instance)
+    return any(name in state.attrs and state.attrs[name].history.has_changes() for name in SECURITY_COLUMNS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed_principals(session, flush_context):
+    # В after_flush dirty/deleted и история атрибутов еще в состоянии до записи
+    changed = session.info.setdefault('principals_changed', {})
+    for instance, deleted in [(instance, False) for instance in session.dirty] + \
+                             [(instance, True) for instance in session.deleted]:
+        name = type(instance).__name__
+        identity = inspect(instance).identity
+        if name not in CACHED_MODELS or not identity:
+            continue
+        key = (name, identity[0])
+        changed[key] = changed.get(key, False) or deleted or _security_change(instance)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_principals(session):
+    # После коммита, иначе другой воркер успеет закэшировать еще не измененную строку
+    for (name, principal_id), shared in session.info.pop('principals_changed', {}).items():
+        if shared:
+            principal_cache.invalidate(name, principal_id)
+        else:
+            principal_cache.forget(name, principal_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back_principals(session, previous_transaction):
+    session.info.pop('principals_changed', None)
@@ -0,0 +1,298 @@
+"""
+Колоночный индекс квартир на NumPy для быстрых фильтров каталога.
+
+Снимок load_properties() — это список больших словарей, и каждый фильтр
+раньше проходил по нему целиком. PropertyIndex хранит нужные для фильтрации
+поля в типизированных массивах (цена, площадь, комнаты, этажи, координаты,
+год сдачи) и категориальные коды (район, застройщик, ЖК, класс), поэтому
+фильтр, сортировка и подсчет — это векторные маски и argsort, а словари
+достаются из исходного списка только для отдаваемой страницы.
+
+    index = property_index_cache.get(load_properties())
+    mask = index.rooms_mask(['2', '3']) & index.range_mask('price', 0, 8_000_000)
+    positions = index.select(mask, sort_type='price_asc', limit=20)
+    page = index.materialize(positions)
+"""
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+MISSING_ROOMS = -1
+
+# Колонка -> (ключ словаря, dtype, значение для пропуска)
+NUMERIC_COLUMNS = {
+    'price': ('price', np.float64, np.nan),
+    'area': ('area', np.float64, np.nan),
+    'rooms': ('rooms', np.int16, MISSING_ROOMS),
+    'floor': ('floor', np.int16, 0),
+    'total_floors': ('total_floors', np.int16, 0),
+    'completion_year': ('completion_year', np.int16, 0),
+}
+
+# Категория -> ключ словаря
+CATEGORICAL_COLUMNS = {
+    'district': 'district',
+    'developer': 'developer',
+    'complex': 'complex_name',
+    'complex_class': 'complex_class',
+}
+
+# Сортировки sort_properties(): (колонка, по убыванию)
+SORT_COLUMNS = {
+    'price_asc': ('price', False),
+    'price_desc': ('price', True),
+    # Кэшбек пропорционален цене, поэтому порядок тот же
+    'cashback_desc': ('price', True),
+    'area_asc': ('area', False),
+    'area_desc': ('area', True),
+}
+
+_YEAR_RE = re.compile(r'(20\d{2}|19\d{2})')
+
+
+def _to_number(value, missing):
+    if value is None or value == '':
+        return missing
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return missing
+
+
+def _completion_year(prop: Dict[str, Any]) -> int:
+    year = prop.get('completion_year')
+    if year:
+        try:
+            return int(year)
+        except (TypeError, ValueError):
+            pass
+    # В снимке год есть только внутри строки вида "2 кв. 2025 г."
+    match = _YEAR_RE.search(str(prop.get('completion_date') or ''))
+    return int(match.group(1)) if match else 0
+
+
+def parse_room_filter(value) -> Optional[tuple]:
+    """
+    Разбирает значение фильтра комнат: '2', 2, '2-комн', 'студия', '0', '4+', '4+-комн'.
+    Возвращает ('eq', n) или ('gte', n), либо None для нераспознанного значения.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return ('eq', int(value))
+    text_value = str(value).strip().lower()
+    if text_value in ('студия', 'studio', '0'):
+        return ('eq', 0)
+    if text_value.endswith('-комн'):
+        text_value = text_value[:-len('-комн')]
+    if text_value.endswith('+'):
+        text_value = text_value[:-1]
+        return ('gte', int(text_value)) if text_value.isdigit() else None
+    return ('eq', int(text_value)) if text_value.isdigit() else None
+
+
+class PropertyIndex:
+    """Типизированные колонки поверх списка словарей-квартир"""
+
+    def __init__(self, properties: Sequence[Dict[str, Any]]):
+        self.properties = properties
+        self.size = len(properties)
+        self.columns: Dict[str, np.ndarray] = {}
+        self.labels: Dict[str, List[Any]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        self._code_of: Dict[str, Dict[Any, int]] = {}
+        self._positions: Dict[str, int] = {}
+
+        for name, (key, dtype, missing) in NUMERIC_COLUMNS.items():
+            if name == 'completion_year':
+                values = [_completion_year(prop) for prop in properties]
+            else:
+                values = [_to_number(prop.get(key), missing) for prop in properties]
+            if np.issubdtype(dtype, np.integer):
+                column = np.array(values, dtype=np.float64)
+                column = np.where(np.isnan(column), missing, column).astype(dtype)
+            else:
+                column = np.array(values, dtype=dtype)
+            self.columns[name] = column
+
+        lat = np.full(self.size, np.nan)
+        lng = np.full(self.size, np.nan)
+        for position, prop in enumerate(properties):
+            coordinates = prop.get('coordinates') or {}
+            lat[position] = _to_number(coordinates.get('lat'), np.nan)
+            lng[position] = _to_number(coordinates.get('lng'), np.nan)
+            self._positions[str(prop.get('id'))] = position
+        self.columns['lat'] = lat
+        self.columns['lng'] = lng
+
+        for name, key in CATEGORICAL_COLUMNS.items():
+            code_of: Dict[Any, int] = {}
+            codes = np.empty(self.size, dtype=np.int32)
+            for position, prop in enumerate(properties):
+                label = prop.get(key)
+                code = code_of.get(label)
+                if code is None:
+                    code = code_of[label] = len(code_of)
+                codes[position] = code
+            self.codes[name] = codes
+            self._code_of[name] = code_of
+            self.labels[name] = list(code_of)
+
+    def __len__(self):
+        return self.size
+
+    # --- маски ---------------------------------------------------------------
+
+    def all_mask(self) -> np.ndarray:
+        return np.ones(self.size, dtype=bool)
+
+    def none_mask(self) -> np.ndarray:
+        return np.zeros(self.size, dtype=bool)
+
+    def range_mask(self, column: str, minimum=None, maximum=None) -> np.ndarray:
+        """minimum <= column <= maximum; пропуски (NaN) не проходят ограниченный фильтр"""
+        values = self.columns[column]
+        mask = self.all_mask()
+        if minimum is not None:
+            mask &= values >= minimum
+        if maximum is not None:
+            mask &= values <= maximum
+        return mask
+
+    def rooms_mask(self, room_filters: Iterable) -> np.ndarray:
+        """Квартиры, подходящие хотя бы под одно значение фильтра комнат"""
+        rooms = self.columns['rooms']
+        mask = self.none_mask()
+        for room_filter in room_filters:
+            parsed = parse_room_filter(room_filter)
+            if parsed is None:
+                continue
+            operator, number = parsed
+            mask |= (rooms >= number) if operator == 'gte' else (rooms == number)
+        return mask
+
+    def category_mask(self, column: str, values: Iterable) -> np.ndarray:
+        """Точное совпадение категории с любым из значений"""
+        code_of = self._code_of[column]
+        codes = [code_of[value] for value in values if value in code_of]
+        if not codes:
+            return self.none_mask()
+        if len(codes) == 1:
+            return self.codes[column] == codes[0]
+        return np.isin(self.codes[column], codes)
+
+    def category_contains_mask(self, column: str, substring: str) -> np.ndarray:
+        """Подстрока без учета регистра: проверяются метки категорий, а не строки"""
+        needle = substring.lower()
+        codes = [code for code, label in enumerate(self.labels[column])
+                 if label and needle in str(label).lower()]
+        if not codes:
+            return self.none_mask()
+        return np.isin(self.codes[column], codes)
+
+    def bbox_mask(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """Квартиры внутри прямоугольника карты (без перехода через 180-й меридиан)"""
+        lat = self.columns['lat']
+        lng = self.columns['lng']
+        return (lat >= south) & (lat <= north) & (lng >= west) & (lng <= east)
+
+    def position_of(self, property_id) -> Optional[int]:
+        """Позиция квартиры в снимке или None"""
+        return self._positions.get(str(property_id))
+
+    def exclude_ids(self, mask: np.ndarray, ids: Iterable) -> np.ndarray:
+        for property_id in ids:
+            position = self._positions.get(str(property_id))
+            if position is not None:
+                mask[position] = False
+        return mask
+
+    # --- выборка -------------------------------------------------------------
+
+    def count(self, mask: np.ndarray) -> int:
+        return int(np.count_nonzero(mask))
+
+    def select(self, mask: Optional[np.ndarray] = None, sort_type: Optional[str] = None,
+               offset: int = 0, limit: Optional[int] = None) -> np.ndarray:
+        """Позиции подходящих квартир в порядке сортировки (по умолчанию — порядок снимка)"""
+        positions = np.flatnonzero(mask) if mask is not None else np.arange(self.size)
+        positions = self.sort(positions, sort_type)
+        end = None if limit is None else offset + limit
+        return positions[offset:end]
+
+    def sort(self, positions: np.ndarray, sort_type: Optional[str]) -> np.ndarray:
+        """Устойчивая сортировка позиций; пропуски считаются нулем, как в sort_properties()"""
+        if sort_type not in SORT_COLUMNS or len(positions) < 2:
+            return positions
+        column, descending = SORT_COLUMNS[sort_type]
+        values = np.nan_to_num(self.columns[column][positions], nan=0.0)
+        if descending:
+            values = -values
+        return positions[np.argsort(values, kind='stable')]
+
+    def grid_clusters(self, mask: np.ndarray, cell_size: float) -> List[Dict[str, Any]]:
+        """
+        Группирует квартиры по квадратной сетке в cell_size градусов.
+        Сетка привязана к координатам, а не к окну, поэтому кластеры не
+        "прыгают" при сдвиге карты. Центр кластера — среднее координат квартир.
+        """
+        positions = np.flatnonzero(mask)
+        if not len(positions):
+            return []
+        lat = self.columns['lat'][positions]
+        lng = self.columns['lng'][positions]
+        price = np.nan_to_num(self.columns['price'][positions], nan=0.0)
+        cells = (np.floor(lng / cell_size).astype(np.int64) << 32) + (
+            np.floor(lat / cell_size).astype(np.int64) + (1 << 31))
+        keys, inverse = np.unique(cells, return_inverse=True)
+        counts = np.bincount(inverse)
+        lat_sum = np.bincount(inverse, weights=lat)
+        lng_sum = np.bincount(inverse, weights=lng)
+        min_price = np.full(len(keys), np.inf)
+        np.minimum.at(min_price, inverse, np.where(price > 0, price, np.inf))
+        return [
+            {
+                'lat': float(lat_sum[i] / counts[i]),
+                'lng': float(lng_sum[i] / counts[i]),
+                'count': int(counts[i]),
+                'min_price': int(min_price[i]) if np.isfinite(min_price[i]) else None,
+            }
+            for i in range(len(keys))
+        ]
+
+    def materialize(self, positions: Iterable[int]) -> List[Dict[str, Any]]:
+        """Словари квартир для выбранных позиций"""
+        properties = self.properties
+        return [properties[position] for position in positions]
+
+    def query(self, mask: Optional[np.ndarray] = None, sort_type: Optional[str] = None,
+              offset: int = 0, limit: Optional[int] = None):
+        """(страница словарей, общее количество)"""
+        total = self.count(mask) if mask is not None else self.size
+        return self.materialize(self.select(mask, sort_type, offset, limit)), total
+
+
+class PropertyIndexCache:
+    """
+    Индекс для текущего снимка: пересобирается, только когда load_properties()
+    вернул другой список (новая версия снимка или истек TTL).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._index: Optional[PropertyIndex] = None
+        self.builds = 0
+
+    def get(self, properties: Sequence[Dict[str, Any]]) -> PropertyIndex:
+        with self._lock:
+            if self._index is None or self._source is not properties:
+                self._index = PropertyIndex(properties)
+                self._source = properties
+                self.builds += 1
+            return self._index
+
+
+property_index_cache = PropertyIndexCache()
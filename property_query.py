@@ -0,0 +1,282 @@
+"""
+Построитель SQL-запросов для каталога квартир (/properties)
+Переводит словарь фильтров в параметризованные WHERE / ORDER BY / LIMIT / OFFSET,
+чтобы база возвращала только текущую страницу, а не всю таблицу excel_properties
+"""
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+# Выражения повторяют нормализацию значений, которую раньше делал Python-цикл:
+# price or 0, area or 0, min_floor or 1, max_floor or min_floor (rooms or 0 — см. _rooms_equals)
+PRICE_EXPR = "COALESCE(price, 0)"
+AREA_EXPR = "COALESCE(object_area, 0)"
+ROOMS_AT_LEAST_FOUR = "object_rooms >= 4"
+FLOOR_EXPR = "COALESCE(NULLIF(object_min_floor, 0), 1)"
+TOTAL_FLOORS_EXPR = "COALESCE(NULLIF(object_max_floor, 0), NULLIF(object_min_floor, 0), 1)"
+
+SORT_CLAUSES = {
+    'price_asc': f"{PRICE_EXPR} ASC, inner_id ASC",
+    'price_desc': f"{PRICE_EXPR} DESC, inner_id ASC",
+    'area_asc': f"{AREA_EXPR} ASC, inner_id ASC",
+    'area_desc': f"{AREA_EXPR} DESC, inner_id ASC",
+}
+
+BUILDING_TYPE_CONDITIONS = {
+    'малоэтажный': f"{TOTAL_FLOORS_EXPR} <= 5",
+    'среднеэтажный': f"{TOTAL_FLOORS_EXPR} BETWEEN 6 AND 12",
+    'многоэтажный': f"{TOTAL_FLOORS_EXPR} >= 13",
+}
+
+
+def _rooms_equals(rooms: int) -> str:
+    """rooms or 0 без COALESCE, чтобы работал индекс (object_rooms, price)"""
+    if rooms == 0:
+        return "(object_rooms = 0 OR object_rooms IS NULL)"
+    return f"object_rooms = {rooms}"
+
+
+def _escape_like(value: str) -> str:
+    """Экранирует спецсимволы LIKE, чтобы фильтр работал как поиск подстроки"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _as_list(value: Any) -> List[str]:
+    """Приводит значение фильтра к списку непустых строк"""
+    if not value:
+        return []
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return [str(v).strip() for v in value if v is not None and str(v).strip()]
+
+
+class PropertyQueryBuilder:
+    """Собирает параметризованный запрос к excel_properties из фильтров каталога"""
+
+    def __init__(self, filters: Dict[str, Any], sort_type: str = 'price_asc'):
+        self.filters = filters or {}
+        self.sort_type = sort_type
+        self.conditions: List[str] = []
+        self.params: Dict[str, Any] = {}
+        self._build()
+
+    # ------------------------------------------------------------------
+    # Вспомогательные методы
+    # ------------------------------------------------------------------
+    def _param(self, value: Any) -> str:
+        name = f"p{len(self.params)}"
+        self.params[name] = value
+        return f":{name}"
+
+    def _contains(self, column: str, value: str) -> str:
+        placeholder = self._param(f"%{_escape_like(value.lower())}%")
+        return f"LOWER({column}) LIKE {placeholder} ESCAPE '\\'"
+
+    def _any_contains(self, column: str, values: List[str]) -> str:
+        return "(" + " OR ".join(self._contains(column, v) for v in values) + ")"
+
+    def _optional_contains(self, column: str, value: str) -> str:
+        """Фильтр применяется только к строкам, где колонка заполнена"""
+        return f"({column} IS NULL OR {column} = '' OR {self._contains(column, value)})"
+
+    def _number(self, key: str, cast=float) -> Optional[float]:
+        raw = self.filters.get(key)
+        if not raw:
+            return None
+        try:
+            return cast(raw)
+        except (TypeError, ValueError):
+            return None
+
+    # ------------------------------------------------------------------
+    # Комнаты: поддержка "студия", "0", "X-комн", "X-комнатная", "4+"
+    # ------------------------------------------------------------------
+    def _room_target_condition(self, room_filter: str) -> Optional[str]:
+        """Явное значение комнат: "студия"/"0", "X-комн", "4+" или число"""
+        if room_filter in ('студия', '0'):
+            return _rooms_equals(0)
+        if room_filter.endswith('-комн'):
+            try:
+                return _rooms_equals(int(room_filter.split('-')[0]))
+            except ValueError:
+                return None
+        if room_filter in ('4+', '4+-комн'):
+            return ROOMS_AT_LEAST_FOUR
+        try:
+            return _rooms_equals(int(room_filter))
+        except ValueError:
+            return None
+
+    def _room_alias_condition(self, room_filter: str) -> Optional[str]:
+        """Текстовые синонимы: "studio", "1-комнатная", "4-комн", "4+" и т.д."""
+        normalized = room_filter.lower()
+        try:
+            number = int(room_filter) if room_filter.isdigit() else None
+        except ValueError:
+            number = None
+        options = []
+        if normalized in ('studio', 'студия'):
+            options.append(_rooms_equals(0))
+        for rooms in (1, 2, 3):
+            if normalized in (f'{rooms}-комнатная', f'{rooms}-комн', str(rooms)) or number == rooms:
+                options.append(_rooms_equals(rooms))
+        if normalized in ('4-комнатная', '4-комн', '4', '4+') or (number is not None and number >= 4):
+            options.append(ROOMS_AT_LEAST_FOUR)
+        if not options:
+            return None
+        return " OR ".join(options)
+
+    def _rooms_conditions(self, rooms: List[str]) -> List[str]:
+        # Оба набора правил должны совпасть, как и в прежнем Python-фильтре
+        conditions = []
+        for parser in (self._room_target_condition, self._room_alias_condition):
+            options = [c for c in (parser(r) for r in rooms) if c]
+            conditions.append("(" + " OR ".join(options) + ")" if options else "1 = 0")
+        return conditions
+
+    def _completion_condition(self, years: List[str]) -> Optional[str]:
+        if 'Сдан' in years:
+            return None
+        options = []
+        for year in years:
+            placeholder = self._param(year)
+            options.append(
+                f"(COALESCE(complex_end_build_year, 0) <> 0 AND CAST(complex_end_build_year AS TEXT) = {placeholder})"
+            )
+            options.append(
+                f"(COALESCE(complex_building_end_build_year, 0) <> 0 "
+                f"AND CAST(complex_building_end_build_year AS TEXT) = {placeholder})"
+            )
+        return "(" + " OR ".join(options) + ")"
+
+    # ------------------------------------------------------------------
+    # Сборка WHERE
+    # ------------------------------------------------------------------
+    def _build(self):
+        f = self.filters
+        add = self.conditions.append
+
+        # Цена: пользователь вводит в миллионах, в базе хранятся рубли
+        price_min = self._number('price_min')
+        if price_min is not None:
+            add(f"{PRICE_EXPR} >= {self._param(price_min * 1000000)}")
+        price_max = self._number('price_max')
+        if price_max is not None:
+            add(f"{PRICE_EXPR} <= {self._param(price_max * 1000000)}")
+
+        area_min = self._number('area_min')
+        if area_min is not None:
+            add(f"{AREA_EXPR} >= {self._param(area_min)}")
+        area_max = self._number('area_max')
+        if area_max is not None:
+            add(f"{AREA_EXPR} <= {self._param(area_max)}")
+
+        floor_min = self._number('floor_min', int)
+        if floor_min is not None:
+            add(f"{FLOOR_EXPR} >= {self._param(floor_min)}")
+        floor_max = self._number('floor_max', int)
+        if floor_max is not None:
+            add(f"{FLOOR_EXPR} <= {self._param(floor_max)}")
+
+        building_types = _as_list(f.get('building_types'))
+        if building_types:
+            options = [BUILDING_TYPE_CONDITIONS[t] for t in building_types if t in BUILDING_TYPE_CONDITIONS]
+            add("(" + " OR ".join(options) + ")" if options else "1 = 0")
+
+        districts = _as_list(f.get('districts'))
+        if districts:
+            add(self._any_contains('address_locality_name', districts))
+
+        developers = _as_list(f.get('developers'))
+        if developers:
+            add(self._any_contains('developer_name', developers))
+
+        rooms = _as_list(f.get('rooms'))
+        if rooms:
+            self.conditions.extend(self._rooms_conditions(rooms))
+
+        for key in ('completion', 'delivery_years'):
+            years = _as_list(f.get(key))
+            if years:
+                condition = self._completion_condition(years)
+                if condition:
+                    add(condition)
+
+        object_classes = _as_list(f.get('object_classes'))
+        if object_classes:
+            column = 'complex_object_class_display_name'
+            add(f"({column} IS NULL OR {column} = '' OR {self._any_contains(column, object_classes)})")
+
+        # Регион и город ищутся в полном адресе объекта
+        regions = _as_list(f.get('regions'))
+        if regions:
+            add(self._any_contains('address_display_name', regions))
+        cities = _as_list(f.get('cities'))
+        if cities:
+            add(self._any_contains('address_display_name', cities))
+        for key in ('region', 'city'):
+            value = (f.get(key) or '').strip()
+            if value:
+                add(self._contains('address_display_name', value))
+
+        developer = (f.get('developer') or '').strip()
+        if developer:
+            add(self._optional_contains('developer_name', developer))
+
+        complex_name = (f.get('residential_complex') or '').strip()
+        if complex_name:
+            add(self._optional_contains('complex_name', complex_name))
+
+        building = (f.get('building') or '').strip()
+        if building:
+            add(self._optional_contains('complex_building_name', building))
+
+        search = (f.get('search') or '').strip()
+        if search:
+            columns = ('address_display_name', 'developer_name', 'complex_name',
+                       'address_locality_name', 'complex_building_name')
+            add("(" + " OR ".join(self._contains(c, search) for c in columns) + ")")
+
+    # ------------------------------------------------------------------
+    # Публичный API
+    # ------------------------------------------------------------------
+    @property
+    def where_clause(self) -> str:
+        if not self.conditions:
+            return ""
+        return "WHERE " + "\n  AND ".join(self.conditions)
+
+    @property
+    def order_clause(self) -> str:
+        return "ORDER BY " + SORT_CLAUSES.get(self.sort_type, "inner_id ASC")
+
+    def count_query(self) -> Tuple[str, Dict[str, Any]]:
+        """SQL для подсчета всех найденных объектов"""
+        sql = f"SELECT COUNT(*) FROM excel_properties {self.where_clause}"
+        return sql, dict(self.params)
+
+    def page_query(self, columns: str, page: int, per_page: int) -> Tuple[str, Dict[str, Any]]:
+        """SQL для выборки одной страницы результатов"""
+        params = dict(self.params)
+        params['page_limit'] = per_page
+        params['page_offset'] = (page - 1) * per_page
+        sql = (
+            f"SELECT {columns} FROM excel_properties {self.where_clause} "
+            f"{self.order_clause} LIMIT :page_limit OFFSET :page_offset"
+        )
+        return sql, params
+
+
+def paginate(total: int, page: int, per_page: int) -> Dict[str, Any]:
+    """Информация о пагинации в формате шаблона properties.html"""
+    total_pages = max(1, math.ceil(total / per_page)) if per_page else 1
+    page = min(max(1, page), total_pages)
+    return {
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'total_pages': total_pages,
+        'has_prev': page > 1,
+        'has_next': page < total_pages,
+        'prev_page': page - 1 if page > 1 else None,
+        'next_page': page + 1 if page < total_pages else None
+    }
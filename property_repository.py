@@ -0,0 +1,101 @@
+"""
+Поиск квартир по inner_id пачкой с LRU-кэшем.
+
+Кабинет клиента, сравнение и избранное менеджера раньше либо искали каждую
+квартиру линейным проходом по всему снимку, либо делали отдельный SELECT на
+каждый элемент. PropertyRepository.get_many(ids) отдает строки excel_properties
+из кэша, а недостающие добирает одним запросом `WHERE inner_id IN (...)`.
+Кэш сбрасывается, когда меняется версия данных (импорт вызывает
+invalidate_properties_cache() и версия снимка растет во всех воркерах).
+
+    rows = property_repository.get_many(['101', '102'])   # {'101': {...}, '102': {...}}
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+DEFAULT_MAX_SIZE = 10_000
+
+
+def normalize_id(property_id) -> Optional[int]:
+    """inner_id как int; None для пустых и нечисловых значений"""
+    if property_id is None or isinstance(property_id, bool):
+        return None
+    try:
+        return int(str(property_id).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+class PropertyRepository:
+    """
+    loader(ids) -> {inner_id: row} загружает строки из БД одним запросом;
+    version() -> текущая версия данных (при ее смене кэш очищается).
+    """
+
+    def __init__(self, loader: Callable[[List[int]], Dict[int, Dict[str, Any]]],
+                 version: Optional[Callable[[], Any]] = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.loader = loader
+        self.version = version
+        self.max_size = max_size
+        self._rows: "OrderedDict[int, Optional[Dict[str, Any]]]" = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'queries': 0}
+
+    def _check_version(self):
+        if self.version is None:
+            return
+        version = self.version()
+        if version != self._version:
+            self._rows.clear()
+            self._version = version
+
+    def get_many(self, ids: Iterable) -> Dict[str, Dict[str, Any]]:
+        """
+        {str(inner_id): строка} для найденных квартир; нечисловые и
+        отсутствующие в БД id в результат не попадают.
+        """
+        wanted = []
+        for property_id in ids:
+            inner_id = normalize_id(property_id)
+            if inner_id is not None and inner_id not in wanted:
+                wanted.append(inner_id)
+
+        found: Dict[int, Optional[Dict[str, Any]]] = {}
+        with self._lock:
+            self._check_version()
+            for inner_id in wanted:
+                if inner_id in self._rows:
+                    self._rows.move_to_end(inner_id)
+                    found[inner_id] = self._rows[inner_id]
+            self.metrics['hits'] += len(found)
+
+        missing = [inner_id for inner_id in wanted if inner_id not in found]
+        if missing:
+            loaded = self.loader(missing)
+            with self._lock:
+                self.metrics['misses'] += len(missing)
+                self.metrics['queries'] += 1
+                for inner_id in missing:
+                    # Отсутствие тоже кэшируем, чтобы не повторять запрос до смены версии
+                    row = loaded.get(inner_id)
+                    found[inner_id] = row
+                    self._rows[inner_id] = row
+                    self._rows.move_to_end(inner_id)
+                while len(self._rows) > self.max_size:
+                    self._rows.popitem(last=False)
+
+        return {str(inner_id): found[inner_id] for inner_id in wanted if found.get(inner_id) is not None}
+
+    def get(self, property_id) -> Optional[Dict[str, Any]]:
+        return self.get_many([property_id]).get(str(normalize_id(property_id)))
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.metrics['hits'] + self.metrics['misses']
+        return dict(self.metrics, size=len(self._rows), max_size=self.max_size,
+                    hit_ratio=round(self.metrics['hits'] / total, 4) if total else None)
@@ -0,0 +1,130 @@
+"""
+Счетчик SQL-запросов для горячих функций и журнал медленных запросов.
+Слушатели SQLAlchemy регистрируются один раз на все Engine: каждый запрос
+замеряется, медленные (дольше SLOW_QUERY_MS) попадают в slow_queries с
+текстом запроса, а подсчет включается только внутри контекста
+count_sql_statements() (его же на каждый HTTP-запрос открывает request_metrics).
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG_SIZE = 100
+# Текст запроса в журнале обрезается (IN с тысячами id и т.п.)
+SLOW_QUERY_TEXT_LIMIT = 2000
+
+logger = logging.getLogger('app.sql')
+
+_active_counters: ContextVar[Optional[List['SQLStatementCounter']]] = ContextVar('_active_counters', default=None)
+
+# Последние медленные запросы процесса, новые в конце
+slow_queries: Deque[Dict[str, Any]] = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+slow_query_total = 0
+_slow_query_lock = threading.Lock()
+
+
+class SQLStatementCounter:
+    """
+    Количество и суммарное время SQL-запросов внутри блока.
+    sql_ms — время выполнения самих запросов, duration_ms — полное (wall) время
+    блока вместе с Python-кодом; оно известно после выхода из блока.
+    """
+
+    def __init__(self, label: Optional[str] = None):
+        self.label = label
+        self.statements = 0
+        self.sql_ms = 0.0
+        self.started_at = time.perf_counter()
+        self.duration_ms = 0.0
+
+    def to_dict(self):
+        return {
+            'sql_statements': self.statements,
+            'sql_ms': round(self.sql_ms, 2),
+            'duration_ms': round(self.duration_ms, 2),
+        }
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+    counters = _active_counters.get()
+    if counters:
+        for counter in counters:
+            counter.statements += 1
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started_at')
+    if not started:
+        return
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+    counters = _active_counters.get()
+    if counters:
+        for counter in counters:
+            counter.sql_ms += elapsed_ms
+    if elapsed_ms >= SLOW_QUERY_MS:
+        _record_slow_query(statement, elapsed_ms, executemany, counters)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _discard_failed_statement(exception_context):
+    # after_cursor_execute не вызывается для упавшего запроса
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started_at'):
+        connection.info['query_started_at'].pop()
+
+
+def _record_slow_query(statement: str, elapsed_ms: float, executemany: bool,
+                       counters: Optional[List[SQLStatementCounter]]):
+    global slow_query_total
+    source = next((counter.label for counter in reversed(counters or []) if counter.label), None)
+    entry = {
+        'at': datetime.utcnow().isoformat(timespec='seconds'),
+        'duration_ms': round(elapsed_ms, 1),
+        'source': source,
+        'executemany': executemany,
+        'statement': ' '.join(statement.split())[:SLOW_QUERY_TEXT_LIMIT],
+    }
+    # Запросы выполняются из потоков gunicorn-воркера одновременно
+    with _slow_query_lock:
+        slow_query_total += 1
+        slow_queries.append(entry)
+    logger.warning("slow query %.0f ms in %s", elapsed_ms, source or '-',
+                   extra={'duration_ms': round(elapsed_ms, 1), 'source': source})
+
+
+def recent_slow_queries(limit: int = SLOW_QUERY_LOG_SIZE) -> List[Dict[str, Any]]:
+    """Последние медленные запросы, новые первыми"""
+    with _slow_query_lock:
+        return list(slow_queries)[-limit:][::-1]
+
+
+@contextmanager
+def count_sql_statements(label: Optional[str] = None):
+    """
+    Считает SQL-запросы и их время в блоке; label попадает в журнал медленных запросов:
+
+        with count_sql_statements() as counter:
+            load_properties()
+        print(counter.statements, counter.sql_ms, counter.duration_ms)   # SQL-время и время блока
+    """
+    counter = SQLStatementCounter(label)
+    counters = list(_active_counters.get() or []) + [counter]
+    token = _active_counters.set(counters)
+    try:
+        yield counter
+    finally:
+        counter.duration_ms = (time.perf_counter() - counter.started_at) * 1000
+        _active_counters.reset(token)
@@ -0,0 +1,211 @@
+"""
+Справочные JSON-файлы (улицы, блог, данные глобального поиска) в памяти процесса.
+
+load_streets(), load_search_data(), load_blog_articles() и load_blog_categories()
+на каждый вызов открывали и разбирали свой файл (streets.json — около 450 КБ),
+а поиск статьи по slug или улицы по названию потом шел перебором. Теперь каждый
+файл читается один раз на процесс и сразу индексируется (slug -> статья,
+название и варианты slug -> улица); при каждом обращении проверяется только
+os.stat(): если mtime или размер файла изменились, файл перечитывается,
+индекс строится заново и подменяется одной операцией присваивания, так что
+читатель видит либо старый, либо новый снимок целиком.
+
+    streets = reference_data.streets()
+    street = streets.find(slug, name)
+"""
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DATA_DIR = 'data'
+# Сколько разных запросов глобального поиска запоминать на снимок
+SEARCH_MEMO_SIZE = 2000
+
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+}
+# Частичная транслитерация старых URL улиц
+_SIMPLE_TRANSLIT = str.maketrans({'ё': 'e', 'й': 'i', 'а': 'a', 'г': 'g', 'р': 'r', 'и': 'i', 'н': 'n'})
+
+
+def _strip_slug(text: str) -> str:
+    return text.replace(' ', '-').replace('.', '').replace('(', '').replace(')', '').replace(',', '')
+
+
+def _without_street_suffix(text: str) -> str:
+    return text.replace(' ул.', '').replace(' ул', '')
+
+
+def street_slug_variants(name: str) -> Tuple[str, ...]:
+    """Варианты slug улицы, которые встречались в URL: кириллица, транслит, частичный транслит"""
+    lower = name.lower()
+    return (
+        _strip_slug(lower),
+        _strip_slug(''.join(_TRANSLIT.get(char, char) for char in lower)),
+        _strip_slug(lower.translate(_SIMPLE_TRANSLIT)),
+    )
+
+
+class StreetsIndex:
+    def __init__(self, streets: List[Dict[str, Any]]):
+        self.items = streets
+        self.sorted_by_name = sorted(streets, key=lambda street: street['name'])
+        # Ключ -> позиция первой подходящей улицы в файле (как при переборе)
+        self._by_slug: Dict[str, int] = {}
+        self._by_name: Dict[str, int] = {}
+        self._by_short_name: Dict[str, int] = {}
+        for position, street in enumerate(streets):
+            for slug in street_slug_variants(street['name']):
+                self._by_slug.setdefault(slug, position)
+            name = street['name'].lower()
+            self._by_name.setdefault(name, position)
+            self._by_short_name.setdefault(_without_street_suffix(name), position)
+
+    def find(self, slug: str, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Улица по slug из URL или по названию (slug с пробелами вместо дефисов);
+        при нескольких совпадениях — первая в файле.
+        """
+        name = name.lower()
+        positions = [position for position in (
+            self._by_slug.get(slug.lower()),
+            self._by_name.get(name),
+            self._by_short_name.get(_without_street_suffix(name)),
+        ) if position is not None]
+        return self.items[min(positions)] if positions else None
+
+
+class BlogIndex:
+    def __init__(self, articles: List[Dict[str, Any]]):
+        self.items = articles
+        self.by_slug: Dict[str, Dict[str, Any]] = {}
+        self.by_category: Dict[str, List[Dict[str, Any]]] = {}
+        # Статья -> текст для поиска в нижнем регистре (заголовок, анонс, текст, теги)
+        self.haystacks: List[Tuple[Dict[str, Any], Tuple[str, ...]]] = []
+        for article in articles:
+            self.by_slug.setdefault(article['slug'], article)
+            self.by_category.setdefault(str(article.get('category', '')).lower(), []).append(article)
+            self.haystacks.append((article, (
+                article['title'].lower(), article['excerpt'].lower(), article['content'].lower(),
+                *(tag.lower() for tag in article['tags']),
+            )))
+
+
+class CategoriesIndex:
+    def __init__(self, categories: List[Dict[str, Any]]):
+        self.items = categories
+        self.by_slug = {category['slug']: category for category in reversed(categories) if 'slug' in category}
+
+
+class SearchDataIndex:
+    CATEGORIES = ('residential_complexes', 'districts', 'developers', 'streets')
+
+    def __init__(self, search_data: Dict[str, Any]):
+        self.data = search_data
+        # (элемент, название в нижнем регистре, ключевые слова в нижнем регистре) в порядке поиска
+        self.entries = [
+            (item, item['name'].lower(), tuple(keyword.lower() for keyword in item.get('keywords', [])))
+            for category in self.CATEGORIES
+            for item in search_data.get(category, [])
+        ]
+        self._memo: Dict[str, List[Dict[str, Any]]] = {}
+        self._memo_lock = threading.Lock()
+
+    def search(self, query_lower: str, build_result: Callable) -> List[Dict[str, Any]]:
+        """build_result(элемент, балл) для подходящих элементов; ответы запоминаются до смены файла"""
+        cached = self._memo.get(query_lower)
+        if cached is not None:
+            return cached
+        results = []
+        for item, name, keywords in self.entries:
+            name_match = query_lower in name
+            if name_match or any(query_lower in keyword for keyword in keywords):
+                score = (10 if name_match else 0) + (20 if query_lower == name else 0)
+                results.append(build_result(item, score))
+        with self._memo_lock:
+            if len(self._memo) >= SEARCH_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[query_lower] = results
+        return results
+
+
+class ReferenceFile:
+    """JSON-файл + индекс, перечитываются при смене mtime или размера файла"""
+
+    def __init__(self, filename: str, default: Callable[[], Any], build_index: Callable[[Any], Any],
+                 directory: str = DATA_DIR):
+        self.path = os.path.join(directory, filename)
+        self.default = default
+        self.build_index = build_index
+        self._lock = threading.Lock()
+        # (подпись файла, индекс) — одна ссылка, чтобы подмена была атомарной
+        self._loaded: Optional[Tuple[Optional[Tuple[int, int]], Any]] = None
+        self.loads = 0
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self):
+        signature = self._file_signature()
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == signature:
+            return loaded[1]
+        with self._lock:
+            loaded = self._loaded
+            if loaded is not None and loaded[0] == signature:
+                return loaded[1]
+            if signature is None:
+                data = self.default()
+            else:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    # Файл перезаписывается не атомарно: оставляем прежний снимок до следующей проверки
+                    print(f"Error loading {self.path}: {e}")
+                    if loaded is not None:
+                        return loaded[1]
+                    data = self.default()
+                    signature = None
+            index = self.build_index(data)
+            self._loaded = (signature, index)
+            self.loads += 1
+            return index
+
+
+class ReferenceData:
+    def __init__(self, directory: str = DATA_DIR):
+        self._files = {
+            'streets': ReferenceFile('streets.json', list, StreetsIndex, directory),
+            'blog_articles': ReferenceFile('blog_articles.json', list, BlogIndex, directory),
+            'blog_categories': ReferenceFile('blog_categories.json', list, CategoriesIndex, directory),
+            'search_data': ReferenceFile('search_data.json', dict, SearchDataIndex, directory),
+        }
+
+    def streets(self) -> StreetsIndex:
+        return self._files['streets'].get()
+
+    def blog_articles(self) -> BlogIndex:
+        return self._files['blog_articles'].get()
+
+    def blog_categories(self) -> CategoriesIndex:
+        return self._files['blog_categories'].get()
+
+    def search_data(self) -> SearchDataIndex:
+        return self._files['search_data'].get()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: {'path': reference.path, 'loads': reference.loads}
+                for name, reference in self._files.items()}
+
+
+reference_data = ReferenceData()
@@ -0,0 +1,236 @@
+"""
+Метрики HTTP-запросов процесса и их экспорт в текстовом формате Prometheus.
+
+На каждый запрос (before_request/teardown_request) замеряются:
+* время ответа — гистограмма по (endpoint, method);
+* число ответов по (endpoint, method, status);
+* число SQL-запросов и их суммарное время — через count_sql_statements()
+  из query_counter (слушатели событий Engine), медленные SQL с текстом
+  попадают в query_counter.slow_queries;
+* клиентские замеры, присланные на /api/metrics (загрузка страницы, поиск).
+
+Метки — имя эндпоинта, а не путь, поэтому число рядов ограничено числом
+маршрутов. Счетчики живут в памяти процесса: при нескольких gunicorn-воркерах
+каждый отдает свои, Prometheus различает их по instance.
+
+    request_metrics.init_app(app)
+    request_metrics.render_prometheus()   # текст для /metrics
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import query_counter
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+# Запрос дольше этого пишется в лог предупреждением
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+logger = logging.getLogger('app.requests')
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами, как histogram в Prometheus"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, накопленное число) включая +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            result.append(('+Inf' if bound == float('inf') else _format_number(bound), total))
+        return result
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        # (endpoint, method) -> гистограмма
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.sql_statements: Dict[Tuple[str, str], Histogram] = {}
+        self.sql_seconds: Dict[Tuple[str, str], float] = {}
+        # (endpoint, method, status) -> число ответов
+        self.responses: Dict[Tuple[str, str, int], int] = {}
+        # тип клиентского замера -> гистограмма
+        self.client: Dict[str, Histogram] = {}
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        from flask import g, request
+
+        sql_context = query_counter.count_sql_statements(label=request.endpoint or 'unmatched')
+        g._request_metrics = (time.perf_counter(), sql_context, sql_context.__enter__())
+
+    def _after_request(self, response):
+        from flask import g
+
+        g._request_metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exception=None):
+        from flask import g, request
+
+        state = g.pop('_request_metrics', None)
+        if state is None:
+            return
+        started, sql_context, sql_counter = state
+        sql_context.__exit__(None, None, None)
+        elapsed = time.perf_counter() - started
+        status = g.pop('_request_metrics_status', 500 if exception is not None else 200)
+        self.observe(request.endpoint or 'unmatched', request.method, status, elapsed,
+                     sql_counter.statements, sql_counter.sql_ms / 1000)
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            logger.warning("slow request %s %s: %.0f ms, %d SQL (%.0f ms)",
+                           request.method, request.path, elapsed * 1000,
+                           sql_counter.statements, sql_counter.sql_ms,
+                           extra={'duration_ms': round(elapsed * 1000, 1),
+                                  'sql_statements': sql_counter.statements,
+                                  'sql_ms': round(sql_counter.sql_ms, 1)})
+
+    def observe(self, endpoint: str, method: str, status: int, seconds: float,
+                sql_statements: int = 0, sql_seconds: float = 0.0):
+        key = (endpoint, method)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.sql_statements[key] = Histogram(SQL_COUNT_BUCKETS)
+                self.sql_seconds[key] = 0.0
+            histogram.observe(seconds)
+            self.sql_statements[key].observe(sql_statements)
+            self.sql_seconds[key] += sql_seconds
+            response_key = (endpoint, method, status)
+            self.responses[response_key] = self.responses.get(response_key, 0) + 1
+
+    def observe_client(self, kind: str, seconds: float):
+        """Замер, присланный браузером (page_load, search_performance)"""
+        with self._lock:
+            histogram = self.client.get(kind)
+            if histogram is None:
+                histogram = self.client[kind] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+
+        def histogram_lines(name: str, series: Iterable[Tuple[dict, Histogram]]):
+            for labels, histogram in series:
+                for le, count in histogram.cumulative():
+                    lines.append(f"{name}_bucket{_labels(**labels, le=le)} {count}")
+                lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+        with self._lock:
+            latency = sorted(self.latency.items())
+            sql_statements = sorted(self.sql_statements.items())
+            sql_seconds = sorted(self.sql_seconds.items())
+            responses = sorted(self.responses.items())
+            client = sorted(self.client.items())
+
+        lines += ["# HELP inback_http_request_duration_seconds Время ответа по эндпоинтам",
+                  "# TYPE inback_http_request_duration_seconds histogram"]
+        histogram_lines('inback_http_request_duration_seconds',
+                        (({'endpoint': endpoint, 'method': method}, histogram)
+                         for (endpoint, method), histogram in latency))
+
+        lines += ["# HELP inback_http_requests_total Ответы по эндпоинтам и статусам",
+                  "# TYPE inback_http_requests_total counter"]
+        lines += [f"inback_http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}"
+                  for (endpoint, method, status), count in responses]
+
+        lines += ["# HELP inback_http_request_sql_statements SQL-запросов на один HTTP-запрос",
+                  "# TYPE inback_http_request_sql_statements histogram"]
+        histogram_lines('inback_http_request_sql_statements',
+                        (({'endpoint': endpoint, 'method': method}, histogram)
+                         for (endpoint, method), histogram in sql_statements))
+
+        lines += ["# HELP inback_http_request_sql_seconds_total Суммарное время SQL в запросах эндпоинта",
+                  "# TYPE inback_http_request_sql_seconds_total counter"]
+        lines += [f"inback_http_request_sql_seconds_total{_labels(endpoint=endpoint, method=method)} {seconds:.6f}"
+                  for (endpoint, method), seconds in sql_seconds]
+
+        lines += ["# HELP inback_sql_slow_queries_total SQL-запросы дольше SLOW_QUERY_MS",
+                  "# TYPE inback_sql_slow_queries_total counter",
+                  f"inback_sql_slow_queries_total {query_counter.slow_query_total}"]
+
+        lines += ["# HELP inback_client_duration_seconds Замеры браузера, присланные на /api/metrics",
+                  "# TYPE inback_client_duration_seconds histogram"]
+        histogram_lines('inback_client_duration_seconds',
+                        (({'type': kind}, histogram) for kind, histogram in client))
+
+        lines += ["# HELP inback_process_start_time_seconds Время старта процесса (unix)",
+                  "# TYPE inback_process_start_time_seconds gauge",
+                  f"inback_process_start_time_seconds {self.started_at:.0f}"]
+        rss = _resident_memory_bytes()
+        if rss is not None:
+            lines += ["# HELP inback_process_resident_memory_bytes RSS процесса",
+                      "# TYPE inback_process_resident_memory_bytes gauge",
+                      f"inback_process_resident_memory_bytes {rss}"]
+        return '\n'.join(lines) + '\n'
+
+    def stats(self, limit: int = 20) -> dict:
+        """Самые затратные эндпоинты и последние медленные SQL — для админки"""
+        with self._lock:
+            endpoints = [{
+                'endpoint': endpoint,
+                'method': method,
+                'requests': histogram.count,
+                'total_seconds': round(histogram.sum, 3),
+                'avg_ms': round(histogram.sum / histogram.count * 1000, 1) if histogram.count else 0,
+                'avg_sql_statements': round(self.sql_statements[(endpoint, method)].sum / histogram.count, 1)
+                if histogram.count else 0,
+                'sql_seconds': round(self.sql_seconds[(endpoint, method)], 3),
+            } for (endpoint, method), histogram in self.latency.items()]
+        endpoints.sort(key=lambda item: item['total_seconds'], reverse=True)
+        return {
+            'uptime_seconds': round(time.time() - self.started_at),
+            'endpoints': endpoints[:limit],
+            'slow_query_ms': query_counter.SLOW_QUERY_MS,
+            'slow_queries_total': query_counter.slow_query_total,
+            'slow_queries': query_counter.recent_slow_queries(limit),
+        }
+
+
+def _resident_memory_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+request_metrics = RequestMetrics()
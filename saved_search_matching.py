@@ -0,0 +1,280 @@
+"""
+Инкрементальное сопоставление новых квартир с сохраненными поисками.
+
+Раньше рассылка прогоняла filter_properties() по всему каталогу (да еще из
+устаревшего data/properties.json) отдельно для каждого поиска —
+O(поиски × квартиры), без понятия "новое с прошлого уведомления". Теперь:
+
+* импорт пишет в property_changes новые и измененные квартиры (excel_import);
+* у каждого поиска есть водяной знак — номер последнего проверенного изменения;
+* фильтры поисков индексируются по ключу (комнаты, район, застройщик,
+  ценовая корзина), где у неограниченного измерения ключ None. Квартира
+  проверяет 16 ключей ({ее комнаты, None} × {ее район, None} × ...), то есть
+  видит только поиски-кандидаты; точные границы цены и площади и водяной
+  знак проверяются векторно — все поиски ключа против всех его квартир сразу.
+
+    index = SubscriptionIndex(predicates, watermarks)
+    search_positions, listing_positions = index.match(ListingBatch(listings))
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from property_index import parse_room_filter
+
+PRICE_BUCKET = 1_000_000
+# Диапазон цен шире стольких корзин индексируется как "любая цена"
+MAX_PRICE_BUCKETS = 16
+ROOM_KEY_LIMIT = 6
+MAX_KEYS_PER_SEARCH = 512
+# Сколько пар (поиск, квартира) сравнивать за одну векторную операцию
+BLOCK_PAIRS = 1 << 21
+
+
+def _number(value) -> Optional[float]:
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_list(value) -> List[Any]:
+    if not value:
+        return []
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return [item for item in values if item not in (None, '')]
+
+
+class SearchPredicate:
+    """Фильтры одного сохраненного поиска в нормализованном виде (цены в рублях)"""
+
+    __slots__ = ('search_id', 'rooms', 'price_min', 'price_max', 'area_min', 'area_max',
+                 'districts', 'developers')
+
+    def __init__(self, search_id, rooms=None, price_min=None, price_max=None, area_min=None,
+                 area_max=None, districts=None, developers=None):
+        self.search_id = search_id
+        # [('eq', 2), ('gte', 4)] или None
+        self.rooms: Optional[List[Tuple[str, int]]] = rooms
+        self.price_min = price_min
+        self.price_max = price_max
+        self.area_min = area_min
+        self.area_max = area_max
+        self.districts: Optional[frozenset] = districts
+        self.developers: Optional[frozenset] = developers
+
+    @classmethod
+    def from_search(cls, search_id, additional_filters=None, location=None, property_type=None,
+                    developer=None, price_min=None, price_max=None, size_min=None, size_max=None):
+        """
+        Фильтры из additional_filters (JSON сохраненного поиска, цены в млн) плюс
+        старые поля SavedSearch — так же, как их объединяет применение поиска.
+        None, если фильтр комнат задан, но ни одно значение не распознано (поиск
+        ничего не может найти).
+        """
+        filters = {}
+        if additional_filters:
+            try:
+                filters = json.loads(additional_filters) if isinstance(additional_filters, str) else dict(additional_filters)
+            except (TypeError, ValueError):
+                filters = {}
+
+        room_values = _as_list(filters.get('rooms')) or _as_list(property_type)
+        rooms = None
+        if room_values:
+            rooms = [parsed for parsed in map(parse_room_filter, room_values) if parsed]
+            if not rooms:
+                return None
+
+        price_from = _number(filters.get('priceFrom'))
+        price_to = _number(filters.get('priceTo'))
+        districts = _as_list(filters.get('districts')) or _as_list(location)
+        developers = _as_list(filters.get('developers')) or _as_list(developer)
+        return cls(
+            search_id,
+            rooms=rooms,
+            price_min=price_from * 1_000_000 if price_from else _number(price_min) or None,
+            price_max=price_to * 1_000_000 if price_to else _number(price_max) or None,
+            area_min=_number(filters.get('areaFrom')) or _number(size_min) or None,
+            area_max=_number(filters.get('areaTo')) or _number(size_max) or None,
+            districts=frozenset(districts) or None,
+            developers=frozenset(developers) or None,
+        )
+
+    def rooms_match(self, rooms) -> bool:
+        if self.rooms is None:
+            return True
+        if rooms is None:
+            return False
+        return any(rooms >= number if operator == 'gte' else rooms == number
+                   for operator, number in self.rooms)
+
+    def matches(self, listing: Dict[str, Any]) -> bool:
+        """Проверка одной квартиры (словарь rooms/price/area/district/developer) — эталон для индекса"""
+        price = listing.get('price') or 0
+        area = listing.get('area') or 0
+        return (self.rooms_match(listing.get('rooms'))
+                and (self.price_min is None or price >= self.price_min)
+                and (self.price_max is None or price <= self.price_max)
+                and (self.area_min is None or area >= self.area_min)
+                and (self.area_max is None or area <= self.area_max)
+                and (self.districts is None or listing.get('district') in self.districts)
+                and (self.developers is None or listing.get('developer') in self.developers))
+
+    def index_keys(self) -> Tuple[List[Tuple], bool]:
+        """
+        Ключи (комнаты, район, застройщик, корзина цены), под которыми поиск лежит
+        в индексе, и флаг "ключи шире фильтра" — тогда кандидата нужно проверить matches().
+        """
+        exact = True
+        if self.rooms is None:
+            room_keys = [None]
+        else:
+            room_keys = set()
+            for operator, number in self.rooms:
+                # Квартиры с ROOM_KEY_LIMIT+ комнат делят один ключ
+                if number >= ROOM_KEY_LIMIT:
+                    room_keys.add(ROOM_KEY_LIMIT)
+                    exact = exact and operator == 'gte' and number == ROOM_KEY_LIMIT
+                elif operator == 'gte':
+                    room_keys.update(range(number, ROOM_KEY_LIMIT + 1))
+                else:
+                    room_keys.add(number)
+            room_keys = sorted(room_keys)
+        district_keys = sorted(self.districts) if self.districts else [None]
+        developer_keys = sorted(self.developers) if self.developers else [None]
+        bucket_keys = [None]
+        if self.price_min is not None and self.price_max is not None and self.price_min <= self.price_max:
+            first, last = int(self.price_min // PRICE_BUCKET), int(self.price_max // PRICE_BUCKET)
+            if last - first < MAX_PRICE_BUCKETS:
+                bucket_keys = list(range(first, last + 1))
+        if len(room_keys) * len(district_keys) * len(developer_keys) * len(bucket_keys) > MAX_KEYS_PER_SEARCH:
+            # Очень широкий поиск: застройщика проверит matches()
+            developer_keys = [None]
+            exact = exact and self.developers is None
+        keys = [(rooms, district, developer, bucket)
+                for rooms in room_keys for district in district_keys
+                for developer in developer_keys for bucket in bucket_keys]
+        return keys, exact
+
+
+def room_key(rooms) -> Optional[int]:
+    """Ключ комнат квартиры: число, ROOM_KEY_LIMIT для всех больших, None если неизвестно"""
+    if rooms is None:
+        return None
+    return min(int(rooms), ROOM_KEY_LIMIT)
+
+
+class ListingBatch:
+    """Измененные квартиры: колонки для проверки и номер изменения (change_id)"""
+
+    def __init__(self, listings: Sequence[Dict[str, Any]]):
+        self.listings = listings
+        self.size = len(listings)
+        self.price = np.array([listing.get('price') or 0 for listing in listings], dtype=np.float64)
+        self.area = np.array([float(listing.get('area') or 0) for listing in listings], dtype=np.float64)
+        self.change_id = np.array([listing.get('change_id') or 0 for listing in listings], dtype=np.int64)
+
+    def __len__(self):
+        return self.size
+
+    def probes(self) -> Dict[Tuple, np.ndarray]:
+        """Ключ индекса -> позиции квартир, которые его проверяют (16 ключей на квартиру)"""
+        probes: Dict[Tuple, List[int]] = {}
+        for position, (listing, price) in enumerate(zip(self.listings, self.price.tolist())):
+            rooms = room_key(listing.get('rooms'))
+            district = listing.get('district')
+            developer = listing.get('developer')
+            bucket = int(price // PRICE_BUCKET)
+            for rooms_key in ((rooms, None) if rooms is not None else (None,)):
+                for district_key in ((district, None) if district is not None else (None,)):
+                    for developer_key in ((developer, None) if developer is not None else (None,)):
+                        for bucket_key in (bucket, None):
+                            probes.setdefault((rooms_key, district_key, developer_key, bucket_key), []).append(position)
+        return {key: np.array(positions, dtype=np.int32) for key, positions in probes.items()}
+
+
+class SubscriptionIndex:
+    """Фильтры всех поисков: словарь ключ -> позиции поисков и массивы для векторной проверки"""
+
+    def __init__(self, predicates: Sequence[SearchPredicate], watermarks: Optional[Iterable[int]] = None):
+        self.predicates = list(predicates)
+        size = len(self.predicates)
+        self.search_ids = [predicate.search_id for predicate in self.predicates]
+        self.watermark = (np.fromiter(watermarks, dtype=np.int64, count=size)
+                          if watermarks is not None else np.zeros(size, dtype=np.int64))
+
+        def bound(values, missing):
+            return np.array([missing if value is None else value for value in values], dtype=np.float64)
+
+        self.price_min = bound((p.price_min for p in self.predicates), -np.inf)
+        self.price_max = bound((p.price_max for p in self.predicates), np.inf)
+        self.area_min = bound((p.area_min for p in self.predicates), -np.inf)
+        self.area_max = bound((p.area_max for p in self.predicates), np.inf)
+
+        postings: Dict[Tuple, List[int]] = {}
+        # Поиски, чьи ключи шире фильтра (проверяются matches())
+        needs_check = np.zeros(size, dtype=bool)
+        for position, predicate in enumerate(self.predicates):
+            keys, exact = predicate.index_keys()
+            needs_check[position] = not exact
+            for key in keys:
+                postings.setdefault(key, []).append(position)
+        self.needs_check = needs_check
+        self.postings = {key: np.array(positions, dtype=np.int32) for key, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.predicates)
+
+    def match(self, batch: ListingBatch) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Пары (позиция поиска, позиция квартиры), где квартира подходит поиску и
+        изменилась после его водяного знака; отсортированы по поиску, затем по квартире.
+
+        Для каждого ключа все его поиски сравниваются со всеми квартирами,
+        проверяющими этот ключ, одной матричной операцией; ключи поиска и
+        квартиры совпадают не больше чем в одном месте, поэтому пары не повторяются.
+        """
+        pair_parts = []
+        for key, listings in batch.probes().items():
+            searches = self.postings.get(key)
+            if searches is None:
+                continue
+            price_min, price_max = self.price_min[searches, None], self.price_max[searches, None]
+            area_min, area_max = self.area_min[searches, None], self.area_max[searches, None]
+            watermark = self.watermark[searches, None]
+            step = max(1, BLOCK_PAIRS // len(searches))
+            for start in range(0, len(listings), step):
+                block = listings[start:start + step]
+                price, area = batch.price[block], batch.area[block]
+                hits = ((price_min <= price) & (price <= price_max)
+                        & (area_min <= area) & (area <= area_max)
+                        & (watermark < batch.change_id[block]))
+                rows, columns = np.nonzero(hits)
+                if len(rows):
+                    pair_parts.append(searches[rows].astype(np.int64) * len(batch) + block[columns])
+        if not pair_parts:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        pairs = np.concatenate(pair_parts)
+        pairs.sort()
+        searches, listings = np.divmod(pairs, max(len(batch), 1))
+        checked = self.needs_check[searches]
+        if checked.any():
+            keep = ~checked
+            for offset in np.flatnonzero(checked).tolist():
+                keep[offset] = self.predicates[searches[offset]].matches(batch.listings[listings[offset]])
+            searches, listings = searches[keep], listings[keep]
+        return searches.astype(np.int32), listings.astype(np.int32)
+
+    def group(self, searches: np.ndarray, listings: np.ndarray) -> Dict[Any, np.ndarray]:
+        """search_id -> позиции подходящих квартир (из результата match)"""
+        if not len(searches):
+            return {}
+        boundaries = np.flatnonzero(np.diff(searches)) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(searches)]))
+        return {self.search_ids[searches[start]]: listings[start:end]
+                for start, end in zip(starts.tolist(), ends.tolist())}
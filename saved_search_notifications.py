@@ -6,160 +6,222 @@
 
 import os
 import sys
-import json
+import time
+from bisect import bisect_right
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine, text
 from email_service import send_notification
+from saved_search_matching import ListingBatch, SearchPredicate, SubscriptionIndex
 
 # Database connection
 DATABASE_URL = os.environ.get('DATABASE_URL')
-if not DATABASE_URL:
-    print("DATABASE_URL not set")
-    sys.exit(1)
-
-def load_properties():
-    """Load properties from JSON file"""
-    try:
-        with open('data/properties.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print("Properties file not found")
-        return []
+
+# Не чаще одного письма в сутки на поиск
+NOTIFICATION_INTERVAL = timedelta(days=1)
+# Сколько квартир показывать в письме
+NOTIFICATION_PROPERTIES_LIMIT = 10
+
+
+def _load_changed_listings(conn, after_change_id, head):
+    """
+    Квартиры, изменившиеся после after_change_id (до head включительно), с текущими полями из
+    excel_properties; у квартиры с несколькими изменениями — последнее.
+    """
+    rows = conn.execute(text("""
+        SELECT c.id AS change_id, c.changed_at, ep.inner_id, ep.object_rooms, ep.price, ep.object_area,
+               ep.address_locality_display_name, ep.developer_name, ep.complex_name
+        FROM property_changes c
+        JOIN excel_properties ep ON ep.inner_id = c.inner_id
+        WHERE c.id > :after AND c.id <= :head
+        ORDER BY c.id
+    """), {'after': after_change_id, 'head': head}).fetchall()
+    latest = {}
+    for row in rows:
+        latest[row.inner_id] = {
+            'change_id': row.change_id,
+            'changed_at': row.changed_at,
+            'id': row.inner_id,
+            'rooms': row.object_rooms,
+            'price': row.price,
+            'area': float(row.object_area) if row.object_area is not None else None,
+            'district': row.address_locality_display_name,
+            'developer': row.developer_name,
+            'complex_name': row.complex_name,
+        }
+    return sorted(latest.values(), key=lambda listing: listing['change_id'])
+
+
+def _initial_watermark(created_at, change_ids, changed_at):
+    """Новый поиск получает только изменения после своего создания"""
+    if created_at is None or not change_ids:
+        return change_ids[-1] if change_ids else 0
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    position = bisect_right(changed_at, created_at)
+    return change_ids[position - 1] if position else 0
+
+
+def _notification_property(listing):
+    rooms = listing.get('rooms')
+    title = 'Студия' if rooms == 0 else f"{rooms}-комн. квартира" if rooms else f"Объект {listing['id']}"
+    if listing.get('area'):
+        title += f", {listing['area']:g} м²"
+    return {
+        'title': title,
+        'name': title,
+        'rooms': rooms,
+        'area': listing.get('area'),
+        'price': listing.get('price'),
+        'district': listing.get('district'),
+        'complex_name': listing.get('complex_name'),
+    }
+
 
 def check_saved_search_results():
     """
-    Проверяет сохраненные поиски и отправляет уведомления о новых результатах
+    Проверяет сохраненные поиски и отправляет уведомления о новых результатах.
+    Возвращает число отправленных уведомлений (запускается задачей saved_search_sweep).
+
+    Проверяются только квартиры из property_changes после водяного знака
+    каждого поиска (см. saved_search_matching); после проверки водяной знак
+    поиска сдвигается на последнее изменение, а уже всеми проверенные
+    изменения удаляются из ленты.
     """
+    if not DATABASE_URL:
+        print("DATABASE_URL not set")
+        return 0
+    
     engine = create_engine(DATABASE_URL)
+    sent_count = 0
+    now = datetime.utcnow()
     
     with engine.connect() as conn:
-        # Получаем активные сохраненные поиски
+        head = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM property_changes")).scalar() or 0
+        
+        # Активные поиски, которым можно отправить письмо (не чаще раза в сутки)
         saved_searches = conn.execute(text("""
-            SELECT s.*, u.email, u.full_name, u.preferred_contact
-            FROM manager_saved_searches s
+            SELECT s.id, s.user_id, s.name, s.additional_filters, s.location, s.property_type, s.developer,
+                   s.price_min, s.price_max, s.size_min, s.size_max, s.created_at,
+                   u.email, w.last_change_id
+            FROM saved_searches s
             JOIN users u ON s.user_id = u.id
-            WHERE s.notify_new_results = true
-            AND (s.last_notification_sent IS NULL OR s.last_notification_sent < NOW() - INTERVAL '1 day')
-        """)).fetchall()
+            LEFT JOIN saved_search_watermarks w ON w.search_id = s.id
+            WHERE s.notify_new_matches = :enabled
+            AND (s.last_notification_sent IS NULL OR s.last_notification_sent < :cutoff)
+        """), {'enabled': True, 'cutoff': now - NOTIFICATION_INTERVAL}).fetchall()
         
-        properties = load_properties()
-        current_time = datetime.now()
+        known = [search.last_change_id for search in saved_searches if search.last_change_id is not None]
+        after = min(known) if known and len(known) == len(saved_searches) else 0
+        listings = _load_changed_listings(conn, after, head) if saved_searches else []
+        change_ids = [listing['change_id'] for listing in listings]
+        changed_at = [listing['changed_at'] for listing in listings]
+        if changed_at and isinstance(changed_at[0], str):
+            changed_at = [datetime.fromisoformat(value) for value in changed_at]
         
+        predicates, watermarks, searches_by_id, start_marks = [], [], {}, {}
         for search in saved_searches:
+            searches_by_id[search.id] = search
+            start_marks[search.id] = (search.last_change_id if search.last_change_id is not None
+                                      else _initial_watermark(search.created_at, change_ids, changed_at))
+            predicate = SearchPredicate.from_search(
+                search.id, search.additional_filters, location=search.location,
+                property_type=search.property_type, developer=search.developer,
+                price_min=search.price_min, price_max=search.price_max,
+                size_min=search.size_min, size_max=search.size_max)
+            if predicate is None:
+                continue
+            predicates.append(predicate)
+            watermarks.append(start_marks[search.id])
+        
+        matches = {}
+        if predicates and listings:
+            started = time.perf_counter()
+            index = SubscriptionIndex(predicates, watermarks)
+            matches = index.group(*index.match(ListingBatch(listings)))
+            print(f"Saved searches: {len(predicates)} searches × {len(listings)} changed listings, "
+                  f"{len(matches)} with new matches in {time.perf_counter() - started:.2f}s")
+        
+        # Поиски без новых квартир тоже проверены до head; при ошибке отправки — повтор в следующий раз
+        checked = set(searches_by_id)
+        for search_id, positions in matches.items():
+            search = searches_by_id[search_id]
             try:
-                # Парсим фильтры поиска
-                filters = json.loads(search.additional_filters) if search.additional_filters else {}
+                # Сначала самые свежие изменения
+                matching_properties = [listings[position] for position in positions[::-1]]
+                properties_list = [_notification_property(listing)
+                                   for listing in matching_properties[:NOTIFICATION_PROPERTIES_LIMIT]]
                 
-                # Применяем фильтры к объектам недвижимости
-                matching_properties = filter_properties(properties, filters)
+                notification_sent = send_notification(
+                    recipient_email=search.email,
+                    subject=f"Новые объекты по поиску \"{search.name}\"",
+                    message=f"По вашему поиску найдено {len(matching_properties)} новых объектов",
+                    notification_type='saved_search_results',
+                    user_id=search.user_id,
+                    search_name=search.name,
+                    properties_list=properties_list,
+                    properties_count=len(matching_properties),
+                    search_url=f"/properties?search_id={search.id}"
+                )
                 
-                # Если есть подходящие объекты, отправляем уведомление
-                if matching_properties:
-                    # Ограничиваем до 10 объектов для уведомления
-                    properties_for_notification = matching_properties[:10]
-                    
-                    # Подготавливаем данные для уведомления
-                    properties_list = []
-                    for prop in properties_for_notification:
-                        properties_list.append({
-                            'title': prop.get('title', f"Объект {prop['id']}"),
-                            'name': prop.get('name', f"Объект {prop['id']}"),
-                            'rooms': prop.get('rooms'),
-                            'area': prop.get('area'),
-                            'price': prop.get('price'),
-                            'district': prop.get('district'),
-                            'complex_name': prop.get('complex_name')
-                        })
-                    
-                    # Отправляем уведомление
-                    notification_sent = send_notification(
-                        recipient_email=search.email,
-                        subject=f"Новые объекты по поиску \"{search.name}\"",
-                        message=f"По вашему поиску найдено {len(matching_properties)} новых объектов",
-                        notification_type='saved_search_results',
-                        user_id=search.user_id,
-                        search_name=search.name,
-                        properties_list=properties_list,
-                        properties_count=len(matching_properties),
-                        search_url=f"/properties?search_id={search.id}"
-                    )
+                # Обновляем время последнего уведомления
+                if notification_sent:
+                    conn.execute(text("""
+                        UPDATE saved_searches 
+                        SET last_notification_sent = :now
+                        WHERE id = :search_id
+                    """), {'search_id': search.id, 'now': now})
+                    conn.commit()
+                    sent_count += 1
                     
-                    # Обновляем время последнего уведомления
-                    if notification_sent:
-                        conn.execute(text("""
-                            UPDATE manager_saved_searches 
-                            SET last_notification_sent = NOW()
-                            WHERE id = :search_id
-                        """), {'search_id': search.id})
-                        conn.commit()
-                        
-                        print(f"Sent notification for search '{search.name}' to {search.email}")
+                    print(f"Sent notification for search '{search.name}' to {search.email}")
+                else:
+                    checked.discard(search_id)
                     
             except Exception as e:
                 print(f"Error processing search {search.id}: {e}")
+                checked.discard(search_id)
                 continue
-
-def filter_properties(properties, filters):
-    """
-    Применяет фильтры к списку объектов недвижимости
-    
-    Args:
-        properties: Список объектов недвижимости
-        filters: Словарь с фильтрами
-    
-    Returns:
-        Отфильтрованный список объектов
-    """
-    filtered = properties.copy()
-    
-    # Фильтр по комнатам
-    if filters.get('rooms'):
-        rooms_list = filters['rooms']
-        if isinstance(rooms_list, str):
-            rooms_list = [rooms_list]
-        filtered = [p for p in filtered if str(p.get('rooms', '')) in rooms_list]
-    
-    # Фильтр по цене
-    if filters.get('priceFrom'):
-        try:
-            price_from = float(filters['priceFrom']) * 1000000  # Конвертируем млн в рубли
-            filtered = [p for p in filtered if p.get('price', 0) >= price_from]
-        except (ValueError, TypeError):
-            pass
-    
-    if filters.get('priceTo'):
-        try:
-            price_to = float(filters['priceTo']) * 1000000
-            filtered = [p for p in filtered if p.get('price', 0) <= price_to]
-        except (ValueError, TypeError):
-            pass
-    
-    # Фильтр по району
-    if filters.get('districts') and filters['districts']:
-        districts = filters['districts']
-        filtered = [p for p in filtered if p.get('district') in districts]
-    
-    # Фильтр по застройщику
-    if filters.get('developers') and filters['developers']:
-        developers = filters['developers']
-        filtered = [p for p in filtered if p.get('developer') in developers]
-    
-    # Фильтр по площади
-    if filters.get('areaFrom'):
-        try:
-            area_from = float(filters['areaFrom'])
-            filtered = [p for p in filtered if p.get('area', 0) >= area_from]
-        except (ValueError, TypeError):
-            pass
-    
-    if filters.get('areaTo'):
-        try:
-            area_to = float(filters['areaTo'])
-            filtered = [p for p in filtered if p.get('area', 0) <= area_to]
-        except (ValueError, TypeError):
-            pass
+        
+        # Новый поиск, письмо которому не ушло, получает водяной знак на своей начальной позиции:
+        # иначе очистка ниже его не учтет и удалит изменения, которые нужно отправить повторно
+        marks = [(search, head if search_id in checked else start_marks[search_id])
+                 for search_id, search in searches_by_id.items()
+                 if search_id in checked or search.last_change_id is None]
+        _advance_watermarks(conn, marks, now)
+        
+        # Изменения, проверенные всеми активными поисками, больше не нужны
+        floor = conn.execute(text("""
+            SELECT MIN(w.last_change_id)
+            FROM saved_search_watermarks w
+            JOIN saved_searches s ON s.id = w.search_id
+            WHERE s.notify_new_matches = :enabled
+        """), {'enabled': True}).scalar()
+        conn.execute(text("DELETE FROM property_changes WHERE id <= :floor"),
+                     {'floor': head if floor is None else min(floor, head)})
+        conn.commit()
     
-    return filtered
+    engine.dispose()
+    return sent_count
+
+
+def _advance_watermarks(conn, marks, now):
+    """Ставит водяные знаки поисков: marks — пары (поиск, id последнего проверенного изменения)"""
+    existing = [{'search_id': search.id, 'head': change_id, 'now': now}
+                for search, change_id in marks if search.last_change_id is not None]
+    new = [{'search_id': search.id, 'head': change_id, 'now': now}
+           for search, change_id in marks if search.last_change_id is None]
+    if existing:
+        conn.execute(text("""
+            UPDATE saved_search_watermarks SET last_change_id = :head, updated_at = :now
+            WHERE search_id = :search_id
+        """), existing)
+    if new:
+        conn.execute(text("""
+            INSERT INTO saved_search_watermarks (search_id, last_change_id, updated_at)
+            VALUES (:search_id, :head, :now)
+        """), new)
+    conn.commit()
+
 
 def setup_notification_schedule():
     """
@@ -171,5 +233,8 @@ def setup_notification_schedule():
     print(f"[{datetime.now()}] Saved search notifications check completed.")
 
 if __name__ == "__main__":
+    if not DATABASE_URL:
+        print("DATABASE_URL not set")
+        sys.exit(1)
     # Запуск проверки уведомлений
     setup_notification_schedule()
\ No newline at end of file
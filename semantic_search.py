@@ -0,0 +1,249 @@
+"""
+Локальный семантический поиск квартир без обращений к GPT.
+
+SmartSearch раньше на каждый запрос /api/smart-search отправлял в gpt-4o
+первые 20 квартир и ждал от модели порядок id. Теперь тексты квартир
+(описание, ЖК, район, отделка, класс, метро) один раз превращаются в
+векторы хэшированных n-грамм: основа слова плюс символьные 3- и 4-граммы
+раскладываются по EMBEDDING_DIM измерениям через crc32 (одинаково во всех
+процессах), веса log(1 + tf), строки нормируются. Матрица float16 хранится
+в общем снимке (SnapshotCache) и пересобирается после импорта, а запрос —
+это один вектор и скалярные произведения по строкам кандидатов.
+
+    embeddings = EmbeddingIndex.from_snapshot(snapshot)
+    ranked = embeddings.rank(filtered_properties, 'квартира у парка рядом со школой')
+"""
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from full_text_search import stem
+
+EMBEDDING_DIM = 256
+NGRAM_SIZES = (3, 4)
+# Вклад всех символьных n-грамм слова относительно его основы
+NGRAM_WEIGHT = 1.0
+
+_TOKEN_RE = re.compile(r'[0-9a-zа-я]+')
+
+
+def property_text(prop: Dict[str, Any]) -> str:
+    """Текст квартиры для эмбеддинга"""
+    parts = [
+        prop.get('description'),
+        prop.get('complex_name') or prop.get('residential_complex'),
+        prop.get('district'),
+        prop.get('finishing'),
+        prop.get('complex_class'),
+        prop.get('nearest_metro'),
+    ]
+    return ' '.join(str(part) for part in parts if part)
+
+
+class HashingEmbedder:
+    """Векторы хэшированных n-грамм; не требует обучения и моделей"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self._word_features: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _features(self, word: str) -> Tuple[np.ndarray, np.ndarray]:
+        cached = self._word_features.get(word)
+        if cached is not None:
+            return cached
+        padded = f'<{word}>'
+        ngrams = [padded[i:i + n] for n in NGRAM_SIZES for i in range(len(padded) - n + 1)]
+        features = [f'w:{stem(word)}'] + [f'g:{ngram}' for ngram in ngrams]
+        weights = [1.0] + [NGRAM_WEIGHT / len(ngrams)] * len(ngrams)
+        indices = np.empty(len(features), dtype=np.int64)
+        values = np.empty(len(features), dtype=np.float32)
+        for i, (feature, weight) in enumerate(zip(features, weights)):
+            digest = zlib.crc32(feature.encode('utf-8'))
+            indices[i] = digest % self.dim
+            # Знак из старших битов хэша, чтобы коллизии гасили друг друга, а не складывались
+            values[i] = weight if (digest // self.dim) % 2 == 0 else -weight
+        cached = self._word_features[word] = (indices, values)
+        return cached
+
+    def _tokens(self, text) -> List[str]:
+        return _TOKEN_RE.findall(str(text or '').lower().replace('ё', 'е'))
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        indices, values = self._features(word)
+        return np.bincount(indices, weights=values, minlength=self.dim).astype(np.float32)
+
+    def embed(self, text: str) -> np.ndarray:
+        """Нормированный вектор float32 (нулевой для пустого текста)"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word, count in Counter(self._tokens(text)).items():
+            vector += self._word_vector(word) * np.float32(1 + np.log(count))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_many(self, texts: Sequence[str], batch_size: int = 2048) -> np.ndarray:
+        """
+        Матрица (len(texts), dim) float16 с нормированными строками.
+        Каждое слово словаря хэшируется один раз; пары (текст, слово)
+        раскладываются в признаки слова и суммируются np.bincount пачками текстов.
+        """
+        unique_texts: Dict[str, int] = {}
+        text_rows = np.fromiter((unique_texts.setdefault(text, len(unique_texts)) for text in texts),
+                                dtype=np.int64, count=len(texts))
+
+        vocabulary: Dict[str, int] = {}
+        word_ids: List[int] = []
+        word_counts: List[int] = []
+        text_starts = np.zeros(len(unique_texts) + 1, dtype=np.int64)
+        for row, text in enumerate(unique_texts):
+            for word, count in Counter(self._tokens(text)).items():
+                word_ids.append(vocabulary.setdefault(word, len(vocabulary)))
+                word_counts.append(count)
+            text_starts[row + 1] = len(word_ids)
+        word_ids_array = np.array(word_ids, dtype=np.int64)
+        pair_weights = (1 + np.log(np.array(word_counts, dtype=np.float32))).astype(np.float32)
+        pair_texts = np.repeat(np.arange(len(unique_texts), dtype=np.int64), np.diff(text_starts))
+
+        # Признаки слов в виде CSR: feature_starts[w]:feature_starts[w + 1]
+        feature_lengths = np.zeros(len(vocabulary), dtype=np.int64)
+        index_chunks, value_chunks = [], []
+        for word, word_id in vocabulary.items():
+            indices, values = self._features(word)
+            feature_lengths[word_id] = len(indices)
+            index_chunks.append(indices)
+            value_chunks.append(values)
+        feature_starts = np.concatenate(([0], np.cumsum(feature_lengths)))
+        feature_indices = np.concatenate(index_chunks) if index_chunks else np.empty(0, dtype=np.int64)
+        feature_values = np.concatenate(value_chunks) if value_chunks else np.empty(0, dtype=np.float32)
+
+        unique_matrix = np.zeros((len(unique_texts), self.dim), dtype=np.float32)
+        for batch_start in range(0, len(unique_texts), batch_size):
+            batch_end = min(batch_start + batch_size, len(unique_texts))
+            pairs = slice(text_starts[batch_start], text_starts[batch_end])
+            batch_words = word_ids_array[pairs]
+            if not len(batch_words):
+                continue
+            lengths = feature_lengths[batch_words]
+            pair_of_feature = np.repeat(np.arange(len(batch_words)), lengths)
+            offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            features = feature_starts[batch_words][pair_of_feature] + offsets
+            targets = (pair_texts[pairs][pair_of_feature] - batch_start) * self.dim + feature_indices[features]
+            values = feature_values[features] * pair_weights[pairs][pair_of_feature]
+            unique_matrix[batch_start:batch_end] = np.bincount(
+                targets, weights=values, minlength=(batch_end - batch_start) * self.dim
+            ).reshape(batch_end - batch_start, self.dim)
+
+        norms = np.linalg.norm(unique_matrix, axis=1, keepdims=True)
+        np.divide(unique_matrix, norms, out=unique_matrix, where=norms > 0)
+        return unique_matrix[text_rows].astype(np.float16)
+
+
+def build_embeddings_snapshot(properties: Sequence[Dict[str, Any]], dim: int = EMBEDDING_DIM) -> Dict[str, Any]:
+    """Снимок для SnapshotCache: id квартир и матрица их эмбеддингов"""
+    started = time.perf_counter()
+    embedder = HashingEmbedder(dim)
+    matrix = embedder.embed_many([property_text(prop) for prop in properties])
+    return {
+        'ids': [str(prop.get('id')) for prop in properties],
+        'matrix': matrix,
+        'dim': dim,
+        'build_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+class EmbeddingIndex:
+    """Матрица эмбеддингов + поиск ближайших по скалярному произведению"""
+
+    def __init__(self, ids: List[str], matrix: np.ndarray, dim: int = EMBEDDING_DIM, build_ms: Optional[float] = None):
+        self.ids = ids
+        # В снимке матрица float16 (вдвое компактнее), для скалярных произведений — float32:
+        # у NumPy нет BLAS для half и умножение было бы в разы медленнее
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+        self.embedder = HashingEmbedder(dim)
+        self.build_ms = build_ms
+        self._row_of = {property_id: row for row, property_id in enumerate(ids)}
+        self._rows_lock = threading.Lock()
+        self._rows_source = None
+        self._rows = None
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Optional[Dict[str, Any]]) -> 'EmbeddingIndex':
+        snapshot = snapshot or {}
+        return cls(snapshot.get('ids', []), snapshot.get('matrix', np.zeros((0, EMBEDDING_DIM), dtype=np.float16)),
+                   snapshot.get('dim', EMBEDDING_DIM), snapshot.get('build_ms'))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_for(self, properties: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """Строки матрицы для списка квартир (-1 — квартиры нет в снимке эмбеддингов)"""
+        with self._rows_lock:
+            # Для полного снимка load_properties() соответствие считаем один раз
+            if self._rows_source is properties:
+                return self._rows
+            rows = np.fromiter((self._row_of.get(str(prop.get('id')), -1) for prop in properties),
+                               dtype=np.int64, count=len(properties))
+            if len(properties) == len(self.ids):
+                self._rows_source, self._rows = properties, rows
+            return rows
+
+    def similarities(self, rows: np.ndarray, query: str) -> np.ndarray:
+        """Косинусная близость запроса к строкам rows (0 для отсутствующих)"""
+        vector = self.embedder.embed(query)
+        scores = np.zeros(len(rows), dtype=np.float32)
+        present = rows >= 0
+        if present.any() and vector.any():
+            if present.all() and len(rows) == len(self.matrix) and np.array_equal(rows, np.arange(len(rows))):
+                scores = self.matrix @ vector
+            else:
+                scores[present] = self.matrix[rows[present]] @ vector
+        return scores
+
+    def top_k(self, properties: Sequence[Dict[str, Any]], query: str, k: int = 20,
+              positions: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """(позиция в properties, близость) для k ближайших; positions ограничивает кандидатов"""
+        all_rows = self.rows_for(properties)
+        if positions is None:
+            positions = np.arange(len(properties))
+        if not len(positions):
+            return []
+        scores = self.similarities(all_rows[positions], query)
+        k = min(k, len(positions))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(int(positions[i]), float(scores[i])) for i in best]
+
+    def rank(self, properties: Sequence[Dict[str, Any]], query: str) -> List[Dict[str, Any]]:
+        """Все квартиры списка по убыванию близости к запросу (при равенстве — исходный порядок)"""
+        if not properties:
+            return list(properties)
+        scores = self.similarities(self.rows_for(properties), query)
+        order = np.argsort(-scores, kind='stable')
+        return [properties[i] for i in order]
+
+    def stats(self) -> Dict[str, Any]:
+        return {'properties': len(self.ids), 'dim': int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0,
+                'matrix_bytes': int(self.matrix.nbytes), 'build_ms': self.build_ms}
+
+
+class EmbeddingIndexCache:
+    """EmbeddingIndex для текущего снимка эмбеддингов (пересоздается при смене снимка)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._index: Optional[EmbeddingIndex] = None
+
+    def get(self, snapshot: Optional[Dict[str, Any]]) -> EmbeddingIndex:
+        with self._lock:
+            if self._index is None or self._source is not snapshot:
+                self._index = EmbeddingIndex.from_snapshot(snapshot)
+                self._source = snapshot
+            return self._index
+
+
+embedding_index_cache = EmbeddingIndexCache()
@@ -0,0 +1,278 @@
+"""
+Рекомендации «похожие квартиры» через ближайших соседей в KD-дереве.
+
+get_similar_properties раньше брал первые три квартиры того же района и не
+смотрел ни на цену, ни на площадь, ни на комнаты. Теперь каждая квартира —
+вектор нормированных признаков (цена за м², площадь, комнаты, этаж, координаты,
+год сдачи, класс ЖК), а по векторам один раз на снимок load_properties()
+строится KD-дерево. Запрос — поиск k ближайших соседей с отсечением ветвей по
+плоскостям разбиения; готовые ответы запоминаются до смены снимка.
+
+    index = similarity_index_cache.get(get_property_index())
+    for position, distance in index.neighbors(index.position_of('101'), k=8):
+        ...
+"""
+import heapq
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from property_index import PropertyIndex
+
+# Листья крупные: расстояния внутри листа считаются векторно, а обход узлов — на Python
+LEAF_SIZE = 256
+# Сколько готовых ответов хранить на снимок
+MEMO_SIZE = 20_000
+
+# Вес признака в расстоянии (после деления на разброс признака)
+FEATURE_WEIGHTS = {
+    'price_per_m2': 1.5,
+    'area': 1.5,
+    'rooms': 1.2,
+    'floor': 0.3,
+    'lat': 1.0,
+    'lng': 1.0,
+    'completion_year': 0.5,
+    'complex_class': 0.8,
+}
+# Координаты переводятся в км и делятся на этот масштаб (одинаково по обеим осям)
+GEO_SCALE_KM = 5.0
+KM_PER_DEGREE = 111.0
+
+# Класс ЖК -> порядковый уровень (неизвестный класс — пропуск)
+CLASS_RANKS = {
+    'эконом': 0,
+    'стандарт': 1,
+    'комфорт': 2,
+    'комфорт+': 3,
+    'бизнес': 4,
+    'премиум': 5,
+    'элит': 6,
+    'элитный': 6,
+    'де-люкс': 6,
+}
+
+
+def _fill_missing(values: np.ndarray) -> np.ndarray:
+    """Пропуски (NaN) -> медиана признака, чтобы они не влияли на расстояние"""
+    present = ~np.isnan(values)
+    if not present.any():
+        return np.zeros_like(values)
+    return np.where(present, values, np.median(values[present]))
+
+
+def _standardize(values: np.ndarray) -> np.ndarray:
+    values = _fill_missing(values)
+    spread = values.std()
+    return (values - values.mean()) / spread if spread > 0 else np.zeros_like(values)
+
+
+def feature_matrix(index: PropertyIndex) -> np.ndarray:
+    """Матрица (квартиры, признаки) float64 с весами FEATURE_WEIGHTS"""
+    if not index.size:
+        return np.zeros((0, len(FEATURE_WEIGHTS)))
+    columns = index.columns
+    price = columns['price']
+    area = np.where(columns['area'] > 0, columns['area'], np.nan)
+    rooms = columns['rooms'].astype(np.float64)
+    floor = columns['floor'].astype(np.float64)
+    year = columns['completion_year'].astype(np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_per_m2 = np.where(price > 0, np.log(price / area), np.nan)
+        log_area = np.log(area)
+    class_ranks = np.array([CLASS_RANKS.get(str(label or '').strip().lower(), np.nan)
+                            for label in index.labels['complex_class']], dtype=np.float64)
+    complex_class = class_ranks[index.codes['complex_class']]
+
+    lat = _fill_missing(columns['lat'])
+    lng = _fill_missing(columns['lng'])
+    lat_km = (lat - lat.mean()) * KM_PER_DEGREE
+    lng_km = (lng - lng.mean()) * KM_PER_DEGREE * np.cos(np.radians(lat.mean()))
+
+    features = {
+        'price_per_m2': _standardize(price_per_m2),
+        'area': _standardize(log_area),
+        'rooms': _standardize(np.where(rooms >= 0, rooms, np.nan)),
+        'floor': _standardize(np.where(floor > 0, np.log(np.maximum(floor, 1)), np.nan)),
+        'lat': lat_km / GEO_SCALE_KM,
+        'lng': lng_km / GEO_SCALE_KM,
+        'completion_year': _standardize(np.where(year > 0, year, np.nan)),
+        'complex_class': _standardize(complex_class),
+    }
+    return np.column_stack([features[name] * weight for name, weight in FEATURE_WEIGHTS.items()])
+
+
+class KDTree:
+    """
+    KD-дерево на массивах NumPy: разбиение по медиане признака с наибольшим
+    разбросом, листья до leaf_size точек. Точки переупорядочены так, что
+    каждый лист — непрерывный срез self.points.
+    """
+
+    def __init__(self, points: np.ndarray, leaf_size: int = LEAF_SIZE):
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(points))
+        # Узел: (начало, конец) среза точек, признак и значение разбиения, потомки (-1 у листа)
+        self.start: List[int] = []
+        self.end: List[int] = []
+        self.split_dim: List[int] = []
+        self.split_value: List[float] = []
+        self.children: List[Tuple[int, int]] = []
+        if len(points):
+            self._build(points, 0, len(points))
+        self.points = points[self.order]
+
+    def __len__(self):
+        return len(self.start)
+
+    def _build(self, points: np.ndarray, start: int, end: int) -> int:
+        node = len(self.start)
+        self.start.append(start)
+        self.end.append(end)
+        self.split_dim.append(-1)
+        self.split_value.append(0.0)
+        self.children.append((-1, -1))
+        block = points[self.order[start:end]]
+        spread = block.max(axis=0) - block.min(axis=0)
+        if end - start <= self.leaf_size or not spread.any():
+            return node
+        dim = int(np.argmax(spread))
+        middle = (end - start) // 2
+        split = np.argpartition(block[:, dim], middle)
+        self.order[start:end] = self.order[start:end][split]
+        self.split_dim[node] = dim
+        self.split_value[node] = float(block[split[middle], dim])
+        left = self._build(points, start, start + middle)
+        right = self._build(points, start + middle, end)
+        self.children[node] = (left, right)
+        return node
+
+    def query(self, point: np.ndarray, k: int, skip: Iterable[int] = ()) -> Tuple[np.ndarray, np.ndarray]:
+        """(позиции, квадраты расстояний) k ближайших точек по возрастанию расстояния"""
+        skip = set(skip)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+        if not self.start or k <= 0:
+            return empty
+        # Исключаемые точки тоже найдутся, поэтому ищем с запасом и убираем их в конце
+        wanted = k + len(skip)
+        coordinates = point.tolist()
+        best_positions, best_distances = empty
+        worst = np.inf
+        # Нижняя граница расстояния до узла: максимум из границы родителя и
+        # квадрата расстояния до плоскостей разбиения, отделяющих узел от точки
+        heap = [(0.0, 0)]
+        while heap:
+            bound, node = heapq.heappop(heap)
+            if bound > worst:
+                break
+            dim = self.split_dim[node]
+            if dim >= 0:
+                left, right = self.children[node]
+                gap = coordinates[dim] - self.split_value[node]
+                near, far = (left, right) if gap < 0 else (right, left)
+                heapq.heappush(heap, (bound, near))
+                far_bound = max(bound, gap * gap)
+                if far_bound <= worst:
+                    heapq.heappush(heap, (far_bound, far))
+                continue
+            start, end = self.start[node], self.end[node]
+            offsets = self.points[start:end] - point
+            best_positions = np.concatenate((best_positions, self.order[start:end]))
+            best_distances = np.concatenate((best_distances, np.einsum('ij,ij->i', offsets, offsets)))
+            if len(best_distances) > wanted:
+                keep = np.argpartition(best_distances, wanted - 1)[:wanted]
+                best_positions, best_distances = best_positions[keep], best_distances[keep]
+            if len(best_distances) == wanted:
+                worst = float(best_distances.max())
+        if skip:
+            keep = np.fromiter((position not in skip for position in best_positions.tolist()),
+                               dtype=bool, count=len(best_positions))
+            best_positions, best_distances = best_positions[keep], best_distances[keep]
+        order = np.lexsort((best_positions, best_distances))[:k]
+        return best_positions[order], best_distances[order]
+
+
+class SimilarityIndex:
+    """KD-дерево признаков квартир снимка + запомненные ответы"""
+
+    def __init__(self, property_index: PropertyIndex):
+        started = time.perf_counter()
+        self.property_index = property_index
+        self.features = feature_matrix(property_index)
+        self.tree = KDTree(self.features)
+        self.build_ms = round((time.perf_counter() - started) * 1000, 2)
+        self._memo: Dict[Tuple[int, int], List[Tuple[int, float]]] = {}
+        self._memo_lock = threading.Lock()
+        self.metrics = {'queries': 0, 'memo_hits': 0}
+
+    def __len__(self):
+        return len(self.features)
+
+    def position_of(self, property_id) -> Optional[int]:
+        return self.property_index.position_of(property_id)
+
+    def neighbors(self, position: Optional[int], k: int = 8) -> List[Tuple[int, float]]:
+        """(позиция, расстояние) k ближайших к квартире position, без нее самой"""
+        if position is None:
+            return []
+        key = (position, k)
+        cached = self._memo.get(key)
+        if cached is not None:
+            self.metrics['memo_hits'] += 1
+            return cached
+        self.metrics['queries'] += 1
+        positions, distances = self.tree.query(self.features[position], k, skip=(position,))
+        result = [(int(p), float(np.sqrt(d))) for p, d in zip(positions, distances)]
+        with self._memo_lock:
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = result
+        return result
+
+    def neighbors_of_many(self, positions: Sequence[int], k: int = 8) -> List[Tuple[int, float]]:
+        """
+        k квартир, ближайших к любой из positions (например, ко всем квартирам
+        презентации), без самих positions.
+        """
+        positions = [position for position in positions if position is not None]
+        excluded = set(positions)
+        closest: Dict[int, float] = {}
+        for position in positions:
+            for neighbor, distance in self.neighbors(position, k + len(excluded)):
+                if neighbor not in excluded and distance < closest.get(neighbor, np.inf):
+                    closest[neighbor] = distance
+        return sorted(closest.items(), key=lambda item: (item[1], item[0]))[:k]
+
+    def similar(self, property_id, k: int = 8) -> List[Dict[str, Any]]:
+        """Словари k самых похожих квартир"""
+        return self.property_index.materialize(
+            position for position, _ in self.neighbors(self.position_of(property_id), k)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.metrics, properties=len(self), nodes=len(self.tree),
+                    memo=len(self._memo), build_ms=self.build_ms)
+
+
+class SimilarityIndexCache:
+    """SimilarityIndex для текущего PropertyIndex (пересобирается вместе со снимком)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._index: Optional[SimilarityIndex] = None
+        self.builds = 0
+
+    def get(self, property_index: PropertyIndex) -> SimilarityIndex:
+        with self._lock:
+            if self._index is None or self._source is not property_index:
+                self._index = SimilarityIndex(property_index)
+                self._source = property_index
+                self.builds += 1
+            return self._index
+
+
+similarity_index_cache = SimilarityIndexCache()
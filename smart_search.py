@@ -1,14 +1,28 @@
 import json
 import os
 import re
-from openai import OpenAI
+
+from llm_cache import llm_cache
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai_client = None
-if OPENAI_API_KEY:
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+_openai_client = None
+
+
+def get_openai_client():
+    """Клиент OpenAI; пакет openai (около секунды импорта) загружается при первом обращении к GPT"""
+    global _openai_client
+    if _openai_client is None and OPENAI_API_KEY:
+        from openai import OpenAI
+        _openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+
+# Разбор запроса и подсказки по умолчанию делают локальные правила (fallback_analysis,
+# fallback_suggestions), ранжирование — локальные эмбеддинги (semantic_search).
+# GPT вызывается только при SMART_SEARCH_USE_LLM=1
+SMART_SEARCH_USE_LLM = os.environ.get("SMART_SEARCH_USE_LLM", "0") == "1"
 
 class SmartSearch:
     def __init__(self):
@@ -41,9 +55,8 @@ class SmartSearch:
         }
 
     def analyze_search_query(self, query):
-        """Анализирует поисковый запрос с помощью OpenAI для извлечения критериев"""
-        if not openai_client:
-            print("OpenAI client not available, using fallback analysis")
+        """Критерии поиска из запроса: правила fallback_analysis, OpenAI — только при SMART_SEARCH_USE_LLM"""
+        if not SMART_SEARCH_USE_LLM or not OPENAI_API_KEY:
             return self.fallback_analysis(query)
             
         try:
@@ -69,14 +82,16 @@ class SmartSearch:
             "квартира у парка" -> {{"rooms": [], "district": "", "features": ["парк"], "semantic_search": true}}
             """
             
-            response = openai_client.chat.completions.create(
+            content = llm_cache.complete(
+                get_openai_client(),
+                schema_version="search_criteria:1",
                 model="gpt-4o",
                 messages=[{"role": "user", "content": prompt}],
                 response_format={"type": "json_object"},
                 temperature=0.3
             )
             
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             print(f"DEBUG: OpenAI analysis result: {result}")
             return result
             
@@ -203,72 +218,27 @@ class SmartSearch:
         # Fallback analysis completed
         return result
 
-    def semantic_property_search(self, properties, query, criteria):
-        """Семантический поиск по свойствам"""
+    def semantic_property_search(self, properties, query, criteria, embeddings=None):
+        """
+        Семантическое ранжирование: все квартиры по близости их текста к запросу
+        (EmbeddingIndex из semantic_search, без обращений к GPT).
+        """
         if not criteria.get("semantic_search") and not criteria.get("features"):
             return properties
             
-        if not openai_client:
-            print("OpenAI client not available, skipping semantic search")
+        if embeddings is None or not len(embeddings):
             return properties
             
         try:
-            # Подготавливаем данные о квартирах для анализа
-            properties_text = []
-            for prop in properties:
-                prop_text = f"ID: {prop['id']}, {prop['title']}, {prop['location']}, "
-                prop_text += f"{prop.get('description', '')}, район {prop['district']}, "
-                prop_text += f"{prop.get('nearby', '')}, {prop.get('complex_name', '')}"
-                properties_text.append(prop_text)
-            
-            # Запрос к OpenAI для семантического поиска
-            prompt = f"""
-            Найди наиболее подходящие квартиры для запроса: "{query}"
-            
-            Критерии поиска: {criteria}
-            
-            Доступные квартиры:
-            {chr(10).join(properties_text[:20])}  # Ограничиваем для токенов
-            
-            Верни JSON со списком ID квартир, отсортированных по релевантности:
-            {{"relevant_ids": [1, 5, 12, ...]}}
-            """
-            
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"},
-                temperature=0.2
-            )
-            
-            result = json.loads(response.choices[0].message.content)
-            relevant_ids = result.get("relevant_ids", [])
-            
-            # Сортируем квартиры по релевантности
-            if relevant_ids:
-                sorted_properties = []
-                for prop_id in relevant_ids:
-                    for prop in properties:
-                        if prop['id'] == prop_id:
-                            sorted_properties.append(prop)
-                            break
-                
-                # Добавляем остальные квартиры в конец
-                for prop in properties:
-                    if prop not in sorted_properties:
-                        sorted_properties.append(prop)
-                        
-                return sorted_properties
-                
+            return embeddings.rank(properties, query)
         except Exception as e:
             print(f"ERROR: Semantic search failed: {e}")
             
         return properties
 
     def generate_search_suggestions(self, query):
-        """Генерирует умные подсказки для автокомплита"""
-        if not openai_client:
-            print("OpenAI client not available, using fallback suggestions")
+        """Подсказки для автокомплита: правила fallback_suggestions, OpenAI — только при SMART_SEARCH_USE_LLM"""
+        if not SMART_SEARCH_USE_LLM or not OPENAI_API_KEY:
             return self.fallback_suggestions(query)
             
         try:
@@ -286,14 +256,16 @@ class SmartSearch:
             - Особенности: рядом с метро, у парка, новостройка, с парковкой
             """
             
-            response = openai_client.chat.completions.create(
+            content = llm_cache.complete(
+                get_openai_client(),
+                schema_version="search_suggestions:1",
                 model="gpt-4o",
                 messages=[{"role": "user", "content": prompt}],
                 response_format={"type": "json_object"},
                 temperature=0.7
             )
             
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             return result.get("suggestions", [])
             
         except Exception as e:
@@ -0,0 +1,255 @@
+"""
+Общий для всех gunicorn-воркеров кэш снимков данных (например, списка квартир).
+
+Снимок хранится сжатым pickle-блобом под версионированным ключем
+`<name>:v<version>` в локальном каталоге (по умолчанию instance/cache) или в
+Redis-совместимом хранилище, если задан SNAPSHOT_CACHE_REDIS_URL. Увеличение
+версии (bump_version) после импорта инвалидирует снимок сразу во всех воркерах,
+а пересобирает его только один воркер, удерживающий блокировку.
+"""
+import fcntl
+import os
+import pickle
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DEFAULT_CACHE_DIR = os.environ.get('SNAPSHOT_CACHE_DIR', os.path.join('instance', 'cache'))
+
+
+class FileSnapshotStore:
+    """Хранилище снимков в локальных файлах; запись атомарная через os.replace"""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{name}.{suffix}")
+
+    def _write_atomic(self, path: str, payload: bytes):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def get_version(self, name: str) -> int:
+        try:
+            with open(self._path(name, 'version'), 'r') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump_version(self, name: str) -> int:
+        with self.lock(name):
+            version = self.get_version(name) + 1
+            self._write_atomic(self._path(name, 'version'), str(version).encode())
+        for filename in os.listdir(self.directory):
+            # Старые версии снимка больше никому не нужны
+            if (filename.startswith(f"{name}.v") and filename.endswith('.snapshot')
+                    and filename != f"{name}.v{version}.snapshot"):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+        return version
+
+    def read(self, name: str, version: int) -> Optional[Tuple[bytes, float]]:
+        path = self._path(name, f"v{version}.snapshot")
+        try:
+            created_at = os.path.getmtime(path)
+            with open(path, 'rb') as f:
+                return f.read(), created_at
+        except FileNotFoundError:
+            return None
+
+    def write(self, name: str, version: int, blob: bytes):
+        self._write_atomic(self._path(name, f"v{version}.snapshot"), blob)
+
+    @contextmanager
+    def lock(self, name: str):
+        with open(self._path(name, 'lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class RedisSnapshotStore:
+    """Хранилище снимков в Redis (или совместимом сервере)"""
+
+    LOCK_TIMEOUT = 120
+
+    def __init__(self, url: str):
+        import redis  # опциональная зависимость
+        self.client = redis.Redis.from_url(url)
+
+    def get_version(self, name: str) -> int:
+        return int(self.client.get(f"snapshot:{name}:version") or 0)
+
+    def bump_version(self, name: str) -> int:
+        return int(self.client.incr(f"snapshot:{name}:version"))
+
+    def read(self, name: str, version: int) -> Optional[Tuple[bytes, float]]:
+        pipe = self.client.pipeline()
+        pipe.get(f"snapshot:{name}:v{version}")
+        pipe.get(f"snapshot:{name}:v{version}:created_at")
+        blob, created_at = pipe.execute()
+        if blob is None:
+            return None
+        return blob, float(created_at or 0)
+
+    def write(self, name: str, version: int, blob: bytes):
+        pipe = self.client.pipeline()
+        pipe.set(f"snapshot:{name}:v{version}", blob, ex=24 * 3600)
+        pipe.set(f"snapshot:{name}:v{version}:created_at", time.time(), ex=24 * 3600)
+        pipe.execute()
+
+    @contextmanager
+    def lock(self, name: str):
+        with self.client.lock(f"snapshot:{name}:lock", timeout=self.LOCK_TIMEOUT):
+            yield
+
+
+def create_default_store():
+    """Redis, если задан SNAPSHOT_CACHE_REDIS_URL и установлен redis-py, иначе файлы"""
+    redis_url = os.environ.get('SNAPSHOT_CACHE_REDIS_URL')
+    if redis_url:
+        try:
+            return RedisSnapshotStore(redis_url)
+        except ImportError:
+            print("redis package not installed, using file snapshot store")
+    return FileSnapshotStore()
+
+
+class SnapshotCache:
+    """
+    Кэш одного снимка данных с версионированным ключом.
+
+    get() отдает копию из памяти воркера, пока версия в общем хранилище не
+    изменилась и снимок не старше ttl; иначе читает общий блоб или
+    пересобирает его через loader() под межпроцессной блокировкой.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Any], ttl: int = 300,
+                 store=None, version_check_interval: float = 2.0):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._store = store
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._created_at = 0.0
+        self._version_checked_at = 0.0
+        self._shared_version = 0
+        self.metrics = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'rebuilds': 0,
+            'rebuild_errors': 0,
+            'last_rebuild_ms': None,
+            'total_rebuild_ms': 0.0,
+            'snapshot_bytes': 0,
+        }
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = create_default_store()
+        return self._store
+
+    def _current_version(self) -> int:
+        now = time.time()
+        if now - self._version_checked_at >= self.version_check_interval:
+            self._shared_version = self.store.get_version(self.name)
+            self._version_checked_at = now
+        return self._shared_version
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return time.time() - created_at < self.ttl
+
+    def _load_shared(self, version: int):
+        stored = self.store.read(self.name, version)
+        if stored is None:
+            return None
+        blob, created_at = stored
+        if not self._is_fresh(created_at):
+            return None
+        self._set_local(pickle.loads(zlib.decompress(blob)), version, created_at, len(blob))
+        return self._data
+
+    def _set_local(self, data, version: int, created_at: float, size: int):
+        self._data = data
+        self._version = version
+        self._created_at = created_at
+        self.metrics['snapshot_bytes'] = size
+
+    def _rebuild(self, version: int):
+        started = time.perf_counter()
+        try:
+            data = self.loader()
+        except Exception:
+            self.metrics['rebuild_errors'] += 1
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.metrics['rebuilds'] += 1
+        self.metrics['last_rebuild_ms'] = round(elapsed_ms, 2)
+        self.metrics['total_rebuild_ms'] = round(self.metrics['total_rebuild_ms'] + elapsed_ms, 2)
+        if not data:
+            # Пустой результат (ошибка БД) не кэшируем, как и раньше
+            return data
+        blob = zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self.store.write(self.name, version, blob)
+        self._set_local(data, version, time.time(), len(blob))
+        return data
+
+    def get(self):
+        with self._lock:
+            version = self._current_version()
+            if self._data is not None and self._version == version and self._is_fresh(self._created_at):
+                self.metrics['hits'] += 1
+                return self._data
+
+            data = self._load_shared(version)
+            if data is not None:
+                self.metrics['shared_hits'] += 1
+                return data
+
+            self.metrics['misses'] += 1
+            with self.store.lock(self.name):
+                # Пока ждали блокировку, другой воркер мог уже собрать снимок
+                data = self._load_shared(version)
+                if data is not None:
+                    self.metrics['shared_hits'] += 1
+                    return data
+                return self._rebuild(version)
+
+    def version(self) -> int:
+        """Текущая версия данных в общем хранилище (проверяется не чаще version_check_interval)"""
+        with self._lock:
+            return self._current_version()
+
+    def invalidate(self) -> int:
+        """Увеличивает версию данных: снимок пересоберется во всех воркерах"""
+        with self._lock:
+            version = self.store.bump_version(self.name)
+            self._shared_version = version
+            self._version_checked_at = time.time()
+            self._data = None
+            return version
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.metrics['hits'] + self.metrics['shared_hits'] + self.metrics['misses']
+        return dict(
+            self.metrics,
+            name=self.name,
+            version=self._version,
+            hit_ratio=round((self.metrics['hits'] + self.metrics['shared_hits']) / total, 4) if total else None,
+            age_seconds=round(time.time() - self._created_at, 1) if self._data is not None else None,
+        )
@@ -0,0 +1,67 @@
+"""
+Настройка логирования приложения.
+
+Раньше app.py включал logging.DEBUG для всего процесса (включая SQLAlchemy и
+urllib3), а отладка горячих путей шла безусловными print("DEBUG: ..."), которые
+форматировались и писались в stdout на каждом запросе. Теперь:
+
+* уровень задается LOG_LEVEL (по умолчанию INFO), отладочные сообщения
+  app.logger.debug("... %s", value) при выключенном DEBUG даже не форматируются;
+* LOG_FORMAT=json — одна JSON-строка на запись (время, уровень, логгер,
+  сообщение, поля из extra=, endpoint/method/path текущего запроса) для
+  сборщиков логов; по умолчанию прежний текстовый формат.
+
+    configure_logging()
+    app.logger.warning("slow request", extra={'duration_ms': 1250})
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Атрибуты, которые есть у любой записи; остальное пришло через extra=
+_STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class RequestContextFilter(logging.Filter):
+    """Добавляет в запись endpoint, method и path, если она сделана внутри HTTP-запроса"""
+
+    def filter(self, record):
+        from flask import has_request_context, request
+
+        if has_request_context():
+            record.endpoint = request.endpoint
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: Optional[str] = None, log_format: Optional[str] = None):
+    """Настраивает корневой логгер один раз на процесс (повторный вызов ничего не меняет)"""
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    log_format = (log_format or os.environ.get('LOG_FORMAT', 'text')).lower()
+    if log_format == 'json':
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(RequestContextFilter())
+        logging.basicConfig(level=level, handlers=[handler])
+    else:
+        logging.basicConfig(level=level, format=TEXT_FORMAT)
@@ -0,0 +1,182 @@
+"""
+Индекс подсказок автодополнения поиска (/api/search-suggestions) в памяти.
+
+Раньше каждое нажатие клавиши выполняло COUNT(*) на каждый тип квартир и
+несколько сканирований `LOWER(col) LIKE '%q%'` по excel_properties. Теперь
+названия ЖК, застройщиков, районов, улиц и городов с готовыми счетчиками
+собираются один раз (при старте и после импорта), а запрос подсказок
+обслуживается без обращений к БД:
+
+* префикс названия или любого его слова — бинарный поиск по отсортированному
+  списку токенов;
+* подстрока — пересечение списков триграмм с проверкой `q in key`;
+* опечатки — доля совпавших триграмм запроса (если точных совпадений мало).
+
+    index = suggestion_index_cache.get(snapshot)
+    for entry in index.search('неометр'):
+        ...
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Ранги совпадения: чем меньше, тем выше в выдаче внутри одного приоритета
+RANK_PREFIX = 0
+RANK_WORD_PREFIX = 1
+RANK_SUBSTRING = 2
+RANK_FUZZY = 3
+
+# Нечеткий поиск: минимальная длина запроса и доля совпавших триграмм
+FUZZY_MIN_LENGTH = 4
+FUZZY_MIN_SIMILARITY = 0.5
+# Нечеткий поиск запускается, только если точных совпадений меньше
+FUZZY_MIN_RESULTS = 3
+
+_NON_WORD_RE = re.compile(r'[^\w]+')
+
+
+def normalize_text(value) -> str:
+    """Нижний регистр, ё -> е, знаки препинания -> пробелы"""
+    if not value:
+        return ''
+    value = str(value).lower().replace('ё', 'е')
+    return ' '.join(_NON_WORD_RE.sub(' ', value).split())
+
+
+def trigrams(value: str) -> set:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class SuggestionIndex:
+    """
+    entries — список словарей подсказок с полями title, type, priority, count
+    (и любыми другими, которые отдаются клиенту как есть, кроме служебных
+    priority и count); room_counts — {число комнат: количество квартир}.
+    """
+
+    def __init__(self, entries: Iterable[Dict[str, Any]], room_counts: Optional[Dict[int, int]] = None):
+        started = time.perf_counter()
+        self.entries: List[Dict[str, Any]] = list(entries)
+        self.room_counts: Dict[int, int] = dict(room_counts or {})
+        self._keys = [normalize_text(entry['title']) for entry in self.entries]
+
+        tokens: List[Tuple[str, int]] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for entry_id, key in enumerate(self._keys):
+            for token in set(key.split()) | {key}:
+                tokens.append((token, entry_id))
+            for gram in trigrams(key):
+                self._postings[gram].append(entry_id)
+        tokens.sort()
+        self._tokens = [token for token, _ in tokens]
+        self._token_ids = [entry_id for _, entry_id in tokens]
+        self.build_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _prefix_matches(self, query: str, matches: Dict[int, int]):
+        position = bisect_left(self._tokens, query)
+        while position < len(self._tokens) and self._tokens[position].startswith(query):
+            entry_id = self._token_ids[position]
+            rank = RANK_PREFIX if self._keys[entry_id].startswith(query) else RANK_WORD_PREFIX
+            if rank < matches.get(entry_id, RANK_FUZZY + 1):
+                matches[entry_id] = rank
+            position += 1
+
+    def _substring_matches(self, query: str, matches: Dict[int, int]):
+        if len(query) < 3:
+            # Для 1-2 символов триграмм нет — названий немного, хватает прохода по ключам
+            candidates: Iterable[int] = range(len(self._keys))
+        else:
+            postings = [self._postings.get(gram) for gram in trigrams(query)]
+            if not all(postings):
+                return
+            postings.sort(key=len)
+            candidate_set = set(postings[0])
+            for posting in postings[1:]:
+                candidate_set.intersection_update(posting)
+                if not candidate_set:
+                    return
+            candidates = candidate_set
+        for entry_id in candidates:
+            if entry_id not in matches and query in self._keys[entry_id]:
+                matches[entry_id] = RANK_SUBSTRING
+
+    def _fuzzy_matches(self, query: str, matches: Dict[int, int]):
+        query_grams = trigrams(query)
+        hits: Dict[int, int] = defaultdict(int)
+        for gram in query_grams:
+            for entry_id in self._postings.get(gram, ()):
+                hits[entry_id] += 1
+        for entry_id, shared in hits.items():
+            if entry_id not in matches and shared >= 2 and shared / len(query_grams) >= FUZZY_MIN_SIMILARITY:
+                matches[entry_id] = RANK_FUZZY
+
+    def search(self, query: str, limits: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Подсказки по запросу, отсортированные по (priority, ранг совпадения,
+        -count); limits — {type: максимум подсказок этого типа}.
+        """
+        query = normalize_text(query)
+        if not query:
+            return []
+
+        matches: Dict[int, int] = {}
+        self._prefix_matches(query, matches)
+        self._substring_matches(query, matches)
+        if len(matches) < FUZZY_MIN_RESULTS and len(query) >= FUZZY_MIN_LENGTH:
+            self._fuzzy_matches(query, matches)
+
+        ordered = sorted(
+            matches.items(),
+            key=lambda item: (self.entries[item[0]]['priority'], item[1],
+                              -self.entries[item[0]].get('count', 0), self._keys[item[0]])
+        )
+        per_type: Dict[str, int] = defaultdict(int)
+        results = []
+        for entry_id, _ in ordered:
+            entry = self.entries[entry_id]
+            if limits and per_type[entry['type']] >= limits.get(entry['type'], len(self.entries)):
+                continue
+            per_type[entry['type']] += 1
+            results.append(entry)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        types: Dict[str, int] = defaultdict(int)
+        for entry in self.entries:
+            types[entry['type']] += 1
+        return {'entries': len(self.entries), 'types': dict(types), 'trigrams': len(self._postings),
+                'build_ms': self.build_ms}
+
+
+_EMPTY_SNAPSHOT: Dict[str, Any] = {}
+
+
+class SuggestionIndexCache:
+    """
+    Индекс для текущего снимка подсказок: пересобирается, только когда снимок
+    стал другим объектом (новая версия после импорта или истек TTL).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._index: Optional[SuggestionIndex] = None
+        self.builds = 0
+
+    def get(self, snapshot: Optional[Dict[str, Any]]) -> SuggestionIndex:
+        snapshot = snapshot or _EMPTY_SNAPSHOT
+        with self._lock:
+            if self._index is None or self._source is not snapshot:
+                self._index = SuggestionIndex(snapshot.get('entries', []), snapshot.get('room_counts'))
+                self._source = snapshot
+                self.builds += 1
+            return self._index
+
+
+suggestion_index_cache = SuggestionIndexCache()
@@ -5,8 +5,11 @@ Telegram Bot для интеграции с InBack
 
 import os
 import asyncio
+import atexit
 import logging
-import requests
+import queue
+import threading
+import time
 
 # Try importing telegram modules with error handling
 try:
@@ -28,6 +31,13 @@ from models import User
 # Конфигурация
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')  # URL для webhook
+# Очередь обновлений webhook и число одновременно обрабатываемых обновлений на воркер
+UPDATE_QUEUE_SIZE = int(os.environ.get('TELEGRAM_UPDATE_QUEUE_SIZE', 1000))
+UPDATE_CONCURRENCY = int(os.environ.get('TELEGRAM_UPDATE_CONCURRENCY', 8))
+# После неудачного запуска бота (нет токена, ошибка initialize) новая попытка — не раньше
+# чем через столько секунд; при повторных неудачах интервал удваивается до START_RETRY_MAX
+START_RETRY_DELAY = 30
+START_RETRY_MAX = 600
 
 # Логирование
 logging.basicConfig(
@@ -37,30 +47,19 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 def send_telegram_message(chat_id, message):
-    """Send telegram message using simple HTTP API"""
+    """Queue telegram message for the outbox dispatcher (pooled HTTP API client)"""
     if not TELEGRAM_BOT_TOKEN:
         print("❌ Telegram bot token not configured in environment")
         return False
     
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        data = {
-            'chat_id': chat_id,
-            'text': message,
-            'parse_mode': 'HTML'  # Changed to HTML for better formatting
-        }
-        
-        response = requests.post(url, data=data, timeout=10)
-        
-        if response.status_code == 200:
-            print(f"✅ Telegram message sent successfully to {chat_id}")
-            return True
-        else:
-            print(f"❌ Telegram API error: {response.status_code} - {response.text}")
-            return False
+        from outbox import enqueue_telegram
+        enqueue_telegram(chat_id, message, parse_mode='HTML')  # Changed to HTML for better formatting
+        print(f"✅ Telegram message queued for {chat_id}")
+        return True
             
     except Exception as e:
-        print(f"❌ Error sending telegram message: {e}")
+        print(f"❌ Error queueing telegram message: {e}")
         return False
 
 def send_recommendation_notification(user_telegram_id, recommendation_data):
@@ -422,6 +421,177 @@ class InBackBot:
         except Exception as e:
             logger.error(f"Ошибка polling: {e}")
 
+class BotRuntime:
+    """
+    Один InBackBot на воркер на фоновом event loop.
+
+    Раньше webhook на каждое обновление создавал новый Application (обработчики,
+    HTTP-клиент) и новый event loop через asyncio.run(). Теперь приложение
+    инициализируется один раз при первом обновлении (уже после fork воркера),
+    webhook кладет JSON в потокобезопасную очередь и сразу отвечает, а цикл
+    берет из очереди не больше concurrency обновлений одновременно. Переполненная
+    очередь — отказ (503), Telegram повторит доставку позже.
+    """
+
+    def __init__(self, queue_size: int = UPDATE_QUEUE_SIZE, concurrency: int = UPDATE_CONCURRENCY,
+                 bot_factory=None):
+        self.concurrency = concurrency
+        self._bot_factory = bot_factory or InBackBot
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._wakeup = None
+        self._ready = threading.Event()
+        self._start_error = None
+        self._start_failures = 0
+        self._retry_at = 0.0
+        self.bot = None
+        self.metrics = {'received': 0, 'rejected': 0, 'processed': 0, 'failed': 0,
+                        'in_flight': 0, 'max_in_flight': 0, 'max_queue_depth': 0,
+                        'queue_wait_ms': 0.0, 'process_ms': 0.0}
+
+    def start(self, timeout: float = 30) -> bool:
+        """
+        Запускает поток с event loop и инициализирует бота (повторный вызов ничего не делает).
+        После неудачного запуска сразу возвращает False, пока не истечет пауза до новой попытки.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self._start_error is not None and time.monotonic() < self._retry_at:
+                    return False
+                self._ready.clear()
+                self._start_error = None
+                self._thread = threading.Thread(target=self._run, name='telegram-bot-loop', daemon=True)
+                self._thread.start()
+        self._ready.wait(timeout)
+        return self.bot is not None and self._start_error is None
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        try:
+            bot = self._bot_factory()
+            application = getattr(bot, 'application', None)
+            if application is None:
+                raise RuntimeError('Telegram bot is not configured')
+            await application.initialize()
+            self.bot = bot
+        except Exception as e:
+            self._start_failures += 1
+            delay = min(START_RETRY_MAX, START_RETRY_DELAY * 2 ** (self._start_failures - 1))
+            logger.error(f"Telegram bot start error: {e}; next attempt in {delay} s")
+            self._retry_at = time.monotonic() + delay
+            self._start_error = e
+            self._ready.set()
+            return
+        self._start_failures = 0
+        self._ready.set()
+
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        try:
+            while True:
+                # Пока все слоты заняты, обновления ждут в очереди — это видно по ее глубине
+                await slots.acquire()
+                item = await self._next_item()
+                if item is None:
+                    slots.release()
+                    break
+                task = loop.create_task(self._process(item, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            await self.bot.application.shutdown()
+            self.bot = None
+
+    async def _next_item(self):
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                self._wakeup.clear()
+                # submit() кладет в очередь, а потом будит цикл, поэтому пропустить элемент нельзя
+                if self._queue.empty():
+                    await self._wakeup.wait()
+
+    def _wake(self):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass
+
+    async def _process(self, item, slots):
+        received_at, json_data = item
+        started = time.perf_counter()
+        self.metrics['queue_wait_ms'] += (started - received_at) * 1000
+        self.metrics['in_flight'] += 1
+        self.metrics['max_in_flight'] = max(self.metrics['max_in_flight'], self.metrics['in_flight'])
+        try:
+            application = self.bot.application
+            await application.process_update(Update.de_json(json_data, application.bot))
+            self.metrics['processed'] += 1
+        except Exception as e:
+            self.metrics['failed'] += 1
+            logger.error(f"Telegram update error: {e}")
+        finally:
+            self.metrics['in_flight'] -= 1
+            self.metrics['process_ms'] += (time.perf_counter() - started) * 1000
+            slots.release()
+
+    def submit(self, json_data) -> bool:
+        """Ставит обновление в очередь; False — бот не запущен или очередь переполнена"""
+        if not self.start():
+            return False
+        try:
+            self._queue.put_nowait((time.perf_counter(), json_data))
+        except queue.Full:
+            self.metrics['rejected'] += 1
+            return False
+        self._wake()
+        self.metrics['received'] += 1
+        self.metrics['max_queue_depth'] = max(self.metrics['max_queue_depth'], self._queue.qsize())
+        return True
+
+    def stop(self, timeout: float = 10):
+        """Дожидается обработки принятых обновлений и закрывает приложение"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._wake()
+        thread.join(timeout)
+
+    def stats(self):
+        finished = self.metrics['processed'] + self.metrics['failed']
+        return dict(self.metrics, queue_wait_ms=round(self.metrics['queue_wait_ms'], 1),
+                    process_ms=round(self.metrics['process_ms'], 1),
+                    running=self.bot is not None, queue_depth=self._queue.qsize(),
+                    queue_size=self._queue.maxsize, concurrency=self.concurrency,
+                    start_error=str(self._start_error) if self._start_error else None,
+                    start_failures=self._start_failures,
+                    avg_queue_wait_ms=round(self.metrics['queue_wait_ms'] / finished, 2) if finished else None,
+                    avg_process_ms=round(self.metrics['process_ms'] / finished, 2) if finished else None)
+
+
+bot_runtime = BotRuntime()
+atexit.register(bot_runtime.stop)
+
 # Flask маршрут для webhook
 def create_webhook_route(app):
     """Создаёт маршрут webhook в Flask приложении"""
@@ -436,12 +606,9 @@ def create_webhook_route(app):
             # Получаем данные от Telegram
             json_data = request.get_json()
             
-            # Обрабатываем через bot application
-            bot = InBackBot()
-            update = Update.de_json(json_data, bot.application.bot)
-            
-            # Обрабатываем в контексте asyncio
-            asyncio.run(bot.application.process_update(update))
+            # Обработка идет в фоновом event loop бота, ответ — сразу
+            if not bot_runtime.submit(json_data):
+                return jsonify({'error': 'Bot is busy'}), 503
             
             return jsonify({'status': 'ok'})
         except Exception as e:
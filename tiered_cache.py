@@ -0,0 +1,425 @@
+"""
+Двухуровневый кэш вместо Flask-Caching 'simple'.
+
+С CACHE_TYPE='simple' у каждого gunicorn-воркера был свой неограниченный
+словарь: попаданий мало, память умножается на число воркеров, а сбросить
+кэш /api/super-search во всех воркерах было нельзя. TieredCache:
+
+* L1 — LRU в памяти воркера, ограниченный по байтам и числу записей;
+* L2 — общее хранилище: файлы в instance/cache/tiered или Redis, если задан
+  CACHE_REDIS_URL (или SNAPSHOT_CACHE_REDIS_URL);
+* защита от лавины: одинаковые промахи в воркере ждут одну загрузку, между
+  воркерами загрузку выполняет держатель блокировки ключа;
+* stale-while-revalidate: в течение stale_ttl после истечения timeout
+  отдается старое значение, а новое считается в фоновом потоке;
+* пространства имен: invalidate('super_search') увеличивает поколение
+  пространства, и старые ключи перестают читаться во всех воркерах
+  (другие воркеры замечают новое поколение в течение GENERATION_CHECK_INTERVAL);
+* метрики по каждому пространству (эндпоинту) для /admin/cache-stats.
+
+    @cache.cached(timeout=180, namespace='super_search', stale_ttl=60)
+    def super_search_api(): ...
+
+    developers = cache.get_or_set('developers', 'list', load_developers, timeout=3600)
+"""
+import fcntl
+import hashlib
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+from snapshot_cache import DEFAULT_CACHE_DIR
+
+L1_MAX_BYTES = int(os.environ.get('CACHE_L1_MAX_BYTES', 64 * 1024 * 1024))
+L1_MAX_ENTRIES = int(os.environ.get('CACHE_L1_MAX_ENTRIES', 5000))
+GENERATION_CHECK_INTERVAL = 1.0
+# Файлы L2 с истекшим сроком удаляются раз в столько записей
+PRUNE_EVERY = 500
+LOCK_STRIPES = 64
+
+_EXPIRES = struct.Struct('!d')
+
+
+class FileCacheBackend:
+    """L2 в файлах: <ключ>.entry = 8 байт срока годности + сжатый pickle"""
+
+    def __init__(self, directory: str = os.path.join(DEFAULT_CACHE_DIR, 'tiered')):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._writes = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _write_atomic(self, path: str, payload: bytes):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(f"{key}.entry"), 'rb') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        if len(payload) < _EXPIRES.size or _EXPIRES.unpack_from(payload)[0] < time.time():
+            return None
+        return payload[_EXPIRES.size:]
+
+    def set(self, key: str, blob: bytes, ttl: float):
+        self._write_atomic(self._path(f"{key}.entry"), _EXPIRES.pack(time.time() + ttl) + blob)
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self) -> int:
+        """Удаляет записи с истекшим сроком (в том числе записи старых поколений)"""
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.entry'):
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    header = f.read(_EXPIRES.size)
+                if len(header) < _EXPIRES.size or _EXPIRES.unpack(header)[0] < now:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def get_generation(self, namespace: str) -> int:
+        try:
+            with open(self._path(f"{namespace}.generation"), 'r') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump_generation(self, namespace: str) -> int:
+        with self.lock(f"generation:{namespace}"):
+            generation = self.get_generation(namespace) + 1
+            self._write_atomic(self._path(f"{namespace}.generation"), str(generation).encode())
+        return generation
+
+    @contextmanager
+    def lock(self, key: str):
+        # Полосы блокировок вместо файла на каждый ключ
+        stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % LOCK_STRIPES
+        with open(self._path(f"lock.{stripe}"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class RedisCacheBackend:
+    """L2 в Redis (или совместимом сервере)"""
+
+    LOCK_TIMEOUT = 60
+
+    def __init__(self, url: str):
+        import redis  # опциональная зависимость
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(f"cache:{key}")
+
+    def set(self, key: str, blob: bytes, ttl: float):
+        self.client.set(f"cache:{key}", blob, px=max(1, int(ttl * 1000)))
+
+    def get_generation(self, namespace: str) -> int:
+        return int(self.client.get(f"cache:{namespace}:generation") or 0)
+
+    def bump_generation(self, namespace: str) -> int:
+        return int(self.client.incr(f"cache:{namespace}:generation"))
+
+    @contextmanager
+    def lock(self, key: str):
+        with self.client.lock(f"cache:lock:{key}", timeout=self.LOCK_TIMEOUT):
+            yield
+
+
+def create_cache_backend():
+    """Redis, если задан CACHE_REDIS_URL/SNAPSHOT_CACHE_REDIS_URL и установлен redis-py, иначе файлы"""
+    redis_url = os.environ.get('CACHE_REDIS_URL') or os.environ.get('SNAPSHOT_CACHE_REDIS_URL')
+    if redis_url:
+        try:
+            return RedisCacheBackend(redis_url)
+        except ImportError:
+            print("redis package not installed, using file cache backend")
+    return FileCacheBackend()
+
+
+class _Entry:
+    __slots__ = ('value', 'fresh_until', 'stale_until', 'size', 'namespace')
+
+    def __init__(self, value, fresh_until: float, stale_until: float, size: int, namespace: str):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+        self.size = size
+        self.namespace = namespace
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+def _new_metrics() -> Dict[str, Any]:
+    return {'requests': 0, 'l1_hits': 0, 'l2_hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0,
+            'loads': 0, 'load_errors': 0, 'load_ms': 0.0, 'refreshes': 0, 'evictions': 0,
+            'bytes': 0, 'entries': 0, 'invalidations': 0}
+
+
+class TieredCache:
+    def __init__(self, backend=None, max_bytes: int = L1_MAX_BYTES, max_entries: int = L1_MAX_ENTRIES):
+        self._backend = backend
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._local: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._local_bytes = 0
+        self._inflight: Dict[str, _InFlight] = {}
+        self._refreshing = set()
+        self._generations: Dict[str, Tuple[int, float]] = {}
+        self.metrics: Dict[str, Dict[str, Any]] = defaultdict(_new_metrics)
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = create_cache_backend()
+        return self._backend
+
+    # --- поколения пространств имен -----------------------------------------
+
+    def _generation(self, namespace: str) -> int:
+        now = time.time()
+        cached = self._generations.get(namespace)
+        if cached is not None and now - cached[1] < GENERATION_CHECK_INTERVAL:
+            return cached[0]
+        generation = self.backend.get_generation(namespace)
+        self._generations[namespace] = (generation, now)
+        return generation
+
+    def invalidate(self, namespace: str) -> int:
+        """Сбрасывает все ключи пространства имен во всех воркерах"""
+        generation = self.backend.bump_generation(namespace)
+        self._generations[namespace] = (generation, time.time())
+        with self._lock:
+            for key in [key for key, entry in self._local.items() if entry.namespace == namespace]:
+                self._drop_local(key)
+        self.metrics[namespace]['invalidations'] += 1
+        return generation
+
+    # --- L1 -----------------------------------------------------------------
+
+    def _drop_local(self, key: str, evicted: bool = False):
+        entry = self._local.pop(key)
+        self._local_bytes -= entry.size
+        metrics = self.metrics[entry.namespace]
+        metrics['bytes'] -= entry.size
+        metrics['entries'] -= 1
+        if evicted:
+            metrics['evictions'] += 1
+
+    def _put_local(self, key: str, entry: _Entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._local:
+                self._drop_local(key)
+            self._local[key] = entry
+            self._local_bytes += entry.size
+            metrics = self.metrics[entry.namespace]
+            metrics['bytes'] += entry.size
+            metrics['entries'] += 1
+            while self._local and (self._local_bytes > self.max_bytes or len(self._local) > self.max_entries):
+                self._drop_local(next(iter(self._local)), evicted=True)
+
+    def _get_local(self, key: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry.stale_until <= time.time():
+                self._drop_local(key)
+                return None
+            self._local.move_to_end(key)
+            return entry
+
+    # --- L2 -----------------------------------------------------------------
+
+    def _get_shared(self, key: str, namespace: str) -> Optional[_Entry]:
+        blob = self.backend.get(key)
+        if blob is None:
+            return None
+        value, fresh_until, stale_until = pickle.loads(zlib.decompress(blob))
+        entry = _Entry(value, fresh_until, stale_until, len(blob), namespace)
+        self._put_local(key, entry)
+        return entry
+
+    def _load(self, key: str, namespace: str, loader: Callable[[], Any], timeout: float, stale_ttl: float,
+              should_cache: Callable[[Any], bool]):
+        metrics = self.metrics[namespace]
+        started = time.perf_counter()
+        try:
+            value = loader()
+        except Exception:
+            metrics['load_errors'] += 1
+            raise
+        metrics['loads'] += 1
+        metrics['load_ms'] = round(metrics['load_ms'] + (time.perf_counter() - started) * 1000, 2)
+        if should_cache(value):
+            now = time.time()
+            blob = zlib.compress(pickle.dumps((value, now + timeout, now + timeout + stale_ttl),
+                                              protocol=pickle.HIGHEST_PROTOCOL), 1)
+            self.backend.set(key, blob, timeout + stale_ttl)
+            self._put_local(key, _Entry(value, now + timeout, now + timeout + stale_ttl, len(blob), namespace))
+        return value
+
+    def _load_locked(self, key: str, namespace: str, loader, timeout, stale_ttl, should_cache):
+        with self.backend.lock(key):
+            # Пока ждали блокировку, другой воркер мог уже загрузить значение
+            entry = self._get_shared(key, namespace)
+            if entry is not None and entry.fresh_until > time.time():
+                self.metrics[namespace]['coalesced'] += 1
+                return entry.value
+            return self._load(key, namespace, loader, timeout, stale_ttl, should_cache)
+
+    def _refresh_in_background(self, key: str, namespace: str, loader, timeout, stale_ttl, should_cache):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.metrics[namespace]['refreshes'] += 1
+                self._load_locked(key, namespace, loader, timeout, stale_ttl, should_cache)
+            except Exception as e:
+                print(f"Cache refresh failed for {namespace}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f"cache-refresh-{namespace}", daemon=True).start()
+
+    # --- API ----------------------------------------------------------------
+
+    def get_or_set(self, namespace: str, key: str, loader: Callable[[], Any], timeout: float = 300,
+                   stale_ttl: float = 0, should_cache: Callable[[Any], bool] = lambda value: value is not None):
+        """
+        Значение из L1/L2 или loader(). Значение отдается всем запросам как есть —
+        изменять его нельзя. should_cache(value) решает, сохранять ли результат
+        (по умолчанию не кэшируется None); исключения loader не кэшируются.
+        Для фонового обновления loader не должен зависеть от контекста запроса.
+        """
+        metrics = self.metrics[namespace]
+        metrics['requests'] += 1
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        full_key = f"{namespace}.g{self._generation(namespace)}.{digest}"
+        now = time.time()
+
+        entry = self._get_local(full_key)
+        if entry is not None and entry.fresh_until > now:
+            metrics['l1_hits'] += 1
+            return entry.value
+        if entry is None or entry.fresh_until <= now:
+            shared = self._get_shared(full_key, namespace)
+            if shared is not None:
+                entry = shared
+                if entry.fresh_until > now:
+                    metrics['l2_hits'] += 1
+                    return entry.value
+        if entry is not None and entry.stale_until > now:
+            metrics['stale_hits'] += 1
+            self._refresh_in_background(full_key, namespace, loader, timeout, stale_ttl, should_cache)
+            return entry.value
+
+        with self._lock:
+            inflight = self._inflight.get(full_key)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[full_key] = _InFlight()
+        if not owner:
+            # Тот же промах уже загружается в этом воркере
+            metrics['coalesced'] += 1
+            inflight.done.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.value
+        metrics['misses'] += 1
+        try:
+            inflight.value = self._load_locked(full_key, namespace, loader, timeout, stale_ttl, should_cache)
+            return inflight.value
+        except BaseException as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(full_key, None)
+            inflight.done.set()
+
+    def cached(self, timeout: float = 300, namespace: Optional[str] = None, stale_ttl: float = 0):
+        """
+        Кэш GET-ответов представления. Ключ — путь и отсортированные параметры
+        запроса; сохраняются только ответы 200. Ответ не должен зависеть от сессии.
+        """
+        def decorator(view):
+            view_namespace = namespace or view.__name__
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                from flask import Response, current_app, request
+
+                if request.method != 'GET':
+                    return view(*args, **kwargs)
+                app = current_app._get_current_object()
+                path = request.path
+                query_string = urlencode(sorted(request.args.items(multi=True)))
+
+                def render():
+                    from flask import has_request_context
+                    if has_request_context():
+                        response = app.make_response(view(*args, **kwargs))
+                    else:
+                        # Фоновое обновление stale-while-revalidate
+                        with app.test_request_context(path, query_string=query_string):
+                            response = app.make_response(view(*args, **kwargs))
+                    return response.get_data(), response.status_code, response.headers.get('Content-Type')
+
+                body, status, content_type = self.get_or_set(
+                    view_namespace, f"{path}?{query_string}", render, timeout, stale_ttl,
+                    should_cache=lambda value: value[1] == 200
+                )
+                return Response(body, status=status, content_type=content_type)
+
+            return wrapper
+        return decorator
+
+    def stats(self) -> Dict[str, Any]:
+        namespaces = {}
+        for namespace, metrics in list(self.metrics.items()):
+            served = metrics['l1_hits'] + metrics['l2_hits'] + metrics['stale_hits']
+            namespaces[namespace] = dict(metrics, hit_ratio=round(served / metrics['requests'], 4)
+                                         if metrics['requests'] else None)
+        return {
+            'backend': type(self.backend).__name__,
+            'l1': {'entries': len(self._local), 'bytes': self._local_bytes,
+                   'max_bytes': self.max_bytes, 'max_entries': self.max_entries},
+            'namespaces': namespaces,
+        }